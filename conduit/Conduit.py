@@ -93,6 +93,9 @@ class Conduit(gobject.GObject):
 
         self._conflicts = {}
 
+        #the profile of the last sync
+        self._syncProfile = None
+
     def _parameters_changed(self):
         self.emit("parameters-changed")
         
@@ -100,7 +103,7 @@ class Conduit(gobject.GObject):
         #Dont trigger a sync if we are already synchronising
         if not self.is_busy() and self.do_auto_sync():
             log.debug("Triggering an auto sync...")
-            self.sync()
+            self.sync(auto=True)
 
     def emit(self, *args):
         """
@@ -331,14 +334,27 @@ class Conduit(gobject.GObject):
         else:
             log.info("Conduit must have a datasource and a datasink")
 
-    def sync(self, block=False):
+    def sync(self, block=False, auto=False):
         if self.datasource is not None and len(self.datasinks) > 0:
-            self.syncManager.sync_conduit(self)
+            self.syncManager.sync_conduit(self, auto)
             if block == True:
                 self.syncManager.join_one(self)
         else:
             log.info("Conduit must have a datasource and a datasink")
 
+    def set_sync_profile(self, profile):
+        self._syncProfile = profile
+
+    def get_sync_report(self):
+        """
+        @returns: The timings of the last sync, as returned by 
+        L{conduit.utils.Profile.SyncProfile.get_report}, or an empty dict
+        if the conduit has not been synchronized
+        """
+        if self._syncProfile == None:
+            return {}
+        return self._syncProfile.get_report()
+
     def emit_conflict(self, conflict):
         hc = hash(conflict)
         if hc not in self._conflicts:
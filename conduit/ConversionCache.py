@@ -0,0 +1,273 @@
+"""
+Persistent cache of the files produced by expensive conversions, such as
+photo resizing and audio/video transcoding
+"""
+import os
+import time
+import shutil
+import tempfile
+import hashlib
+import threading
+import logging
+log = logging.getLogger("ConversionCache")
+
+import conduit
+import conduit.Database as Database
+import conduit.datatypes.DataType as DataType
+import conduit.datatypes.File as File
+import conduit.utils as Utils
+
+DB_FIELDS = ("KEY","FILENAME","CLASS","SIZE","ATIME")
+DB_TYPES =  ("TEXT","TEXT","TEXT","INTEGER","REAL")
+
+def get_source_key(data):
+    """
+    Identifies the data being converted. Local files are identified by the
+    digest of their contents, so a file converted once is not converted
+    again when it is synchronized to another sink, or when it is renamed.
+    The digests come from the shared L{conduit.FileCache.FileCache}, and
+    local files are not identified if there is none.
+    Other data is identified by its UID and Rid hash.
+
+    @returns: A string, or None if the data can not be identified
+    """
+    if isinstance(data, File.File):
+        #without the shared digest cache every lookup would read the
+        #whole file, which costs as much as many conversions
+        if not data.is_local() or conduit.GLOBALS.fileCache == None:
+            return None
+        digest = conduit.GLOBALS.fileCache.get_digest(data.get_local_uri())
+        if digest == None:
+            return None
+        return "digest:%s" % digest
+
+    try:
+        return "rid:%s:%s" % (data.get_UID(), data.get_rid().get_hash())
+    except Exception:
+        return None
+
+class ConversionCache(object):
+    """
+    Caches the results of conversions that return local files, keyed by
+    the data converted, the conversion and its arguments. The cached files
+    are kept in a directory, and the least recently used are removed once
+    they occupy more than maxSize bytes.
+    """
+    def __init__(self, dirname, maxSize):
+        self._dir = os.path.abspath(dirname)
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+        self.maxSize = maxSize
+
+        self._db = Database.ConcurrentGenericDB(os.path.join(self._dir, "conversions.db"))
+        if "conversions" not in self._db.get_tables():
+            self._db.create(
+                    table="conversions",
+                    fields=DB_FIELDS,
+                    fieldtypes=DB_TYPES
+                    )
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS conversions_key_idx ON conversions (KEY)")
+
+        #protects the size and the statistics
+        self._lock = threading.Lock()
+        self._size = self._db.select_one("SELECT SUM(SIZE) FROM conversions")[0] or 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_path(self, key):
+        return os.path.join(self._dir, key)
+
+    def _count(self, attr):
+        self._lock.acquire()
+        try:
+            setattr(self, attr, getattr(self, attr) + 1)
+        finally:
+            self._lock.release()
+
+    def _remove(self, key):
+        try:
+            os.remove(self._get_path(key))
+        except OSError:
+            pass
+        self._db.execute("DELETE FROM conversions WHERE KEY = ?", (key,))
+
+    def _evict(self):
+        """
+        Removes the least recently used results until the cache is within
+        its maximum size
+        """
+        if self._size <= self.maxSize:
+            return
+        for key, size in self._db.select("SELECT KEY,SIZE FROM conversions ORDER BY ATIME"):
+            if self._size <= self.maxSize:
+                break
+            log.debug("Evicting %s (%s bytes)" % (key, size))
+            self._remove(key)
+            self._lock.acquire()
+            try:
+                self._size -= size
+                self.evictions += 1
+            finally:
+                self._lock.release()
+
+    def get_key(self, data, conversion, args):
+        """
+        @param conversion: The conversion, as "fromtype,totype"
+        @param args: The dict of arguments to the conversion
+        @returns: The key of the result of the conversion of data, or None
+        if the result can not be cached
+        """
+        source = get_source_key(data)
+        if source == None:
+            return None
+        args = ["%s=%s" % (k, args[k]) for k in sorted(args.keys())]
+        return hashlib.sha1("%s|%s|%s" % (source, conversion, ",".join(args))).hexdigest()
+
+    def get(self, key, filename=None):
+        """
+        Returns a copy of the cached result, in a new temporary file, so
+        that it may be modified by further conversions and dataproviders
+
+        @param filename: The name to give the copy, by default the name of
+        the cached result
+        @returns: A L{conduit.datatypes.File.File} (or subclass) or None
+        """
+        res = self._db.select_one("SELECT FILENAME,CLASS FROM conversions WHERE KEY = ?", (key,))
+        if res == None or not os.path.exists(self._get_path(key)):
+            self._count("misses")
+            return None
+
+        cachedFilename, klassName = res
+        if filename == None:
+            filename = cachedFilename
+        try:
+            moduleName, name = str(klassName).rsplit(".", 1)
+            klass = getattr(__import__(moduleName, {}, {}, [name]), name)
+            path = os.path.join(Utils.new_tempdir(), filename)
+            shutil.copyfile(self._get_path(key), path)
+        except Exception, e:
+            log.warn("Could not get cached conversion %s: %s" % (key, e))
+            self._remove(key)
+            self._count("misses")
+            return None
+
+        self._db.execute("UPDATE conversions SET ATIME = ? WHERE KEY = ?", (time.time(), key))
+        self._count("hits")
+        log.debug("Using cached conversion %s" % key)
+        return klass(URI=path)
+
+    def put(self, key, data):
+        """
+        Stores a copy of data, the result of a conversion, if it is a
+        local file
+        """
+        if not isinstance(data, File.File) or not data.is_local():
+            return
+        path = data.get_local_uri()
+        if path == None or not os.path.isfile(path):
+            return
+
+        #copy to a tempfile first, so that a partial copy is never used
+        fd, temp = tempfile.mkstemp(dir=self._dir)
+        os.close(fd)
+        try:
+            shutil.copyfile(path, temp)
+            os.rename(temp, self._get_path(key))
+        except (IOError, OSError), e:
+            log.warn("Could not cache conversion %s: %s" % (key, e))
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+
+        size = os.path.getsize(self._get_path(key))
+        old = self._db.select_one("SELECT SIZE FROM conversions WHERE KEY = ?", (key,))
+        self._db.execute(
+                "INSERT OR REPLACE INTO conversions (KEY,FILENAME,CLASS,SIZE,ATIME) VALUES (?,?,?,?,?)",
+                (key, data.get_filename(), "%s.%s" % (data.__class__.__module__, data.__class__.__name__), size, time.time())
+                )
+        self._lock.acquire()
+        try:
+            self._size += size
+            if old != None:
+                self._size -= old[0]
+        finally:
+            self._lock.release()
+        self._evict()
+
+    def convert(self, func, data, conversion, args):
+        """
+        Returns the cached result of func(data, **args), or calls func and 
+        caches its result
+        """
+        key = self.get_key(data, conversion, args)
+        if key == None:
+            return func(data, **args)
+
+        #results are shared between files with the same contents, so name the
+        #result after the file converted, keeping the extension the 
+        #converter gave it
+        filename = None
+        if isinstance(data, File.File):
+            res = self._db.select_one("SELECT FILENAME FROM conversions WHERE KEY = ?", (key,))
+            if res != None:
+                filename = os.path.splitext(data.get_filename())[0] + os.path.splitext(res[0])[1]
+
+        newdata = self.get(key, filename)
+        if newdata != None:
+            #the cached file is a new instance, so retain the UID, mtime,
+            #open URI and tags of the data converted, and the grouping of
+            #the original file, as the converter would have
+            DataType.DataType.__setstate__(newdata, DataType.DataType.__getstate__(data))
+            if isinstance(data, File.File):
+                newdata.basePath = data.basePath
+                newdata.group = data.group
+            return newdata
+
+        #converters return the original file if no conversion was needed,
+        #there is no need to cache that
+        path = None
+        if isinstance(data, File.File):
+            path = data.get_local_uri()
+        newdata = func(data, **args)
+        if isinstance(newdata, File.File) and newdata.is_local() and newdata.get_local_uri() != path:
+            self.put(key, newdata)
+        return newdata
+
+    def get_size(self):
+        """
+        @returns: The number of bytes used by cached results
+        """
+        return self._size
+
+    def get_stats(self):
+        """
+        @returns: A dict of the hits, misses and evictions since the cache
+        was opened, and the number of cached results and their size
+        """
+        return {
+            "hits"      :   self.hits,
+            "misses"    :   self.misses,
+            "evictions" :   self.evictions,
+            "entries"   :   self._db.select_one("SELECT COUNT(*) FROM conversions")[0],
+            "size"      :   self._size
+        }
+
+    def clear(self):
+        """
+        Removes all cached results
+        """
+        for (key,) in self._db.select("SELECT KEY FROM conversions"):
+            self._remove(key)
+        self._lock.acquire()
+        try:
+            self._size = 0
+        finally:
+            self._lock.release()
+
+    def save(self):
+        self._db.save()
+
+    def close(self):
+        log.info("Conversion cache: %s" % self.get_stats())
+        self._db.close()
@@ -216,6 +216,11 @@ class ConduitDBusItem(DBusItem):
         self._print("Refresh")
         self.conduit.refresh()
 
+    @dbus.service.method(CONDUIT_DBUS_IFACE, in_signature='', out_signature='a{s(udt)}')
+    def GetSyncReport(self):
+        self._print("GetSyncReport")
+        return self.conduit.get_sync_report()
+
     @dbus.service.signal(CONDUIT_DBUS_IFACE, signature='')
     def SyncStarted(self):
         self._print("SyncStarted")
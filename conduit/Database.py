@@ -37,6 +37,8 @@ except ImportError:
     from pysqlite2 import dbapi2 as sqlite
 
 #for threadsafe db
+import thread
+import threading
 from threading import Thread
 from Queue import Queue
 
@@ -117,6 +119,8 @@ class GenericDB(gobject.GObject):
             gobject.TYPE_INT])          #row oid
         }
     DEBUG = False
+    #Number of rows returned at a time by select_chunks
+    CHUNK_SIZE = 500
     def __init__(self, filename=":memory:", **kwargs):
         gobject.GObject.__init__(self)
         #dictionary of field names, key is table name
@@ -127,20 +131,23 @@ class GenericDB(gobject.GObject):
         self._open()
         self._get_tables()
 
-    def _open(self):
-        #Open the DB and set options
+    def _connect(self, **kwargs):
+        #Open a new connection to the DB and set options
         if self.options.get("detect_types",False):
-            self.db = sqlite.connect(self.filename, detect_types=sqlite.PARSE_DECLTYPES)
-        else:
-            self.db = sqlite.connect(self.filename)
-        self.db.isolation_level = self.options.get("isolation_level",None)
+            kwargs["detect_types"] = sqlite.PARSE_DECLTYPES
+        db = sqlite.connect(self.filename, **kwargs)
+        db.isolation_level = self.options.get("isolation_level",None)
         if self.options.get("row_by_name",False) == True:
-            self.db.row_factory = sqlite.Row
+            db.row_factory = sqlite.Row
+        return db
+
+    def _open(self):
+        self.db = self._connect()
         self.cur = self.db.cursor()
 
     def _get_tables(self):
         #get the field names for all tables
-        for name, in self.cur.execute("SELECT name FROM sqlite_master WHERE type='table' and name != 'sqlite_sequence'"):
+        for name, in self.cur.execute("SELECT name FROM sqlite_master WHERE type='table' and name != 'sqlite_sequence'").fetchall():
             self.tables[str(name)] = [row[1] for row in self.cur.execute("PRAGMA table_info('%s')" % name) if row[1] != 'oid']
             
     def _build_insert_sql(self, table, *values):
@@ -188,6 +195,13 @@ class GenericDB(gobject.GObject):
     def execute(self, sql, args=()):
         if self.DEBUG: log.debug(sql)
         self.cur.execute(sql, args)
+
+    def execute_many(self, sql, argsList):
+        """
+        Executes sql once for each tuple of arguments in argsList
+        """
+        if self.DEBUG: log.debug(sql)
+        self.cur.executemany(sql, argsList)
         
     def select(self, sql, args=()):
         self.execute(sql, args)
@@ -198,6 +212,19 @@ class GenericDB(gobject.GObject):
         for i in self.select(sql, args):
             return i
 
+    def select_chunks(self, sql, args=(), size=None):
+        """
+        Like select, but yields lists of (at most) size rows at a time
+        """
+        chunk = []
+        for row in self.select(sql, args):
+            chunk.append(row)
+            if len(chunk) >= (size or self.CHUNK_SIZE):
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
     def create(self, table, fields=(), fieldtypes=()):
         sql = self._build_create_sql(table, fields, fieldtypes)
         self.execute(sql)
@@ -211,6 +238,20 @@ class GenericDB(gobject.GObject):
         self.emit("row-inserted",int(self.cur.lastrowid))
         return self.cur.lastrowid
 
+    def insert_many(self, table, rows=()):
+        """
+        Inserts many rows into table using a single prepared statement.
+        The row-inserted signal is not emitted for bulk inserts.
+        """
+        sql = None
+        argsList = []
+        for values in rows:
+            sql,values = self._build_insert_sql(table, *values)
+            argsList.append(values)
+        if argsList:
+            self.execute_many(sql, argsList)
+        return len(argsList)
+
     def update(self, table, oid, values=(), **kwargs):
         sql, values = self._build_update_sql(table, oid, *values, **kwargs)
         self.execute(sql, values)
@@ -222,6 +263,24 @@ class GenericDB(gobject.GObject):
         sql = "DELETE from %s where oid=?" % table
         self.execute(sql,(oid,))
 
+    def begin(self):
+        """
+        Starts a transaction, which lasts until L{end} is called
+        """
+        self.execute("BEGIN")
+
+    def end(self):
+        """
+        Commits the transaction started by L{begin}
+        """
+        self.execute("COMMIT")
+
+    def rollback(self):
+        """
+        Discards the transaction started by L{begin}
+        """
+        self.execute("ROLLBACK")
+
     def save(self):
         self.db.commit()
 
@@ -289,7 +348,7 @@ class ThreadSafeGenericDB(Thread, GenericDB):
         db = sqlite.connect(self.filename)
         cur = db.cursor()
         #get the field names for all tables
-        for name, in cur.execute("SELECT name FROM sqlite_master WHERE type='table' and name != 'sqlite_sequence'"):
+        for name, in cur.execute("SELECT name FROM sqlite_master WHERE type='table' and name != 'sqlite_sequence'").fetchall():
             self.tables[str(name)] = [row[1] for row in cur.execute("PRAGMA table_info('%s')" % name) if row[1] != 'oid']
             
     def run(self):
@@ -301,7 +360,10 @@ class ThreadSafeGenericDB(Thread, GenericDB):
             elif req=='--save--': 
                 self.db.commit()
             else:
-                self.cur.execute(req, args)
+                if operation == "MANY":
+                    self.cur.executemany(req, args)
+                else:
+                    self.cur.execute(req, args)
 
                 #res is used to return a result to the caller
                 #in a blocking way
@@ -323,6 +385,9 @@ class ThreadSafeGenericDB(Thread, GenericDB):
         if not self.stopped:
             self.reqs.put((req, args, res, operation))
 
+    def execute_many(self, req, argsList):
+        self.execute(req, argsList, None, "MANY")
+
     def select(self, req, args=()):
         res=Queue()
         self.execute(req, args, res, "SELECT")
@@ -346,3 +411,217 @@ class ThreadSafeGenericDB(Thread, GenericDB):
             self.emit("row-inserted",int(newId))
             return newId
 
+class ConcurrentGenericDB(GenericDB):
+    """
+    Threadsafe GenericDB that runs statements in the calling thread instead
+    of passing them to a worker thread through a queue.
+
+    All writes share one connection and are serialized with a lock. When the
+    DB is on disk it is switched to WAL mode, and reads go through a pool
+    of up to MAX_READERS read connections, so they do not wait for each
+    other or for a write. Once every read connection is busy, reads go
+    through the (locked) write connection.
+    Results of select are returned as a list (the whole result set), and
+    select_chunks returns lists of rows without loading them all at once.
+    """
+    MAX_READERS = 4
+
+    def __init__(self, filename=":memory:", **kwargs):
+        #protects the write connection, and any open transaction
+        self._lock = threading.RLock()
+        #the thread with an open transaction (see begin())
+        self._transaction = None
+        #idle read connections, and the number open. Only used in WAL mode.
+        self._idleReaders = []
+        self._numReaders = 0
+        self._connections = []
+        self._connectionsLock = threading.Lock()
+        self._wal = False
+        GenericDB.__init__(self, filename, **kwargs)
+
+    def _connect(self, **kwargs):
+        db = GenericDB._connect(self, check_same_thread=False, **kwargs)
+        self._connectionsLock.acquire()
+        try:
+            self._connections.append(db)
+        finally:
+            self._connectionsLock.release()
+        return db
+
+    def _open(self):
+        GenericDB._open(self)
+        #readers only see committed data, so they can only be used if every
+        #write is committed immediately
+        if self.filename != ":memory:" and self.db.isolation_level == None:
+            mode, = self.cur.execute("PRAGMA journal_mode=WAL").fetchone()
+            self._wal = (str(mode).lower() == "wal")
+            if self._wal:
+                self.cur.execute("PRAGMA synchronous=NORMAL")
+        log.debug("Opened %s (WAL: %s)" % (self.filename, self._wal))
+
+    def _acquire_reader(self):
+        #Returns a read connection from the pool, or None if reads must go
+        #through the (locked) write connection
+        if not self._wal or self._transaction == thread.get_ident():
+            return None
+        self._connectionsLock.acquire()
+        try:
+            if len(self._idleReaders) > 0:
+                return self._idleReaders.pop()
+            if self._numReaders >= self.MAX_READERS:
+                return None
+            self._numReaders += 1
+        finally:
+            self._connectionsLock.release()
+        try:
+            return self._connect()
+        except:
+            self._connectionsLock.acquire()
+            self._numReaders -= 1
+            self._connectionsLock.release()
+            raise
+
+    def _release_reader(self, db):
+        #Returns a read connection to the pool, unless the DB was closed
+        self._connectionsLock.acquire()
+        try:
+            if db in self._connections:
+                self._idleReaders.append(db)
+        finally:
+            self._connectionsLock.release()
+
+    def execute(self, sql, args=()):
+        if self.DEBUG: log.debug(sql)
+        self._lock.acquire()
+        try:
+            self.cur.execute(sql, args)
+        finally:
+            self._lock.release()
+
+    def execute_many(self, sql, argsList):
+        if self.DEBUG: log.debug(sql)
+        self._lock.acquire()
+        try:
+            #commit all the rows at once, unless already in a transaction
+            if self._transaction == None and self.db.isolation_level == None:
+                self.cur.execute("BEGIN")
+                try:
+                    self.cur.executemany(sql, argsList)
+                finally:
+                    self.cur.execute("COMMIT")
+            else:
+                self.cur.executemany(sql, argsList)
+        finally:
+            self._lock.release()
+
+    def select(self, sql, args=()):
+        if self.DEBUG: log.debug(sql)
+        reader = self._acquire_reader()
+        if reader != None:
+            cur = reader.cursor()
+            try:
+                return cur.execute(sql, args).fetchall()
+            finally:
+                cur.close()
+                self._release_reader(reader)
+
+        self._lock.acquire()
+        try:
+            return self.cur.execute(sql, args).fetchall()
+        finally:
+            self._lock.release()
+
+    def select_one(self, sql, args=()):
+        if self.DEBUG: log.debug(sql)
+        reader = self._acquire_reader()
+        if reader != None:
+            cur = reader.cursor()
+            try:
+                return cur.execute(sql, args).fetchone()
+            finally:
+                cur.close()
+                self._release_reader(reader)
+
+        self._lock.acquire()
+        try:
+            return self.cur.execute(sql, args).fetchone()
+        finally:
+            self._lock.release()
+
+    def select_chunks(self, sql, args=(), size=None):
+        reader = self._acquire_reader()
+        if reader == None:
+            #cant hold the lock between chunks
+            for chunk in GenericDB.select_chunks(self, sql, args, size):
+                yield chunk
+            return
+
+        if self.DEBUG: log.debug(sql)
+        cur = reader.cursor()
+        try:
+            cur.execute(sql, args)
+            while True:
+                chunk = cur.fetchmany(size or self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            cur.close()
+            self._release_reader(reader)
+
+    def insert(self, table, values=()):
+        sql,values = self._build_insert_sql(table, *values)
+        if self.DEBUG: log.debug(sql)
+        self._lock.acquire()
+        try:
+            self.cur.execute(sql, values)
+            oid = self.cur.lastrowid
+        finally:
+            self._lock.release()
+        self.emit("row-inserted",int(oid))
+        return oid
+
+    def begin(self):
+        #the lock is held until end(), so that statements from other threads
+        #do not become part of the transaction
+        self._lock.acquire()
+        try:
+            self.cur.execute("BEGIN")
+        except:
+            self._lock.release()
+            raise
+        self._transaction = thread.get_ident()
+
+    def end(self):
+        try:
+            self.cur.execute("COMMIT")
+        finally:
+            self._transaction = None
+            self._lock.release()
+
+    def rollback(self):
+        try:
+            self.cur.execute("ROLLBACK")
+        finally:
+            self._transaction = None
+            self._lock.release()
+
+    def save(self):
+        self._lock.acquire()
+        try:
+            self.db.commit()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        self._connectionsLock.acquire()
+        try:
+            for db in self._connections:
+                db.close()
+            self._connections = []
+            self._idleReaders = []
+            self._numReaders = 0
+        finally:
+            self._connectionsLock.release()
+            self._lock.release()
@@ -18,52 +18,95 @@ log = logging.getLogger("DeltaProvider")
 import conduit
 
 class DeltaProvider:
-    def __init__(self, dpw, otherdpw):
+    def __init__(self, dpw, otherdpw, mappings=None):
+        """
+        @param mappings: A L{conduit.MappingDB.MappingTable} for the dataprovider
+        pair. If not supplied it is loaded from the mapping DB
+        """
         self.me = dpw
         self.other = otherdpw
+        self.mappings = mappings
 
         log.info("Delta: Source (%s) does not implement get_changes(). Proxying..." % self.me.get_UID())
 
+    def _get_all(self):
+        """
+        @returns: An iterable of (LUID, Rid) for all the items in the 
+        dataprovider. The Rid is None if it must be looked up
+        """
+        try:
+            return self.me.module.get_all_with_rids()
+        except NotImplementedError:
+            return ((i,None) for i in self.me.module.get_all())
+
+    def _get_rids(self, LUIDs):
+        """
+        @returns: A dict of LUID : Rid, using get_rid_bulk if the
+        dataprovider implements it. The Rids get_rid_bulk does not return
+        are looked up one at a time
+        """
+        rids = {}
+        try:
+            for i,rid in self.me.module.get_rid_bulk(LUIDs).items():
+                if type(i) != unicode:
+                    i = unicode(i,errors='replace')
+                if rid != None:
+                    rids[i] = rid
+        except NotImplementedError:
+            pass
+
+        missing = [i for i in LUIDs if i not in rids]
+        if len(missing) > 0:
+            log.debug("Delta: Getting %s Rids one at a time" % len(missing))
+        for i in missing:
+            rids[i] = self.me.module.get(i).get_rid()
+        return rids
+
     def get_changes(self):
         """
+        Compares the current items with those seen in the previous sync.
+        Takes time linear in the number of items, and only looks up the
+        Rids of items that were seen before.
+
         @returns: added, modified, deleted
         """
-        allItems = []
-        for i in self.me.module.get_all():
+        #In order to detect deletions we need to fetch all the existing relationships.
+        #we also get the rids because we need those to detect if something has changed
+        if self.mappings == None:
+            self.mappings = conduit.GLOBALS.mappingDB.get_mappings_table(self.me.get_UID(), self.other.get_UID())
+        rids = self.mappings.get_rids(self.me.get_UID())
+        log.debug("Delta: Expecting %s items" % len(rids))
+
+        #now classify all my items relative to the expected data from the previous
+        #sync with the supplied other dataprovider
+        added = []
+        existing = []
+        actual = {}
+        for i,rid in self._get_all():
             #Make sure the are in unicode to assure a 
             #good comparison with mapping UID's
             if type(i) != unicode:
                 i = unicode(i,errors='replace')
-            allItems.append(i)
-
-        log.debug("Delta: Got %s items\n%s" % (len(allItems), allItems))
+            if i in rids:
+                if i not in actual:
+                    existing.append(i)
+                actual[i] = rid
+            else:
+                added.append(i)
 
-        #In order to detect deletions we need to fetch all the existing relationships.
-        #we also get the rids because we need those to detect if something has changed
-        rids = {}
-        for m in conduit.GLOBALS.mappingDB.get_mappings_for_dataproviders(self.me.get_UID(), self.other.get_UID()):
-            rids[ m.get_source_rid().get_UID() ] = m.get_source_rid()
-        for m in conduit.GLOBALS.mappingDB.get_mappings_for_dataproviders(self.other.get_UID(), self.me.get_UID()):
-            rids[ m.get_sink_rid().get_UID() ] = m.get_sink_rid()
+        log.debug("Delta: Got %s items (%s new)" % (len(added)+len(existing), len(added)))
 
-        log.debug("Delta: Expecting %s items" % len(rids))
-        for uid,rid in rids.items():
-            log.debug("%s) -- %s" % (uid,rid))
+        unknown = [i for i in existing if actual[i] == None]
+        if len(unknown) > 0:
+            actual.update(self._get_rids(unknown))
 
-        #now classify all my items relative to the expected data from the previous
-        #sync with the supplied other dataprovider. Copy (slice) the list because we
-        #modify it in place
         modified = []
-        for i in allItems[:]:
-            if i in rids:
-                data = self.me.module.get(i)
-                if data.get_rid().get_hash() != rids[i].get_hash():
-                    log.debug("Modified: Actual:%s v DB:%s" % (data.get_rid(), rids[i]))
-                    modified.append(i)
-                del(rids[i])
-                allItems.remove(i)
-
-        #now all that remains in rids is data which has been deleted,
-        #and all that remains in allItems is new data
-        return allItems, modified, rids.keys()
+        for i in existing:
+            if actual[i].get_hash() != rids[i].get_hash():
+                log.debug("Modified: Actual:%s v DB:%s" % (actual[i], rids[i]))
+                modified.append(i)
+
+        #all that were expected but not seen have been deleted
+        deleted = [i for i in rids if i not in actual]
+        return added, modified, deleted
 
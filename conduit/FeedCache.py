@@ -0,0 +1,164 @@
+"""
+Persistent mirror of the entries of remote feeds
+"""
+import os
+import datetime
+import logging
+log = logging.getLogger("FeedCache")
+
+import conduit
+import conduit.Database as Database
+from conduit.datatypes import Rid
+
+ENTRY_FIELDS = ("FEED","ID","MTIME","HASH","DATA")
+ENTRY_TYPES =  ("TEXT","TEXT","TEXT","TEXT","BLOB")
+MARK_FIELDS = ("FEED","MARK")
+MARK_TYPES =  ("TEXT","TEXT")
+#mtimes are stored as text, so they are read back exactly
+MTIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+def _format_mtime(mtime):
+    if mtime == None:
+        return None
+    return mtime.strftime(MTIME_FORMAT)
+
+def _parse_mtime(mtime):
+    if mtime == None:
+        return None
+    return datetime.datetime.strptime(mtime, MTIME_FORMAT)
+
+class FeedCache(object):
+    """
+    Mirrors the entries of remote feeds, so that a dataprovider only needs
+    to download the entries that changed since it last looked at the feed.
+    Each entry is stored with its L{conduit.datatypes.Rid}, so changes can
+    be detected without parsing the entries, and its data, which is
+    whatever the dataprovider needs to build the datatype again.
+
+    Each feed also has a mark, which the dataprovider sets after it brings
+    the entries up to date, and later asks the service for changes since.
+    """
+    def __init__(self, filename=":memory:"):
+        if filename != ":memory:":
+            filename = os.path.abspath(filename)
+        self._db = Database.ConcurrentGenericDB(filename)
+        tables = self._db.get_tables()
+        if "entries" not in tables:
+            self._db.create(
+                    table="entries",
+                    fields=ENTRY_FIELDS,
+                    fieldtypes=ENTRY_TYPES
+                    )
+        if "marks" not in tables:
+            self._db.create(
+                    table="marks",
+                    fields=MARK_FIELDS,
+                    fieldtypes=MARK_TYPES
+                    )
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS entries_feed_id_idx ON entries (FEED,ID)")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS marks_feed_idx ON marks (FEED)")
+
+    def _get_row(self, feed, rid, data):
+        return (feed, rid.get_UID(), _format_mtime(rid.get_mtime()), rid.get_hash(), buffer(data))
+
+    def get_mark(self, feed):
+        """
+        @returns: The mark set by the last update of feed, or None if
+        it has never been updated
+        """
+        res = self._db.select_one("SELECT MARK FROM marks WHERE FEED = ?", (feed,))
+        if res == None:
+            return None
+        return str(res[0])
+
+    def update(self, feed, mark, entries, deleted, replace=False):
+        """
+        Stores the changes to a feed, and the mark to ask for changes since
+        next time. Everything is stored at once, so an update interrupted by
+        an error leaves the feed as it was.
+
+        @param entries: A list of (Rid, data) for the added or modified entries
+        @param deleted: A list of the ids of deleted entries
+        @param replace: If True entries contains the whole feed, and all
+        other entries are removed
+        """
+        self._db.begin()
+        try:
+            if replace:
+                self._db.execute("DELETE FROM entries WHERE FEED = ?", (feed,))
+            self._db.execute_many(
+                    "DELETE FROM entries WHERE FEED = ? AND ID = ?",
+                    [(feed, i) for i in deleted]
+                    )
+            self._db.execute_many(
+                    "INSERT OR REPLACE INTO entries (FEED,ID,MTIME,HASH,DATA) VALUES (?,?,?,?,?)",
+                    [self._get_row(feed, rid, data) for rid, data in entries]
+                    )
+            self._db.execute("INSERT OR REPLACE INTO marks (FEED,MARK) VALUES (?,?)", (feed, mark))
+        finally:
+            self._db.end()
+        log.debug("Updated %s: %s entries changed, %s deleted (mark %s)" % (feed, len(entries), len(deleted), mark))
+
+    def put(self, feed, rid, data):
+        """
+        Stores an entry the dataprovider has just written to the feed
+        """
+        self._db.execute(
+                "INSERT OR REPLACE INTO entries (FEED,ID,MTIME,HASH,DATA) VALUES (?,?,?,?,?)",
+                self._get_row(feed, rid, data)
+                )
+
+    def delete(self, feed, i):
+        """
+        Removes an entry the dataprovider has just deleted from the feed
+        """
+        self._db.execute("DELETE FROM entries WHERE FEED = ? AND ID = ?", (feed, i))
+
+    def clear(self, feed):
+        """
+        Removes all entries of feed and its mark, so the next update must
+        download the whole feed
+        """
+        self._db.execute("DELETE FROM entries WHERE FEED = ?", (feed,))
+        self._db.execute("DELETE FROM marks WHERE FEED = ?", (feed,))
+
+    def get_ids(self, feed):
+        """
+        @returns: The ids of every entry of feed
+        """
+        return [row[0] for row in self._db.select("SELECT ID FROM entries WHERE FEED = ?", (feed,))]
+
+    def get_rids(self, feed):
+        """
+        @returns: An iterable of (id, Rid) for every entry of feed
+        """
+        for chunk in self._db.select_chunks("SELECT ID,MTIME,HASH FROM entries WHERE FEED = ?", (feed,)):
+            for i, mtime, hash in chunk:
+                yield i, Rid(uid=i, mtime=_parse_mtime(mtime), hash=hash)
+
+    def get_rid(self, feed, i):
+        """
+        @returns: The Rid of an entry, or None if it is not cached
+        """
+        res = self._db.select_one("SELECT MTIME,HASH FROM entries WHERE FEED = ? AND ID = ?", (feed, i))
+        if res == None:
+            return None
+        return Rid(uid=i, mtime=_parse_mtime(res[0]), hash=res[1])
+
+    def get_data(self, feed, i):
+        """
+        @returns: The data of an entry, or None if it is not cached
+        """
+        res = self._db.select_one("SELECT DATA FROM entries WHERE FEED = ? AND ID = ?", (feed, i))
+        if res == None:
+            return None
+        return str(res[0])
+
+    def get_num_entries(self, feed):
+        return self._db.select_one("SELECT COUNT(*) FROM entries WHERE FEED = ?", (feed,))[0]
+
+    def save(self):
+        self._db.save()
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,221 @@
+"""
+Persistent cache of file content digests, and of snapshots of the files
+in folders
+"""
+import os
+import stat
+import hashlib
+import logging
+log = logging.getLogger("FileCache")
+
+import conduit
+import conduit.Database as Database
+import conduit.utils.Thread as Thread
+
+DB_FIELDS = ("URI","INODE","MTIME","SIZE","DIGEST")
+DB_TYPES =  ("TEXT","INTEGER","REAL","INTEGER","TEXT")
+SNAPSHOT_FIELDS = ("FOLDER","URI","MTIME","SIZE")
+SNAPSHOT_TYPES =  ("TEXT","TEXT","REAL","INTEGER")
+#Bytes read at a time when computing a digest
+CHUNK_SIZE = 64*1024
+
+def stat_file(path):
+    """
+    @returns: The os.stat result for path, or None if it is not a
+    regular file
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st
+
+def compute_digest(path):
+    """
+    @returns: The sha1 hex digest of the file contents, read in chunks
+    """
+    digest = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            buf = f.read(CHUNK_SIZE)
+            if not buf:
+                break
+            digest.update(buf)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+def get_digest(path, st=None):
+    """
+    Returns the content digest of a local file, from the global
+    L{FileCache} if there is one
+    """
+    if conduit.GLOBALS.fileCache != None:
+        return conduit.GLOBALS.fileCache.get_digest(path, st)
+    try:
+        return compute_digest(path)
+    except IOError, e:
+        log.warn("Could not compute digest of %s: %s" % (path, e))
+        return None
+
+class FileCache(object):
+    """
+    Caches the content digest of local files, keyed by path. An entry is
+    only valid while the (inode, mtime, size) of the file is unchanged, so
+    checking it costs a single os.stat. Digests are computed by streaming
+    the file contents through sha1.
+
+    Also stores a snapshot of the (mtime, size) of each file in a folder,
+    so that the changes made to it between runs can be found.
+    """
+    #Number of files digested simultaneously by get_digests
+    DIGEST_THREADS = 2
+
+    def __init__(self, filename=":memory:"):
+        if filename != ":memory:":
+            filename = os.path.abspath(filename)
+        self._db = Database.ConcurrentGenericDB(filename)
+        if "files" not in self._db.get_tables():
+            self._db.create(
+                    table="files",
+                    fields=DB_FIELDS,
+                    fieldtypes=DB_TYPES
+                    )
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS files_uri_idx ON files (URI)")
+        #a folder has a snapshot (possibly of no files) if it is in folders
+        tables = self._db.get_tables()
+        if "folders" not in tables:
+            self._db.create(
+                    table="folders",
+                    fields=("FOLDER",),
+                    fieldtypes=("TEXT",)
+                    )
+        if "snapshots" not in tables:
+            self._db.create(
+                    table="snapshots",
+                    fields=SNAPSHOT_FIELDS,
+                    fieldtypes=SNAPSHOT_TYPES
+                    )
+        self._db.execute("CREATE INDEX IF NOT EXISTS snapshots_folder_idx ON snapshots (FOLDER)")
+
+    def _get_key(self, st):
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def get_digest(self, path, st=None):
+        """
+        Returns the content digest of the local file at path, computing
+        and storing it if the cached value is missing or stale.
+
+        @param st: The os.stat result for path, if the caller already has it
+        @returns: The hex digest, or None if the file could not be read
+        """
+        if st == None:
+            st = stat_file(path)
+        if st == None:
+            return None
+
+        key = self._get_key(st)
+        res = self._db.select_one("SELECT INODE,MTIME,SIZE,DIGEST FROM files WHERE URI = ?", (path,))
+        if res != None and tuple(res[0:3]) == key and res[3]:
+            return str(res[3])
+
+        try:
+            digest = compute_digest(path)
+        except IOError, e:
+            log.warn("Could not compute digest of %s: %s" % (path, e))
+            return None
+
+        self._db.execute(
+                "INSERT OR REPLACE INTO files (URI,INODE,MTIME,SIZE,DIGEST) VALUES (?,?,?,?,?)",
+                (path,) + key + (digest,)
+                )
+        return digest
+
+    def get_digests(self, paths):
+        """
+        Computes the content digests of many local files, in parallel
+
+        @returns: A dict of path : digest
+        """
+        paths = list(paths)
+        if len(paths) < 2:
+            return dict([(p,self.get_digest(p)) for p in paths])
+
+        pool = Thread.WorkerPool(self.DIGEST_THREADS, "FileCache")
+        try:
+            digests = pool.imap(self.get_digest, paths)
+            return dict(zip(paths, digests))
+        finally:
+            pool.stop()
+
+    def forget(self, path):
+        """
+        Removes any cached information about path
+        """
+        self._db.execute("DELETE FROM files WHERE URI = ?", (path,))
+
+    def prune(self, folder, paths):
+        """
+        Removes the cached information about the files in folder that are
+        not among paths, because they have been deleted or moved
+
+        @returns: The number of files forgotten
+        """
+        #everything starting with "folder/" sorts before "folder0"
+        prefix = folder.rstrip("/") + "/"
+        #sqlite returns unicode, compare with the utf-8 encoded paths
+        keep = set([type(p) == unicode and p.encode("utf-8") or p for p in paths])
+        stale = [(uri,) for uri, in self._db.select(
+                        "SELECT URI FROM files WHERE URI >= ? AND URI < ?",
+                        (prefix, prefix[:-1] + "0")) if uri.encode("utf-8") not in keep]
+        if len(stale) > 0:
+            log.debug("Forgetting %s files deleted from %s" % (len(stale), folder))
+            self._db.execute_many("DELETE FROM files WHERE URI = ?", stale)
+        return len(stale)
+
+    def get_snapshot(self, folder):
+        """
+        @returns: A dict of URI : (mtime, size) of the files in folder when
+        its snapshot was stored, or None if there is no snapshot
+        """
+        if self._db.select_one("SELECT oid FROM folders WHERE FOLDER = ?", (folder,)) == None:
+            return None
+        snapshot = {}
+        for uri,mtime,size in self._db.select("SELECT URI,MTIME,SIZE FROM snapshots WHERE FOLDER = ?", (folder,)):
+            snapshot[uri.encode("utf-8")] = (mtime, size)
+        return snapshot
+
+    def set_snapshot(self, folder, snapshot):
+        """
+        Replaces the snapshot of folder, in a single transaction
+
+        @param snapshot: A dict of URI : (mtime, size)
+        """
+        self._db.begin()
+        try:
+            self.forget_snapshot(folder)
+            self._db.execute("INSERT INTO folders (FOLDER) VALUES (?)", (folder,))
+            self._db.execute_many(
+                    "INSERT INTO snapshots (FOLDER,URI,MTIME,SIZE) VALUES (?,?,?,?)",
+                    [(folder,uri,mtime,size) for uri,(mtime,size) in snapshot.items()]
+                    )
+        except:
+            self._db.rollback()
+            raise
+        self._db.end()
+
+    def forget_snapshot(self, folder):
+        """
+        Removes the snapshot of folder
+        """
+        self._db.execute("DELETE FROM snapshots WHERE FOLDER = ?", (folder,))
+        self._db.execute("DELETE FROM folders WHERE FOLDER = ?", (folder,))
+
+    def save(self):
+        self._db.save()
+
+    def close(self):
+        self._db.close()
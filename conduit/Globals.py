@@ -10,6 +10,16 @@ class Globals:
         self.moduleManager = None
         self.typeConverter = None
         self.mappingDB = None
+        #caches file digests for content based change detection
+        self.fileCache = None
+        #caches the metadata GStreamer discovers in media files
+        self.mediaCache = None
+        #caches the results of expensive conversions
+        self.conversionCache = None
+        #remembers resumable uploads so they continue after a restart
+        self.uploadState = None
+        #mirrors web service feeds so only their changes are downloaded
+        self.feedCache = None
         #syncManager provides the single point of cancellation when exiting
         self.syncManager = None
 
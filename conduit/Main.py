@@ -14,6 +14,11 @@ import conduit
 import conduit.utils as Utils
 from conduit.Module import ModuleManager
 from conduit.MappingDB import MappingDB
+from conduit.FileCache import FileCache
+from conduit.MediaCache import MediaCache
+from conduit.ConversionCache import ConversionCache
+from conduit.FeedCache import FeedCache
+from conduit.dataproviders.Upload import UploadState
 from conduit.TypeConverter import TypeConverter
 from conduit.SyncSet import SyncSet
 from conduit.Synchronization import SyncManager
@@ -46,6 +51,12 @@ class Application(dbus.service.Object):
         gobject.set_application_name("Conduit")
         self.settingsFile = os.path.join(conduit.USER_DIR, "settings.xml")
         self.dbFile = os.path.join(conduit.USER_DIR, "mapping.db")
+        self.fileCacheFile = os.path.join(conduit.USER_DIR, "filecache.db")
+        self.mediaCacheFile = os.path.join(conduit.USER_DIR, "media.db")
+        self.conversionCacheDir = os.path.join(conduit.USER_DIR, "conversions")
+        self.uploadStateFile = os.path.join(conduit.USER_DIR, "uploads.db")
+        self.feedCacheFile = os.path.join(conduit.USER_DIR, "feeds.db")
+        self.moduleManifestFile = os.path.join(conduit.USER_DIR, "modules.manifest")
 
         #initialize application settings
         conduit.GLOBALS.settings = Settings()
@@ -87,6 +98,14 @@ class Application(dbus.service.Object):
                 "-U", "--enable-unsupported",
                 action="store_true", default=False,
                 help="Enable loading of unfinished or unsupported dataproviders. [default: %default]")
+        parser.add_option(
+                "--profile-sync",
+                action="store_true", default=False,
+                help="Log the time spent in each dataprovider, conversion and phase of every sync. [default: %default]")
+        parser.add_option(
+                "--dump-conversions",
+                action="store_true", default=False,
+                help="Print the conversions between datatypes, and their costs, then exit. [default: %default]")
         options, args = parser.parse_args()
 
         whitelist = None
@@ -96,6 +115,8 @@ class Application(dbus.service.Object):
             for i in options.settings.split(','):
                 k,v = i.split('=')
                 settings[k] = v
+        if options.profile_sync:
+            settings["sync_profile_log"] = True
         if options.with_modules:
             whitelist = options.with_modules.split(",")
         if options.without_modules:
@@ -108,6 +129,21 @@ class Application(dbus.service.Object):
         log.info("Platform Implementations: %s,%s,%s" % (conduit.FILE_IMPL,conduit.BROWSER_IMPL, conduit.SETTINGS_IMPL))
         if settings:
             log.info("Settings have been overridden: %s" % settings)
+            conduit.GLOBALS.settings.set_overrides(**settings)
+
+        #Dynamically load all datasources, datasinks and converters
+        dirs_to_search = [
+            conduit.SHARED_MODULE_DIR,
+            os.path.join(conduit.USER_DIR, "modules")
+        ]
+        if options.enable_unsupported:
+            dirs_to_search.append(os.path.join(conduit.SHARED_MODULE_DIR, "UNSUPPORTED"))
+
+        if options.dump_conversions:
+            moduleManager = ModuleManager(dirs_to_search, self.moduleManifestFile)
+            moduleManager.load_all(whitelist, blacklist)
+            print TypeConverter(moduleManager).get_graph_description()
+            sys.exit(0)
         
         #Make conduit single instance. If conduit is already running then
         #make the original process build or show the gui
@@ -141,21 +177,22 @@ class Application(dbus.service.Object):
                 self.ShowSplash()
             self.ShowStatusIcon()
 
-        #Dynamically load all datasources, datasinks and converters
-        dirs_to_search = [
-            conduit.SHARED_MODULE_DIR,
-            os.path.join(conduit.USER_DIR, "modules")
-        ]
-        if options.enable_unsupported:
-            dirs_to_search.append(os.path.join(conduit.SHARED_MODULE_DIR, "UNSUPPORTED"))
-
         #Initialize all globals variables
         conduit.GLOBALS.app = self
-        conduit.GLOBALS.moduleManager = ModuleManager(dirs_to_search)
+        conduit.GLOBALS.moduleManager = ModuleManager(dirs_to_search, self.moduleManifestFile)
         conduit.GLOBALS.moduleManager.load_all(whitelist, blacklist)
         conduit.GLOBALS.typeConverter = TypeConverter(conduit.GLOBALS.moduleManager)
         conduit.GLOBALS.syncManager = SyncManager(conduit.GLOBALS.typeConverter)
         conduit.GLOBALS.mappingDB = MappingDB(self.dbFile)
+        conduit.GLOBALS.fileCache = FileCache(self.fileCacheFile)
+        conduit.GLOBALS.mediaCache = MediaCache(self.mediaCacheFile)
+        conduit.GLOBALS.uploadState = UploadState(self.uploadStateFile)
+        conduit.GLOBALS.feedCache = FeedCache(self.feedCacheFile)
+        conversionCacheSize = conduit.GLOBALS.settings.get("conversion_cache_size")
+        if conversionCacheSize > 0:
+            conduit.GLOBALS.conversionCache = ConversionCache(
+                                                self.conversionCacheDir,
+                                                conversionCacheSize*1024*1024)
         conduit.GLOBALS.mainloop = gobject.MainLoop()
         
         #Build both syncsets and put on the bus as early as possible
@@ -273,6 +310,12 @@ class Application(dbus.service.Object):
         #Save the mapping DB
         conduit.GLOBALS.mappingDB.save()
         conduit.GLOBALS.mappingDB.close()
+        conduit.GLOBALS.fileCache.close()
+        conduit.GLOBALS.mediaCache.close()
+        conduit.GLOBALS.uploadState.close()
+        conduit.GLOBALS.feedCache.close()
+        if conduit.GLOBALS.conversionCache != None:
+            conduit.GLOBALS.conversionCache.close()
 
         #Save the application settings
         conduit.GLOBALS.settings.save()
@@ -11,6 +11,13 @@ import conduit.Database as Database
 
 DB_FIELDS = ("sourceUID","sourceDataLUID","sourceDataMtime","sourceDataHash","sinkUID","sinkDataLUID","sinkDataMtime","sinkDataHash")
 DB_TYPES =  ("TEXT",     "TEXT",          "timestamp",      "TEXT",          "TEXT",   "TEXT",        "timestamp",    "TEXT")
+#Composite indexes covering the lookups in _get_mapping_oid, created (if missing)
+#whenever the DB is opened so that older DBs are upgraded in place
+DB_INDEXES = (
+    ("mappings_source_idx", ("sourceUID","sinkUID","sourceDataLUID")),
+    ("mappings_sink_idx",   ("sourceUID","sinkUID","sinkDataLUID"))
+    )
+
 class Mapping(object):
     """
     Manages a mapping of source -> sink
@@ -40,7 +47,158 @@ class Mapping(object):
     def values(self):
         return (self.sourceUID,self.sourceRid.get_UID(),self.sourceRid.get_mtime(),self.sourceRid.get_hash(),
                 self.sinkUID,self.sinkRid.get_UID(),self.sinkRid.get_mtime(),self.sinkRid.get_hash())
-        
+
+    def reversed(self):
+        """
+        @returns: A copy of the mapping in the other direction, where the
+        source is the sink and vice versa
+        """
+        return Mapping(
+                    self.oid,
+                    sourceUID=self.sinkUID,
+                    sourceRid=self.sinkRid,
+                    sinkUID=self.sourceUID,
+                    sinkRid=self.sourceRid
+                    )
+
+class MappingTable(object):
+    """
+    An in memory, bidirectional view of all the mappings between a pair of
+    dataproviders. Data LUIDs from either dataprovider can be looked up in
+    constant time. Changes are recorded and written back to the DB in a
+    single transaction by L{MappingDB.save_mappings_table}
+    """
+    def __init__(self, sourceUID, sinkUID):
+        self.sourceUID = sourceUID
+        self.sinkUID = sinkUID
+        #dataLUID -> Mapping, for LUIDs on both sides of the mapping
+        self._luids = {}
+        #Mapping -> the LUIDs it was indexed under
+        self._mappings = {}
+        #mappings that need to be saved/deleted when the table is saved
+        self._dirty = {}
+        self._deleted = []
+        #reversed copy -> the mapping in the table it was copied from
+        self._reversed = {}
+
+    def __len__(self):
+        return len(self._mappings)
+
+    def __contains__(self, dataLUID):
+        return dataLUID in self._luids
+
+    def __iter__(self):
+        return iter(self._mappings.keys())
+
+    def _check_uids(self, sourceUID, sinkUID):
+        if (sourceUID,sinkUID) not in ((self.sourceUID,self.sinkUID),(self.sinkUID,self.sourceUID)):
+            raise ValueError("Mapping (%s,%s) does not belong to this table" % (sourceUID, sinkUID))
+
+    def _index(self, m):
+        #The first (lowest oid) mapping for a LUID wins, the same as
+        #MappingDB._get_mapping_oid
+        luids = []
+        for luid in (m.sourceRid.get_UID(), m.sinkRid.get_UID()):
+            if luid != None and luid not in self._luids:
+                self._luids[luid] = m
+                luids.append(luid)
+        self._mappings[m] = luids
+
+    def _unindex(self, m):
+        for luid in self._mappings.pop(m, ()):
+            del(self._luids[luid])
+
+    def add(self, m):
+        """
+        Adds a mapping loaded from the DB to the table
+        """
+        self._index(m)
+
+    def get_mapping(self, sourceUID, dataLUID, sinkUID):
+        """
+        Same as L{MappingDB.get_mapping} but does not touch the DB
+        """
+        self._check_uids(sourceUID, sinkUID)
+        m = self._luids.get(dataLUID)
+        if m == None:
+            return Mapping(
+                    None,
+                    sourceUID=sourceUID,
+                    sourceRid=conduit.datatypes.Rid(uid=dataLUID),
+                    sinkUID=sinkUID,
+                    sinkRid=conduit.datatypes.Rid()
+                    )
+        #a mapping is always returned relative to the source -> sink
+        #order in which it was called. The table keeps its own copy in
+        #the order it was loaded
+        if m.sourceUID != sourceUID:
+            r = m.reversed()
+            self._reversed[r] = m
+            return r
+        return m
+
+    def _get_stored(self, m):
+        #Returns the mapping kept in the table for m, updated from m if m
+        #is a reversed copy of it
+        stored = self._reversed.get(m)
+        if stored == None:
+            return m
+        stored.oid = m.oid
+        stored.sourceRid = m.sinkRid
+        stored.sinkRid = m.sourceRid
+        return stored
+
+    def get_matching_UID(self, dataLUID):
+        """
+        Same as L{MappingDB.get_matching_UID} but does not touch the DB
+
+        @returns: dataLUID
+        """
+        m = self._luids.get(dataLUID)
+        if m == None:
+            return None
+        if dataLUID == m.sourceRid.get_UID():
+            return m.sinkRid.get_UID()
+        return m.sourceRid.get_UID()
+
+    def get_rids(self, dpUID):
+        """
+        @returns: A dict of dataLUID -> Rid of all the data belonging to the
+        dataprovider with dpUID
+        """
+        rids = {}
+        for m in self._mappings:
+            if m.sourceUID == dpUID:
+                rids[m.sourceRid.get_UID()] = m.sourceRid
+            else:
+                rids[m.sinkRid.get_UID()] = m.sinkRid
+        return rids
+
+    def save_mapping(self, m):
+        """
+        Records a new or modified mapping. The mapping is written to the DB
+        when the table is saved
+        """
+        self._check_uids(m.sourceUID, m.sinkUID)
+        m = self._get_stored(m)
+        #the LUIDs may have changed
+        self._unindex(m)
+        self._index(m)
+        self._dirty[m] = True
+
+    def delete_mapping(self, m):
+        """
+        Records the deletion of a mapping
+        """
+        m = self._get_stored(m)
+        self._unindex(m)
+        self._dirty.pop(m, None)
+        if m.oid != None:
+            self._deleted.append(m)
+
+    def is_dirty(self):
+        return len(self._dirty) > 0 or len(self._deleted) > 0
+
 class MappingDB:
     """
     Manages mappings of RID <-> RID on a per dataprovider basis.
@@ -75,13 +233,24 @@ class MappingDB:
             return oid[0]
             
     def _open_db_and_check_structure(self, filename):
-        self._db = Database.ThreadSafeGenericDB(filename,detect_types=True)
+        self._db = Database.ConcurrentGenericDB(filename,detect_types=True)
         if "mappings" not in self._db.get_tables():
             self._db.create(
                     table="mappings",
                     fields=DB_FIELDS,
                     fieldtypes=DB_TYPES
                     )
+        for name,fields in DB_INDEXES:
+            self._db.execute("CREATE INDEX IF NOT EXISTS %s ON mappings (%s)" % (name, ",".join(fields)))
+
+    def _mapping_from_row(self, res):
+        return Mapping(
+                    res[0],
+                    sourceUID=res[1],
+                    sourceRid=conduit.datatypes.Rid(res[2],res[3],res[4]),
+                    sinkUID=res[5],
+                    sinkRid=conduit.datatypes.Rid(res[6],res[7],res[8])
+                    )
                     
     def _open_db(self, f):
         """
@@ -168,16 +337,56 @@ class MappingDB:
         mappings = []
         sql = "SELECT * FROM mappings WHERE sourceUID = ? AND sinkUID = ?"
         for res in self._db.select(sql, (sourceUID, sinkUID)):
-            m = Mapping(
-                    res[0],
-                    sourceUID=res[1],
-                    sourceRid=conduit.datatypes.Rid(res[2],res[3],res[4]),
-                    sinkUID=res[5],
-                    sinkRid=conduit.datatypes.Rid(res[6],res[7],res[8])
-                    )
-            mappings.append(m)
+            mappings.append(self._mapping_from_row(res))
 
         return mappings
+
+    def get_mappings_table(self, sourceUID, sinkUID):
+        """
+        Loads all the mappings between the dataprovider pair, in both
+        directions, into a L{MappingTable}. Use this in preference to
+        get_mapping and get_matching_UID when processing many items.
+        """
+        table = MappingTable(sourceUID, sinkUID)
+        sql =   "SELECT * FROM mappings WHERE sourceUID = ? AND sinkUID = ? " \
+                "UNION " \
+                "SELECT * FROM mappings WHERE sourceUID = ? AND sinkUID = ? " \
+                "ORDER BY oid"
+        for res in self._db.select(sql, (sourceUID, sinkUID, sinkUID, sourceUID)):
+            table.add(self._mapping_from_row(res))
+        log.debug("Loaded %s mappings (%s <--> %s)" % (len(table), sourceUID, sinkUID))
+        return table
+
+    def save_mappings(self, mappings, deleted=()):
+        """
+        Saves (and deletes) many mappings in a single transaction. If any
+        of them fails then none are saved.
+        """
+        new = [m for m in mappings if m.oid == None]
+        self._db.begin()
+        try:
+            for m in deleted:
+                self.delete_mapping(m)
+            for m in mappings:
+                self.save_mapping(m)
+        except:
+            self._db.rollback()
+            for m in new:
+                m.oid = None
+            raise
+        self._db.end()
+
+    def save_mappings_table(self, table):
+        """
+        Writes all the changes made to a L{MappingTable} to the DB
+        in a single transaction
+        """
+        if table.is_dirty():
+            log.debug("Saving mappings table (%s <--> %s): %s modified, %s deleted" % (
+                        table.sourceUID, table.sinkUID, len(table._dirty), len(table._deleted)))
+            self.save_mappings(table._dirty.keys(), table._deleted)
+            table._dirty = {}
+            table._deleted = []
         
     def save_mapping(self, mapping):
         """
@@ -185,7 +394,7 @@ class MappingDB:
         """
         if mapping.oid == None:
             #log.debug("New Mapping: %s" % mapping)
-            self._db.insert(
+            mapping.oid = self._db.insert(
                         table="mappings",
                         values=mapping.values()
                         )
@@ -226,6 +435,7 @@ class MappingDB:
         """
         if mapping.oid == None:
             log.warn("Could not delete mapping ")
+            return
         self._db.delete(table="mappings",oid=mapping.oid)
 
     def save(self):
@@ -0,0 +1,95 @@
+"""
+Persistent cache of the metadata of media files
+"""
+import os
+import pickle
+import logging
+log = logging.getLogger("MediaCache")
+
+import conduit
+import conduit.Database as Database
+import conduit.FileCache as FileCache
+
+DB_FIELDS = ("URI","MTIME","SIZE","TAGS")
+DB_TYPES =  ("TEXT","REAL","INTEGER","BLOB")
+
+class MediaCache(object):
+    """
+    Caches the tags, duration and stream information that GStreamer
+    discovers in local media files, keyed by path. An entry is only valid
+    while the (mtime, size) of the file is unchanged.
+    """
+    def __init__(self, filename=":memory:"):
+        if filename != ":memory:":
+            filename = os.path.abspath(filename)
+        self._db = Database.ConcurrentGenericDB(filename)
+        if "media" not in self._db.get_tables():
+            self._db.create(
+                    table="media",
+                    fields=DB_FIELDS,
+                    fieldtypes=DB_TYPES
+                    )
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS media_uri_idx ON media (URI)")
+
+    def _get_key(self, st):
+        return (st.st_mtime, st.st_size)
+
+    def lookup(self, path, st=None):
+        """
+        @param st: The os.stat result for path, if the caller already has it
+        @returns: The cached tags of the file at path, or None if they are
+        missing or stale
+        """
+        if st == None:
+            st = FileCache.stat_file(path)
+        if st == None:
+            return None
+
+        res = self._db.select_one("SELECT MTIME,SIZE,TAGS FROM media WHERE URI = ?", (path,))
+        if res != None and tuple(res[0:2]) == self._get_key(st) and res[2] != None:
+            try:
+                return pickle.loads(str(res[2]))
+            except Exception, e:
+                log.warn("Could not load cached tags of %s: %s" % (path, e))
+        return None
+
+    def store(self, path, tags, st=None):
+        """
+        Stores the tags discovered in the file at path. Tags that can not
+        be pickled, such as images and dates, are stored as strings
+
+        @returns: The tags as stored, which L{lookup} will return
+        """
+        stored = {}
+        for name, value in tags.items():
+            try:
+                pickle.dumps(value)
+                stored[name] = value
+            except Exception:
+                try:
+                    stored[name] = str(value)
+                except Exception:
+                    log.debug("Not caching tag %s of %s" % (name, path))
+
+        if st == None:
+            st = FileCache.stat_file(path)
+        if st == None:
+            return stored
+
+        self._db.execute(
+                "INSERT OR REPLACE INTO media (URI,MTIME,SIZE,TAGS) VALUES (?,?,?,?)",
+                (path,) + self._get_key(st) + (buffer(pickle.dumps(stored, pickle.HIGHEST_PROTOCOL)),)
+                )
+        return stored
+
+    def forget(self, path):
+        """
+        Removes any cached information about path
+        """
+        self._db.execute("DELETE FROM media WHERE URI = ?", (path,))
+
+    def save(self):
+        self._db.save()
+
+    def close(self):
+        self._db.close()
@@ -9,11 +9,13 @@ import gobject
 import os, os.path
 import traceback
 import pydoc
+import threading
 import logging
 log = logging.getLogger("Module")
 
 import conduit.dataproviders
 import conduit.ModuleWrapper as ModuleWrapper
+import conduit.ModuleManifest as ModuleManifest
 import conduit.Knowledge as Knowledge
 import conduit.Vfs as Vfs
 
@@ -25,6 +27,10 @@ class ModuleManager(gobject.GObject):
 
     Also manages dataprovider factories which make dataproviders available
     at runtime
+
+    If given a manifest file, the dataproviders and converters in each file
+    are remembered there, and on later loads the file is only imported when
+    one of them is instantiated, or one of the conversions is used
     """
     __gsignals__ = {
         #Fired when a new instantiatable DP becomes available. It is described via 
@@ -40,12 +46,14 @@ class ModuleManager(gobject.GObject):
             gobject.TYPE_PYOBJECT]),    #The syncset that was added
         }
        
-    def __init__(self, dirs=None):
+    def __init__(self, dirs=None, manifestFile=None):
         """
         @param dirs: A list of directories to search. Relative pathnames and paths
         containing ~ will be expanded. If dirs is None the 
         ModuleLoader will not search for modules.
         @type dirs: C{string[]}
+        @param manifestFile: Where the L{conduit.ModuleManifest.ModuleManifest}
+        is kept. If None every file is imported
         """
         gobject.GObject.__init__(self)
         #Dict of loaded modulewrappers. key is wrapper.get_key()
@@ -56,6 +64,12 @@ class ModuleManager(gobject.GObject):
         self.invalidFiles = []
         #Keep a ref to dataprovider factories so they are not collected
         self.dataproviderFactories = []
+        #The files already imported, path : python module
+        self.importedFiles = {}
+        self._importLock = threading.RLock()
+        self.manifest = None
+        if manifestFile != None:
+            self.manifest = ModuleManifest.ModuleManifest(manifestFile)
         #scan all dirs for files in the right format (*Module/*Module.py)
         self.filelist = self._build_filelist_from_directories(dirs)
 
@@ -151,6 +165,8 @@ class ModuleManager(gobject.GObject):
         Primarily for internal use. Note that the python module returned may actually
         contain several more loadable modules.
         """
+        if filename in self.importedFiles:
+            return self.importedFiles[filename]
         mods = pydoc.importfile (filename)
         try:
             if (mods.MODULES): pass
@@ -163,12 +179,58 @@ class ModuleManager(gobject.GObject):
                 if i not in infos:
                     log.warn("Class %s in file %s does define a %s attribute. Skipping." % (modules, filename, i))
                     raise Exception
+        self.importedFiles[filename] = mods
         return mods
 
+    def _get_class(self, filename, classname):
+        """
+        Imports filename, if it was loaded from the manifest, and returns
+        the class called classname in it
+        """
+        self._importLock.acquire()
+        try:
+            try:
+                log.debug("Importing %s for %s" % (filename, classname))
+                return getattr(self._import_file(filename), classname)
+            except Exception:
+                #it must be imported again to describe it correctly
+                if self.manifest != None:
+                    self.manifest.remove(filename)
+                    self.manifest.save()
+                raise
+        finally:
+            self._importLock.release()
+
+    def _load_modules_in_manifest(self, filename, description):
+        """
+        Loads the modules described in the manifest for filename, without
+        importing it
+        """
+        for classname, d in description.items():
+            if d["infos"]["type"] == "converter":
+                klass = ModuleManifest.LazyConverterClass(self._get_class, filename, classname, d)
+            else:
+                klass = ModuleManifest.LazyClass(self._get_class, filename, classname, d)
+            mod_wrapper = ModuleWrapper.ModuleWrapper(
+                            klass=klass,
+                            initargs=(),
+                            category=self.manifest.get_category(d)
+                            )
+            self._append_module(
+                    mod_wrapper,
+                    klass
+                    )
+
     def _load_modules_in_file(self, filename):
         """
         Loads all modules in the given file
         """
+        if self.manifest != None:
+            description = self.manifest.get(filename)
+            if description != None and not ModuleManifest.has_factory(description):
+                self._load_modules_in_manifest(filename, description)
+                return
+
         try:
             mod = self._import_file(filename)
             for modules, infos in mod.MODULES.items():
@@ -197,6 +259,12 @@ class ModuleManager(gobject.GObject):
                         log.warn("Class is an unknown type: %s" % klass)
                 except AttributeError:
                     log.warn("Could not find module %s in %s\n%s" % (modules,filename,traceback.format_exc()))
+            if self.manifest != None:
+                try:
+                    self.manifest.set(filename, ModuleManifest.describe_module(mod))
+                except Exception:
+                    log.warn("Could not describe %s in the module manifest\n%s" % (filename, traceback.format_exc()))
+                    self.manifest.remove(filename)
         except pydoc.ErrorDuringImport, e:
             log.warn("Error loading the file: %s\n%s" % (filename, "".join(traceback.format_exception(e.exc,e.value,e.tb))))
             self.invalidFiles.append(os.path.basename(filename))
@@ -227,6 +295,8 @@ class ModuleManager(gobject.GObject):
             i.connect("dataprovider-added", self._on_dynamic_dataprovider_added)
             i.probe()
 
+        if self.manifest != None:
+            self.manifest.save()
         self.emit('all-modules-loaded')
             
     def get_all_modules(self):
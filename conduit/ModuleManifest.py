@@ -0,0 +1,243 @@
+"""
+Describes the dataproviders and converters in each module file, so that
+the files need only be imported when something in them is used
+
+Copyright: John Stowers, 2006
+License: GPLv2
+"""
+import os
+import cPickle
+import tempfile
+import logging
+log = logging.getLogger("ModuleManifest")
+
+import conduit
+import conduit.dataproviders
+import conduit.dataproviders.DataProviderCategory as DataProviderCategory
+
+#The class attributes read by L{conduit.ModuleWrapper.ModuleWrapper}
+CLASS_ATTRIBUTES = (
+    "_name_",
+    "_description_",
+    "_icon_",
+    "_module_type_",
+    "_in_type_",
+    "_out_type_",
+    "_configurable_",
+    "_concurrency_",
+    )
+
+def _get_environment():
+    #names and descriptions are translated, and modules change between
+    #versions, so the manifest is only valid for the same version and language
+    return (
+        conduit.VERSION,
+        tuple([os.environ.get(i, "") for i in ("LANGUAGE", "LC_ALL", "LC_MESSAGES", "LANG")])
+        )
+
+def describe_module(mod):
+    """
+    Describes the classes listed in the MODULES dict of an imported file.
+    Converters are instantiated to find their conversions.
+
+    @returns: A dict of classname : description
+    """
+    description = {}
+    for classname, infos in mod.MODULES.items():
+        klass = getattr(mod, classname)
+        d = {"infos" : dict(infos), "attributes" : {}}
+        for attr in CLASS_ATTRIBUTES:
+            if hasattr(klass, attr):
+                d["attributes"][attr] = getattr(klass, attr)
+        category = getattr(klass, "_category_", None)
+        if category != None:
+            d["category"] = (category.name, category.icon, category.key)
+        if infos["type"] == "converter":
+            instance = klass()
+            conversions = {}
+            for c, func in getattr(instance, "conversions", {}).items():
+                try:
+                    conversions[c] = "%s.%s" % (func.im_class.__name__, func.__name__)
+                except AttributeError:
+                    conversions[c] = getattr(func, "__name__", str(func))
+            d["conversions"] = conversions
+            d["cached_conversions"] = tuple(getattr(instance, "cached_conversions", ()))
+            d["conversion_costs"] = dict(getattr(instance, "conversion_costs", {}))
+        description[classname] = d
+    return description
+
+def has_factory(description):
+    """
+    @returns: True if the described file contains a dataprovider factory,
+    which must always be imported so it can look for dataproviders
+    """
+    for d in description.values():
+        if d["infos"]["type"] == "dataprovider-factory":
+            return True
+    return False
+
+class ModuleManifest(object):
+    """
+    Remembers the description of each module file, keyed by its path and
+    valid while its mtime is unchanged. Files whose MODULES dict was empty
+    are not remembered, because modules leave it empty when something they
+    depend on is missing, and it might be installed later.
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        #path : (mtime, description)
+        self._files = {}
+        self._changed = False
+        #(name, icon, key) : category, so that each category is only created once
+        self._categories = {}
+        for name in dir(conduit.dataproviders):
+            if name.startswith("CATEGORY_"):
+                c = getattr(conduit.dataproviders, name)
+                self._categories[(c.name, c.icon, c.key)] = c
+
+        try:
+            f = open(self.filename, "rb")
+            try:
+                environment, files = cPickle.load(f)
+            finally:
+                f.close()
+            if environment == _get_environment():
+                self._files = files
+            else:
+                log.info("Module manifest is for a different version or language, rebuilding")
+        except IOError:
+            log.info("No module manifest, building")
+        except Exception, e:
+            log.warn("Could not read module manifest, rebuilding: %s" % e)
+
+    def _get_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def get(self, path):
+        """
+        @returns: The description of the file at path, or None if it is not
+        known or has been modified
+        """
+        if path not in self._files:
+            return None
+        mtime, description = self._files[path]
+        if mtime != self._get_mtime(path):
+            log.debug("%s modified, it must be imported" % path)
+            return None
+        return description
+
+    def set(self, path, description):
+        if len(description) == 0:
+            self.remove(path)
+            return
+        entry = (self._get_mtime(path), description)
+        if self._files.get(path) != entry:
+            self._files[path] = entry
+            self._changed = True
+
+    def remove(self, path):
+        if path in self._files:
+            del(self._files[path])
+            self._changed = True
+
+    def get_category(self, description):
+        """
+        @returns: The L{conduit.dataproviders.DataProviderCategory.DataProviderCategory}
+        of the described class, which is the same instance as the class had
+        for the standard categories
+        """
+        if "category" not in description:
+            return conduit.dataproviders.CATEGORY_TEST
+        name, icon, key = description["category"]
+        if (name, icon, key) not in self._categories:
+            category = DataProviderCategory.DataProviderCategory(name, icon)
+            category.key = key
+            self._categories[(name, icon, key)] = category
+        return self._categories[(name, icon, key)]
+
+    def save(self):
+        """
+        Writes the manifest if it changed. It is written to a temporary file
+        first, so an interrupted write never leaves a partial manifest
+        """
+        if not self._changed:
+            return
+        try:
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(self.filename))
+            f = os.fdopen(fd, "wb")
+            try:
+                cPickle.dump((_get_environment(), self._files), f, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(temp, self.filename)
+            self._changed = False
+        except Exception, e:
+            log.warn("Could not save module manifest: %s" % e)
+
+class LazyClass(object):
+    """
+    Stands in for a class in a module file that has not been imported. It
+    has the class attributes from the manifest, and imports the file and
+    creates an instance of the real class when called.
+    """
+    def __init__(self, get_class, path, classname, description):
+        """
+        @param get_class: Called with path and classname to import the file
+        and return the real class
+        """
+        self._get_class = get_class
+        self.path = path
+        self.__name__ = classname
+        for attr, value in description["attributes"].items():
+            setattr(self, attr, value)
+
+    def get_class(self):
+        return self._get_class(self.path, self.__name__)
+
+    def __call__(self, *args, **kwargs):
+        return self.get_class()(*args, **kwargs)
+
+class LazyConverterClass(LazyClass):
+    """
+    Stands in for a converter class. Calling it returns a L{LazyConverter},
+    so the file is only imported when one of its conversions is used
+    """
+    def __init__(self, get_class, path, classname, description):
+        LazyClass.__init__(self, get_class, path, classname, description)
+        self.conversionNames = description["conversions"]
+        self.cached_conversions = description["cached_conversions"]
+        self.conversion_costs = description["conversion_costs"]
+        self._instance = None
+
+    def get_instance(self):
+        if self._instance == None:
+            self._instance = self.get_class()()
+        return self._instance
+
+    def __call__(self):
+        return LazyConverter(self)
+
+class LazyConverter(object):
+    """
+    Has the conversions of a converter that has not been imported
+    """
+    _module_type_ = "converter"
+    def __init__(self, klass):
+        self.conversions = {}
+        for c, name in klass.conversionNames.items():
+            self.conversions[c] = _LazyConversion(klass, c, name)
+        self.cached_conversions = klass.cached_conversions
+        self.conversion_costs = klass.conversion_costs
+
+class _LazyConversion(object):
+    def __init__(self, klass, conversion, name):
+        self.klass = klass
+        self.conversion = conversion
+        self.__name__ = name
+
+    def __call__(self, *args, **kwargs):
+        return self.klass.get_instance().conversions[self.conversion](*args, **kwargs)
+
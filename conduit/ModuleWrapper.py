@@ -29,6 +29,7 @@ class ModuleWrapper:
         @ivar category: The category of the contained module
         @ivar in_type: The name of the datatype that the module accepts (put())
         @ivar out_type: The name of the datatype that the module produces (get())
+        @ivar concurrency: The number of simultaneous get() and put() calls the module supports
         @ivar classname: The classname used to instanciate another module instance
         @ivar initargs: The arguments passed to the new module if created
         @ivar module: An instance of the described module
@@ -49,6 +50,7 @@ class ModuleWrapper:
             self.in_type =          getattr(klass, "_in_type_", "")
             self.out_type =         getattr(klass, "_out_type_", "")
             self.configurable =     getattr(klass, "_configurable_", False)
+            self.concurrency =      getattr(klass, "_concurrency_", 1)
             self.classname =        klass.__name__
         else:
             self.name =             "Unknown"
@@ -59,6 +61,7 @@ class ModuleWrapper:
             self.out_type =         ""
             self.classname =        ""
             self.configurable =     False
+            self.concurrency =      1
 
         self.dndKey = None
         self.enabled = True
@@ -146,6 +149,15 @@ class ModuleWrapper:
         else:
             return self.module.get_output_type()
 
+    def get_concurrency(self):
+        """
+        Returns the number of simultaneous get() and put() calls the module
+        supports during a pipelined sync. See get_input_type()
+        """
+        if self.module == None:
+            return self.concurrency
+        else:
+            return getattr(self.module, "_concurrency_", 1)
 
     def get_icon(self, size=16):
         """
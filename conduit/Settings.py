@@ -69,6 +69,7 @@ class Settings(gobject.GObject):
         'save_on_exit'              :   True,           #Is the sync set saved on exit automatically?
         'enable_network'            :   True,           #Should conduit look for other conduits on the local network
         'enable_removable_devices'  :   True,           #Should conduit support iPods, USB keys, etc
+        'network_allow_pickle'      :   False,          #Accept pickled data from old (protocol 1) peers. Unsafe, a peer can run code when it is unpickled
         'default_policy_conflict'   :   "ask",          #Default conflict policy for new Conduits, ask,replace,skip
         'default_policy_deleted'    :   "ask",          #Default deleted policy for new Conduits, ask,replace,skip
         'gui_expanded_rows'         :   [],             #list of expanded column paths in the treeview
@@ -81,6 +82,15 @@ class Settings(gobject.GObject):
         'gui_use_rgba_colormap'     :   False,          #Seems to corrupt gtkmozembed on some systems
         'gui_show_hints'            :   True,           #Show message area hints in the Conduit GUI
         'gui_show_treeview_lines'   :   False,          #Show treeview lines
+        'sync_pipelined'            :   False,          #Get, convert and put data in parallel (for dataproviders that support it)
+        'sync_conversion_threads'   :   0,              #Number of simultaneous conversions in a pipelined sync (0 is the number of CPUs)
+        'transcode_threads'         :   0,              #Number of simultaneous audio/video transcodes (0 is the number of CPUs)
+        'sync_batch_size'           :   1,              #Number of items given to put_many/delete_many at once (1 disables batching)
+        'sync_max_conduits'         :   4,              #Number of conduits that sync at once, others wait (0 is the number of CPUs)
+        'sync_max_io_calls'         :   8,              #Number of simultaneous refresh, get, put and delete calls over all syncs (0 is the number of CPUs)
+        'sync_max_cpu_calls'        :   0,              #Number of simultaneous conversions over all syncs (0 is the number of CPUs)
+        'conversion_cache_size'     :   512,            #Megabytes of converted photos, audio and video to keep (0 disables the cache)
+        'sync_profile_log'          :   False,          #Log the time spent in each dataprovider, conversion and phase of a sync
     }
         
     def __init__(self, **kwargs):
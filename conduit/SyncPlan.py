@@ -0,0 +1,82 @@
+"""
+Works out what a two way sync needs to do, given the changes to both
+dataproviders since the previous sync.
+
+Planning does not touch the dataproviders or the mapping DB, and takes
+time linear in the number of changes.
+"""
+import logging
+log = logging.getLogger("SyncPlan")
+
+class TwoWayPlan(object):
+    """
+    The actions needed for a two way sync, in the order they should
+    be performed
+    """
+    def __init__(self):
+        self.todelete = []  # (sourcedp, dataUID, sinkdp)
+        self.toput = []     # (sourcedp, dataUID, sinkdp)
+        self.tocomp = []    # (dp1, data1UID, dp2, data2UID)
+
+    def __len__(self):
+        return len(self.toput) + len(self.todelete) + len(self.tocomp)
+
+def _modified_and_deleted(dp1, modified, dp2, deleted, mappings, plan):
+    """
+    Data modified on one side and deleted on the other is deleted.
+    @returns: The remaining (modified, deleted)
+    """
+    deletedSet = set(deleted)
+    remaining = []
+    for i in modified:
+        matchingUID = mappings.get_matching_UID(i)
+        if matchingUID in deletedSet:
+            log.debug("2WAY MOD+DEL: %s v %s" % (i, matchingUID))
+            deletedSet.remove(matchingUID)
+            plan.todelete.append( (dp2, matchingUID, dp1) )
+        else:
+            remaining.append(i)
+    return remaining, [i for i in deleted if i in deletedSet]
+
+def plan_two_way_sync(source, sourceChanges, sink, sinkChanges, mappings):
+    """
+    @param sourceChanges: The (added, modified, deleted) LUIDs of source
+    @param sinkChanges: The (added, modified, deleted) LUIDs of sink
+    @param mappings: A L{conduit.MappingDB.MappingTable} for source and sink
+    @returns: A L{TwoWayPlan}
+    """
+    sourceAdded, sourceModified, sourceDeleted = sourceChanges
+    sinkAdded, sinkModified, sinkDeleted = sinkChanges
+    plan = TwoWayPlan()
+
+    #added data can be put right away
+    plan.toput += [(source, i, sink) for i in sourceAdded]
+    plan.toput += [(sink, i, source) for i in sinkAdded]
+
+    #check first for data that had been simulatainously modified and deleted
+    sourceModified, sinkDeleted = _modified_and_deleted(source, sourceModified, sink, sinkDeleted, mappings, plan)
+    sinkModified, sourceDeleted = _modified_and_deleted(sink, sinkModified, source, sourceDeleted, mappings, plan)
+
+    #as can deleted data
+    plan.todelete += [(source, i, sink) for i in sourceDeleted]
+    plan.todelete += [(sink, i, source) for i in sinkDeleted]
+
+    #modified is a bit harder because we need to check if both side have
+    #been modified at the same time. First find items in both lists and seperate
+    #them out as they need to be compared.
+    sinkModifiedSet = set(sinkModified)
+    remaining = []
+    for i in sourceModified:
+        matchingUID = mappings.get_matching_UID(i)
+        if matchingUID in sinkModifiedSet:
+            log.warn("2WAY BOTH MODIFIED: %s v %s" % (i, matchingUID))
+            sinkModifiedSet.remove(matchingUID)
+            plan.tocomp.append( (source, i, sink, matchingUID) )
+        else:
+            remaining.append(i)
+
+    #all that remains in the original lists are to be put
+    plan.toput += [(source, i, sink) for i in remaining]
+    plan.toput += [(sink, i, source) for i in sinkModified if i in sinkModifiedSet]
+
+    return plan
@@ -0,0 +1,247 @@
+"""
+Decides when the syncs and refreshes of many conduits run, so that
+conduits syncing at the same time share the disk, network and CPU.
+
+Copyright: John Stowers, 2006
+License: GPLv2
+"""
+import time
+import threading
+import logging
+log = logging.getLogger("SyncScheduler")
+
+import conduit
+import conduit.utils.Thread as Thread
+
+#Syncs requested by the user run before automatic syncs
+PRIORITY_USER = 0
+PRIORITY_AUTO = 1
+
+#Kinds of phase. IO is talking to dataproviders (refresh, get, put,
+#delete), CPU is converting data
+IO = "io"
+CPU = "cpu"
+
+#How often waiting workers check whether they were cancelled
+CANCEL_CHECK_INTERVAL = 0.1
+
+class SyncScheduler(object):
+    """
+    Runs at most maxRunning workers (syncs, refreshes, etc) at once. Other
+    workers wait in a queue, ordered by priority then by when they were
+    queued, and a worker is never run at the same time as another worker
+    that uses the same dataprovider instance.
+
+    Running workers also share a limited number of IO and CPU slots. Each
+    call made in an IO or CPU phase (see L{call}) waits for a free slot of
+    its kind, so conduits syncing at once do not all hit the disk or CPU.
+    """
+    def __init__(self, maxRunning, maxIO, maxCPU):
+        self.maxRunning = max(1, maxRunning)
+        self.limits = {IO : max(1, maxIO), CPU : max(1, maxCPU)}
+        self._lock = threading.Condition()
+        #[(priority, sequence number, worker, dataprovider modules, time queued)]
+        self._queue = []
+        self._sequence = 0
+        #worker : dataprovider modules
+        self._running = {}
+        self._phases = {IO : 0, CPU : 0}
+        #the phases held by each thread, so nested calls do not wait again
+        self._local = threading.local()
+        self._stats = {
+            "started"           : 0,
+            "cancelled"         : 0,
+            "max_queued"        : 0,
+            "max_running"       : 0,
+            "wait_time"         : 0.0,
+            "max_wait_time"     : 0.0,
+            "phase_calls"       : {IO : 0, CPU : 0},
+            "phase_wait_time"   : {IO : 0.0, CPU : 0.0},
+            "max_phases"        : {IO : 0, CPU : 0},
+            }
+
+    def _get_modules(self, worker):
+        return [dpw.module for dpw in worker.get_dataproviders() if dpw.module != None]
+
+    def _can_run(self, modules):
+        #must be called with the lock held
+        if len(self._running) >= self.maxRunning:
+            return False
+        for running in self._running.values():
+            for m in modules:
+                if m in running:
+                    return False
+        return True
+
+    def _get_next(self):
+        """
+        @returns: The first queued entry that can run now, or None
+        """
+        #must be called with the lock held
+        for entry in self._queue:
+            if self._can_run(entry[3]):
+                return entry
+        return None
+
+    def _is_cancelled(self, worker):
+        return conduit.GLOBALS.cancelled or getattr(worker, "cancelled", False)
+
+    def wait_to_run(self, worker):
+        """
+        Queues worker and blocks until it may run. Called from the thread
+        of the worker.
+
+        @returns: True when the worker may run, or False if it was cancelled
+        while waiting. If True, call L{finished} when the worker is done
+        """
+        modules = self._get_modules(worker)
+        queued = time.time()
+        self._lock.acquire()
+        try:
+            entry = (getattr(worker, "priority", PRIORITY_USER), self._sequence, worker, modules, queued)
+            self._sequence += 1
+            self._queue.append(entry)
+            self._queue.sort()
+            self._stats["max_queued"] = max(self._stats["max_queued"], len(self._queue))
+            if len(self._queue) > 1 or not self._can_run(modules):
+                log.info("%s waiting to run (%s queued, %s running)" % (worker, len(self._queue), len(self._running)))
+
+            while self._get_next() is not entry:
+                if self._is_cancelled(worker):
+                    self._queue.remove(entry)
+                    self._stats["cancelled"] += 1
+                    #another worker may now be first
+                    self._lock.notifyAll()
+                    return False
+                self._lock.wait(CANCEL_CHECK_INTERVAL)
+
+            self._queue.remove(entry)
+            self._running[worker] = modules
+            waited = time.time() - queued
+            self._stats["started"] += 1
+            self._stats["wait_time"] += waited
+            self._stats["max_wait_time"] = max(self._stats["max_wait_time"], waited)
+            self._stats["max_running"] = max(self._stats["max_running"], len(self._running))
+            return True
+        finally:
+            self._lock.release()
+
+    def finished(self, worker):
+        """
+        Frees the place of a worker that has finished running
+        """
+        self._lock.acquire()
+        try:
+            if worker in self._running:
+                del(self._running[worker])
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+    def _get_held(self):
+        if not hasattr(self._local, "held"):
+            self._local.held = 0
+        return self._local.held
+
+    def acquire(self, kind, worker=None):
+        """
+        Waits for a free slot for a phase of kind IO or CPU. A thread that
+        already holds a slot (of either kind) does not wait again, so nested
+        calls never deadlock.
+
+        @param worker: The worker making the call. The wait stops if it, or
+        all syncs, are cancelled
+        @returns: True once the slot is taken, or False if cancelled while
+        waiting. If True, call L{release} when the phase is done
+        """
+        held = self._get_held()
+        if held > 0:
+            self._local.held = held + 1
+            return True
+
+        t = time.time()
+        self._lock.acquire()
+        try:
+            while self._phases[kind] >= self.limits[kind]:
+                if self._is_cancelled(worker):
+                    return False
+                self._lock.wait(CANCEL_CHECK_INTERVAL)
+            self._phases[kind] += 1
+            self._stats["phase_calls"][kind] += 1
+            self._stats["phase_wait_time"][kind] += time.time() - t
+            self._stats["max_phases"][kind] = max(self._stats["max_phases"][kind], self._phases[kind])
+        finally:
+            self._lock.release()
+        self._local.held = 1
+        self._local.kind = kind
+        return True
+
+    def release(self):
+        """
+        Frees the slot taken by the last L{acquire} in this thread
+        """
+        held = self._get_held()
+        if held <= 0:
+            log.warn("Released a slot that was not acquired")
+            return
+        self._local.held = held - 1
+        if self._local.held > 0:
+            return
+
+        self._lock.acquire()
+        try:
+            self._phases[self._local.kind] -= 1
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+    def get_queue_depth(self):
+        """
+        @returns: The number of workers waiting to run
+        """
+        self._lock.acquire()
+        try:
+            return len(self._queue)
+        finally:
+            self._lock.release()
+
+    def get_num_running(self):
+        self._lock.acquire()
+        try:
+            return len(self._running)
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """
+        @returns: A dict of the current queue depth and number running,
+        the peaks reached, the number of workers started and cancelled while
+        queued, the total and longest time workers waited to run, and for
+        each kind of phase the number of calls, total time waited for a slot
+        and the most slots in use at once
+        """
+        self._lock.acquire()
+        try:
+            stats = dict(self._stats)
+            for k in ("phase_calls", "phase_wait_time", "max_phases"):
+                stats[k] = dict(self._stats[k])
+            stats["queued"] = len(self._queue)
+            stats["running"] = len(self._running)
+            return stats
+        finally:
+            self._lock.release()
+
+def new_scheduler():
+    """
+    @returns: A L{SyncScheduler} with the limits from the settings, where
+    0 means the number of CPUs
+    """
+    cpus = Thread.get_cpu_count()
+    limits = []
+    for key in ("sync_max_conduits", "sync_max_io_calls", "sync_max_cpu_calls"):
+        value = conduit.GLOBALS.settings.get(key)
+        if value <= 0:
+            value = cpus
+        limits.append(value)
+    log.debug("Running %s syncs at once, with %s IO and %s CPU calls" % tuple(limits))
+    return SyncScheduler(*limits)
@@ -4,9 +4,13 @@ Holds class used for the actual synchronisation phase
 Copyright: John Stowers, 2006
 License: GPLv2
 """
+import sys
+import copy
 import thread
+import time
 import traceback
 import threading
+import collections
 import logging
 log = logging.getLogger("Syncronization")
 
@@ -15,17 +19,48 @@ import conduit
 import conduit.dataproviders.DataProvider as DataProvider
 import conduit.Exceptions as Exceptions
 import conduit.DeltaProvider as DeltaProvider
+import conduit.SyncPlan as SyncPlan
+import conduit.SyncScheduler as SyncScheduler
+import conduit.datatypes.File as File
+import conduit.utils.Thread as Thread
+import conduit.utils.Profile as Profile
 
 from conduit.Conflict import Conflict, CONFLICT_DELETE, CONFLICT_COPY_SOURCE_TO_SINK,CONFLICT_SKIP,CONFLICT_COPY_SINK_TO_SOURCE
 from conduit.datatypes import DataType, Rid, COMPARISON_OLDER, COMPARISON_EQUAL, COMPARISON_NEWER, COMPARISON_UNKNOWN
 
-def put_data(source, sink, sourceData, sourceDataRid, overwrite):
+def _get_size(data):
+    """
+    @returns: The size of data if it is a local file, otherwise 0. The size
+    of other data is not known without serializing it
+    """
+    if isinstance(data, File.File) and data.is_local() and data.exists():
+        return data.get_size() or 0
+    return 0
+
+def _copy_data(data):
+    """
+    @returns: A copy of data that may be put into a sink without changing
+    data. Files are copied without their contents, putting a file only 
+    changes which file the instance refers to, so each copy gets its own
+    file implementation for the same URI. Other data is deep copied
+    """
+    if isinstance(data, File.File):
+        newdata = data.__class__.__new__(data.__class__)
+        newdata.__dict__.update(data.__dict__)
+        newdata._file = data.FileImpl.FileImpl(data._get_text_uri())
+        return newdata
+    return copy.deepcopy(data)
+
+def put_data(source, sink, sourceData, sourceDataRid, overwrite, mappings=None):
     """
     Puts sourceData into sink, overwrites if overwrite is True. Updates 
-    the mappingDB
+    the mappingDB, or the supplied L{conduit.MappingDB.MappingTable}
     """
+    if mappings == None:
+        mappings = conduit.GLOBALS.mappingDB
+
     #get the existing mapping
-    mapping = conduit.GLOBALS.mappingDB.get_mapping(
+    mapping = mappings.get_mapping(
                             sourceUID=source.get_UID(),
                             dataLUID=sourceDataRid.get_UID(),
                             sinkUID=sink.get_UID()
@@ -43,26 +78,95 @@ def put_data(source, sink, sourceData, sourceDataRid, overwrite):
     #Update the mapping and save
     mapping.set_source_rid(sourceDataRid)
     mapping.set_sink_rid(sinkRid)
-    conduit.GLOBALS.mappingDB.save_mapping(mapping)
+    mappings.save_mapping(mapping)
 
-def delete_data(source, sink, dataLUID):
+def delete_data(source, sink, dataLUID, mappings=None):
     """
-    Deletes data from sink and updates the mapping DB
+    Deletes data from sink and updates the mapping DB, or the supplied
+    L{conduit.MappingDB.MappingTable}
     """
+    if mappings == None:
+        mappings = conduit.GLOBALS.mappingDB
+
     log.info("Deleting %s from %s" % (dataLUID, sink.get_UID()))
     sink.module.delete(dataLUID)
-    mapping = conduit.GLOBALS.mappingDB.get_mapping(
+    mapping = mappings.get_mapping(
                         sourceUID=source.get_UID(),
                         dataLUID=dataLUID,
                         sinkUID=sink.get_UID()
                         )
-    conduit.GLOBALS.mappingDB.delete_mapping(mapping)
+    mappings.delete_mapping(mapping)
+
+def put_data_many(source, sink, items, overwrite, mappings=None):
+    """
+    Puts each (sourceData, sourceDataRid) in items into sink, with a single
+    call to put_many. Updates the mappings of the data that was put, like
+    L{put_data}
+
+    @returns: A list with, for each item, None if it was put or the
+    exception raised when putting it
+    """
+    if mappings == None:
+        mappings = conduit.GLOBALS.mappingDB
+
+    existing = []
+    for sourceData, sourceDataRid in items:
+        existing.append(mappings.get_mapping(
+                            sourceUID=source.get_UID(),
+                            dataLUID=sourceDataRid.get_UID(),
+                            sinkUID=sink.get_UID()
+                            ))
+
+    log.info("Putting %s items into %s" % (len(items), sink.get_UID()))
+    results = sink.module.put_many(
+                    [(sourceData, overwrite, mapping.get_sink_rid().get_UID()) for (sourceData, sourceDataRid), mapping in zip(items, existing)]
+                    )
+
+    errors = []
+    for (sourceData, sourceDataRid), mapping, sinkRid in zip(items, existing, results):
+        if isinstance(sinkRid, Exception):
+            errors.append(sinkRid)
+        else:
+            mapping.set_source_rid(sourceDataRid)
+            mapping.set_sink_rid(sinkRid)
+            mappings.save_mapping(mapping)
+            errors.append(None)
+    return errors
+
+def delete_data_many(source, sink, dataLUIDs, mappings=None):
+    """
+    Deletes many items from sink with a single call to delete_many, and
+    updates the mappings of those that were deleted. Raises the first error,
+    like L{delete_data}
+    """
+    if mappings == None:
+        mappings = conduit.GLOBALS.mappingDB
+
+    log.info("Deleting %s items from %s" % (len(dataLUIDs), sink.get_UID()))
+    results = sink.module.delete_many(dataLUIDs)
+
+    errors = []
+    for dataLUID, err in zip(dataLUIDs, results):
+        if err != None:
+            errors.append(err)
+        else:
+            mapping = mappings.get_mapping(
+                                sourceUID=source.get_UID(),
+                                dataLUID=dataLUID,
+                                sinkUID=sink.get_UID()
+                                )
+            mappings.delete_mapping(mapping)
+    if len(errors) > 0:
+        raise errors[0]
 
 class SyncManager: 
     """
     Given a dictionary of relationships this class synchronizes
     the relevant sinks and sources. If there is a conflict then this is
     handled by the conflictResolver
+
+    Each sync, refresh, etc runs in its own thread, but waits for the
+    L{conduit.SyncScheduler.SyncScheduler} to let it run
     """
     def __init__ (self, typeConverter):
         """
@@ -72,6 +176,7 @@ class SyncManager:
         """
         self.syncWorkers = {}
         self.typeConverter = typeConverter
+        self.scheduler = SyncScheduler.new_scheduler()
 
     def _cancel_sync_thread(self, cond):
         log.warn("Conduit already in queue (alive: %s)" % self.syncWorkers[cond].isAlive())
@@ -91,6 +196,7 @@ class SyncManager:
         conduit.GLOBALS.cancelled = False
 
         log.debug("Starting worker: %s" % worker)
+        worker.scheduler = self.scheduler
         cond.connect("sync-completed", self._on_sync_completed, worker)
         self.syncWorkers[cond] = worker
         self.syncWorkers[cond].start()
@@ -167,12 +273,18 @@ class SyncManager:
         threadedWorker = SyncWorker(self.typeConverter, cond, False)
         self._start_worker_thread(cond, threadedWorker)
 
-    def sync_conduit(self, cond):
+    def sync_conduit(self, cond, auto=False):
+        """
+        Syncs cond. Automatic syncs (auto is True) wait for those the user
+        asked for
+        """
         if cond in self.syncWorkers:
             log.info("Sync already in progress")
             self.join_one(cond)
 
         threadedWorker = SyncWorker(self.typeConverter, cond, True)
+        if auto:
+            threadedWorker.priority = SyncScheduler.PRIORITY_AUTO
         self._start_worker_thread(cond, threadedWorker)
 
     def did_sync_abort(self, cond):
@@ -206,6 +318,13 @@ class _ThreadedWorker(threading.Thread):
     SYNC_STATE = 2
     DONE_STATE = 3
 
+    STATE_NAMES = {
+        CONFIGURE_STATE :   "configure",
+        REFRESH_STATE   :   "refresh",
+        SYNC_STATE      :   "sync",
+        DONE_STATE      :   "done"
+    }
+
     def __init__(self):
         threading.Thread.__init__(self)
         log.debug("Created thread %s (thread: %s)" % (self,thread.get_ident()))
@@ -220,23 +339,107 @@ class _ThreadedWorker(threading.Thread):
         #Class variable because these may occur in a data conversion. 
         #Needed so that the correct status is shown on the GUI at the end of the sync process
         self.sinkErrors = {}
+
+        #The time spent in each state, and in the calls made from them
+        self.profile = Profile.SyncProfile()
+        self._state = None
+        self._stateStarted = None
         
         #Start at the beginning
         self.state = self.CONFIGURE_STATE
-        
-    def _get_changes(self, source, sink):
+
+        #Set by the SyncManager, which decides when the worker runs
+        self.scheduler = None
+        self.priority = SyncScheduler.PRIORITY_USER
+
+    def _record_state_time(self):
+        now = time.time()
+        if self._state != None:
+            self.profile.record(
+                        Profile.PHASE,
+                        self.__class__.__name__,
+                        self.STATE_NAMES[self._state],
+                        now - self._stateStarted)
+        self._stateStarted = now
+
+    def _get_state(self):
+        return self._state
+
+    def _set_state(self, state):
+        self._record_state_time()
+        self._state = state
+
+    state = property(_get_state, _set_state)
+
+    def finish_profile(self):
+        """
+        Records the time spent in the final state and stops the profile
+        """
+        self._record_state_time()
+        self.profile.finish()
+
+    def get_dataproviders(self):
+        """
+        @returns: The dataprovider wrappers used by this worker. Workers that
+        share a dataprovider are not run at the same time
+        """
+        return self.cond.get_all_dataproviders()
+
+    def _call_in_phase(self, kind, func, *args):
+        """
+        Calls func(*args) once the scheduler has a free slot for a phase of
+        kind L{conduit.SyncScheduler.IO} or L{conduit.SyncScheduler.CPU}
+        """
+        if self.scheduler == None:
+            return func(*args)
+        if not self.scheduler.acquire(kind, self):
+            log.info("%s cancelled while waiting to call %s" % (self, func))
+            raise Exceptions.StopSync(self.state)
+        try:
+            return func(*args)
+        finally:
+            self.scheduler.release()
+
+    def run(self):
+        """
+        Waits for the scheduler to let this worker run, then runs it
+        """
+        if self.scheduler != None:
+            if not self.scheduler.wait_to_run(self):
+                log.info("%s cancelled before it started" % self)
+                self.aborted = True
+                self.cond.emit("sync-completed", self.aborted, False, False)
+                return
+        try:
+            self._run()
+        finally:
+            if self.scheduler != None:
+                self.scheduler.finished(self)
+
+    def _run(self):
+        raise NotImplementedError
+
+    def _get_changes(self, source, sink, mappings=None):
         """
         Returns all the data from the source to the sink. If the dataprovider
         implements get_changes() then this is called. Otherwise the dataprovider
-        is proxied using DeltaProvider
+        is proxied using DeltaProvider. So is a pair that has not been
+        synchronized before, because every item is new to it, whatever has
+        changed since the dataprovider was last synchronized
 
         @returns: added, modified, deleted
         """
         try:
-            added, modified, deleted = source.module.get_changes()
+            added, modified, deleted = self.profile.call(
+                                Profile.DATAPROVIDER, source.get_UID(), "get_changes",
+                                self._call_in_phase, SyncScheduler.IO, source.module.get_changes)
+            if mappings != None and len(mappings) == 0:
+                raise NotImplementedError
         except NotImplementedError:
-            delta = DeltaProvider.DeltaProvider(source, sink)
-            added, modified, deleted = delta.get_changes()
+            delta = DeltaProvider.DeltaProvider(source, sink, mappings)
+            added, modified, deleted = self.profile.call(
+                                Profile.DATAPROVIDER, source.get_UID(), "get_changes (DeltaProvider)",
+                                self._call_in_phase, SyncScheduler.IO, delta.get_changes)
 
         log.debug("%s Changes: New %s items\n%s" % (source.get_UID(), len(added), added))
         log.debug("%s Changes: Modified %s items\n%s" % (source.get_UID(), len(modified), modified))
@@ -286,13 +489,36 @@ class SyncWorker(_ThreadedWorker):
 
         self._progress = 0
         self._progressUIDs = []
-        
+        #the progress of the last item, and the progress each item adds, so
+        #that the progress of long conversions can be shown
+        self._itemProgress = 0
+        self._itemFraction = 0
+        #converters report progress from their own threads
+        self._progressLock = threading.Lock()
+
+        #In a pipelined sync data is got and converted in worker threads
+        #while it is put in this thread
+        self.pipelined = conduit.GLOBALS.settings.get("sync_pipelined")
+        self.conversionThreads = conduit.GLOBALS.settings.get("sync_conversion_threads")
+        if self.conversionThreads <= 0:
+            self.conversionThreads = Thread.get_cpu_count()
+        #dataprovider -> semaphore limiting simultaneous get() and put() calls
+        self._dataproviderLocks = {}
+
+        #Data is put and deleted in batches for sinks that implement
+        #put_many and delete_many
+        self.batchSize = conduit.GLOBALS.settings.get("sync_batch_size")
+        self._putManyUnsupported = {}
+        self._deleteManyUnsupported = {}
 
         if self.cond.is_two_way():
             self.setName("%s <--> %s" % (self.source, self.sinks[0]))
         else:
             self.setName("%s |--> %s" % (self.source, self.sinks))
 
+    def get_dataproviders(self):
+        return [self.source] + self.sinks
+
     def _emit_progress(self, progress, dataUID):
         """
         Emits progress signals, if the elapsed progress since the last 
@@ -300,27 +526,93 @@ class SyncWorker(_ThreadedWorker):
         otherwise we starve the main loop with too frequent progress
         events
         """
-        self._progressUIDs.append(dataUID)
-        if (progress - self._progress) > self.PROGRESS_UPDATE_THRESHOLD or progress == 1.0:
-            self._progress = progress
-            self.cond.emit("sync-progress", self._progress, self._progressUIDs)
-            self._progressUIDs = []
-
-    def _get_data(self, source, sink, uid):
+        self._progressLock.acquire()
+        try:
+            self._itemProgress = progress
+            self._progressUIDs.append(dataUID)
+            if (progress - self._progress) > self.PROGRESS_UPDATE_THRESHOLD or progress == 1.0:
+                self._progress = progress
+                self.cond.emit("sync-progress", self._progress, self._progressUIDs)
+                self._progressUIDs = []
+        finally:
+            self._progressLock.release()
+
+    def emit_conversion_progress(self, items):
         """
-        Gets the data from source. Handles exceptions, etc.
+        Called by converters during long conversions, such as transcoding,
+        with the number of items worth of conversion done but not yet put.
+        Emits progress in the same way as L{_emit_progress}, but no item is
+        marked as completed. May be called from any thread
+        """
+        self._progressLock.acquire()
+        try:
+            progress = min(self._itemProgress + items*self._itemFraction, 1.0)
+            if (progress - self._progress) > self.PROGRESS_UPDATE_THRESHOLD:
+                self._progress = progress
+                self.cond.emit("sync-progress", self._progress, [])
+        finally:
+            self._progressLock.release()
+
+    def _get_data(self, source, sinks, uid):
+        """
+        Gets the data from source, for each of sinks. Handles exceptions, etc.
 
         @returns: The data that was got or None
         """
         data = None
         try:
-            data = source.module.get(uid)
+            data = self.profile.call(
+                                Profile.DATAPROVIDER, source.get_UID(), "get",
+                                self._call_in_phase, SyncScheduler.IO, source.module.get, uid,
+                                sizeof=_get_size)
         except Exceptions.SyncronizeError, err:
             log.warn("%s\n%s" % (err, traceback.format_exc()))                     
-            self.sinkErrors[sink] = DataProvider.STATUS_DONE_SYNC_ERROR
+            for sink in sinks:
+                self.sinkErrors[sink] = DataProvider.STATUS_DONE_SYNC_ERROR
         return data
 
-    def _put_data(self, source, sink, sourceData, sourceDataRid):
+    def _get_mappings_table(self, source, sink):
+        return self.profile.call(
+                        Profile.MAPPINGDB, "MappingDB", "get_mappings_table",
+                        conduit.GLOBALS.mappingDB.get_mappings_table,
+                        source.get_UID(), sink.get_UID())
+
+    def _save_mappings_table(self, mappings):
+        self.profile.call(
+                        Profile.MAPPINGDB, "MappingDB", "save_mappings_table",
+                        conduit.GLOBALS.mappingDB.save_mappings_table,
+                        mappings)
+
+    def _delete_data(self, source, sink, dataLUID, mappings=None):
+        self.profile.call(
+                        Profile.DATAPROVIDER, sink.get_UID(), "delete",
+                        self._call_in_phase, SyncScheduler.IO, delete_data,
+                        source, sink, dataLUID, mappings)
+
+    def _handle_put_error(self, source, sink, sourceData, sourceDataRid, err, mappings=None):
+        """
+        Handles the exception raised when putting data from source to sink,
+        or returned by put_many
+        """
+        if isinstance(err, Exceptions.SyncronizeError):
+            #errors returned by put_many were not raised here, so there is
+            #no traceback
+            if sys.exc_info()[1] is err:
+                log.warn("%s\n%s" % (err, traceback.format_exc()))
+            else:
+                log.warn("%r" % err)
+            self.sinkErrors[sink] = DataProvider.STATUS_DONE_SYNC_ERROR
+        elif isinstance(err, Exceptions.SynchronizeConflictError):
+            comp = err.comparison
+            if comp == COMPARISON_EQUAL:
+                log.info("Skipping %s (Equal)" % sourceData)
+            else:
+                assert(err.fromData == sourceData)
+                self._apply_conflict_policy(source, sink, err.comparison, sourceData, sourceDataRid, err.toData, err.toData.get_rid(), mappings)
+        else:
+            raise err
+
+    def _put_data(self, source, sink, sourceData, sourceDataRid, mappings=None):
         """
         Handles exceptions when putting data from source to sink. Default is
         not to overwrite
@@ -328,43 +620,316 @@ class SyncWorker(_ThreadedWorker):
         @returns: True if the data was successfully put
         """
         if sourceData != None:
+            size = _get_size(sourceData)
+            lock = self._dataproviderLocks.get(sink)
+            if lock: lock.acquire()
             try:
-                put_data(source, sink, sourceData, sourceDataRid, False)
+                self.profile.call(
+                            Profile.DATAPROVIDER, sink.get_UID(), "put",
+                            self._call_in_phase, SyncScheduler.IO, put_data, source, sink, sourceData, sourceDataRid, False, mappings,
+                            nbytes=size)
                 return True
-            except Exceptions.SyncronizeError, err:
-                log.warn("%s\n%s" % (err, traceback.format_exc()))                     
-                self.sinkErrors[sink] = DataProvider.STATUS_DONE_SYNC_ERROR
-            except Exceptions.SynchronizeConflictError, err:
-                comp = err.comparison
-                if comp == COMPARISON_EQUAL:
-                    log.info("Skipping %s (Equal)" % sourceData)
-                else:
-                    assert(err.fromData == sourceData)
-                    self._apply_conflict_policy(source, sink, err.comparison, sourceData, sourceDataRid, err.toData, err.toData.get_rid())
+            except (Exceptions.SyncronizeError, Exceptions.SynchronizeConflictError), err:
+                self._handle_put_error(source, sink, sourceData, sourceDataRid, err, mappings)
+            finally:
+                if lock: lock.release()
         else:
             log.info("Could not put data: Was None")
         
         return False
 
-    def _convert_data(self, source, sink, data):
+    def _put_data_many(self, source, sink, items, mappings):
+        """
+        Puts a batch of (sourceData, sourceDataRid) from source to sink
+        using put_many, or one at a time if the sink does not implement
+        it. Errors are handled the same as in L{_put_data}, and if put_many
+        fails as a whole each item is retried on its own. The mappings are
+        saved once the batch is put. A L{conduit.Exceptions.SyncronizeFatalError}
+        returned by put_many is raised after that, as _put_data would raise it.
+        """
+        errors = None
+        fatal = None
+        size = sum([_get_size(sourceData) for sourceData, sourceDataRid in items])
+        lock = self._dataproviderLocks.get(sink)
+        if lock: lock.acquire()
+        try:
+            try:
+                errors = self.profile.call(
+                            Profile.DATAPROVIDER, sink.get_UID(), "put_many",
+                            self._call_in_phase, SyncScheduler.IO, put_data_many, source, sink, items, False, mappings,
+                            nbytes=size)
+            except NotImplementedError:
+                log.info("%s does not implement put_many" % sink)
+                self._putManyUnsupported[sink] = True
+            except Exceptions.SyncronizeError, err:
+                #the whole batch failed, so try each item on its own
+                log.warn("Retrying each item in the batch: %s\n%s" % (err, traceback.format_exc()))
+
+            if errors != None:
+                for (sourceData, sourceDataRid), err in zip(items, errors):
+                    if isinstance(err, Exceptions.SyncronizeFatalError):
+                        #put_many stopped here
+                        fatal = err
+                        break
+                    elif err != None:
+                        self._handle_put_error(source, sink, sourceData, sourceDataRid, err, mappings)
+        finally:
+            if lock: lock.release()
+
+        if errors == None:
+            for sourceData, sourceDataRid in items:
+                self._put_data(source, sink, sourceData, sourceDataRid, mappings)
+
+        if mappings != None:
+            self._save_mappings_table(mappings)
+        if fatal != None:
+            raise fatal
+
+    def _put_converted_data(self, jobs, mappings, progressCb, failed=None, parallel=False):
         """
-        Converts data into a format acceptable for sink, handling exceptions, etc.
+        Gets, converts and puts the data for each (sourcedp, dataUID, sinkdps)
+        job in jobs into each of sinkdps. mappings is a dict of the 
+        L{conduit.MappingDB.MappingTable} to use for each sink. Data is put
+        in batches into sinks that implement put_many. progressCb(n, dataUID)
+        is called after the nth put (or skipped put).
+
+        If failed is a dict, a sink that raises an unexpected error is added
+        to it and skipped from then on, otherwise the error is raised. If 
+        parallel is True each sink is put into from its own thread.
+        """
+        #(sourcedp, sinkdp) : [(data, dataRid), ...]
+        batches = {}
+        #sinkdp : WorkerPool
+        pools = {}
+        #[(sourcedp, sinkdp), ...] in the order they were first put into
+        pairs = []
+        #(sourcedp, sinkdp, dataUID, Job) of the puts not yet waited for
+        pending = collections.deque()
+        #puts that may be queued for the sinks before waiting
+        window = 0
+
+        #put and flush return the dataUIDs of the items that are done, which
+        #for a batch is only once the whole batch has been put
+        def put(sourcedp, sinkdp, data, dataRid, dataUID):
+            if self.batchSize > 1 and sinkdp not in self._putManyUnsupported:
+                if data == None:
+                    log.info("Could not put data: Was None")
+                    return [dataUID]
+                batch = batches.setdefault((sourcedp, sinkdp), [])
+                batch.append((data, dataRid, dataUID))
+                if len(batch) < self.batchSize:
+                    return []
+                return flush(sourcedp, sinkdp)
+            self._put_data(sourcedp, sinkdp, data, dataRid, mappings[sinkdp])
+            return [dataUID]
+
+        def flush(sourcedp, sinkdp):
+            batch = batches.pop((sourcedp, sinkdp), [])
+            if batch:
+                self._put_data_many(sourcedp, sinkdp, [(data, dataRid) for data, dataRid, dataUID in batch], mappings[sinkdp])
+            return [dataUID for data, dataRid, dataUID in batch]
+
+        def submit(sourcedp, sinkdp, func, *args):
+            if sinkdp in pools:
+                return pools[sinkdp].submit(func, sourcedp, sinkdp, *args)
+            job = Thread.Job(func, (sourcedp, sinkdp) + args)
+            job.run()
+            return job
+
+        def wait(sourcedp, sinkdp, job):
+            #returns the dataUIDs put by the job. Re-raises any error from
+            #the put, or marks the sink failed
+            try:
+                return job.get()
+            except Exceptions.StopSync:
+                raise
+            except Exception:
+                if failed == None:
+                    raise
+                self._sync_failed(sourcedp, sinkdp)
+                failed[sinkdp] = True
+                if sinkdp in pools:
+                    pools[sinkdp].stop()
+                return []
+
+        def done(sourcedp, sinkdp, dataUID, job):
+            #the dataUIDs to report progress for, once job is done. Data that
+            #was not put, including that queued for a sink that has since
+            #failed, is reported straight away
+            if job == None or (job.is_cancelled() and failed != None and sinkdp in failed):
+                return [dataUID]
+            return wait(sourcedp, sinkdp, job)
+
+        n = 0
+        try:
+            for sourcedp, dataUID, dataRid, converted in self._get_and_convert_data(jobs):
+                self.check_thread_not_cancelled([sourcedp] + [sinkdp for sinkdp, data in converted])
+                for sinkdp, data in converted:
+                    job = None
+                    if dataRid != None and (failed == None or sinkdp not in failed):
+                        if (sourcedp, sinkdp) not in pairs:
+                            pairs.append((sourcedp, sinkdp))
+                            if parallel:
+                                pools[sinkdp] = Thread.WorkerPool(1, "Put %s" % sinkdp, self)
+                                window = 2 * max(1, self.batchSize) * len(pools)
+                        #transfer the data
+                        log.debug("PUT: %s (%s) -----> %s" % (sourcedp.name,dataUID,sinkdp.name))
+                        job = submit(sourcedp, sinkdp, put, data, dataRid, dataUID)
+                    pending.append((sourcedp, sinkdp, dataUID, job))
+
+                #wait for the puts that are done, or if too many are queued
+                while len(pending) > 0 and (pending[0][3] == None or pending[0][3].is_done() or len(pending) > window):
+                    for dataUID in done(*pending.popleft()):
+                        n += 1
+                        progressCb(n, dataUID)
+
+            #put the remaining batches
+            for sourcedp, sinkdp in pairs:
+                if failed == None or sinkdp not in failed:
+                    pending.append((sourcedp, sinkdp, None, submit(sourcedp, sinkdp, flush)))
+
+            while len(pending) > 0:
+                for dataUID in done(*pending.popleft()):
+                    n += 1
+                    progressCb(n, dataUID)
+        finally:
+            for pool in pools.values():
+                pool.stop()
+            #if cancelled, dont leave puts running after the sync
+            for sourcedp, sinkdp, dataUID, job in pending:
+                if job != None:
+                    try:
+                        job.get()
+                    except Exception: pass
+            self._dataproviderLocks = {}
+
+    def _convert_data(self, source, sinks, data):
+        """
+        Converts data into a format acceptable for sinks, which all take the
+        same type, handling exceptions, etc.
         """
         newdata = None
+        error = None
+        fromType = source.get_output_type()
+        toType = sinks[0].get_input_type()
         try:
-            newdata = self.typeConverter.convert(source.get_output_type(), sink.get_input_type(), data)
+            newdata = self.profile.call(
+                                Profile.CONVERSION, "%s->%s" % (fromType, toType), "convert",
+                                self._call_in_phase, SyncScheduler.CPU, self.typeConverter.convert, fromType, toType, data,
+                                sizeof=_get_size)
         except Exceptions.ConversionDoesntExistError, err:
             log.warn("Error performing conversion:\n%s" % err)
-            self.sinkErrors[sink] = DataProvider.STATUS_DONE_SYNC_SKIPPED
+            error = DataProvider.STATUS_DONE_SYNC_SKIPPED
         except Exceptions.ConversionError, err:
             log.warn("Error performing conversion:\n%s" % err)
-            self.sinkErrors[sink] = DataProvider.STATUS_DONE_SYNC_ERROR
+            error = DataProvider.STATUS_DONE_SYNC_ERROR
         except Exception:       
             log.critical("UNKNOWN CONVERSION ERROR\n%s" % traceback.format_exc())
-            self.sinkErrors[sink] = DataProvider.STATUS_DONE_SYNC_ERROR
+            error = DataProvider.STATUS_DONE_SYNC_ERROR
+        if error != None:
+            for sink in sinks:
+                self.sinkErrors[sink] = error
         return newdata
 
-    def _apply_deleted_policy(self, sourceWrapper, sourceDataLUID, sinkWrapper, sinkDataLUID):
+    def _convert_data_for_sinks(self, source, sinks, data):
+        """
+        Converts data for each of sinks. Sinks that take the same type, 
+        including the conversion args, share the work of one conversion,
+        but each sink is given its own copy of the result because putting
+        data may change it (e.g. a transferred file refers to its new 
+        location)
+
+        @returns: A list of (sink, converted data or None), in the order of sinks
+        """
+        if len(sinks) == 1:
+            return [(sinks[0], self._convert_data(source, sinks, data))]
+
+        #input type : [sink, ...]
+        groups = {}
+        for sink in sinks:
+            groups.setdefault(sink.get_input_type(), []).append(sink)
+
+        converted = {}
+        for toType, group in groups.items():
+            #converters may return, or change, the data they are given
+            if len(groups) > 1:
+                newdata = self._convert_data(source, group, _copy_data(data))
+            else:
+                newdata = self._convert_data(source, group, data)
+            for sink in group:
+                if sink is group[0] or newdata == None:
+                    converted[sink] = newdata
+                else:
+                    converted[sink] = _copy_data(newdata)
+        return [(sink, converted[sink]) for sink in sinks]
+
+    def _get_and_convert_data(self, jobs):
+        """
+        Gets once, and converts to the type of each sink, the data for each 
+        (sourcedp, dataUID, sinkdps) job in jobs.
+
+        @returns: A generator of (sourcedp, dataUID, dataRid, [(sinkdp, data), ...])
+        in the same order as jobs. dataRid is None if the data could not be 
+        got, and data is None if it could not be got or converted
+        """
+        if self.pipelined:
+            return self._get_and_convert_data_pipelined(jobs)
+        return self._get_and_convert_data_serially(jobs)
+
+    def _get_and_convert_data_serially(self, jobs):
+        for sourcedp, dataUID, sinkdps in jobs:
+            self.check_thread_not_cancelled([sourcedp] + sinkdps)
+            data = self._get_data(sourcedp, sinkdps, dataUID)
+            dataRid = None
+            converted = [(sinkdp, None) for sinkdp in sinkdps]
+            if data != None:
+                dataRid = data.get_rid()
+                converted = self._convert_data_for_sinks(sourcedp, sinkdps, data)
+            yield sourcedp, dataUID, dataRid, converted
+
+    def _get_and_convert_data_pipelined(self, jobs):
+        def get(job):
+            sourcedp, dataUID, sinkdps = job
+            data = dataRid = None
+            if not self.cancelled:
+                lock = self._dataproviderLocks[sourcedp]
+                lock.acquire()
+                try:
+                    data = self._get_data(sourcedp, sinkdps, dataUID)
+                finally:
+                    lock.release()
+                if data != None:
+                    dataRid = data.get_rid()
+            return sourcedp, dataUID, sinkdps, data, dataRid
+
+        def convert(job):
+            sourcedp, dataUID, sinkdps, data, dataRid = job
+            converted = [(sinkdp, None) for sinkdp in sinkdps]
+            if data != None and not self.cancelled:
+                converted = self._convert_data_for_sinks(sourcedp, sinkdps, data)
+            return sourcedp, dataUID, dataRid, converted
+
+        #Each dataprovider gets a limit on the number of simultaneous calls
+        #into it, which is 1 unless it declares it is thread safe
+        getThreads = 1
+        for sourcedp, dataUID, sinkdps in jobs:
+            for dp in [sourcedp] + sinkdps:
+                if dp not in self._dataproviderLocks:
+                    self._dataproviderLocks[dp] = threading.BoundedSemaphore(max(1, dp.get_concurrency()))
+            getThreads = max(getThreads, sourcedp.get_concurrency())
+
+        log.debug("Pipelined sync of %s items (%s get threads, %s conversion threads)" % (
+                            len(jobs), getThreads, self.conversionThreads))
+        getPool = Thread.WorkerPool(getThreads, "Get %s" % self.getName(), self)
+        convertPool = Thread.WorkerPool(self.conversionThreads, "Convert %s" % self.getName(), self)
+        try:
+            for job in convertPool.imap(convert, getPool.imap(get, jobs)):
+                yield job
+        finally:
+            getPool.stop()
+            convertPool.stop()
+
+    def _apply_deleted_policy(self, sourceWrapper, sourceDataLUID, sinkWrapper, sinkDataLUID, mappings=None):
         """
         Applies user policy when data has been deleted from source.
         sourceDataLUID is the original UID of the data that has been deleted
@@ -408,9 +973,44 @@ class SyncWorker(_ThreadedWorker):
             log.debug("Deleted Policy: Delete")
             #FIXME: Delete should be handled differently from conflict
             self.sinkErrors[sinkWrapper] = DataProvider.STATUS_DONE_SYNC_CONFLICT
-            delete_data(sourceWrapper, sinkWrapper, sinkDataLUID)
+            self._delete_data(sourceWrapper, sinkWrapper, sinkDataLUID, mappings)
+
+    def _apply_deleted_policy_many(self, deleted, mappings):
+        """
+        Applies user policy to each (sourceWrapper, sourceDataLUID, sinkWrapper, 
+        sinkDataLUID) in deleted. If the data is to be deleted it is deleted
+        in batches from sinks that implement delete_many
+        """
+        if self.cond.get_policy("deleted") != "replace" or self.batchSize <= 1:
+            for sourceWrapper, sourceDataLUID, sinkWrapper, sinkDataLUID in deleted:
+                self._apply_deleted_policy(sourceWrapper, sourceDataLUID, sinkWrapper, sinkDataLUID, mappings)
+            return
+
+        #(sourceWrapper, sinkWrapper) : [sinkDataLUID, ...]
+        batches = {}
+        for sourceWrapper, sourceDataLUID, sinkWrapper, sinkDataLUID in deleted:
+            batches.setdefault((sourceWrapper, sinkWrapper), []).append(sinkDataLUID)
+
+        for (sourceWrapper, sinkWrapper), sinkDataLUIDs in batches.items():
+            log.debug("Deleted Policy: Delete")
+            #FIXME: Delete should be handled differently from conflict
+            self.sinkErrors[sinkWrapper] = DataProvider.STATUS_DONE_SYNC_CONFLICT
+            for i in range(0, len(sinkDataLUIDs), self.batchSize):
+                batch = sinkDataLUIDs[i:i+self.batchSize]
+                if sinkWrapper not in self._deleteManyUnsupported:
+                    try:
+                        self.profile.call(
+                                    Profile.DATAPROVIDER, sinkWrapper.get_UID(), "delete_many",
+                                    self._call_in_phase, SyncScheduler.IO, delete_data_many, sourceWrapper, sinkWrapper, batch, mappings)
+                        batch = []
+                    except NotImplementedError:
+                        log.info("%s does not implement delete_many" % sinkWrapper)
+                        self._deleteManyUnsupported[sinkWrapper] = True
+                for sinkDataLUID in batch:
+                    self._delete_data(sourceWrapper, sinkWrapper, sinkDataLUID, mappings)
+                self._save_mappings_table(mappings)
          
-    def _apply_conflict_policy(self, sourceWrapper, sinkWrapper, comparison, fromData, fromDataRid, toData, toDataRid):
+    def _apply_conflict_policy(self, sourceWrapper, sinkWrapper, comparison, fromData, fromDataRid, toData, toDataRid, mappings=None):
         """
         Applies user policy when a put() has failed. This may mean emitting
         the conflict up to the GUI or skipping altogether
@@ -445,7 +1045,10 @@ class SyncWorker(_ThreadedWorker):
             self.sinkErrors[sinkWrapper] = DataProvider.STATUS_DONE_SYNC_CONFLICT
 
             try:
-                put_data(sourceWrapper, sinkWrapper, fromData, fromDataRid, True)
+                self.profile.call(
+                        Profile.DATAPROVIDER, sinkWrapper.get_UID(), "put",
+                        self._call_in_phase, SyncScheduler.IO, put_data,
+                        sourceWrapper, sinkWrapper, fromData, fromDataRid, True, mappings)
             except:
                 log.warn("Forced Put Failed\n%s" % traceback.format_exc())        
 
@@ -460,147 +1063,157 @@ class SyncWorker(_ThreadedWorker):
                 s.module.set_status(DataProvider.STATUS_DONE_SYNC_CANCELLED)
             raise Exceptions.StopSync(self.state)
 
-    def one_way_sync(self, source, sink):
+    def _sync_failed(self, source, sink):
         """
-        Transfers numItems of data from source to sink.
+        Logs the exception being handled, which stopped the sync of source
+        with sink, and marks both as failed
         """
-        log.info("Synchronizing %s |--> %s " % (source, sink))
-
-        #get all the data
-        added, modified, deleted = self._get_changes(source, sink)
-
-        #handle deleted data
-        for d in deleted:
-            matchingUID = conduit.GLOBALS.mappingDB.get_matching_UID(source.get_UID(), d, sink.get_UID())
-            if matchingUID != None:
-                self._apply_deleted_policy(source, d, sink, matchingUID)
-
-        #one way sync treats added and modifed the same. Both get transferred
-        items = added + modified
-        numItems = len(items)
-        idx = 0
-        for i in items:
-            idx += 1.0
-            self.check_thread_not_cancelled([source, sink])
-
-            #transfer the data
-            data = self._get_data(source, sink, i)
-            if data != None:
-                log.debug("1WAY PUT: %s (%s) -----> %s" % (source.name,data.get_UID(),sink.name))
-                dataRid = data.get_rid()
-                data = self._convert_data(source, sink, data)
-                self._put_data(source, sink, data, dataRid)
+        err = sys.exc_info()[1]
+        if isinstance(err, Exceptions.SyncronizeFatalError):
+            log.warn("%s\n%s" % (err, traceback.format_exc()))
+        else:
+            log.critical("UNKNOWN SYNCHRONIZATION ERROR\n%s" % traceback.format_exc())
+        sink.module.set_status(DataProvider.STATUS_DONE_SYNC_ERROR)
+        source.module.set_status(DataProvider.STATUS_DONE_SYNC_ERROR)
 
-            #work out the percent complete
-            done = idx/(numItems*len(self.sinks)) + \
-                    float(self.sinks.index(sink))/len(self.sinks)
-            self._emit_progress(done, i)
+    def one_way_sync(self, source, sinks):
+        """
+        Transfers the added and modified data from source to each of sinks.
+        Each item is got from source once, and converted once for all the 
+        sinks that take the same type. If the sync with a sink fails the
+        others continue.
+        """
+        log.info("Synchronizing %s |--> %s " % (source, sinks))
+
+        #sink : mappings. Load all the existing mappings once, instead 
+        #of querying the DB for every item
+        tables = {}
+        #sinks whose sync has failed
+        failed = {}
+        #dataUID : [sink, ...] and the order the data was first seen
+        wanted = {}
+        uids = []
+        try:
+            for sink in sinks:
+                self.check_thread_not_cancelled([source, sink])
+                mappings = self._get_mappings_table(source, sink)
+                tables[sink] = mappings
+                try:
+                    #get all the data
+                    added, modified, deleted = self._get_changes(source, sink, mappings)
+
+                    #handle deleted data
+                    todelete = []
+                    for d in deleted:
+                        matchingUID = mappings.get_matching_UID(d)
+                        if matchingUID != None:
+                            todelete.append( (source, d, sink, matchingUID) )
+                    self._apply_deleted_policy_many(todelete, mappings)
+                except Exceptions.StopSync:
+                    raise
+                except Exception:
+                    self._sync_failed(source, sink)
+                    failed[sink] = True
+                    continue
+
+                #one way sync treats added and modifed the same. Both get transferred
+                for i in added + modified:
+                    if i not in wanted:
+                        wanted[i] = []
+                        uids.append(i)
+                    wanted[i].append(sink)
+
+            items = [(source, i, wanted[i]) for i in uids]
+            numPuts = sum([len(sinkdps) for sourcedp, i, sinkdps in items])
+            if numPuts > 0:
+                self._itemFraction = 1.0/numPuts
+            def emit_progress(n, i):
+                #work out the percent complete
+                self._emit_progress(float(n)/numPuts, i)
+
+            self._put_converted_data(items, tables, emit_progress, failed, 
+                                    parallel=self.pipelined and len(sinks) > 1)
+        finally:
+            #save all the mappings in one transaction each, even if cancelled
+            for mappings in tables.values():
+                self._save_mappings_table(mappings)
        
     def two_way_sync(self, source, sink):
         """
         Performs a two way sync from source to sink and back.
         """
-        def modified_and_deleted(dp1, modified, dp2, deleted):
-            found = []
-            for i in modified[:]:
-                matchingUID = conduit.GLOBALS.mappingDB.get_matching_UID(dp1.get_UID(), i, dp2.get_UID())
-                if deleted.count(matchingUID) != 0:
-                    log.debug("2WAY MOD+DEL: %s v %s" % (i, matchingUID))
-                    deleted.remove(matchingUID)
-                    modified.remove(i)
-                    found += [(dp2, matchingUID, dp1)]
-            return found
-            
         log.info("Synchronizing (Two Way) %s <--> %s " % (source, sink))
-        #Need to do all the analysis before we touch the mapping db
-        toput = []      # (sourcedp, dataUID, sinkdp)
-        todelete = []   # (sourcedp, dataUID, sinkdp)
-        tocomp = []     # (dp1, data1UID, dp2, data2UID)
+        #load all the existing mappings once, instead of querying
+        #the DB for every item
+        mappings = self._get_mappings_table(source, sink)
 
         #PHASE ONE: CALCULATE WHAT NEEDS TO BE DONE
-        #get all the datauids
-        sourceAdded, sourceModified, sourceDeleted = self._get_changes(source, sink)
-        sinkAdded, sinkModified, sinkDeleted = self._get_changes(sink, source)
-
-        #added data can be put right away
-        toput += [(source, i, sink) for i in sourceAdded]
-        toput += [(sink, i, source) for i in sinkAdded]
-
-        #check first for data that had been simulatainously modified and deleted
-        todelete += modified_and_deleted(source, sourceModified, sink, sinkDeleted)
-        todelete += modified_and_deleted(sink, sinkModified, source, sourceDeleted)
-
-        #as can deleted data
-        todelete += [(source, i, sink) for i in sourceDeleted]
-        todelete += [(sink, i, source) for i in sinkDeleted]
-
-        #modified is a bit harder because we need to check if both side have
-        #been modified at the same time. First find items in both lists and seperate
-        #them out as they need to be compared.
-        for i in sourceModified[:]:
-            matchingUID = conduit.GLOBALS.mappingDB.get_matching_UID(source.get_UID(), i, sink.get_UID())
-            if sinkModified.count(matchingUID) != 0:
-                log.warn("2WAY BOTH MODIFIED: %s v %s" % (i, matchingUID))
-                sourceModified.remove(i)
-                sinkModified.remove(matchingUID)
-                tocomp.append( (source, i, sink, matchingUID) )
-
-        #all that remains in the original lists are to be put
-        toput += [(source, i, sink) for i in sourceModified]
-        toput += [(sink, i, source) for i in sinkModified]
-
-        total = len(toput) + len(todelete) + len(tocomp)
+        #Need to do all the analysis before we touch the mapping db
+        sourceChanges = self._get_changes(source, sink, mappings)
+        sinkChanges = self._get_changes(sink, source, mappings)
+        plan = SyncPlan.plan_two_way_sync(source, sourceChanges, sink, sinkChanges, mappings)
+        toput = plan.toput
+        todelete = plan.todelete
+        tocomp = plan.tocomp
+
+        total = len(plan)
+        if total > 0:
+            self._itemFraction = 1.0/total
         cnt = 0
 
         #PHASE TWO: TRANSFER DATA
-        for sourcedp, dataUID, sinkdp in todelete:
-            matchingUID = conduit.GLOBALS.mappingDB.get_matching_UID(sourcedp.get_UID(), dataUID, sinkdp.get_UID())
-            log.debug("2WAY DEL: %s (%s)" % (sinkdp.name, matchingUID))
-            if matchingUID != None:
-                self._apply_deleted_policy(sourcedp, dataUID, sinkdp, matchingUID)
+        try:
+            deleted = []
+            for sourcedp, dataUID, sinkdp in todelete:
+                matchingUID = mappings.get_matching_UID(dataUID)
+                log.debug("2WAY DEL: %s (%s)" % (sinkdp.name, matchingUID))
+                if matchingUID != None:
+                    deleted.append( (sourcedp, dataUID, sinkdp, matchingUID) )
+            self._apply_deleted_policy_many(deleted, mappings)
 
             #progress
-            cnt = cnt+1
-            self._emit_progress(float(cnt)/total, dataUID)
-
-        for sourcedp, dataUID, sinkdp in toput:
-            data = self._get_data(sourcedp, sinkdp, dataUID)
-            if data != None:
-                log.debug("2WAY PUT: %s (%s) -----> %s" % (sourcedp.name,dataUID,sinkdp.name))
-                dataRid = data.get_rid()
-                data = self._convert_data(sourcedp, sinkdp, data)
-                self._put_data(sourcedp, sinkdp, data, dataRid)
-
-            cnt = cnt+1
-            self._emit_progress(float(cnt)/total, dataUID)
-
-        #FIXME: rename dp1 -> sourcedp1 and dp2 -> sinkdp2 because when both
-        #data is modified we might as well choost source -> sink as the comparison direction
-        for dp1, data1UID, dp2, data2UID in tocomp:
-            data1 = self._get_data(dp1, dp2, data1UID)
-            data1Rid = data1.get_rid()
-            data2 = self._get_data(dp2, dp1, data2UID)
-            data2Rid = data2.get_rid()
-            
-            #Only need to convert one data to the other type
-            #choose to convert the source data for no reason other than convention
-            data1 = self._convert_data(dp1, dp2, data1)
-            
-            log.debug("2WAY CMP: %s v %s" % (data1, data2))
-
-            #compare the data
-            if data1 != None and data2 != None:
-                comparison = data1.compare(data2)
-                if comparison == conduit.datatypes.COMPARISON_OLDER:
-                    self._apply_conflict_policy(dp2, dp1, COMPARISON_UNKNOWN, data2, data2Rid, data1, data1Rid)
-                else:
-                    self._apply_conflict_policy(dp1, dp2, COMPARISON_UNKNOWN, data1, data1Rid, data2, data2Rid)
-
-            cnt = cnt+1
-            self._emit_progress(float(cnt)/total, data1UID)
+            for sourcedp, dataUID, sinkdp in todelete:
+                cnt = cnt+1
+                self._emit_progress(float(cnt)/total, dataUID)
+
+            def emit_progress(idx, dataUID):
+                self._emit_progress(float(cnt+idx)/total, dataUID)
+
+            self._put_converted_data(
+                            [(sourcedp, dataUID, [sinkdp]) for sourcedp, dataUID, sinkdp in toput],
+                            {source : mappings, sink : mappings},
+                            emit_progress)
+            cnt = cnt+len(toput)
+
+            #FIXME: rename dp1 -> sourcedp1 and dp2 -> sinkdp2 because when both
+            #data is modified we might as well choost source -> sink as the comparison direction
+            for dp1, data1UID, dp2, data2UID in tocomp:
+                data1 = self._get_data(dp1, [dp2], data1UID)
+                data1Rid = data1.get_rid()
+                data2 = self._get_data(dp2, [dp1], data2UID)
+                data2Rid = data2.get_rid()
+                
+                #Only need to convert one data to the other type
+                #choose to convert the source data for no reason other than convention
+                data1 = self._convert_data(dp1, [dp2], data1)
+                
+                log.debug("2WAY CMP: %s v %s" % (data1, data2))
+
+                #compare the data
+                if data1 != None and data2 != None:
+                    comparison = data1.compare(data2)
+                    if comparison == conduit.datatypes.COMPARISON_OLDER:
+                        self._apply_conflict_policy(dp2, dp1, COMPARISON_UNKNOWN, data2, data2Rid, data1, data1Rid, mappings)
+                    else:
+                        self._apply_conflict_policy(dp1, dp2, COMPARISON_UNKNOWN, data1, data1Rid, data2, data2Rid, mappings)
 
+                cnt = cnt+1
+                self._emit_progress(float(cnt)/total, data1UID)
+        finally:
+            #save all the mappings in one transaction, even if cancelled
+            self._save_mappings_table(mappings)
 
-    def run(self):
+    def _run(self):
         """
         The main syncronisation state machine.
         
@@ -677,7 +1290,7 @@ class SyncWorker(_ThreadedWorker):
                     log.debug("Source Status = %s" % self.source.module.get_status())
                     #Refresh the source
                     try:
-                        self.source.module.refresh()
+                        self.profile.call(Profile.DATAPROVIDER, self.source.get_UID(), "refresh", self._call_in_phase, SyncScheduler.IO, self.source.module.refresh)
                         self.source.module.set_status(DataProvider.STATUS_DONE_REFRESH_OK)
                     except Exceptions.RefreshError:
                         self.source.module.set_status(DataProvider.STATUS_DONE_REFRESH_ERROR)
@@ -695,7 +1308,7 @@ class SyncWorker(_ThreadedWorker):
                         self.check_thread_not_cancelled([self.source, sink])
                         if sink not in sinkDidntConfigureOK:
                             try:
-                                sink.module.refresh()
+                                self.profile.call(Profile.DATAPROVIDER, sink.get_UID(), "refresh", self._call_in_phase, SyncScheduler.IO, sink.module.refresh)
                                 sink.module.set_status(DataProvider.STATUS_DONE_REFRESH_OK)
                             except Exceptions.RefreshError:
                                 log.warn("RefreshError: %s" % sink)
@@ -722,31 +1335,32 @@ class SyncWorker(_ThreadedWorker):
 
                 #synchronize state
                 elif self.state is self.SYNC_STATE:
-                    for sink in self.sinks:
-                        self.check_thread_not_cancelled([self.source, sink])
-                        #only sync with those sinks that refresh'd OK
-                        if sink not in sinkDidntRefreshOK:
+                    #only sync with those sinks that refresh'd OK
+                    sinks = [dp for dp in self.sinks if dp not in sinkDidntRefreshOK]
+                    #now perform a one or two way sync depending on the user prefs
+                    #and the capabilities of the dataprovider
+                    if  self.cond.is_two_way():
+                        for sink in sinks:
+                            self.check_thread_not_cancelled([self.source, sink])
                             try:
-                                #now perform a one or two way sync depending on the user prefs
-                                #and the capabilities of the dataprovider
-                                if  self.cond.is_two_way():
-                                    #two way
-                                    self.two_way_sync(self.source, sink)
-                                else:
-                                    #one way
-                                    self.one_way_sync(self.source, sink)
-                            except Exceptions.SyncronizeFatalError, err:
-                                log.warn("%s\n%s" % (err, traceback.format_exc()))
-                                sink.module.set_status(DataProvider.STATUS_DONE_SYNC_ERROR)                                  
-                                self.source.module.set_status(DataProvider.STATUS_DONE_SYNC_ERROR)                             
-                                #cannot continue with this source, sink pair
-                                continue
-                            except Exception:       
-                                log.critical("UNKNOWN SYNCHRONIZATION ERROR\n%s" % traceback.format_exc())
-                                sink.module.set_status(DataProvider.STATUS_DONE_SYNC_ERROR)
-                                self.source.module.set_status(DataProvider.STATUS_DONE_SYNC_ERROR)
+                                self.two_way_sync(self.source, sink)
+                            except Exceptions.StopSync:
+                                raise
+                            except Exception:
                                 #cannot continue with this source, sink pair
-                                continue
+                                self._sync_failed(self.source, sink)
+                    else:
+                        #one way, all the sinks at once so that the data is 
+                        #only got and converted once
+                        self.check_thread_not_cancelled([self.source] + sinks)
+                        try:
+                            self.one_way_sync(self.source, sinks)
+                        except Exceptions.StopSync:
+                            raise
+                        except Exception:
+                            #cannot continue with this source
+                            for sink in sinks:
+                                self._sync_failed(self.source, sink)
 
                     #Done go clean up
                     self.state = self.DONE_STATE
@@ -784,8 +1398,14 @@ class SyncWorker(_ThreadedWorker):
         error = self.did_sync_error()
         conflict = self.did_sync_conflict()
         for s in [self.source] + self.sinks:
-            s.module.finish(self.aborted, error, conflict)
-        conduit.GLOBALS.mappingDB.save()
+            self.profile.call(Profile.DATAPROVIDER, s.get_UID(), "finish", s.module.finish, self.aborted, error, conflict)
+        self.profile.call(Profile.MAPPINGDB, "MappingDB", "save", conduit.GLOBALS.mappingDB.save)
+
+        self.finish_profile()
+        self.cond.set_sync_profile(self.profile)
+        if conduit.GLOBALS.settings.get("sync_profile_log"):
+            log.info(self.profile.format_report())
+
         self.cond.emit("sync-completed", self.aborted, error, conflict)
 
 class RefreshDataProviderWorker(_ThreadedWorker):
@@ -803,7 +1423,10 @@ class RefreshDataProviderWorker(_ThreadedWorker):
 
         self.setName("%s" % self.dataproviderWrapper)
 
-    def run(self):
+    def get_dataproviders(self):
+        return [self.dataproviderWrapper]
+
+    def _run(self):
         """
         The main refresh state machine.
         
@@ -825,7 +1448,7 @@ class RefreshDataProviderWorker(_ThreadedWorker):
         
             self.state = self.REFRESH_STATE
             try:
-                self.dataproviderWrapper.module.refresh()
+                self._call_in_phase(SyncScheduler.IO, self.dataproviderWrapper.module.refresh)
                 self.dataproviderWrapper.module.set_status(DataProvider.STATUS_DONE_REFRESH_OK)
             except Exceptions.RefreshError:
                 self.dataproviderWrapper.module.set_status(DataProvider.STATUS_DONE_REFRESH_ERROR)
@@ -856,7 +1479,7 @@ class BlockingFunctionCallWorker(_ThreadedWorker):
         self.functions = functions
         self.setName("%s functions" % len(self.functions))
 
-    def run(self):
+    def _run(self):
         log.debug("Started thread %s (thread: %s)" % (self,thread.get_ident()))
         try:
             #FIXME: Set the status text on the dataprovider
@@ -4,15 +4,33 @@ Holds the TypeConverter class
 Copyright: John Stowers, 2006
 License: GPLv2
 """
+import heapq
 import traceback
 import logging
 log = logging.getLogger("TypeConverter")
 
+import conduit
 import conduit.Exceptions as Exceptions
 import conduit.utils as Utils
 
+#The cost of conversions not listed in conversion_costs
+DEFAULT_CONVERSION_COST = 1
+
 class Converter:
+    """
+    Converters describe their conversions in the conversions dict. Those
+    listed (as "fromtype,totype") in cached_conversions return local files,
+    and are expensive enough that their results should be stored in the
+    L{conduit.ConversionCache.ConversionCache}
+
+    When types can be converted in more than one way, the path of least
+    cost is used. The relative cost of conversions that are slower, or
+    lose more information, than most can be given in the
+    conversion_costs dict of "fromtype,totype" : cost
+    """
     _module_type_ = "converter"
+    cached_conversions = ()
+    conversion_costs = {}
 
 class TypeConverter: 
     """
@@ -52,6 +70,12 @@ class TypeConverter:
         """
         #dict of dict of conversion functions
         self.convertables = {}
+        #(fromtype, totype) of conversions whose results are cached
+        self.cachedConversions = set()
+        #(fromtype, totype) : cost, of conversions not of the default cost
+        self.costs = {}
+        #(from_type, to_type) : conversions, of the routes already found
+        self._routes = {}
 
         moduleManager.make_modules_callable("converter")
         dynamic_modules = moduleManager.get_modules_by_type("converter")
@@ -80,6 +104,24 @@ class TypeConverter:
                 except Exception:
                     log.warn("BAD PROGRAMMER")
 
+            for c in getattr(converterWrapper.module,"cached_conversions", ()):
+                try:
+                    fromtype,totype = c.split(',')
+                    self.cachedConversions.add( (fromtype,totype) )
+                except ValueError:
+                    log.warn("Cached conversion (%s) wrong format. Should be fromtype,totype" % c)
+
+            costs = getattr(converterWrapper.module,"conversion_costs", {})
+            for c in costs:
+                try:
+                    fromtype,totype = c.split(',')
+                    self.costs[(fromtype,totype)] = costs[c]
+                except ValueError:
+                    log.warn("Conversion cost (%s) wrong format. Should be fromtype,totype" % c)
+
+            #the new conversions may give cheaper routes
+            self._routes = {}
+
     def _retain_info_in_conversion(self, fromdata, todata):
         """
         Retains the original datatype properties through a type conversion.
@@ -97,58 +139,105 @@ class TypeConverter:
             todata.set_UID(fromdata.get_UID())
         return todata
         
+    def _get_parent_type(self, t):
+        """
+        @returns: The type that t is a subtype of, e.g. file/audio -> file,
+        or None
+        """
+        if "/" in t:
+            return t.rsplit("/", 1)[0]
+        return None
+
+    def _find_path(self, fromType, toType):
+        """
+        Finds the cheapest path through the conversion graph from fromType
+        to toType. Each conversion is an edge, weighted by its cost, and
+        each subtype is also joined to its parent type by an implicit edge
+        of no cost, because a file/audio is also a file. Of the paths of
+        equal cost, that of fewest conversions is preferred.
+
+        @returns: list of (fromtype, totype, implicit) edges, or None if
+        there is no path
+        """
+        #(cost, hops, counter, type, path)
+        queue = [(0, 0, 0, fromType, [])]
+        visited = set()
+        counter = 1
+        while queue:
+            cost, hops, c, t, path = heapq.heappop(queue)
+            if t == toType:
+                return path
+            if t in visited:
+                continue
+            visited.add(t)
+
+            parent = self._get_parent_type(t)
+            if parent != None and parent not in visited:
+                heapq.heappush(queue, (cost, hops, counter, parent, path + [(t, parent, True)]))
+                counter += 1
+            for to in self.convertables.get(t, {}):
+                if to != t and to not in visited:
+                    heapq.heappush(queue, (
+                                cost + self.costs.get((t, to), DEFAULT_CONVERSION_COST),
+                                hops + 1,
+                                counter,
+                                to,
+                                path + [(t, to, False)]))
+                    counter += 1
+        return None
+
+    def _find_conversions(self, fromType, toType, args):
+        if fromType == toType:
+            return [(fromType, toType, args)]
+
+        path = self._find_path(fromType, toType)
+        if path == None:
+            log.debug("Conversions %s -> %s dont exist" % (fromType, toType))
+            return None
+
+        #implicit edges need no conversion. The args are given to the last
+        #conversion, or if that was to a parent type, to a final transcode
+        #of the destination type
+        conversions = [(f, t, {}) for f, t, implicit in path if not implicit]
+        if len(conversions) > 0 and path[-1][2] == False:
+            f, t, a = conversions[-1]
+            conversions[-1] = (f, t, args)
+        else:
+            conversions.append( (toType, toType, args) )
+        return conversions
+
     def _get_conversions(self, from_type, to_type):
         """
         Returns the conversions required fromtype -> totype. Considers if fromtype and/or
-        totype are super/subclasses of each other. The args string is always taken from the 
+        totype are super/subclasses of each other, and conversions via any number of
+        intermediate types. The args string is always taken from the 
         destination, i.e. the totype.
 
-        Does not check if the conversion actually exists.
+        Routes are only searched for once for each from_type and to_type,
+        until another converter is added.
 
-        @returns: list of (fromtype, totype, args) tuples
+        @returns: list of (fromtype, totype, args) tuples, or None if
+        no conversion exists
         """
-        conversions = []
-        args = {}
-        fromType = from_type
-        toType = to_type
+        key = (from_type, to_type)
+        try:
+            return self._routes[key]
+        except KeyError:
+            pass
 
+        args = {}
         #remove the args string of present at source
-        try:
-            fromType = from_type.split("?")[0]
-        except ValueError: pass
+        fromType = from_type.split("?")[0]
 
         #args string is only considered for the destination
+        toType = to_type
         try:
             toType,argString = to_type.split("?")
             args = Utils.decode_conversion_args(argString)
         except ValueError: pass            
 
-        if fromType != toType:
-            #check first for and explicit conversion
-            if self._conversion_exists(fromType, toType):
-                conversions.append( (fromType, toType, args) )
-            else:
-                froms = fromType.split("/")
-                tos = toType.split("/")
-                if froms[0] == tos[0]:
-                    #same base type, so only convert parent -> child e.g.
-                    #file/audio -> file = file -> file
-                    #file -> file/audio = file -> file/audio
-                    conversions.append( (froms[0],"/".join(tos),args) )
-                else:
-                    #different base type, e.g.
-                    #foo/bar -> bar/baz
-                    if len(tos) > 1:
-                        #Two conversions are needed, a main type, and a subtype
-                        #conversion. remains is any necessary subtype conversion
-                        conversions.append( (froms[0], tos[0], {}) )
-                        conversions.append( (tos[0],"/".join(tos),args) )
-                    else:
-                        #Just a main type conversion is needed (remember the args)
-                        conversions.append( (froms[0], tos[0], args) )
-        else:
-            conversions.append( (fromType, toType, args) )
-
+        conversions = self._find_conversions(fromType, toType, args)
+        self._routes[key] = conversions
         return conversions
 
     def _conversion_exists(self, from_type, to_type):
@@ -157,6 +246,17 @@ class TypeConverter:
                 return True
         return False
         
+    def _convert_one(self, from_type, to_type, args, data):
+        """
+        Performs a single conversion, using the conversion cache if the
+        converter allows it
+        """
+        func = self.convertables[from_type][to_type]
+        cache = conduit.GLOBALS.conversionCache
+        if cache == None or (from_type, to_type) not in self.cachedConversions:
+            return func(data, **args)
+        return cache.convert(func, data, "%s,%s" % (from_type, to_type), args)
+
     def _convert(self, conversions, data):
         if data and len(conversions) > 0:
             from_type, to_type, args = conversions[0]
@@ -173,7 +273,7 @@ class TypeConverter:
                 #recurse
                 return self._convert(
                                 conversions[1:],
-                                self.convertables[from_type][to_type](data, **args)
+                                self._convert_one(from_type, to_type, args, data)
                                 )
             except Exception:
                 log.debug(traceback.format_exc())
@@ -186,11 +286,7 @@ class TypeConverter:
         Checks if all conversion(s) exists to convert from from_type 
         into to_type
         """
-        for f,t,a in self._get_conversions(from_type, to_type):
-            if f != t and not self._conversion_exists(f,t):
-                log.debug("Conversions %s -> %s doesnt exist" % (f,t))
-                return False
-        return True
+        return self._get_conversions(from_type, to_type) != None
 
     def convert(self, from_type, to_type, data):
         """
@@ -225,5 +321,28 @@ class TypeConverter:
             for tos in self.convertables[froms]:
                 l.append( (froms, tos) )
         return l
+
+    def get_graph_description(self):
+        """
+        Describes each conversion, its cost and the converter that
+        performs it. Used by --dump-conversions
+
+        @returns: A string, one conversion per line
+        """
+        lines = []
+        for froms in sorted(self.convertables):
+            for tos in sorted(self.convertables[froms]):
+                func = self.convertables[froms][tos]
+                try:
+                    name = "%s.%s" % (func.im_class.__name__, func.__name__)
+                except AttributeError:
+                    name = getattr(func, "__name__", str(func))
+                lines.append("%s -> %s (cost %s, %s%s)" % (
+                            froms, 
+                            tos, 
+                            self.costs.get((froms, tos), DEFAULT_CONVERSION_COST),
+                            name,
+                            ((froms, tos) in self.cachedConversions and ", cached") or ""))
+        return "\n".join(lines)
                 
           
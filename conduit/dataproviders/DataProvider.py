@@ -47,6 +47,9 @@ class DataProviderBase(gobject.GObject):
     _configurable_ = False
     _out_type_ = ""
     _in_type_ = ""
+    #The maximum number of simultaneous calls to get() and put() during a
+    #pipelined sync. Only set this > 1 if the dataprovider is thread safe
+    _concurrency_ = 1
     
     def __init__(self, *args):
         """
@@ -489,6 +492,24 @@ class DataSource(DataProviderBase):
         """
         raise NotImplementedError
 
+    def get_all_with_rids(self):
+        """
+        Returns all the LUIDs this dataprovider holds along with their
+        L{conduit.datatypes.Rid}, as an iterable of (LUID, Rid). Override
+        this if the Rids are known when listing the data, so that changes
+        can be detected without calling get() for each item.
+        """
+        raise NotImplementedError
+
+    def get_rid_bulk(self, LUIDs):
+        """
+        Returns the L{conduit.datatypes.Rid} of many items at once. Override
+        this if Rids can be found without building the datatypes.
+
+        @returns: A dict of LUID : Rid
+        """
+        raise NotImplementedError
+
     def add(self, LUID):
         """
         Adds an item to the datasource according to LUID. This method 
@@ -539,6 +560,33 @@ class DataSink(DataProviderBase):
         """
         self.set_status(STATUS_SYNC)
 
+    def put_many(self, items):
+        """
+        Stores many items at once. Override this if the dataprovider can
+        store data faster in batches than one at a time.
+
+        @param items: A list of (putData, overwrite, LUID), with the same
+        meaning as the arguments to put()
+        @returns: A list with, for each item, the Rid put() would have 
+        returned, or the L{conduit.Exceptions.SyncronizeError} or
+        L{conduit.Exceptions.SynchronizeConflictError} put() would have raised.
+        If put() would have raised a L{conduit.Exceptions.SyncronizeFatalError}
+        it is the last item in the list and the items after it are not put.
+        The sync then stops, the same as when put() raises it. If put_many
+        raises a SyncronizeError then each item is put again with put().
+        """
+        raise NotImplementedError
+
+    def delete_many(self, LUIDs):
+        """
+        Deletes many items at once. Override this if the dataprovider can
+        delete data faster in batches than one at a time.
+
+        @returns: A list with, for each LUID, None if the data was deleted
+        or the exception delete() would have raised
+        """
+        raise NotImplementedError
+
 
 class TwoWay(DataSource, DataSink):
     """
@@ -1,5 +1,7 @@
 import os.path
+import time
 import logging
+import threading
 import ConfigParser
 log = logging.getLogger("dataproviders.File")
 
@@ -72,6 +74,309 @@ def read_removable_volume_group_file(folderUri):
                     items.append((p,n))
     return items
 
+class FolderJournal(object):
+    """
+    Keeps the list of files in a folder up to date between syncs, so the
+    folder only needs to be completely scanned once. After that every
+    directory in the folder is monitored, created and deleted files are
+    recorded as they happen, and newly created directories are scanned
+    at the next refresh.
+
+    The folder is monitored from before the complete scan starts (see
+    L{begin_scan}), and the changes made while it is scanned are merged
+    into its result.
+
+    Only local folders are journaled. If a folder cannot be monitored the
+    journal is invalid, and every refresh scans the whole folder.
+    """
+    #Each directory needs its own monitor (e.g. an inotify watch), so large
+    #trees are always scanned
+    MAX_MONITORED_FOLDERS = 4096
+    #Folders modified within this many seconds before a scan started are
+    #listed again, file systems store mtimes with limited precision
+    MTIME_PRECISION = 2
+
+    def __init__(self, folder, includeHidden, followSymlinks):
+        self.folder = folder
+        self.includeHidden = includeHidden
+        self.followSymlinks = followSymlinks
+
+        self._lock = threading.Lock()
+        self._valid = False
+        #unescaped URI : URI as returned by the FolderScanner. Monitors
+        #and scanners do not agree on how URIs are escaped
+        self._files = {}
+        self._folders = {}
+        #unescaped URI : FileMonitor
+        self._monitors = {}
+        #folders created since the last refresh
+        self._pending = []
+        #(monitor, uri, event) received while scanning, and when the scan
+        #started. None when not scanning
+        self._events = None
+        self._scanStarted = None
+        #URI : os.stat result, for the files scanned by the last refresh
+        self._stats = {}
+
+    def _key(self, uri):
+        return Vfs.uri_unescape(uri).rstrip("/")
+
+    def _scan(self, uri):
+        scanner = Vfs.FolderScanner(uri, self.includeHidden, self.followSymlinks)
+        scanner.start()
+        scanner.join()
+        self._stats.update(scanner.get_stats())
+        return scanner.get_uris(), scanner.get_folder_uris()
+
+    def _monitor(self, uri):
+        monitor = Vfs.FileMonitor()
+        monitor.connect("changed", self._on_change)
+        monitor.add(uri, monitor.MONITOR_DIRECTORY)
+        if not monitor.is_monitoring():
+            raise Exception("%s cannot be monitored" % uri)
+        self._monitors[self._key(uri)] = monitor
+
+    def _cancel_monitors(self):
+        for monitor in self._monitors.values():
+            monitor.cancel()
+        self._monitors = {}
+
+    def _reset(self):
+        self._cancel_monitors()
+        self._files = {}
+        self._folders = {}
+        self._pending = []
+        self._valid = False
+        self._events = None
+        self._scanStarted = None
+
+    def _add(self, uris, folderURIs):
+        for uri in uris:
+            self._files[self._key(uri)] = uri
+        for uri in folderURIs:
+            key = self._key(uri)
+            self._folders[key] = uri
+            if key not in self._monitors:
+                self._monitor(uri)
+
+    def _remove_folder(self, key):
+        prefix = key + "/"
+        for k in self._files.keys():
+            if k.startswith(prefix):
+                del(self._files[k])
+        for k in self._folders.keys():
+            if k == key or k.startswith(prefix):
+                del(self._folders[k])
+                monitor = self._monitors.pop(k, None)
+                if monitor:
+                    monitor.cancel()
+
+    def _changed_since(self, key, t):
+        try:
+            return os.stat(Vfs.uri_to_local_path(key)).st_mtime >= t - self.MTIME_PRECISION
+        except (OSError, TypeError):
+            return True
+
+    def _relist(self, key, uri):
+        """
+        Replaces the files directly in a folder with its current contents.
+        Folders created in it are scanned at the next refresh
+        """
+        path = Vfs.uri_to_local_path(key)
+        try:
+            names = os.listdir(path)
+        except OSError:
+            self._remove_folder(key)
+            return
+
+        log.debug("Listing folder changed while scanning %s" % uri)
+        prefix = key + "/"
+        for k in self._files.keys():
+            if k.startswith(prefix) and "/" not in k[len(prefix):]:
+                del(self._files[k])
+        for name in names:
+            if name == Vfs.FolderScanner.CONFIG_FILE_NAME:
+                continue
+            if name.startswith(".") and not self.includeHidden:
+                continue
+            child = os.path.join(path, name)
+            if os.path.islink(child) and not self.followSymlinks:
+                continue
+            if os.path.isdir(child):
+                if prefix + name not in self._folders:
+                    self._pending.append(uri + "/" + name)
+            elif os.path.isfile(child):
+                self._files[prefix + name] = uri + "/" + name
+
+    def _merge(self, events, started):
+        #Folders other than the base folder were only monitored once the
+        #scan completed, so those changed since the scan started are 
+        #listed again. Then the events received while scanning are applied
+        base = self._key(self.folder)
+        for key, uri in self._folders.items():
+            if key != base and key in self._folders and self._changed_since(key, started):
+                self._relist(key, uri)
+        for monitor, uri, event in events:
+            self._apply_change(monitor, uri, event)
+
+    def _apply_change(self, monitor, uri, event):
+        key = self._key(uri)
+        parent,name = key.rsplit("/",1)
+        parentURI = self._folders.get(parent)
+        if parentURI == None:
+            return
+        if event == monitor.MONITOR_EVENT_CREATED:
+            if name.startswith(".") and not self.includeHidden:
+                return
+            if Vfs.uri_is_folder(uri):
+                if key not in self._folders:
+                    self._pending.append(parentURI + "/" + name)
+            else:
+                self._files[key] = parentURI + "/" + name
+        elif event == monitor.MONITOR_EVENT_DELETED:
+            if key in self._folders:
+                self._remove_folder(key)
+            else:
+                self._files.pop(key, None)
+
+    def _on_change(self, monitor, uri, event):
+        self._lock.acquire()
+        try:
+            if self._events != None:
+                #scanning, the event is applied once the scan completes
+                self._events.append((monitor, uri, event))
+            elif self._valid:
+                self._apply_change(monitor, uri, event)
+        finally:
+            self._lock.release()
+
+    def is_for(self, folder, includeHidden, followSymlinks):
+        """
+        @returns: True if the journal tracks the folder with the given options
+        """
+        return self.folder == folder and \
+               self.includeHidden == includeHidden and \
+               self.followSymlinks == followSymlinks
+
+    def is_valid(self):
+        """
+        @returns: True if the journal is up to date, and refresh will not
+        scan the whole folder
+        """
+        return self._valid
+
+    def begin_scan(self):
+        """
+        Called before the folder is completely scanned. The folder is
+        monitored from then on, so that the changes made while it is 
+        scanned are merged into the result given to L{set_scanned}
+        """
+        self._lock.acquire()
+        try:
+            self._reset()
+            if Vfs.uri_get_scheme(self.folder) != "file":
+                return
+            self._events = []
+            self._scanStarted = time.time()
+            try:
+                self._monitor(self.folder)
+            except Exception, e:
+                log.warn("Could not monitor %s: %s" % (self.folder, e))
+                self._reset()
+        finally:
+            self._lock.release()
+
+    def set_scanned(self, uris, folderURIs):
+        """
+        Replaces the contents of the journal with the result of a complete
+        scan of the folder, and starts monitoring it. If the scan began
+        with L{begin_scan}, the changes made while scanning are merged
+        """
+        self._lock.acquire()
+        try:
+            events = self._events
+            started = self._scanStarted
+            if events == None:
+                self._reset()
+            self._files = {}
+            self._folders = {}
+            self._pending = []
+            self._valid = False
+            self._events = None
+            self._scanStarted = None
+            if Vfs.uri_get_scheme(self.folder) != "file":
+                log.debug("Not journaling remote folder %s" % self.folder)
+                self._reset()
+            elif len(folderURIs) > self.MAX_MONITORED_FOLDERS:
+                log.info("Not journaling %s, it contains too many folders (%s)" % (self.folder, len(folderURIs)))
+                self._reset()
+            else:
+                try:
+                    self._add(uris, folderURIs)
+                    if events != None:
+                        self._merge(events, started)
+                    self._valid = True
+                except Exception, e:
+                    log.warn("Could not monitor %s: %s" % (self.folder, e))
+                    self._reset()
+        finally:
+            self._lock.release()
+
+    def refresh(self):
+        """
+        Brings the journal up to date, scanning the whole folder if the
+        journal is invalid
+
+        @returns: The URIs of all the files in the folder
+        """
+        self._stats = {}
+        if not self._valid:
+            self.begin_scan()
+            uris,folderURIs = self._scan(self.folder)
+            self.set_scanned(uris, folderURIs)
+            if not self._valid:
+                return uris
+
+        self._lock.acquire()
+        pending = self._pending
+        self._pending = []
+        self._lock.release()
+
+        for uri in pending:
+            log.debug("Scanning new folder %s" % uri)
+            uris,folderURIs = self._scan(uri)
+            self._lock.acquire()
+            try:
+                try:
+                    self._add(uris, folderURIs)
+                except Exception, e:
+                    log.warn("Could not monitor %s: %s" % (uri, e))
+                    self._valid = False
+                    self._cancel_monitors()
+            finally:
+                self._lock.release()
+            if not self._valid:
+                return self.refresh()
+
+        return self._files.values()
+
+    def get_stats(self):
+        """
+        @returns: A dict of URI : os.stat result for the files scanned by
+        the last refresh, if the scanner collected them
+        """
+        return self._stats
+
+    def invalidate(self):
+        """
+        Stops monitoring the folder. The next refresh will scan it completely
+        """
+        self._lock.acquire()
+        try:
+            self._reset()
+        finally:
+            self._lock.release()
+
 class FileSource(DataProvider.DataSource, Vfs.FolderScannerThreadManager):
 
     _category_ = conduit.dataproviders.CATEGORY_FILES
@@ -86,7 +391,7 @@ class FileSource(DataProvider.DataSource, Vfs.FolderScannerThreadManager):
 
         #One table stores the top level files and folders (config)
         #The other stores all files to sync. 
-        self.db = DB.ThreadSafeGenericDB()
+        self.db = DB.ConcurrentGenericDB()
         self.db.create(
                 table="config",
                 fields=("URI","TYPE","CONTAINS_NUM_ITEMS","SCAN_COMPLETE","GROUP_NAME")
@@ -95,6 +400,10 @@ class FileSource(DataProvider.DataSource, Vfs.FolderScannerThreadManager):
                 table="files",
                 fields=("URI","BASEPATH","GROUPNAME")
                 )
+        #folder URI : FolderJournal
+        self._journals = {}
+        #URI : os.stat result, for the files scanned by this refresh
+        self._stats = {}
 
     def _add_file(self, f):
         self.db.insert(
@@ -112,13 +421,33 @@ class FileSource(DataProvider.DataSource, Vfs.FolderScannerThreadManager):
         return True
 
     def uninitialize(self):
+        for journal in self._journals.values():
+            journal.invalidate()
+        self._journals = {}
         self.db.close()
 
     def refresh(self):
         DataProvider.DataSource.refresh(self)
         self.db.execute("DELETE FROM files")
+        self._stats = {}
         #Make a whole bunch of threads to go and scan the directories
+        #that have changed in an unknown way since the last refresh
         for oid,uri,groupname in self.db.select("SELECT oid,URI,GROUP_NAME FROM config WHERE TYPE = ?",(TYPE_FOLDER,)):
+            journal = self._journals.get(uri)
+            if journal != None and journal.is_valid():
+                self.db.insert_many(
+                            table="files",
+                            rows=[(f,uri,groupname) for f in journal.refresh()]
+                            )
+                self._stats.update(journal.get_stats())
+                continue
+            #Watch for changes from before the scan, so the next refresh
+            #need not scan again
+            if journal != None:
+                journal.invalidate()
+            journal = FolderJournal(uri, False, False)
+            journal.begin_scan()
+            self._journals[uri] = journal
             self.make_thread(
                     uri, 
                     False,  #include hidden
@@ -152,7 +481,8 @@ class FileSource(DataProvider.DataSource, Vfs.FolderScannerThreadManager):
         f = File.File(
                     URI=        LUID,
                     basepath=   basepath,
-                    group=      group
+                    group=      group,
+                    stat=       self._stats.pop(LUID, None)
                     )
         f.set_open_URI(LUID)
         f.set_UID(LUID)
@@ -185,6 +515,7 @@ class FileSource(DataProvider.DataSource, Vfs.FolderScannerThreadManager):
     def finish(self, aborted, error, conflict):
         DataProvider.DataSource.finish(self)
         self.db.execute("DELETE FROM files")
+        self._stats = {}
 
     def _on_scan_folder_progress(self, folderScanner, numItems, oid, groupname):
         """
@@ -207,15 +538,26 @@ class FileSource(DataProvider.DataSource, Vfs.FolderScannerThreadManager):
                     GROUP_NAME=groupname
                     )
         #Put all files into files
-        for f in folderScanner.get_uris():
-            self.db.insert(
-                        table="files",
-                        values=(f,folderScanner.baseURI,groupname)
-                        )
+        uris = folderScanner.get_uris()
+        self.db.insert_many(
+                    table="files",
+                    rows=[(f,folderScanner.baseURI,groupname) for f in uris]
+                    )
+        self._stats.update(folderScanner.get_stats())
+        journal = self._journals.get(folderScanner.baseURI)
+        if journal != None:
+            journal.set_scanned(uris, folderScanner.get_folder_uris())
 
 class FolderTwoWay(DataProvider.TwoWay):
     """
     TwoWay dataprovider for synchronizing a folder
+
+    The (mtime, size) of each file is stored in a snapshot when a sync
+    completes without errors or conflicts. get_changes compares the files
+    with the snapshot, instead of the DeltaProvider getting every file.
+    Snapshots are kept in the global L{conduit.FileCache.FileCache}, keyed
+    by the folder (like the mappings of the folder, which are keyed by
+    its UID)
     """
 
     _category_ = conduit.dataproviders.CATEGORY_FILES
@@ -224,17 +566,44 @@ class FolderTwoWay(DataProvider.TwoWay):
     _out_type_ = "file"
     _icon_ = "folder"
 
-    def __init__(self, folder, folderGroupName, includeHidden, compareIgnoreMtime, followSymlinks):
+    def __init__(self, folder, folderGroupName, includeHidden, compareIgnoreMtime, followSymlinks, compareContents=False):
         DataProvider.TwoWay.__init__(self)
         self.folder = folder
         self.folderGroupName = folderGroupName
         self.includeHidden = includeHidden
         self.compareIgnoreMtime = compareIgnoreMtime
         self.followSymlinks = followSymlinks
+        #detect changes using the file contents, for filesystems
+        #with unreliable mtimes
+        self.compareContents = compareContents
 
         self.fstype = None
         self.files = []
+        self._journal = None
+        #URI : os.stat result, for the files scanned by this refresh
+        self._stats = {}
+        #URI : (mtime, size) of the files, from get_changes. Saved as the
+        #snapshot when the sync finishes
+        self._snapshot = None
         
+    def _stat(self, uri):
+        st = self._stats.get(uri)
+        if st == None:
+            path = Vfs.uri_to_local_path(Vfs.uri_unescape(uri))
+            try:
+                st = os.stat(path)
+            except (OSError, TypeError):
+                return None
+        return (st.st_mtime, st.st_size)
+
+    def _update_snapshot(self, uri):
+        #called once uri has been written or deleted
+        if self._snapshot != None:
+            self._snapshot.pop(uri, None)
+            value = self._stat(uri)
+            if value != None:
+                self._snapshot[uri] = value
+
     def _transfer_file(self, vfsFile, newURI, overwrite):
         try:
             vfsFile.transfer(newURI, overwrite)
@@ -252,11 +621,24 @@ class FolderTwoWay(DataProvider.TwoWay):
         #cache the filesystem type for speed
         self.fstype = Vfs.uri_get_filesystem_type(self.folder)
 
-        #scan the folder
-        scanThread = Vfs.FolderScanner(self.folder, self.includeHidden, self.followSymlinks)
-        scanThread.start()
-        scanThread.join()
-        self.files = scanThread.get_uris()
+        #scan the folder, or just the changes since the last refresh
+        if self._journal == None or not self._journal.is_for(self.folder, self.includeHidden, self.followSymlinks):
+            if self._journal != None:
+                self._journal.invalidate()
+            self._journal = FolderJournal(self.folder, self.includeHidden, self.followSymlinks)
+        self.files = self._journal.refresh()
+        self._stats = self._journal.get_stats()
+        self._snapshot = None
+
+        #forget the digests of files that have gone, and digest all the
+        #files up front, in parallel
+        folderPath = Vfs.uri_to_local_path(Vfs.uri_unescape(self.folder))
+        if folderPath and conduit.GLOBALS.fileCache != None:
+            paths = [Vfs.uri_to_local_path(Vfs.uri_unescape(uri)) for uri in self.files]
+            paths = [p for p in paths if p]
+            conduit.GLOBALS.fileCache.prune(folderPath, paths)
+            if self.compareContents:
+                conduit.GLOBALS.fileCache.get_digests(paths)
 
     def put(self, vfsFile, overwrite, LUID=None):
         """
@@ -300,6 +682,8 @@ class FolderTwoWay(DataProvider.TwoWay):
         #escape illegal filesystem characters
         if self.fstype:
             newURI = Vfs.uri_sanitize_for_filesystem(newURI, self.fstype)
+        #the file is about to change, so its scanned stat is stale
+        self._stats.pop(newURI, None)
             
         #overwrite is the easy case, as for it to be true, requires specific user
         #interaction
@@ -311,7 +695,8 @@ class FolderTwoWay(DataProvider.TwoWay):
             if destFile.exists():
                 comp = vfsFile.compare(
                             destFile, 
-                            sizeOnly=self.compareIgnoreMtime
+                            sizeOnly=self.compareIgnoreMtime,
+                            contents=self.compareContents
                             )
 
                 if LUID != None and comp == DataType.COMPARISON_NEWER:
@@ -330,19 +715,24 @@ class FolderTwoWay(DataProvider.TwoWay):
             else:
                 self._transfer_file(vfsFile, newURI, overwrite)                    
 
+        self._update_snapshot(newURI)
         return self.get(newURI).get_rid()
 
     def delete(self, LUID):
+        self._stats.pop(LUID, None)
         f = File.File(URI=LUID)
         if f.exists():
             f.delete()
+        self._update_snapshot(LUID)
                 
     def get(self, uid):
         DataProvider.TwoWay.get(self, uid)
         f = File.File(
                     URI=uid,
                     basepath=self.folder,
-                    group=self.folderGroupName
+                    group=self.folderGroupName,
+                    compareContents=self.compareContents,
+                    stat=self._stats.pop(uid, None)
                     )
         f.set_open_URI(uid)
         f.set_UID(uid)
@@ -352,9 +742,51 @@ class FolderTwoWay(DataProvider.TwoWay):
         DataProvider.TwoWay.get_all(self)
         return self.files
 
+    def get_changes(self):
+        """
+        Compares the files found by refresh with the snapshot stored by
+        the last sync. Raises NotImplementedError (so the DeltaProvider is
+        used) if there is no snapshot, the folder is not local, or files
+        are compared by their contents, which the snapshot does not record
+        """
+        self.set_status(DataProvider.STATUS_SYNC)
+        cache = conduit.GLOBALS.fileCache
+        if cache == None or self.compareContents or not Vfs.uri_to_local_path(Vfs.uri_unescape(self.folder)):
+            raise NotImplementedError
+
+        if self._snapshot == None:
+            self._snapshot = {}
+            for uri in self.files:
+                value = self._stat(uri)
+                if value != None:
+                    self._snapshot[uri] = value
+
+        previous = cache.get_snapshot(self.folder)
+        if previous == None:
+            log.debug("No snapshot of %s" % self.folder)
+            raise NotImplementedError
+
+        added = []
+        modified = []
+        for uri,value in self._snapshot.items():
+            old = previous.pop(uri, None)
+            if old == None:
+                added.append(uri)
+            elif old != value:
+                modified.append(uri)
+        return added, modified, previous.keys()
+
     def finish(self, aborted, error, conflict):
         DataProvider.TwoWay.finish(self)
+        if self._snapshot != None and conduit.GLOBALS.fileCache != None:
+            #the next sync must find the changes that were not synchronized
+            if aborted or error or conflict:
+                conduit.GLOBALS.fileCache.forget_snapshot(self.folder)
+            else:
+                conduit.GLOBALS.fileCache.set_snapshot(self.folder, self._snapshot)
+        self._snapshot = None
         self.files = []
+        self._stats = {}
         try:
             #Save the .group file to the root of this volume (if it is removable)
             save_removable_volume_group_file(self.folder, self.folderGroupName)
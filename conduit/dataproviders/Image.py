@@ -5,13 +5,16 @@ import conduit
 import conduit.Exceptions as Exceptions
 import conduit.datatypes.File as File
 import conduit.dataproviders.DataProvider as DataProvider
+import conduit.dataproviders.Upload as Upload
 from conduit.datatypes import Rid
 
 class UploadInfo:
     """
     Upload information container, this way we can add info
     and keep the _upload_info method on the ImageSink retain
-    its api
+    its api. Uploads are made through L{Upload.retry}, so
+    _upload_photo and _replace_photo should let connection
+    errors propagate for them to be retried
     """
     def __init__ (self, url, mimeType, name="", tags=(), caption=""):
         self.url = url
@@ -31,6 +34,9 @@ class ImageSink(DataProvider.DataSink):
 
     IMAGE_SIZES = ["640x480", "800x600", "1024x768"]
     NO_RESIZE = "None"
+    #Photos given to put_many are uploaded on this many threads. Set to 1
+    #if _upload_photo is not threadsafe
+    UPLOAD_THREADS = Upload.MAX_CONCURRENT_UPLOADS
 
     def __init__(self, *args):
         DataProvider.DataSink.__init__(self)
@@ -131,7 +137,7 @@ class ImageSink(DataProvider.DataSink):
             if info != None:
                 if overwrite == True:
                     #replace the photo
-                    return self._replace_photo(LUID, uploadInfo)
+                    return Upload.retry(self._replace_photo, LUID, uploadInfo)
                 else:
                     #Only upload the photo if it is newer than the Remote one
                     url = self._get_raw_photo_url(info)
@@ -149,7 +155,13 @@ class ImageSink(DataProvider.DataSink):
         log.debug("Uploading Photo URI = %s, Mimetype = %s, Original Name = %s" % (photoURI, mimeType, originalName))
 
         #upload the file
-        return self._upload_photo (uploadInfo)
+        return Upload.retry(self._upload_photo, uploadInfo)
+
+    def put_many(self, items):
+        """
+        Uploads many photos concurrently
+        """
+        return Upload.put_many(self.put, items, self.UPLOAD_THREADS)
 
     def delete(self, LUID):
         pass
@@ -191,7 +203,7 @@ class ImageTwoWay(DataProvider.DataSource, ImageSink):
         uploadInfo = UploadInfo(photoURI, mimeType, originalName, tags, caption)
 
         if overwrite and LUID:
-            rid = self._replace_photo(LUID, uploadInfo)
+            rid = Upload.retry(self._replace_photo, LUID, uploadInfo)
         else:
             if LUID and self._get_photo_info(LUID):
                 remotePhoto = self.get(LUID)
@@ -200,7 +212,7 @@ class ImageTwoWay(DataProvider.DataSource, ImageSink):
                           (photo.get_filename(),remotePhoto.get_filename(),comp))
 
                 if LUID != None and comp == conduit.datatypes.COMPARISON_NEWER:
-                    rid = self._replace_photo(LUID, uploadInfo)
+                    rid = Upload.retry(self._replace_photo, LUID, uploadInfo)
                 elif comp == conduit.datatypes.COMPARISON_EQUAL:                    
                     rid = remotePhoto.get_rid()
                 else:
@@ -208,7 +220,7 @@ class ImageTwoWay(DataProvider.DataSource, ImageSink):
             else:
                 log.debug("Uploading Photo URI = %s, Mimetype = %s, Original Name = %s" %
                           (photoURI, mimeType, originalName))
-                rid = self._upload_photo (uploadInfo)
+                rid = Upload.retry(self._upload_photo, uploadInfo)
 
         if not rid:
             raise Exceptions.SyncronizeError("Error putting/updating photo")
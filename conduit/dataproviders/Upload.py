@@ -0,0 +1,312 @@
+"""
+Uploads files to web services. Uploads that fail because of the
+connection are retried with backoff, many uploads run at once on a
+bounded pool of threads, and services that support it receive files in
+chunks through a resumable upload that continues where it stopped,
+even after a restart.
+"""
+import os
+import time
+import socket
+import httplib
+import urllib2
+import urlparse
+import logging
+log = logging.getLogger("dataproviders.Upload")
+
+import conduit
+import conduit.Database as Database
+import conduit.Exceptions as Exceptions
+import conduit.utils.Thread as Thread
+
+#Uploads run concurrently on at most this many threads
+MAX_CONCURRENT_UPLOADS = 3
+#Resumable uploads send files this many bytes at a time
+CHUNK_SIZE = 1024*1024
+#Failed uploads are tried this many times, waiting RETRY_DELAY seconds
+#before the first retry and twice as long before each one after that
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 2.0
+#How often the cancellation flag is checked while waiting to retry
+CANCEL_CHECK_INTERVAL = 0.1
+
+DB_FIELDS = ("KEY","SESSION","SIZE","MTIME")
+DB_TYPES =  ("TEXT","TEXT","INTEGER","REAL")
+
+class RetryUpload(Exception):
+    """
+    Raised when an upload failed, but may succeed if tried again, such as
+    when the service is temporarily unavailable
+    """
+    pass
+
+def is_cancelled():
+    """
+    @returns: True if conduit is exiting, or the sync this upload is part
+    of was cancelled
+    """
+    return conduit.GLOBALS.cancelled or getattr(Thread.get_owner(), "cancelled", False)
+
+def is_retryable(err):
+    """
+    @returns: True if an upload that failed with err may succeed if tried
+    again. Connection errors and server errors (5xx) are retryable, errors
+    that the request was bad are not
+    """
+    if isinstance(err, urllib2.HTTPError):
+        return err.code >= 500
+    return isinstance(err, (RetryUpload, socket.error, urllib2.URLError, httplib.HTTPException))
+
+def _wait(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        if is_cancelled():
+            raise Exceptions.StopSync
+        time.sleep(min(CANCEL_CHECK_INTERVAL, max(0, end - time.time())))
+
+def retry(func, *args):
+    """
+    Calls func(*args), and if it fails with a retryable error calls it
+    again, up to MAX_ATTEMPTS times with exponential backoff. Waiting is
+    interrupted by cancellation, which raises L{conduit.Exceptions.StopSync}
+
+    @returns: The result of func
+    """
+    delay = RETRY_DELAY
+    attempt = 1
+    while True:
+        if is_cancelled():
+            raise Exceptions.StopSync
+        try:
+            return func(*args)
+        except Exception, err:
+            if attempt >= MAX_ATTEMPTS or not is_retryable(err):
+                raise
+            log.info("Upload failed (attempt %s of %s), retrying in %ss: %s" % (attempt, MAX_ATTEMPTS, delay, err))
+        _wait(delay)
+        delay *= 2
+        attempt += 1
+
+def put_many(put, items, numThreads=MAX_CONCURRENT_UPLOADS):
+    """
+    Implements L{conduit.dataproviders.DataProvider.DataSink.put_many}
+    for a dataprovider that uploads each item, by calling put(*item) for
+    each item concurrently on a pool of numThreads threads. put is not
+    retried, it should make its uploads through L{retry}.
+
+    Raises L{conduit.Exceptions.StopSync} if the sync was cancelled
+    """
+    if len(items) == 0:
+        return []
+
+    pool = Thread.WorkerPool(min(numThreads, len(items)), "Upload", Thread.get_owner())
+    try:
+        jobs = [pool.submit(put, *item) for item in items]
+        results = []
+        for job in jobs:
+            try:
+                results.append(job.get())
+            except Exceptions.StopSync:
+                raise
+            except (Exceptions.SyncronizeError, Exceptions.SynchronizeConflictError, Exceptions.SyncronizeFatalError), err:
+                results.append(err)
+            except Exception, err:
+                log.warn("Upload failed: %s" % err)
+                results.append(Exceptions.SyncronizeError(str(err)))
+            if isinstance(results[-1], Exceptions.SyncronizeFatalError):
+                break
+        return results
+    finally:
+        pool.stop()
+
+def _request(method, uri, body, headers):
+    """
+    @returns: The status, headers (with lowercase names) and body of the
+    response
+    """
+    scheme, host, path, params, query, fragment = urlparse.urlparse(uri)
+    if query:
+        path += "?" + query
+    if scheme == "https":
+        conn = httplib.HTTPSConnection(host)
+    else:
+        conn = httplib.HTTPConnection(host)
+    try:
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+def start_resumable_session(uri, metadata, headers):
+    """
+    Starts a L{ResumableUpload} by POSTing the metadata of the file
+    @returns: The session URI the file is then sent to
+    """
+    status, responseHeaders, body = _request("POST", uri, metadata, headers)
+    if status >= 500:
+        raise RetryUpload("Server error %s" % status)
+    if status != 200 or "location" not in responseHeaders:
+        raise Exceptions.SyncronizeError("Could not start upload: %s %s" % (status, body))
+    return responseHeaders["location"]
+
+class UploadState(object):
+    """
+    Remembers the session of each resumable upload in progress, so that
+    it can be continued after a restart. Uploads are identified by a key
+    for the file and its destination, and a session is only valid while
+    the size and mtime of the file are unchanged.
+    """
+    def __init__(self, filename=":memory:"):
+        if filename != ":memory:":
+            filename = os.path.abspath(filename)
+        self._db = Database.ConcurrentGenericDB(filename)
+        if "uploads" not in self._db.get_tables():
+            self._db.create(
+                    table="uploads",
+                    fields=DB_FIELDS,
+                    fieldtypes=DB_TYPES
+                    )
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS uploads_key_idx ON uploads (KEY)")
+
+    def get_session(self, key, st):
+        """
+        @param st: The os.stat result of the file being uploaded
+        @returns: The session URI of the upload, or None
+        """
+        res = self._db.select_one("SELECT SESSION,SIZE,MTIME FROM uploads WHERE KEY = ?", (key,))
+        if res != None and (res[1], res[2]) == (st.st_size, st.st_mtime):
+            return str(res[0])
+        return None
+
+    def set_session(self, key, st, session):
+        self._db.execute(
+                "INSERT OR REPLACE INTO uploads (KEY,SESSION,SIZE,MTIME) VALUES (?,?,?,?)",
+                (key, session, st.st_size, st.st_mtime)
+                )
+
+    def forget(self, key):
+        self._db.execute("DELETE FROM uploads WHERE KEY = ?", (key,))
+
+    def save(self):
+        self._db.save()
+
+    def close(self):
+        self._db.close()
+
+class ResumableUpload(object):
+    """
+    Sends a file using the resumable upload protocol of Google services.
+    A session URI is created for the upload, then the file is PUT to it
+    in CHUNK_SIZE chunks. When the upload is interrupted, the server is
+    asked how much it received, and the upload continues from there.
+
+    Sessions are remembered in the global L{UploadState}, so uploads
+    also continue after a restart. Call L{upload} through L{retry}.
+    """
+    def __init__(self, path, mimeType, key, create_session, headers={}, chunkSize=CHUNK_SIZE):
+        """
+        @param key: Identifies the upload of this file to its destination
+        @param create_session: Called to start a new upload, it must
+        return the session URI
+        @param headers: Additional headers sent with each request
+        """
+        self.path = path
+        self.mimeType = mimeType
+        self.key = key
+        self.create_session = create_session
+        self.headers = headers
+        self.chunkSize = chunkSize
+        self.session = None
+        self.offset = 0
+        self.stat = os.stat(path)
+        self.size = self.stat.st_size
+
+        state = conduit.GLOBALS.uploadState
+        if state != None:
+            self.session = state.get_session(self.key, self.stat)
+            if self.session != None:
+                log.info("Resuming upload of %s" % self.path)
+
+    def _set_session(self, session):
+        self.session = session
+        state = conduit.GLOBALS.uploadState
+        if state != None:
+            if session == None:
+                state.forget(self.key)
+            else:
+                state.set_session(self.key, self.stat, session)
+
+    def _put(self, body, contentRange):
+        headers = dict(self.headers)
+        headers["Content-Type"] = self.mimeType
+        headers["Content-Range"] = contentRange
+        status, responseHeaders, body = _request("PUT", self.session, body, headers)
+        return status, responseHeaders.get("range"), body
+
+    def _handle_response(self, status, received, body):
+        """
+        @returns: The response body if the upload is complete, otherwise
+        updates the offset the server has received up to and returns None
+        """
+        if status in (200, 201):
+            return body
+        if status == 308:
+            #Range: bytes=0-N, where N is the last byte received
+            if received:
+                self.offset = int(received.split("-")[-1]) + 1
+            else:
+                self.offset = 0
+            return None
+        if status in (404, 410):
+            #the session expired, start again
+            self._set_session(None)
+            raise RetryUpload("Upload session expired")
+        if status >= 500:
+            raise RetryUpload("Server error %s" % status)
+        raise Exceptions.SyncronizeError("Upload of %s failed: %s %s" % (self.path, status, body))
+
+    def get_offset(self):
+        """
+        Asks the server how much of the file it has received
+        """
+        return self._handle_response(*self._put("", "bytes */%d" % self.size))
+
+    def upload(self):
+        """
+        Sends the file, continuing where the last upload stopped
+        @returns: The body of the response to the request that completed
+        the upload
+        """
+        if self.session == None:
+            self.offset = 0
+            self._set_session(self.create_session())
+        else:
+            body = self.get_offset()
+            if body != None:
+                self._set_session(None)
+                return body
+
+        f = open(self.path, "rb")
+        try:
+            while True:
+                if is_cancelled():
+                    raise Exceptions.StopSync
+                f.seek(self.offset)
+                chunk = f.read(self.chunkSize)
+                if chunk:
+                    start = self.offset
+                    end = start + len(chunk) - 1
+                    log.debug("Uploading %s bytes %s-%s/%s" % (self.path, start, end, self.size))
+                    body = self._handle_response(*self._put(chunk, "bytes %d-%d/%d" % (start, end, self.size)))
+                    if body == None and self.offset <= start:
+                        raise RetryUpload("Upload did not progress")
+                else:
+                    body = self.get_offset()
+                    if body == None:
+                        raise RetryUpload("Upload incomplete")
+                if body != None:
+                    self._set_session(None)
+                    return body
+        finally:
+            f.close()
@@ -1,78 +1,134 @@
-import vobject 
+import vobject
 import conduit.datatypes.DataType as DataType
+import conduit.datatypes.VObject as VObject
+
 def parse_vcf(string):
     """
-    Parses a vcf string, potentially containing many vcards
+    Parses a vcf string, potentially containing many vcards. Each vcard is
+    checked, but only parsed when its contents are needed
+    @param string: A string, or an open .vcf file
     @returns: A list of Contacts
+    @raise ValueError: If a vcard is badly formed
     """
     contacts = []
-    for vobj in vobject.readComponents(string):
-        if vobj.behavior == vobject.vcard.VCard3_0:
-            contacts.append(Contact(vcard=vobj))
+    for text in VObject.split_components(string, "VCARD"):
+        #only the vcards vobject reads as VCard3_0
+        version = VObject.get_property(text, "VERSION")
+        if vobject.base.getBehavior("VCARD", version) != vobject.vcard.VCard3_0:
+            continue
+        c = Contact()
+        c.set_from_vcard_string(text)
+        contacts.append(c)
     return contacts
-    
+
 class Contact(DataType.DataType):
     """
     Very basic contact representation
+
+    The vcard is kept as text until one of its fields is needed. The
+    serialized vcard and the hash are remembered until the contact is
+    changed. Code that modifies the vobject directly (through the vcard
+    attribute) turns this off for the contact, because the changes cannot
+    be seen.
+
     @keyword vcard: A vobject.vcard.VCard3_0 instance
     """
     _name_ = "contact"
     def __init__(self, **kwargs):
         DataType.DataType.__init__(self)
-        self.vcard = kwargs.get('vcard',vobject.vCard())
+        self._vcardString = None
+        self._serialized = None
+        self._hash = None
+        self._vcard = None
+        self._shared = False
+        if 'vcard' in kwargs:
+            self.vcard = kwargs['vcard']
         self.set_name(**kwargs)
 
+    def _get_vcard(self):
+        if self._vcard == None:
+            if self._vcardString == None:
+                self._vcard = vobject.vCard()
+            else:
+                self._vcard = vobject.readOne(self._vcardString)
+                self._vcardString = None
+            #vcards must have one, and only one N and FN
+            for prop in ('fn', 'n'):
+                if prop not in self._vcard.contents:
+                    self._vcard.add(prop)
+        return self._vcard
+
+    def _changed(self):
+        self._serialized = None
+        self._hash = None
+
+    def _get_vcard_attr(self):
+        vcard = self._get_vcard()
+        self._shared = True
+        self._changed()
+        return vcard
+
+    def _set_vcard_attr(self, vcard):
+        self._vcardString = None
+        self._vcard = vcard
+        self._shared = True
+        self._changed()
+
+    vcard = property(_get_vcard_attr, _set_vcard_attr)
+
     def set_from_vcard_string(self, string):
-        self.vcard = vobject.readOne(string)
+        VObject.check_component(string)
+        self._vcardString = string
+        self._vcard = None
+        self._shared = False
+        self._changed()
 
     def get_vcard_string(self, version=2.1):
-        for prop in ('fn', 'n'):
-	    if prop not in self.vcard.contents:
-	        self.vcard.add(prop)
-        return self.vcard.serialize()
-        
+        if self._serialized != None:
+            return self._serialized
+        serialized = self._get_vcard().serialize()
+        if not self._shared:
+            self._serialized = serialized
+        return serialized
+
     def get_emails(self):
         emails = []
-        if 'email' in self.vcard.contents:
-            for email in self.vcard.contents['email']:
+        vcard = self._get_vcard()
+        if 'email' in vcard.contents:
+            for email in vcard.contents['email']:
                 emails.append(email.value)
         return emails
-        
+
     def get_name(self):
         #In order of preference, 1)formatted name, 2)name, 3)""
         #FIXME: Return dict of formattedName, givenName, familyName, etc
-        for attr in [self.vcard.fn, self.vcard.n]:
+        vcard = self._get_vcard()
+        for attr in [vcard.fn, vcard.n]:
             #because str() on a vobject.vcard.Name pads with whitespace
             name = str(attr.value).strip()
             if len(name) > 0:
                 return name
         return ""
-        
+
     def set_name(self, **kwargs):
-        #vcards must have one, and only one N and FN
         fn = kwargs.get("formattedName","")
-        try:
-            self.vcard.fn
-        except AttributeError:
-            self.vcard.add('fn')
-        if fn:
-            self.vcard.fn.value = fn
-
         g = kwargs.get("givenName","")
         f = kwargs.get("familyName","")
-        try:
-            self.vcard.n
-        except AttributeError:
-            self.vcard.add('n')
+        if fn:
+            self._get_vcard().fn.value = fn
+            self._changed()
         if f or g:
-            self.vcard.n.value = vobject.vcard.Name(family=f,given=g)
+            self._get_vcard().n.value = vobject.vcard.Name(family=f,given=g)
+            self._changed()
 
     def set_emails(self, *args):
+        vcard = self._get_vcard()
         for address in args:
-            email = self.vcard.add('email')
+            email = vcard.add('email')
             email.value = address
             email.type_param = 'INTERNET'
-        
+        self._changed()
+
     def __getstate__(self):
         data = DataType.DataType.__getstate__(self)
         data['vcard'] = self.get_vcard_string()
@@ -80,12 +136,18 @@ class Contact(DataType.DataType):
 
     def __setstate__(self, data):
         self.set_from_vcard_string(data['vcard'])
+        #it was serialized by get_vcard_string, so it is already canonical
+        self._serialized = data['vcard']
         DataType.DataType.__setstate__(self, data)
 
     def __str__(self):
         return "Name: %s" % self.get_name()
-        
+
     def get_hash(self):
-        return str(hash(self.get_vcard_string()))
-    
+        if self._hash != None:
+            return self._hash
+        h = str(hash(self.get_vcard_string()))
+        if not self._shared:
+            self._hash = h
+        return h
 
@@ -1,21 +1,83 @@
-import vobject 
+import vobject
 import re
 import conduit.datatypes.DataType as DataType
+import conduit.datatypes.VObject as VObject
+
+#Properties that change without the event changing, so are not hashed
+HASH_IGNORED = [re.compile(p) for p in ('CREATED:.*\n', 'LAST-MODIFIED:.*\n', 'UID:.*\n')]
+
+def parse_ics(string):
+    """
+    Parses an ics string, potentially containing many calendars. Each
+    calendar is only parsed when its contents are needed
+    @param string: A string, or an open .ics file
+    @returns: A list of Events
+    """
+    events = []
+    for text in VObject.split_components(string, "VCALENDAR"):
+        e = Event()
+        e.set_from_ical_string(text)
+        events.append(e)
+    return events
 
 class Event(DataType.DataType):
     """
     Very basic calendar event representation
+
+    Like L{conduit.datatypes.Contact.Contact}, the iCalendar is kept as
+    text until it is needed, and the serialized iCalendar and the hash are
+    remembered until the event is changed.
     """
     _name_ = "event"
     def __init__(self, **kwargs):
         DataType.DataType.__init__(self)
-        self.iCal = vobject.iCalendar()
+        self._icalString = None
+        self._serialized = None
+        self._hash = None
+        self._ical = None
+        self._shared = False
+
+    def _get_ical(self):
+        if self._ical == None:
+            if self._icalString == None:
+                self._ical = vobject.iCalendar()
+            else:
+                self._ical = vobject.readOne(self._icalString)
+                self._icalString = None
+        return self._ical
+
+    def _changed(self):
+        self._serialized = None
+        self._hash = None
+
+    def _get_ical_attr(self):
+        ical = self._get_ical()
+        self._shared = True
+        self._changed()
+        return ical
+
+    def _set_ical_attr(self, ical):
+        self._icalString = None
+        self._ical = ical
+        self._shared = True
+        self._changed()
+
+    iCal = property(_get_ical_attr, _set_ical_attr)
 
     def set_from_ical_string(self, string):
-        self.iCal = vobject.readOne(string)
+        VObject.check_component(string)
+        self._icalString = string
+        self._ical = None
+        self._shared = False
+        self._changed()
 
     def get_ical_string(self, version=1.0):
-        return self.iCal.serialize()
+        if self._serialized != None:
+            return self._serialized
+        serialized = self._get_ical().serialize()
+        if not self._shared:
+            self._serialized = serialized
+        return serialized
 
     def __getstate__(self):
         data = DataType.DataType.__getstate__(self)
@@ -24,14 +86,17 @@ class Event(DataType.DataType):
 
     def __setstate__(self, data):
         self.set_from_ical_string(data['ical'])
+        #it was serialized by get_ical_string, so it is already canonical
+        self._serialized = data['ical']
         DataType.DataType.__setstate__(self, data)
-        
+
     def get_hash(self):
+        if self._hash != None:
+            return self._hash
         ical_string = self.get_ical_string()
-        p = re.compile('CREATED:.*\n')
-        ical_string = p.sub( '', ical_string )
-        p = re.compile('LAST-MODIFIED:.*\n')
-        ical_string = p.sub( '', ical_string )
-        p = re.compile('UID:.*\n')
-        ical_string = p.sub( '', ical_string )
-        return str(hash(ical_string))
+        for p in HASH_IGNORED:
+            ical_string = p.sub( '', ical_string )
+        h = str(hash(ical_string))
+        if not self._shared:
+            self._hash = h
+        return h
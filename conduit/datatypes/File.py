@@ -9,6 +9,7 @@ log = logging.getLogger("datatypes.File")
 import conduit
 import conduit.datatypes.DataType as DataType
 import conduit.Vfs as Vfs
+import conduit.FileCache as FileCache
 
 class FileTransferError(Exception):
     pass
@@ -26,6 +27,8 @@ class File(DataType.DataType):
         Optional kwargs
           - basepath: The files basepath
           - group: A named group to which this file belongs
+          - compareContents: Use a digest of the file contents to detect
+            changes, instead of the modification time
         """
         DataType.DataType.__init__(self)
         
@@ -49,8 +52,15 @@ class File(DataType.DataType):
         #optional args
         self.basePath = kwargs.get("basepath","")
         self.group = kwargs.get("group","")
-
-        #instance
+        self.compareContents = kwargs.get("compareContents",False)
+
+        #instance. The os.stat result may be supplied by a folder scanner
+        #that has just read it, in which case it is used for the first read
+        #of the file metadata
+        self._stat = kwargs.get("stat",None)
+        self._statFromScan = self._stat != None
+        #the number of nested reads of the file metadata (see _begin_read)
+        self._statReads = 0
         self._newFilename = None
         self._newMtime = None
 
@@ -59,6 +69,7 @@ class File(DataType.DataType):
         
     def _close_file(self):
         self._file.close()
+        self._stat = None
 
         #check to see if we have applied the rename/mtimes yet
         if self.get_filename() == self._newFilename:
@@ -108,6 +119,7 @@ class File(DataType.DataType):
         return self._isProxyFile
 
     def _set_file_mtime(self, mtime):
+        self._stat = None
         timestamp = conduit.utils.datetime_get_timestamp(mtime)
         log.debug("Setting mtime of %s to %s (%s)" % (
                             self._file.get_text_uri(),
@@ -116,6 +128,7 @@ class File(DataType.DataType):
         return self._file.set_mtime(timestamp)
 
     def _set_filename(self, filename):
+        self._stat = None
         oldname = self._file.get_filename()
         olduri = self._file.get_text_uri()
         #ignore unicode for equality
@@ -132,6 +145,53 @@ class File(DataType.DataType):
     def _get_impl(self):
         return self._file
 
+    def _begin_read(self):
+        """
+        Starts reading the file metadata. Each outermost read (such as
+        get_rid() or compare()) stats the file again, so that changes made
+        outside this instance are seen, and the reads nested in it share
+        that result. Must be paired with L{_end_read}
+        """
+        if self._statReads == 0:
+            if self._statFromScan:
+                self._statFromScan = False
+            else:
+                self._stat = None
+        self._statReads += 1
+
+    def _end_read(self):
+        self._statReads -= 1
+
+    def _get_stat(self):
+        """
+        For local files, a single os.stat is much cheaper than asking
+        the file implementation for the mtime and size, so do that, and
+        remember the result for the rest of the current read (see
+        L{_begin_read})
+
+        @returns: The os.stat result, or None if the file is not a local,
+        regular file
+        """
+        if self._stat == None and self._file.is_local():
+            path = self._file.get_local_path()
+            if path:
+                self._stat = FileCache.stat_file(path)
+        return self._stat
+
+    def _get_digest(self):
+        """
+        @returns: The (cached) digest of the file contents, or None if
+        the file is not local
+        """
+        self._begin_read()
+        try:
+            st = self._get_stat()
+            if st == None or self._is_proxyfile():
+                return None
+            return FileCache.get_digest(self._file.get_local_path(), st)
+        finally:
+            self._end_read()
+
     def set_from_instance(self, f):
         """
         Function to give this file all the properties of the
@@ -146,6 +206,9 @@ class File(DataType.DataType):
         self._newMtime = f._newMtime
         self._isProxyFile = f._isProxyFile
         self._proxyFileSize = f._proxyFileSize
+        self.compareContents = f.compareContents
+        self._stat = None
+        self._statFromScan = False
 
     def to_tempfile(self):
         """
@@ -272,6 +335,7 @@ class File(DataType.DataType):
         """
         log.debug("Deleting %s" % self._file.get_text_uri())
         self._file.delete()
+        self._stat = None
 
     def get_mimetype(self):
         """
@@ -289,12 +353,19 @@ class File(DataType.DataType):
         """
         if self._is_deferred_new_mtime():
             return self._newMtime
-        else:
-            ts = self._file.get_mtime()
-            if ts:
-                return datetime.datetime.fromtimestamp(ts)
+        self._begin_read()
+        try:
+            st = self._get_stat()
+            if st != None:
+                ts = int(st.st_mtime)
             else:
-                return None
+                ts = self._file.get_mtime()
+        finally:
+            self._end_read()
+        if ts:
+            return datetime.datetime.fromtimestamp(ts)
+        else:
+            return None
 
     def set_mtime(self, mtime):
         """
@@ -309,14 +380,43 @@ class File(DataType.DataType):
         """
         if self._is_proxyfile():
             return self._proxyFileSize
-        else:
+        self._begin_read()
+        try:
+            st = self._get_stat()
+            if st != None:
+                return st.st_size
             return self._file.get_size()
+        finally:
+            self._end_read()
 
     def get_hash(self):
         # Join the tags into a string to be hashed so the object is updated if
         # they change.
-        tagstr = "%s%s%s" % (self.get_mtime(),self.get_size(),"".join(self.get_tags()))
-        return str(hash(tagstr))
+        self._begin_read()
+        try:
+            if self.compareContents:
+                digest = self._get_digest()
+                if digest != None:
+                    return str(hash("%s%s" % (digest,"".join(self.get_tags()))))
+            tagstr = "%s%s%s" % (self.get_mtime(),self.get_size(),"".join(self.get_tags()))
+            return str(hash(tagstr))
+        finally:
+            self._end_read()
+
+    def get_rid(self):
+        self._begin_read()
+        try:
+            #when comparing contents the mtime is not considered reliable, so
+            #leave it out of the Rid
+            if self.compareContents and self._get_digest() != None:
+                return conduit.datatypes.Rid(
+                            uid=self.get_UID(),
+                            mtime=None,
+                            hash=self.get_hash()
+                            )
+            return DataType.DataType.get_rid(self)
+        finally:
+            self._end_read()
 
                        
     def get_filename(self):
@@ -338,6 +438,7 @@ class File(DataType.DataType):
         return self._file.get_contents()
 
     def set_contents_as_text(self, contents):
+        self._stat = None
         return self._file.set_contents(contents)
         
     def get_local_uri(self):
@@ -372,14 +473,30 @@ class File(DataType.DataType):
         else:
             return self._get_text_uri()
 
-    def compare(self, B, sizeOnly=False):
+    def compare(self, B, sizeOnly=False, contents=False):
         """
         Compare me with B based upon their modification times, or optionally
-        based on size only
+        based on size only. If contents is True, files with the same
+        contents are equal regardless of their modification times
         """
+        self._begin_read()
+        try:
+            return self._compare(B, sizeOnly, contents)
+        finally:
+            self._end_read()
+
+    def _compare(self, B, sizeOnly, contents):
         if B.exists() == False:
             return conduit.datatypes.COMPARISON_NEWER
 
+        #Compare the contents of local files?
+        if contents and self.get_size() == B.get_size():
+            meDigest = self._get_digest()
+            bDigest = B._get_digest()
+            log.debug("Comparing %s (DIGEST: %s) with %s (DIGEST: %s)" % (self._get_text_uri(), meDigest, B._get_text_uri(), bDigest))
+            if meDigest != None and meDigest == bDigest:
+                return conduit.datatypes.COMPARISON_EQUAL
+
         #Compare based on size only?
         if sizeOnly:
             meSize = self.get_size()
@@ -427,23 +544,22 @@ class File(DataType.DataType):
             log.warn("Error comparing file modification times")
             return conduit.datatypes.COMPARISON_UNKNOWN
 
-    def __getstate__(self):
+    def _get_file_state(self):
+        """
+        @returns: The state of the file, excluding its contents
+        """
         data = DataType.DataType.__getstate__(self)
         data['basePath'] = self.basePath
         data['group'] = self.group
         data['filename'] = self.get_filename()
         data['filemtime'] = self.get_mtime()
-
-        #FIXME: Maybe we should tar this first...
-        data['data'] = open(self.get_local_uri(), 'rb').read()
-
         return data
 
-    def __setstate__(self, data):
-        fd, name = tempfile.mkstemp(prefix="netsync")
-        os.write(fd, data['data'])
-        os.close(fd)
-
+    def _set_file_state(self, path, data):
+        """
+        Restores the state of a file whose contents have been
+        transferred to the local file at path
+        """
         implName = conduit.FILE_IMPL
         if implName == "GnomeVfs":
             import conduit.platform.FileGnomeVfs as FileImpl
@@ -457,7 +573,12 @@ class File(DataType.DataType):
         else:
             raise Exception("File Implementation %s Not Supported" % implName)
         
-        self._file = self.FileImpl.FileImpl(name)
+        self._file = self.FileImpl.FileImpl(path)
+        self._stat = None
+        self._statFromScan = False
+        self._statReads = 0
+        self._isProxyFile = False
+        self.compareContents = False
         self.basePath = data['basePath']
         self.group = data['group']
         self._defer_rename(data['filename'])
@@ -465,6 +586,20 @@ class File(DataType.DataType):
 
         DataType.DataType.__setstate__(self, data)
 
+    def __getstate__(self):
+        data = self._get_file_state()
+
+        #FIXME: Maybe we should tar this first...
+        data['data'] = open(self.get_local_uri(), 'rb').read()
+
+        return data
+
+    def __setstate__(self, data):
+        fd, name = tempfile.mkstemp(prefix="netsync")
+        os.write(fd, data['data'])
+        os.close(fd)
+        self._set_file_state(name, data)
+
 class TempFile(File):
     """
     Creates a file in the system temp directory with the given contents.
@@ -0,0 +1,107 @@
+"""
+Helpers for the datatypes stored as vCard or iCalendar text (vobjects)
+"""
+import re
+
+#NAME or GROUP.NAME, optional ;PARAMS, then :VALUE
+CONTENT_LINE = re.compile(r'^([\w-]+\.)?([\w-]+)(;[^:]*)?:(.*)$')
+
+def _content_lines(string):
+    """
+    @returns: An iterator over the (name, value) of each unfolded line
+    @raise ValueError: If a line is not a content line
+    """
+    softBreak = False
+    for line in string.splitlines():
+        #quoted-printable values continue after a trailing =
+        if softBreak:
+            softBreak = line.endswith("=")
+            continue
+        #folded lines continue the previous line
+        if line[0:1] in (" ", "\t") or line.strip() == "":
+            continue
+        match = CONTENT_LINE.match(line)
+        if match == None:
+            raise ValueError("Not a content line: %s" % line)
+        softBreak = line.endswith("=") and "QUOTED-PRINTABLE" in (match.group(3) or "").upper()
+        yield match.group(2).upper(), match.group(4)
+
+def split_components(lines, name):
+    """
+    Splits vCard or iCalendar text into the text of each top level
+    component called name (such as VCARD), without parsing it. The text is
+    read a line at a time, so large files can be split as they are read.
+
+    @param lines: A string, or an iterable of lines such as an open file
+    @returns: An iterator over the text of each component
+    """
+    if isinstance(lines, basestring):
+        lines = lines.splitlines(True)
+    begin = "BEGIN:%s" % name.upper()
+    depth = 0
+    found = False
+    component = []
+    for line in lines:
+        if line[0:6].upper() == "BEGIN:":
+            if depth == 0:
+                found = (line.strip().upper() == begin)
+            depth += 1
+        if found:
+            component.append(line)
+        if line[0:4].upper() == "END:" and depth > 0:
+            depth -= 1
+            if depth == 0 and found:
+                yield "".join(component)
+                component = []
+                found = False
+
+def check_component(string, name=""):
+    """
+    Checks that string is one well formed component, without parsing the
+    values of its properties
+
+    @param name: If given, the component must be called name
+    @raise ValueError: If a line is not a content line, the BEGIN and END
+    lines do not match, or there is anything after the component
+    """
+    if not is_component(string, name):
+        raise ValueError("Not a %s component" % (name or "vobject"))
+    stack = []
+    ended = False
+    for prop, value in _content_lines(string):
+        if ended:
+            raise ValueError("Content after the component ends: %s" % prop)
+        if prop == "BEGIN":
+            stack.append(value.strip().upper())
+        elif prop == "END":
+            if len(stack) == 0 or stack.pop() != value.strip().upper():
+                raise ValueError("Unexpected END:%s" % value)
+            ended = (len(stack) == 0)
+    if len(stack) > 0:
+        raise ValueError("No END:%s" % stack[-1])
+
+def get_property(string, name):
+    """
+    @returns: The value of the first property called name of the top level
+    component in string, without parsing the rest, or None
+    """
+    name = name.upper()
+    depth = 0
+    for prop, value in _content_lines(string):
+        if prop == "BEGIN":
+            depth += 1
+        elif prop == "END":
+            depth -= 1
+        elif prop == name and depth == 1:
+            return value.strip()
+    return None
+
+def is_component(string, name=""):
+    """
+    Checks that string looks like a component, without parsing it
+
+    @param name: If given, the component must be called name
+    @returns: True if string starts with BEGIN:name
+    """
+    begin = "BEGIN:%s" % name.upper()
+    return string.lstrip()[0:len(begin)].upper() == begin
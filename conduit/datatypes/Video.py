@@ -40,3 +40,9 @@ class Video(MediaFile.MediaFile):
         Video size, as a tuple (width, height), both in pixels (int, int)
         '''
         return self._get_metadata('width'), self._get_metadata('height')
+
+    def get_video_rate(self):
+        '''
+        Video frame rate, in frames per second (float)
+        '''
+        return self._get_metadata('videorate')
@@ -7,6 +7,7 @@ log = logging.getLogger("modules.AVConverter")
 
 import conduit
 import conduit.utils as Utils
+import conduit.utils.Thread as Thread
 import conduit.TypeConverter as TypeConverter
 import conduit.datatypes.File as File
 import conduit.datatypes.Audio as Audio
@@ -218,48 +219,197 @@ class GStreamerConversionPipeline(Pipeline):
         if not self.set_state(gst.STATE_PLAYING):
             self._finished()
             
-class GStreamerConverter():
-    def _run_pipeline(self, **kwargs):
-        def converted(converter, success):
-            self.success = success
-            event.set()
-        event = threading.Event()
-        pipeline = GStreamerConversionPipeline(**kwargs)
-        pipeline.connect("converted", converted)
-        pipeline.convert()
-        current_thread = threading.currentThread()
-        check_progress = False
-        while not event.isSet():
-            # Dont print an error message if we havent yet started the conversion
-            if check_progress:
-                (time, total) = pipeline.progress()
-                if total:
-                    log.debug("Conversion progress: %.2f%%" % (100.0 * time/total))
-            event.wait(PROGRESS_WAIT)
-			# FIXME: A little hackish, but works.
-            if hasattr(current_thread, 'cancelled'):
-                if current_thread.cancelled:
-                    log.debug("Stopping conversion")
-                    pipeline.set_state(gst.STATE_NULL)      
-                    pipeline = None
-                    return False
-            check_progress = True
-        pipeline.set_state(gst.STATE_NULL)
-        pipeline = None
-        return self.success
+class TranscodeJob(object):
+    """
+    A conversion, of one or two passes, run by the L{TranscodeScheduler}
+    """
+    def __init__(self, owner, kwargs):
+        self.owner = owner
+        self.kwargs = kwargs
+        self.passes = []
+        if kwargs.get('twopass', False):
+            self.passes = [1, 2]
+        self.pipeline = None
+        self.success = False
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def is_cancelled(self):
+        return conduit.GLOBALS.cancelled or getattr(self.owner, 'cancelled', False)
+
+    def start(self, converted):
+        """
+        Starts the next pass. converted(job, success) is called when it 
+        is finished
+        """
+        kwargs = self.kwargs.copy()
+        if self.passes:
+            kwargs['pass'] = self.passes[0]
+        self.pipeline = GStreamerConversionPipeline(**kwargs)
+        self.pipeline.connect("converted", lambda pipeline, success: converted(self, success))
+        self.pipeline.convert()
+
+    def stop(self):
+        if self.pipeline != None:
+            self.pipeline.set_state(gst.STATE_NULL)
+            self.pipeline = None
+
+    def get_progress(self):
+        """
+        @returns: The fraction of the conversion that is complete
+        """
+        if self.pipeline == None:
+            return 0.0
+        time, total = self.pipeline.progress()
+        if not total:
+            return 0.0
+        progress = time/total
+        if len(self.passes) == 2:
+            return progress/2
+        elif len(self.passes) == 1 and self.kwargs.get('twopass', False):
+            return 0.5 + progress/2
+        return progress
+
+class TranscodeScheduler(object):
+    """
+    Runs up to maxJobs GStreamer pipelines at once. Jobs wait in a queue
+    until a pipeline is free, and are cancelled when the sync (or
+    other thread) that started them is.
+    """
+    def __init__(self, maxJobs):
+        self.maxJobs = maxJobs
+        self._lock = threading.Lock()
+        self._queue = []
+        self._running = []
+
+    def _schedule(self):
+        #must be called with the lock held
+        while self._queue and len(self._running) < self.maxJobs:
+            job = self._queue.pop(0)
+            self._running.append(job)
+            try:
+                job.start(self._converted)
+            except Exception, e:
+                log.debug("Error starting conversion: %s" % e)
+                self._finish(job, False)
+
+    def _finish(self, job, success):
+        #must be called with the lock held
+        job.stop()
+        job.success = success
+        if job in self._running:
+            self._running.remove(job)
+        job.done.set()
+
+    def _converted(self, job, success):
+        self._lock.acquire()
+        try:
+            if job.done.isSet():
+                return
+            if job.passes:
+                job.passes.pop(0)
+            if success and job.passes:
+                #the second pass runs in the same slot
+                job.stop()
+                try:
+                    job.start(self._converted)
+                except Exception, e:
+                    log.debug("Error starting conversion: %s" % e)
+                    self._finish(job, False)
+            else:
+                self._finish(job, success)
+            self._schedule()
+        finally:
+            self._lock.release()
 
+    def cancel(self, job):
+        self._lock.acquire()
+        try:
+            if not job.done.isSet():
+                log.debug("Stopping conversion")
+                job.cancelled = True
+                if job in self._queue:
+                    self._queue.remove(job)
+                self._finish(job, False)
+                self._schedule()
+        finally:
+            self._lock.release()
+
+    def get_progress(self, owner):
+        """
+        @returns: The sum of the progress of the running conversions
+        started by owner, i.e. the number of conversions worth of work done
+        """
+        self._lock.acquire()
+        try:
+            return sum([job.get_progress() for job in self._running if job.owner == owner])
+        finally:
+            self._lock.release()
+
+    def run(self, owner, **kwargs):
+        """
+        Queues a conversion and waits for it to finish. Progress is reported
+        to owner if it has an emit_conversion_progress method
+
+        @returns: True if the file was converted
+        """
+        job = TranscodeJob(owner, kwargs)
+        self._lock.acquire()
+        try:
+            self._queue.append(job)
+            self._schedule()
+        finally:
+            self._lock.release()
+
+        while not job.done.isSet():
+            job.done.wait(PROGRESS_WAIT)
+            if job.is_cancelled():
+                self.cancel(job)
+            elif hasattr(owner, 'emit_conversion_progress'):
+                owner.emit_conversion_progress(self.get_progress(owner))
+        return job.success
+
+_scheduler = None
+_schedulerLock = threading.Lock()
+
+def get_scheduler():
+    """
+    @returns: The L{TranscodeScheduler} shared by all conversions
+    """
+    global _scheduler
+    _schedulerLock.acquire()
+    try:
+        if _scheduler == None:
+            maxJobs = conduit.GLOBALS.settings.get("transcode_threads")
+            if maxJobs <= 0:
+                maxJobs = Thread.get_cpu_count()
+            log.debug("Running %s simultaneous conversions" % maxJobs)
+            _scheduler = TranscodeScheduler(maxJobs)
+        return _scheduler
+    finally:
+        _schedulerLock.release()
+
+class GStreamerConverter():
     def convert(self, **kwargs):
-        if kwargs.get('twopass', False):
-            kwargs['pass'] = 1
-            self._run_pipeline(**kwargs)
-            kwargs['pass'] = 2
-            return self._run_pipeline(**kwargs)
-        else:
-            return self._run_pipeline(**kwargs)
+        """
+        Converts kwargs['in_file'] to kwargs['out_file'], waiting for a free
+        pipeline if too many conversions are already running. The conversion
+        is cancelled if the thread it is run for (see 
+        L{conduit.utils.Thread.get_owner}) is cancelled
 
+        @returns: True if the file was converted
+        """
+        return get_scheduler().run(Thread.get_owner(), **kwargs)
 
 class AudioVideoConverter(TypeConverter.Converter):
 
+    cached_conversions = (
+                        "file/video,file/video",
+                        "file,file/video",
+                        "file/audio,file/audio",
+                        "file,file/audio"
+                        )
+
     def __init__(self):
         self.conversions =  {
                             "file/video,file/video"     :   self.transcode_video,
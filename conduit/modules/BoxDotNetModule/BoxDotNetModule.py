@@ -11,6 +11,7 @@ import conduit
 import conduit.utils as Utils
 import conduit.Web as Web
 import conduit.dataproviders.DataProvider as DataProvider
+import conduit.dataproviders.Upload as Upload
 import conduit.Exceptions as Exceptions
 from conduit.datatypes import Rid
 import conduit.datatypes.File as File
@@ -243,14 +244,14 @@ class BoxDotNetTwoWay(DataProvider.TwoWay):
 
         if LUID == None:
             log.debug("Uploading file URI = %s, Mimetype = %s, Original Name = %s" % (fileURI, mimeType, originalName))
-            LUID = self._upload_file (fileURI, originalName)
+            LUID = Upload.retry(self._upload_file, fileURI, originalName)
         else:
             #check if a file exists at that UID
             id = self._get_file_info(LUID)
             if id != None:
                 if overwrite == True:
                     log.debug("Replacing file URI = %s, Mimetype = %s, Original Name = %s" % (fileURI, mimeType, originalName))
-                    LUID = self._replace_file(LUID, fileURI, originalName)
+                    LUID = Upload.retry(self._replace_file, LUID, fileURI, originalName)
                 else:
                     #Only upload the file if it is newer than the Remote one
                     url = self._get_raw_file_url(id)
@@ -264,6 +265,12 @@ class BoxDotNetTwoWay(DataProvider.TwoWay):
             
         return self.get(LUID).get_rid()
 
+    def put_many(self, items):
+        """
+        Uploads many files concurrently
+        """
+        return Upload.put_many(self.put, items)
+
     def delete(self, LUID):
         """
         Simply call the delete method on the api
@@ -302,12 +302,13 @@ class _FileSourceConfigurator(Vfs.FolderScannerThreadManager):
                 dialog.emit_stop_by_name("response")
 
 class _FolderTwoWayConfigurator:
-    def __init__(self, mainWindow, folder, includeHidden, compareIgnoreMtime, followSymlinks):
+    def __init__(self, mainWindow, folder, includeHidden, compareIgnoreMtime, followSymlinks, compareContents):
         log.debug("Starting new folder chooser at %s" % folder)
         self.folder = folder
         self.includeHidden = includeHidden
         self.compareIgnoreMtime = compareIgnoreMtime
         self.followSymlinks = followSymlinks
+        self.compareContents = compareContents
 
         tree = Utils.dataprovider_glade_get_widget(
                         __file__, 
@@ -322,6 +323,8 @@ class _FolderTwoWayConfigurator:
         self.mtimeCb.set_active(self.compareIgnoreMtime)
         self.followSymlinksCb = tree.get_widget("followSymlinks")
         self.followSymlinksCb.set_active(self.followSymlinks)
+        self.compareContentsCb = tree.get_widget("compareContents")
+        self.compareContentsCb.set_active(self.compareContents)
 
         self.dlg = tree.get_widget("FolderTwoWayConfigDialog")
         self.dlg.connect("response",self.on_response)
@@ -334,9 +337,10 @@ class _FolderTwoWayConfigurator:
             self.includeHidden = self.hiddenCb.get_active()
             self.compareIgnoreMtime = self.mtimeCb.get_active()
             self.followSymlinks = self.followSymlinksCb.get_active() 
+            self.compareContents = self.compareContentsCb.get_active()
 
     def show_dialog(self):
         self.dlg.show_all()
         self.dlg.run()
         self.dlg.destroy()
-        return self.folder, self.includeHidden, self.compareIgnoreMtime, self.followSymlinks
+        return self.folder, self.includeHidden, self.compareIgnoreMtime, self.followSymlinks, self.compareContents
@@ -69,6 +69,7 @@ class FolderTwoWay(FileDataProvider.FolderTwoWay, AutoSync.AutoSync):
     DEFAULT_HIDDEN = False
     DEFAULT_COMPARE_IGNORE_MTIME = False
     DEFAULT_FOLLOW_SYMLINKS = False
+    DEFAULT_COMPARE_CONTENTS = False
 
     def __init__(self, *args):
         FileDataProvider.FolderTwoWay.__init__(self,
@@ -76,7 +77,8 @@ class FolderTwoWay(FileDataProvider.FolderTwoWay, AutoSync.AutoSync):
                 self.DEFAULT_GROUP,
                 self.DEFAULT_HIDDEN,
                 self.DEFAULT_COMPARE_IGNORE_MTIME,
-                self.DEFAULT_FOLLOW_SYMLINKS
+                self.DEFAULT_FOLLOW_SYMLINKS,
+                self.DEFAULT_COMPARE_CONTENTS
                 )
         AutoSync.AutoSync.__init__(self)
         self._monitor = Vfs.FileMonitor()
@@ -93,8 +95,9 @@ class FolderTwoWay(FileDataProvider.FolderTwoWay, AutoSync.AutoSync):
                                     self.folder,
                                     self.includeHidden,
                                     self.compareIgnoreMtime,
-                                    self.followSymlinks)
-        self.folder, self.includeHidden, self.compareIgnoreMtime, self.followSymlinks = f.show_dialog()
+                                    self.followSymlinks,
+                                    self.compareContents)
+        self.folder, self.includeHidden, self.compareIgnoreMtime, self.followSymlinks, self.compareContents = f.show_dialog()
         self._monitor_folder()
         
     def set_configuration(self, config):
@@ -102,6 +105,7 @@ class FolderTwoWay(FileDataProvider.FolderTwoWay, AutoSync.AutoSync):
         self.includeHidden = config.get("includeHidden", self.DEFAULT_HIDDEN)
         self.compareIgnoreMtime = config.get("compareIgnoreMtime", self.DEFAULT_COMPARE_IGNORE_MTIME)
         self.followSymlinks = config.get("followSymlinks", self.DEFAULT_FOLLOW_SYMLINKS)        
+        self.compareContents = config.get("compareContents", self.DEFAULT_COMPARE_CONTENTS)
         self._monitor_folder()
 
     def get_configuration(self):
@@ -109,7 +113,8 @@ class FolderTwoWay(FileDataProvider.FolderTwoWay, AutoSync.AutoSync):
             "folder" : self.folder,
             "includeHidden" : self.includeHidden,
             "compareIgnoreMtime" : self.compareIgnoreMtime,
-            "followSymlinks" : self.followSymlinks
+            "followSymlinks" : self.followSymlinks,
+            "compareContents" : self.compareContents
             }
 
     def get_UID(self):
@@ -1,6 +1,7 @@
 """
 Flickr Uploader.
 """
+import threading
 import logging
 log = logging.getLogger("modules.Flickr")
 
@@ -10,6 +11,7 @@ import conduit.Web as Web
 import conduit.dataproviders.Image as Image
 import conduit.Exceptions as Exceptions
 import conduit.datatypes.Photo as Photo
+import conduit.utils.Thread as Thread
 from conduit.datatypes import Rid
 
 from gettext import gettext as _
@@ -29,6 +31,56 @@ if flickrapi.__version__ == "1.1":
 else:
     MODULES = {}
     log.info("Flickr support disabled")
+
+#Photosets are listed this many photos at a time, the most Flickr allows
+PHOTOS_PER_PAGE = 500
+#Metadata listed along with each photo, so it need not be got separately
+PHOTO_EXTRAS = "description,tags"
+#Pages of large photosets are listed in parallel on this many threads
+NUM_PAGE_THREADS = 4
+
+PHOTO_URL = "http://farm%(farm)s.static.flickr.com/%(server)s/%(id)s_%(secret)s.jpg"
+
+class _FlickrPhoto:
+    """
+    The metadata needed to get a photo, either from photos.getInfo, or
+    from a listing of a photoset with PHOTO_EXTRAS
+    """
+    def __init__(self, photoId, url, title, caption, tags):
+        self.photoId = photoId
+        self.url = url
+        self.title = title
+        self.caption = caption
+        self.tags = tags
+
+    @classmethod
+    def from_info(cls, info):
+        photo = info.photo[0]
+        tagsNode = photo.tags[0]
+        if hasattr(tagsNode, 'tag'):
+            tags = tuple(tag.text for tag in tagsNode.tag)
+        else:
+            tags = ()
+        return cls(
+                photo['id'],
+                #photo is a dict so we can use pythons string formatting natively with the correct keys
+                PHOTO_URL % photo.attrib,
+                photo.title[0].text,
+                photo.description[0].text,
+                tags)
+
+    @classmethod
+    def from_list(cls, photo):
+        if hasattr(photo, 'description'):
+            caption = photo.description[0].text
+        else:
+            caption = ""
+        return cls(
+                photo['id'],
+                PHOTO_URL % photo.attrib,
+                photo['title'],
+                caption,
+                tuple(photo.attrib.get('tags', "").split()))
     
 class MyFlickrAPI(flickrapi.FlickrAPI):
     """
@@ -91,7 +143,13 @@ class FlickrTwoWay(Image.ImageTwoWay):
         self.photoSetName = ""
         self.showPublic = True
         self.photoSetId = None
+        #photos are uploaded concurrently, but only one may create the photoset
+        self._photoSetLock = threading.Lock()
         self.imageSize = "None"
+        #photo id : _FlickrPhoto, filled when the photoset is listed in
+        #refresh, and cleared when the sync finishes
+        self.photos = {}
+        self.photoIds = []
 
     # Helper methods
     def _get_user_quota(self):
@@ -110,16 +168,19 @@ class FlickrTwoWay(Image.ImageTwoWay):
 
     def _get_photo_info(self, photoID):
         try:
-            return self.fapi.photos_getInfo(photo_id=photoID)
+            return self.photos[photoID]
+        except KeyError:
+            pass
+        try:
+            info = _FlickrPhoto.from_info(self.fapi.photos_getInfo(photo_id=photoID))
         except flickrapi.FlickrError, e:
             log.debug("Error getting photo info: %s" % e)
             return None
+        self.photos[photoID] = info
+        return info
 
     def _get_raw_photo_url(self, photoInfo):
-        photo = photoInfo.photo[0]
-        #photo is a dict so we can use pythons string formatting natively with the correct keys
-        url = "http://farm%(farm)s.static.flickr.com/%(server)s/%(id)s_%(secret)s.jpg" % photo
-        return url
+        return photoInfo.url
 
     def _upload_photo (self, uploadInfo):
         try:
@@ -134,13 +195,18 @@ class FlickrTwoWay(Image.ImageTwoWay):
 
         # get the id
         photoId = ret.photoid[0].text
+        self.photoIds.append(photoId)
 
         # check if phtotoset exists, if not create it
         firstPhoto = False
-        if not self.photoSetId:
-            self.photoSetId = self._create_photoset(photoId)
-            # first photo shouldn't be added to photoset as Flickrs does it for us
-            firstPhoto = True
+        self._photoSetLock.acquire()
+        try:
+            if not self.photoSetId:
+                self.photoSetId = self._create_photoset(photoId)
+                # first photo shouldn't be added to photoset as Flickrs does it for us
+                firstPhoto = True
+        finally:
+            self._photoSetLock.release()
 
         # add the photo to the photoset
         if self.photoSetId and not firstPhoto:
@@ -154,6 +220,24 @@ class FlickrTwoWay(Image.ImageTwoWay):
         #return the photoID
         return Rid(uid=photoId)
 
+    def _replace_photo(self, photoId, uploadInfo):
+        #the metadata listed when refreshing will be stale, so get it
+        #again when it is next needed
+        self.photos.pop(photoId, None)
+        try:
+            self.fapi.replace(filename=uploadInfo.url, photo_id=photoId)
+            self.fapi.photos_setMeta(
+                                photo_id=photoId,
+                                title=uploadInfo.name,
+                                description=uploadInfo.caption)
+            self.fapi.photos_setTags(
+                                photo_id=photoId,
+                                tags=' '.join(tag.replace(' ', '_') for tag in uploadInfo.tags))
+        except flickrapi.FlickrError, e:
+            raise Exceptions.SyncronizeError("Flickr Replace Error: %s" % e)
+
+        return Rid(uid=photoId)
+
     def _get_photo_size (self):
         return self.imageSize
 
@@ -200,30 +284,62 @@ class FlickrTwoWay(Image.ImageTwoWay):
 
         return photosets        
         
+    def _get_photos_page(self, page):
+        ret = self.fapi.photosets_getPhotos(
+                                photoset_id=self.photoSetId,
+                                extras=PHOTO_EXTRAS,
+                                per_page=PHOTOS_PER_PAGE,
+                                page=page)
+        return ret.photoset[0]
+
     def _get_photos(self):
+        """
+        Lists the photoset, along with the metadata of each photo. The
+        first page says how many more there are, which are then listed
+        in parallel
+        """
+        self.photos = {}
+        self.photoIds = []
         if not self.photoSetId:
-            return []
+            return
 
-        photoList = []
         try:
-            ret = self.fapi.photosets_getPhotos(photoset_id=self.photoSetId)
-            for photo in ret.photoset[0].photo:
-                photoList.append(photo['id'])
+            first = self._get_photos_page(1)
+            pages = [first]
+            numPages = int(first.attrib.get('pages', 1))
+            if numPages > 1:
+                pool = Thread.WorkerPool(min(NUM_PAGE_THREADS, numPages-1), name="Flickr")
+                try:
+                    pages.extend(pool.imap(self._get_photos_page, range(2, numPages+1)))
+                finally:
+                    pool.stop()
         except flickrapi.FlickrError, e:
             log.warn("Flickr failed to get photos: %s" % e)
-
-        return photoList
+            return
+
+        for page in pages:
+            for photo in getattr(page, 'photo', []):
+                info = _FlickrPhoto.from_list(photo)
+                self.photos[info.photoId] = info
+                self.photoIds.append(info.photoId)
+        log.debug("Listed %s photos in %s pages" % (len(self.photoIds), len(pages)))
         
     # DataProvider methods
     def refresh(self):
         Image.ImageTwoWay.refresh(self)
         self._login()
         self._get_photoset()
+        self._get_photos()
         used,tot,percent = self._get_user_quota()
         log.debug("Used %2.1f%% of monthly badwidth quota (%skb/%skb)" % (percent,used,tot))
 
+    def finish(self, aborted, error, conflict):
+        Image.ImageTwoWay.finish(self)
+        self.photos = {}
+        self.photoIds = []
+
     def get_all(self):
-        return self._get_photos()
+        return self.photoIds[:]
 
     def get (self, LUID):
         # get photo info
@@ -231,16 +347,11 @@ class FlickrTwoWay(Image.ImageTwoWay):
         # get url
         url = self._get_raw_photo_url (photoInfo)
         # get the title
-        title = str(photoInfo.photo[0].title[0].text)
+        title = str(photoInfo.title)
         # get tags
-        tagsNode = photoInfo.photo[0].tags[0]
+        tags = photoInfo.tags
         # get caption
-        caption = photoInfo.photo[0].description[0].text
-        
-        if hasattr(tagsNode, 'tag'):
-            tags = tuple(tag.text for tag in tagsNode.tag)
-        else:
-            tags = ()
+        caption = photoInfo.caption
 
         # create the file
         f = Photo.Photo (URI=url)
@@ -267,6 +378,9 @@ class FlickrTwoWay(Image.ImageTwoWay):
             try:
                 ret = self.fapi.photos_delete(photo_id=LUID)
                 log.debug("Successfully deleted photo: %s" % LUID)
+                self.photos.pop(LUID, None)
+                if LUID in self.photoIds:
+                    self.photoIds.remove(LUID)
             except flickrapi.FlickrError, e:
                 log.warn("Error deleting %s: %s" % (LUID,e))
         else:
@@ -14,8 +14,11 @@ log = logging.getLogger("modules.Google")
 import conduit
 import conduit.dataproviders.DataProvider as DataProvider
 import conduit.dataproviders.Image as Image
+import conduit.dataproviders.Upload as Upload
 import conduit.utils as Utils
+import conduit.utils.Thread as Thread
 import conduit.Exceptions as Exceptions
+import conduit.FeedCache as FeedCache
 from conduit.datatypes import Rid
 import conduit.datatypes.Contact as Contact
 import conduit.datatypes.Event as Event
@@ -50,6 +53,13 @@ except (ImportError, AttributeError):
 # time format
 FORMAT_STRING = "%Y-%m-%dT%H:%M:%S"
 
+#Albums are listed this many photos at a time
+PICASA_PHOTOS_PER_PAGE = 500
+#Pages of large albums are listed in parallel on this many threads
+PICASA_PAGE_THREADS = 4
+#Changes to calendars and contacts are listed this many entries at a time
+FEED_ENTRIES_PER_PAGE = 500
+
 class _GoogleBase:
     _configurable_ = True
     def __init__(self, service):
@@ -57,6 +67,8 @@ class _GoogleBase:
         self.password = ""
         self.loggedIn = False
         self.service = service
+        #used instead of the global feed cache if there is none
+        self._feedCache = None
         
         if conduit.GLOBALS.settings.proxy_enabled():
             log.info("Configuring proxy for %s" % self.service)
@@ -111,6 +123,97 @@ class _GoogleBase:
     def get_UID(self):
         return self.username
 
+    def _get_feed_cache(self):
+        if conduit.GLOBALS.feedCache != None:
+            return conduit.GLOBALS.feedCache
+        if self._feedCache == None:
+            self._feedCache = FeedCache.FeedCache()
+        return self._feedCache
+
+    def _get_feed_key(self):
+        """
+        @returns: The key the entries of the feed are cached under
+        """
+        raise NotImplementedError
+
+    def _get_entry_id(self, entry):
+        raise NotImplementedError
+
+    def _get_entry_rid(self, entry):
+        """
+        @returns: The Rid of the datatype built from entry by get()
+        """
+        raise NotImplementedError
+
+    def _is_deleted_entry(self, entry):
+        """
+        @returns: True if entry is the tombstone of a deleted entry
+        """
+        raise NotImplementedError
+
+    def _update_feed(self, query, converter):
+        """
+        Brings the cached entries of the feed up to date. Only the entries
+        updated since the last refresh are downloaded, along with the
+        tombstones of those that were deleted. The whole feed is downloaded
+        the first time, or if the service no longer has the tombstones
+        of everything deleted since then.
+        """
+        cache = self._get_feed_cache()
+        key = self._get_feed_key()
+        mark = cache.get_mark(key)
+
+        query['max-results'] = str(FEED_ENTRIES_PER_PAGE)
+        if mark != None:
+            query.updated_min = mark
+            query['showdeleted'] = 'true'
+        try:
+            page = self.service.Get(query.ToUri(), converter=converter)
+        except gdata.service.RequestError, e:
+            if mark == None or e.message.get("status") != 410:
+                raise
+            log.info("Changes to %s since %s are not available, getting all entries" % (key, mark))
+            cache.clear(key)
+            del query['updated-min']
+            del query['showdeleted']
+            return self._update_feed(query, converter)
+
+        #entries changed while the pages are listed are updated after
+        #the mark, so they are listed again next time
+        newMark = page.updated.text or mark
+        entries = []
+        deleted = []
+        while True:
+            for entry in page.entry:
+                if self._is_deleted_entry(entry):
+                    deleted.append(self._get_entry_id(entry))
+                else:
+                    entries.append((self._get_entry_rid(entry), entry.ToString()))
+            if page.GetNextLink() == None:
+                break
+            page = self.service.GetNext(page)
+
+        log.info("%s: %s entries changed, %s deleted since %s" % (key, len(entries), len(deleted), mark))
+        cache.update(key, newMark, entries, deleted, replace=(mark == None))
+
+    def _put_entry(self, entry):
+        """
+        Caches an entry that was just written to the feed
+        @returns: Its Rid
+        """
+        rid = self._get_entry_rid(entry)
+        self._get_feed_cache().put(self._get_feed_key(), rid, entry.ToString())
+        return rid
+
+    def _get_cached_entry(self, LUID, converter):
+        """
+        @returns: The cached entry, or None
+        """
+        data = self._get_feed_cache().get_data(self._get_feed_key(), LUID)
+        if data == None:
+            return None
+        return converter(data)
+
 class _GoogleCalendar:
     def __init__(self, name, uri):
         self.uri = uri
@@ -378,14 +481,32 @@ class GoogleCalendarTwoWay(_GoogleBase, DataProvider.TwoWay):
         _GoogleBase.__init__(self,gdata.calendar.service.CalendarService())
         DataProvider.TwoWay.__init__(self)
         self.selectedCalendar = None
-        self.events = {}
 
-    def _get_all_events(self):
-        self._login()
-        calQuery = gdata.calendar.service.CalendarEventQuery(user = self.selectedCalendar.get_uri())
-        eventFeed = self.service.CalendarQuery(calQuery)
-        for event in eventFeed.entry:   
-            yield _GoogleEvent.from_google_format(event)
+    def _get_feed_key(self):
+        return "calendar:%s:%s" % (self.username, self.selectedCalendar.get_uri())
+
+    def _get_entry_id(self, entry):
+        return entry.id.text.split('/')[-1] + "@google.com"
+
+    def _get_entry_rid(self, entry):
+        return self._get_conduit_event(_GoogleEvent.from_google_format(entry)).get_rid()
+
+    def _is_deleted_entry(self, entry):
+        return entry.event_status != None and entry.event_status.value == 'CANCELED'
+
+    def _get_event(self, LUID):
+        entry = self._get_cached_entry(LUID, gdata.calendar.CalendarEventEntryFromString)
+        if entry == None:
+            return None
+        return _GoogleEvent.from_google_format(entry)
+
+    def _get_conduit_event(self, event):
+        conduitEvent = Event.Event()
+        conduitEvent.set_from_ical_string(event.get_ical_format())
+        conduitEvent.set_open_URI(event.get_uid())
+        conduitEvent.set_mtime(event.get_mtime())
+        conduitEvent.set_UID(event.get_uid())
+        return conduitEvent
 
     def _get_all_calendars(self):
         self._login()
@@ -458,46 +579,52 @@ class GoogleCalendarTwoWay(_GoogleBase, DataProvider.TwoWay):
         
     def refresh(self):
         DataProvider.TwoWay.refresh(self)
-        self.events = {}
-        for event in self._get_all_events():
-            self.events[event.get_uid()] = event
-        
-    def finish(self, aborted, error, conflict):
-        self.events = {}
+        self._login()
+        if not self.loggedIn:
+            raise Exceptions.RefreshError("Could not log in")
+        #only the events changed since the last refresh are downloaded
+        self._update_feed(
+                gdata.calendar.service.CalendarEventQuery(user=self.selectedCalendar.get_uri()),
+                gdata.calendar.CalendarEventFeedFromString)
         
     def get_all(self):
-        return self.events.keys()
+        DataProvider.TwoWay.get_all(self)
+        return self._get_feed_cache().get_ids(self._get_feed_key())
+
+    def get_all_with_rids(self):
+        return self._get_feed_cache().get_rids(self._get_feed_key())
         
     def get_num_items(self):
         DataProvider.TwoWay.get_num_items(self) 
-        return len(self.events)
+        return self._get_feed_cache().get_num_entries(self._get_feed_key())
 
     def get(self, LUID):
         DataProvider.TwoWay.get(self, LUID)       
-        event = self.events[LUID]
-        conduitEvent = Event.Event()
-        conduitEvent.set_from_ical_string(event.get_ical_format())
-        conduitEvent.set_open_URI(LUID)
-        conduitEvent.set_mtime(event.get_mtime())
-        conduitEvent.set_UID(event.get_uid())
-        return conduitEvent          
+        event = self._get_event(LUID)
+        if event == None:
+            raise Exceptions.SyncronizeError("Event %s not found" % LUID)
+        return self._get_conduit_event(event)
                    
     def _create_event(self, conduitEvent):
         googleEvent = _GoogleEvent.from_ical_format( conduitEvent.get_ical_string() )
         newEvent = self.service.InsertEvent(
                                         googleEvent.get_google_format(),
                                         self.selectedCalendar.get_feed_link())
-        newEvent = _GoogleEvent.from_google_format(newEvent)
-        return Rid(uid=newEvent.get_uid(), mtime=None, hash=None)
+        return self._put_entry(newEvent)
         
     def _delete_event(self, LUID):
-        googleEvent = self.events[LUID]
-        self.service.DeleteEvent(googleEvent.get_edit_link())
+        googleEvent = self._get_event(LUID)
+        if googleEvent != None:
+            self.service.DeleteEvent(googleEvent.get_edit_link())
+            self._get_feed_cache().delete(self._get_feed_key(), LUID)
         
     def _update_event(self, LUID, conduitEvent):
-        self._delete_event(LUID)
-        rid = self._create_event(conduitEvent)
-        return rid
+        #update the event in place, so it keeps its id
+        googleEvent = _GoogleEvent.from_ical_format( conduitEvent.get_ical_string() )
+        newEvent = self.service.UpdateEvent(
+                                        self._get_event(LUID).get_edit_link(),
+                                        googleEvent.get_google_format())
+        return self._put_entry(newEvent)
 
     def delete(self, LUID):
         self._delete_event(LUID)
@@ -506,7 +633,10 @@ class GoogleCalendarTwoWay(_GoogleBase, DataProvider.TwoWay):
         #Following taken from EvolutionModule
         DataProvider.TwoWay.put(self, obj, overwrite, LUID)
         if LUID != None:
-            existing = self.events.get(LUID, None)
+            existing = None
+            event = self._get_event(LUID)
+            if event != None:
+                existing = self._get_conduit_event(event)
             if existing != None:
                 if overwrite == True:
                     rid = self._update_event(LUID, obj)
@@ -562,6 +692,8 @@ class PicasaTwoWay(_GoogleBase, Image.ImageTwoWay):
         self.albumName = ""
         self.imageSize = "None"
         self.galbum = None
+        #photo id : gphoto, filled when the album is listed in refresh,
+        #and cleared when the sync finishes
         self.gphoto_dict = {}
 
     def _get_raw_photo_url(self, photoInfo):
@@ -588,8 +720,11 @@ class PicasaTwoWay(_GoogleBase, Image.ImageTwoWay):
                                 uploadInfo.url)
             for tag in uploadInfo.tags:
                 self.service.InsertTag(gphoto, str(tag))
+            self.gphoto_dict[gphoto.gphoto_id.text] = gphoto
             return Rid(uid=gphoto.gphoto_id.text)
         except Exception, e:
+            if Upload.is_retryable(e):
+                raise
             raise Exceptions.SyncronizeError("Picasa Upload Error:\n%s" % e)
 
     def _replace_photo(self, id, uploadInfo):
@@ -607,9 +742,12 @@ class PicasaTwoWay(_GoogleBase, Image.ImageTwoWay):
         
             # This should be done just only the photo itself has changed
             gphoto = self.service.UpdatePhotoBlob(gphoto, uploadInfo.url)
+            self.gphoto_dict[gphoto.gphoto_id.text] = gphoto
 
             return Rid(uid=gphoto.gphoto_id.text)
         except Exception, e:
+            if Upload.is_retryable(e):
+                raise
             raise Exceptions.SyncronizeError("Picasa Update Error:\n%s" % e)
 
     def _find_album(self):
@@ -635,10 +773,41 @@ class PicasaTwoWay(_GoogleBase, Image.ImageTwoWay):
                     album))             #album
         return albums
         
+    def _get_photos_page(self, startIndex):
+        return self.service.GetFeed(
+                        self.galbum.GetPhotosUri(),
+                        limit=PICASA_PHOTOS_PER_PAGE,
+                        start_index=startIndex).entry
+
     def _get_photos(self):
+        """
+        Lists the album. The photo entries include their tags (as media
+        keywords), so they need not be got for each photo. The album says
+        how many photos it has, so all pages are listed in parallel
+        """
         self.gphoto_dict = {}
-        for photo in self.service.GetFeed(self.galbum.GetPhotosUri()).entry:
-            self.gphoto_dict[photo.gphoto_id.text] = photo
+        try:
+            numPhotos = int(self.galbum.numphotos.text)
+        except (AttributeError, TypeError, ValueError):
+            numPhotos = PICASA_PHOTOS_PER_PAGE
+        starts = range(1, max(numPhotos, 1)+1, PICASA_PHOTOS_PER_PAGE)
+
+        pool = Thread.WorkerPool(min(PICASA_PAGE_THREADS, len(starts)), name="Picasa")
+        try:
+            for entries in pool.imap(self._get_photos_page, starts):
+                for photo in entries:
+                    self.gphoto_dict[photo.gphoto_id.text] = photo
+        finally:
+            pool.stop()
+
+    def _get_photo_tags(self, gphoto):
+        try:
+            keywords = gphoto.media.keywords.text
+        except AttributeError:
+            keywords = None
+        if not keywords:
+            return ()
+        return tuple(k.strip() for k in keywords.split(",") if k.strip())
 
     def _get_photo_timestamp(self, gphoto):
         from datetime import datetime
@@ -661,9 +830,12 @@ class PicasaTwoWay(_GoogleBase, Image.ImageTwoWay):
         if self.galbum:
             self._get_photos()
 
+    def finish(self, aborted, error, conflict):
+        Image.ImageTwoWay.finish(self)
+        self.gphoto_dict = {}
+
     def get_all (self):
         Image.ImageTwoWay.get_all(self)
-        self._get_photos()
         return self.gphoto_dict.keys()
         
     def get (self, LUID):
@@ -671,7 +843,7 @@ class PicasaTwoWay(_GoogleBase, Image.ImageTwoWay):
 
         gphoto = self.gphoto_dict[LUID]
         url = gphoto.GetMediaURL()
-        tags = (tag.title.text for tag in self.service.GetFeed(gphoto.GetTagsUri()).entry)
+        tags = self._get_photo_tags(gphoto)
 
         f = Photo.Photo (URI=url)
         f.force_new_mtime(self._get_photo_timestamp(gphoto))
@@ -811,6 +983,33 @@ class ContactsTwoWay(_GoogleBase,  DataProvider.TwoWay):
     def __init__(self, *args):
         _GoogleBase.__init__(self,gdata.contacts.service.ContactsService())
         DataProvider.TwoWay.__init__(self)
+
+    def _get_feed_key(self):
+        return "contacts:%s" % self.username
+
+    def _get_entry_id(self, entry):
+        return str(entry.id.text)
+
+    def _get_entry_rid(self, entry):
+        return self._get_contact_from_entry(entry).get_rid()
+
+    def _is_deleted_entry(self, entry):
+        return entry.deleted != None
+
+    def _get_entry(self, LUID):
+        """
+        @returns: The gdata contact, from the cache if it has been seen
+        """
+        gc = self._get_cached_entry(LUID, gdata.contacts.ContactEntryFromString)
+        if gc == None:
+            gc = self.service.Get(LUID, converter=gdata.contacts.ContactEntryFromString)
+        return gc
+
+    def _get_contact_from_entry(self, gc):
+        c = self._conduit_contact_from_google_contact(gc)
+        c.set_UID(str(gc.id.text))
+        c.set_mtime(convert_madness_to_datetime(gc.updated.text))
+        return c
         
     def _google_contact_from_conduit_contact(self, contact, gc=None):
         """
@@ -893,21 +1092,26 @@ class ContactsTwoWay(_GoogleBase,  DataProvider.TwoWay):
 
         if entry:
             log.debug("Created contact: %s" % entry.id.text)
+            self._put_entry(entry)
             return entry.id.text
         else:
             log.debug("Create contact error")
             return None
 
     def _update_contact(self, LUID, contact):
-        #get the gdata contact from google
+        #get the gdata contact
         try:
-            oldgc = self.service.Get(LUID, converter=gdata.contacts.ContactEntryFromString)
+            oldgc = self._get_entry(LUID)
         except gdata.service.RequestError:
             return None
             
         #update the contact
         gc = self._google_contact_from_conduit_contact(contact, oldgc)
-        self.service.UpdateContact(oldgc.GetEditLink().href, gc)
+        entry = self.service.UpdateContact(oldgc.GetEditLink().href, gc)
+        if isinstance(entry, gdata.contacts.ContactEntry):
+            self._put_entry(entry)
+        else:
+            self._get_feed_cache().delete(self._get_feed_key(), LUID)
         
         #fixme, we should really just return the RID here, but its safer
         #to use the same code path as get, because I am not sure if/how google
@@ -918,33 +1122,30 @@ class ContactsTwoWay(_GoogleBase,  DataProvider.TwoWay):
         if not LUID:
             return None
 
-        #get the gdata contact from google
+        #get the gdata contact
         try:
-            gc = self.service.Get(LUID, converter=gdata.contacts.ContactEntryFromString)
+            gc = self._get_entry(LUID)
         except gdata.service.RequestError:
             return None
             
-        c = self._conduit_contact_from_google_contact(gc)
-        c.set_UID(LUID)
-        c.set_mtime(convert_madness_to_datetime(gc.updated.text))
-        return c
-
-    def _get_all_contacts(self):
-        feed = self.service.GetContactsFeed()
-        if not feed.entry:
-            return []
-        return [str(contact.id.text) for contact in feed.entry]
+        return self._get_contact_from_entry(gc)
         
     def refresh(self):
         DataProvider.TwoWay.refresh(self)
         self._login()
         if not self.loggedIn:
             raise Exceptions.RefreshError("Could not log in")
+        #only the contacts changed since the last refresh are downloaded
+        self._update_feed(
+                gdata.contacts.service.ContactsQuery(),
+                gdata.contacts.ContactsFeedFromString)
 
     def get_all(self):
         DataProvider.TwoWay.get_all(self)
-        self._login()
-        return self._get_all_contacts()
+        return self._get_feed_cache().get_ids(self._get_feed_key())
+
+    def get_all_with_rids(self):
+        return self._get_feed_cache().get_rids(self._get_feed_key())
 
     def get(self, LUID):
         DataProvider.TwoWay.get(self, LUID)
@@ -987,10 +1188,11 @@ class ContactsTwoWay(_GoogleBase,  DataProvider.TwoWay):
     def delete(self, LUID):
         DataProvider.TwoWay.delete(self, LUID)
         self._login()
-        #get the gdata contact from google
+        #get the gdata contact
         try:
-            gc = self.service.Get(LUID, converter=gdata.contacts.ContactEntryFromString)
+            gc = self._get_entry(LUID)
             self.service.DeleteContact(gc.GetEditLink().href)
+            self._get_feed_cache().delete(self._get_feed_key(), LUID)
         except gdata.service.RequestError, e:
             log.warn("Error deleting: %s" % e)        
 
@@ -1362,6 +1564,7 @@ class YouTubeTwoWay(_GoogleBase, DataProvider.TwoWay):
     UPLOAD_CLIENT_ID="ytapi-ConduitProject-Conduit-e14hdhdm-0"
     UPLOAD_DEVELOPER_KEY="AI39si6wJ3VA_UWZCWeuA-wmJEpEhGbE3ZxCOZq89JJFy5CpSkFOq8gdZluNvBAM6DW8m7AhliSYPLyfEPJx6XphBq3vOBHuzQ"
     UPLOAD_URL="http://uploads.gdata.youtube.com/feeds/api/users/%(username)s/uploads"
+    RESUMABLE_UPLOAD_URL="http://uploads.gdata.youtube.com/resumable/feeds/api/users/default/uploads"
 
     def __init__(self, *args):
         youtube_service = gdata.youtube.service.YouTubeService()
@@ -1433,20 +1636,40 @@ class YouTubeTwoWay(_GoogleBase, DataProvider.TwoWay):
         self.service.ClientLogin(self.username, self.password, auth_service_url="https://www.google.com/youtube/accounts/ClientLogin")
 
     def _upload_video (self, uploadInfo):
-        try:
-            self.gvideo = gdata.youtube.YouTubeVideoEntry()
-            self.gvideo.media = gdata.media.Group(
-                                title = gdata.media.Title(text=uploadInfo.name),
-                                description = gdata.media.Description(text=uploadInfo.description),
-                                category = gdata.media.Category(text=uploadInfo.category),
-                                keywords = gdata.media.Keywords(text=','.join(uploadInfo.keywords)))
+        """
+        Uploads the video in chunks with the resumable upload protocol,
+        so interrupted uploads continue where they stopped
+        """
+        gvideo = gdata.youtube.YouTubeVideoEntry()
+        gvideo.media = gdata.media.Group(
+                            title = gdata.media.Title(text=uploadInfo.name),
+                            description = gdata.media.Description(text=uploadInfo.description),
+                            category = gdata.media.Category(text=uploadInfo.category),
+                            keywords = gdata.media.Keywords(text=','.join(uploadInfo.keywords)))
+
+        headers = dict(self.service.additional_headers)
+        headers["Authorization"] = self.service.auth_token
+        headers["GData-Version"] = "2"
+
+        def start_session():
+            sessionHeaders = dict(headers)
+            sessionHeaders["Content-Type"] = "application/atom+xml; charset=UTF-8"
+            sessionHeaders["Slug"] = os.path.basename(uploadInfo.url)
+            return Upload.start_resumable_session(self.RESUMABLE_UPLOAD_URL, str(gvideo), sessionHeaders)
 
-            gvideo = self.service.InsertVideoEntry(
-                                self.gvideo,
-                                uploadInfo.url)
+        try:
+            upload = Upload.ResumableUpload(
+                                uploadInfo.url,
+                                uploadInfo.mimeType,
+                                "youtube:%s:%s" % (self.username, uploadInfo.url),
+                                start_session,
+                                headers)
+            gvideo = gdata.youtube.YouTubeVideoEntryFromString(Upload.retry(upload.upload))
             return Rid(uid=self._extract_video_id(gvideo.id.text))
+        except (Exceptions.StopSync, Exceptions.SyncronizeError):
+            raise
         except Exception, e:
-            raise Exceptions.SyncronizeError("YouTube Upload Error.")
+            raise Exceptions.SyncronizeError("YouTube Upload Error: %s" % e)
 
     def _replace_video (self, LUID, uploadInfo):
         try:
@@ -1535,6 +1758,12 @@ class YouTubeTwoWay(_GoogleBase, DataProvider.TwoWay):
         #Upload the file
         return self._upload_video (uploadInfo)
 
+    def put_many(self, items):
+        """
+        Uploads many videos concurrently
+        """
+        return Upload.put_many(self.put, items)
+
     def finish(self, aborted, error, conflict):
         DataProvider.TwoWay.finish(self)
         self.entries = None
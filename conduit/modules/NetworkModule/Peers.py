@@ -19,7 +19,10 @@ import conduit
 
 AVAHI_SERVICE_NAME = "_conduit._tcp"
 AVAHI_SERVICE_DOMAIN = ""
-PROTOCOL_VERSION = "1"
+PROTOCOL_VERSION = "2"
+#Peers of these versions can sync with us. From version 2 data is sent in
+#the WireFormat, older peers send pickles
+COMPATIBLE_PROTOCOL_VERSIONS = ("1", "2")
 
 PORT_IDX = 0
 VERSION_IDX = 1
@@ -245,8 +248,8 @@ class AvahiMonitor:
         log.debug("Resolved conduit service %s on %s - %s:%s\nExtra Info: %s" % (name, host, address, port, extra_info))
 
         # Check if the service is local and then check the 
-        # conduit versions are identical
-        if extra.get("protocol-version", None) == PROTOCOL_VERSION:
+        # conduit versions are compatible
+        if extra.get("protocol-version", None) in COMPATIBLE_PROTOCOL_VERSIONS:
             self.detected_cb(str(name), str(host), str(address), str(port), extra_info)
         else:
             log.debug("Ignoring %s (version: %s, protocol version: %s)" % (
@@ -0,0 +1,346 @@
+"""
+Transfers the contents of files between peers as a stream of chunks,
+separately from the xml-rpc calls, which then only carry the pickled
+file metadata. Files are never read entirely into memory.
+
+Copyright: John Stowers, 2006
+License: GPLv2
+"""
+import os
+import time
+import uuid
+import socket
+import threading
+import tempfile
+import cPickle
+import cStringIO
+import SocketServer
+import logging
+log = logging.getLogger("modules.Network.Stream")
+
+import conduit.datatypes.File as File
+
+#Files are read and written through a buffer of this size
+CHUNK_SIZE = 256*1024
+#Larger files are refused
+MAX_FILE_SIZE = 4*1024*1024*1024
+#Offered files not requested, and received files not used, within this
+#many seconds are forgotten (and received files deleted)
+TOKEN_TIMEOUT = 10*60
+
+#Classes of the files that may be received. The class of a file not
+#listed is sent as the closest listed class it derives from
+FILE_CLASSES = (
+    "conduit.datatypes.File.File",
+    "conduit.datatypes.File.TempFile",
+    "conduit.datatypes.File.ProxyFile",
+    "conduit.datatypes.Photo.Photo",
+    "conduit.datatypes.Audio.Audio",
+    "conduit.datatypes.Video.Video",
+    "conduit.utils.MediaFile.MediaFile",
+)
+
+def get_file_class_name(klass):
+    """
+    @returns: The name of klass, or of the first class in FILE_CLASSES it
+    derives from
+    """
+    for k in klass.__mro__:
+        name = "%s.%s" % (k.__module__, k.__name__)
+        if name in FILE_CLASSES:
+            return name
+    raise TypeError("%s is not a File" % klass)
+
+def import_file_class(name):
+    """
+    Imports the class of a received file, if it is one of FILE_CLASSES
+
+    @raises ValueError: If name is not one of FILE_CLASSES
+    """
+    if name not in FILE_CLASSES:
+        raise ValueError("Refusing file of class %s" % name)
+    moduleName, name = name.rsplit(".", 1)
+    return getattr(__import__(moduleName, {}, {}, [name]), name)
+
+def _read_line(sock):
+    """
+    Reads a short line, one byte at a time so that nothing following it
+    is consumed
+    """
+    line = ""
+    while not line.endswith("\n") and len(line) < 128:
+        c = sock.recv(1)
+        if not c:
+            break
+        line += c
+    return line
+
+def send_file(sock, path):
+    """
+    Sends the size of the file at path, followed by its contents
+    """
+    size = os.path.getsize(path)
+    sock.sendall("%d\n" % size)
+
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    f = open(path, "rb")
+    try:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            sock.sendall(view[:n])
+    finally:
+        f.close()
+
+def receive_file(sock, maxSize=MAX_FILE_SIZE):
+    """
+    Receives a file sent by L{send_file} into a new temporary file
+
+    @returns: The path of the temporary file
+    @raises IOError: If the file is not available, is larger than maxSize,
+    or is not received completely
+    """
+    line = _read_line(sock)
+    try:
+        size = int(line)
+    except ValueError:
+        raise IOError("Bad stream header: %s" % line)
+    if size < 0:
+        raise IOError("File not available")
+    if size > maxSize:
+        raise IOError("File too large (%d bytes)" % size)
+
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    fd, path = tempfile.mkstemp(prefix="netsync")
+    f = os.fdopen(fd, "wb")
+    try:
+        remaining = size
+        while remaining > 0:
+            n = sock.recv_into(buf, min(CHUNK_SIZE, remaining))
+            if n == 0:
+                raise IOError("Connection closed with %d bytes remaining" % remaining)
+            f.write(view[:n])
+            remaining -= n
+    except:
+        f.close()
+        os.remove(path)
+        raise
+    f.close()
+    return path
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def dumps(obj, offer):
+    """
+    Pickles obj. The contents of any files are not included, instead
+    offer(path) is called, which must return a token with which the
+    receiver can request the file
+    """
+    def persistent_id(o):
+        if isinstance(o, File.File):
+            path = o.get_local_uri()
+            if path != None:
+                return (get_file_class_name(o.__class__), o._get_file_state(), offer(path))
+        return None
+
+    s = cStringIO.StringIO()
+    pickler = cPickle.Pickler(s, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    return s.getvalue()
+
+def loads(string, fetch):
+    """
+    Unpickles a string pickled by L{dumps}. fetch(token) is called for
+    each file, and must return the local path its contents were
+    transferred to
+    """
+    def persistent_load(pid):
+        klass, state, token = pid
+        try:
+            klass = import_file_class(klass)
+        except ValueError, e:
+            raise cPickle.UnpicklingError(str(e))
+        f = klass.__new__(klass)
+        f._set_file_state(fetch(token), state)
+        return f
+
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(string))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+class _StreamHandler(SocketServer.BaseRequestHandler):
+    """
+    Handles a single request, either
+        GET token, which sends the offered file, or
+        PUT token, which receives a file
+    """
+    def handle(self):
+        line = _read_line(self.request)
+        try:
+            command, token = line.split()
+        except ValueError:
+            log.warn("Bad stream request: %s" % line)
+            return
+
+        if command == "GET":
+            path = self.server.pop_offer(token)
+            if path == None:
+                log.warn("Stream %s not offered" % token)
+                self.request.sendall("-1\n")
+            else:
+                send_file(self.request, path)
+        elif command == "PUT":
+            try:
+                path = receive_file(self.request, self.server.maxFileSize)
+            except IOError, e:
+                log.warn("Stream %s not received: %s" % (token, e))
+                self.request.sendall("ERROR\n")
+                return
+            self.server.add_received(token, path)
+            self.request.sendall("OK\n")
+        else:
+            log.warn("Bad stream request: %s" % line)
+
+class StreamServer(SocketServer.ThreadingTCPServer):
+    """
+    Serves the files offered to, and receives the files sent by, the
+    peer on the other end of a L{XMLRPCUtils.DataproviderServer}
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+    def __init__(self, host='', port=0, timeout=TOKEN_TIMEOUT, maxFileSize=MAX_FILE_SIZE):
+        SocketServer.ThreadingTCPServer.__init__(self, (host,port), _StreamHandler)
+        self.port = self.socket.getsockname()[1]
+        self.timeout = timeout
+        self.maxFileSize = maxFileSize
+        self._lock = threading.Lock()
+        #token : (path, time)
+        self._offered = {}
+        self._received = {}
+        self._thread = None
+
+    def _expire(self):
+        #Forgets tokens older than the timeout, and deletes the files
+        #received with them. Called with the lock held
+        oldest = time.time() - self.timeout
+        for token, (path, t) in self._offered.items():
+            if t < oldest:
+                log.debug("Offer %s expired" % token)
+                del self._offered[token]
+        for token, (path, t) in self._received.items():
+            if t < oldest:
+                log.debug("Received file %s expired" % token)
+                del self._received[token]
+                _remove(path)
+
+    def offer(self, path):
+        """
+        Makes the file at path available to the next GET of the
+        returned token, for up to timeout seconds
+        """
+        token = uuid.uuid4().hex
+        self._lock.acquire()
+        try:
+            self._expire()
+            self._offered[token] = (path, time.time())
+        finally:
+            self._lock.release()
+        return token
+
+    def pop_offer(self, token):
+        self._lock.acquire()
+        try:
+            self._expire()
+            path, t = self._offered.pop(token, (None, None))
+            return path
+        finally:
+            self._lock.release()
+
+    def add_received(self, token, path):
+        self._lock.acquire()
+        try:
+            self._expire()
+            self._received[token] = (path, time.time())
+        finally:
+            self._lock.release()
+
+    def pop_received(self, token):
+        """
+        @returns: The path of the file received with token. The file is
+        then owned by the caller
+        """
+        self._lock.acquire()
+        try:
+            self._expire()
+            path, t = self._received.pop(token, (None, None))
+        finally:
+            self._lock.release()
+        if path == None:
+            raise IOError("File %s not received" % token)
+        return path
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread != None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
+        self._lock.acquire()
+        try:
+            self._offered.clear()
+            for path, t in self._received.values():
+                _remove(path)
+            self._received.clear()
+        finally:
+            self._lock.release()
+
+class StreamClient:
+    """
+    Requests and sends files from and to a L{StreamServer}
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def _connect(self, command, token):
+        sock = socket.create_connection((self.host, self.port))
+        sock.sendall("%s %s\n" % (command, token))
+        return sock
+
+    def fetch(self, token):
+        """
+        @returns: The path of a temporary file containing the file offered
+        by the server with token
+        """
+        sock = self._connect("GET", token)
+        try:
+            return receive_file(sock)
+        finally:
+            sock.close()
+
+    def send(self, path):
+        """
+        Sends the file at path to the server
+        @returns: The token which identifies the file to the server
+        """
+        token = uuid.uuid4().hex
+        sock = self._connect("PUT", token)
+        try:
+            send_file(sock, path)
+            reply = _read_line(sock)
+        finally:
+            sock.close()
+        if reply.strip() != "OK":
+            raise IOError("File not sent")
+        return token
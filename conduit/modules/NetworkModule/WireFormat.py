@@ -0,0 +1,360 @@
+"""
+A compact binary serialization of the core datatypes, used instead of
+pickling when both peers support it. Unlike unpickling, decoding data
+from a peer can only create the datatypes described in SCHEMAS.
+
+Each message starts with MAGIC and the WIRE_VERSION. Values are a one
+byte tag followed by their encoding. Datatypes are encoded as their
+schema id followed by the values of the fields of their state (from
+__getstate__) in schema order, so field names are never sent. Files
+are encoded as their class, the fields of their state, and either a
+stream token (S) or their contents (C).
+
+Messages can be streamed by prefixing them with their length, see
+L{write_message} and L{read_message}.
+
+Copyright: John Stowers, 2006
+License: GPLv2
+"""
+import struct
+import datetime
+import logging
+log = logging.getLogger("modules.Network.Wire")
+
+import conduit.datatypes.File as File
+
+import Streaming
+
+MAGIC = "CDW"
+WIRE_VERSION = 1
+
+_DATATYPE = ("uid", "mtime", "open_uri", "tags")
+
+#schema id, class, fields of the state of the class
+SCHEMAS = (
+    (1,     "conduit.datatypes.Rid",                _DATATYPE[0:2] + ("hash",)),
+    (2,     "conduit.datatypes.Note.Note",          _DATATYPE + ("title", "contents")),
+    (3,     "conduit.datatypes.Contact.Contact",    _DATATYPE + ("vcard",)),
+    (4,     "conduit.datatypes.Event.Event",        _DATATYPE + ("ical",)),
+    (5,     "conduit.datatypes.Setting.Setting",    _DATATYPE + ("key", "value")),
+    (6,     "conduit.datatypes.Bookmark.Bookmark",  _DATATYPE + ("title", "uri")),
+    (7,     "conduit.datatypes.Text.Text",          _DATATYPE + ("text",)),
+    (8,     "conduit.datatypes.Email.Email",        _DATATYPE + ("email",)),
+)
+
+#Files may be any subclass of File, their class is sent
+FILE_FIELDS = _DATATYPE + ("basePath", "group", "filename", "filemtime")
+
+_HEADER = MAGIC + chr(WIRE_VERSION)
+_LENGTH = struct.Struct(">I")
+_INT = struct.Struct(">q")
+_FLOAT = struct.Struct(">d")
+_SCHEMA = struct.Struct(">H")
+_DATETIME = struct.Struct(">HBBBBBI")
+
+#"module.Class" : (id, fields), and id : (class, fields)
+_SCHEMAS_BY_CLASS = dict([(klass, (i, fields)) for i, klass, fields in SCHEMAS])
+_SCHEMAS_BY_ID = dict([(i, [klass, fields]) for i, klass, fields in SCHEMAS])
+
+class WireFormatError(Exception):
+    """
+    Raised when a value can not be encoded, or a message decoded
+    """
+    pass
+
+def _get_class_name(klass):
+    return "%s.%s" % (klass.__module__, klass.__name__)
+
+def _import_class(name):
+    try:
+        moduleName, name = name.rsplit(".", 1)
+        return getattr(__import__(moduleName, {}, {}, [name]), name)
+    except (ValueError, ImportError, AttributeError):
+        raise WireFormatError("Unknown class: %s" % name)
+
+class _Encoder:
+    def __init__(self, offer):
+        self.offer = offer
+        self.out = []
+        self.schemas = {}
+
+    def encode(self, value):
+        try:
+            encoder = _ENCODERS[type(value)]
+        except KeyError:
+            encoder = _Encoder.encode_object
+        encoder(self, value)
+
+    def encode_none(self, value):
+        self.out.append("N")
+
+    def encode_bool(self, value):
+        if value:
+            self.out.append("T")
+        else:
+            self.out.append("F")
+
+    def encode_int(self, value):
+        try:
+            self.out.append("i" + _INT.pack(value))
+        except struct.error:
+            raise WireFormatError("Integer out of range: %s" % value)
+
+    def encode_float(self, value):
+        self.out.append("f" + _FLOAT.pack(value))
+
+    def encode_str(self, value):
+        self.out.append("s" + _LENGTH.pack(len(value)))
+        self.out.append(value)
+
+    def encode_unicode(self, value):
+        value = value.encode("utf-8")
+        self.out.append("u" + _LENGTH.pack(len(value)))
+        self.out.append(value)
+
+    def encode_list(self, value):
+        self.out.append("l" + _LENGTH.pack(len(value)))
+        for v in value:
+            self.encode(v)
+
+    def encode_tuple(self, value):
+        self.out.append("t" + _LENGTH.pack(len(value)))
+        for v in value:
+            self.encode(v)
+
+    def encode_dict(self, value):
+        self.out.append("d" + _LENGTH.pack(len(value)))
+        for k, v in value.iteritems():
+            self.encode(k)
+            self.encode(v)
+
+    def encode_datetime(self, value):
+        if value.tzinfo != None:
+            raise WireFormatError("Datetimes with a timezone are not supported")
+        self.out.append("D" + _DATETIME.pack(
+                            value.year, value.month, value.day,
+                            value.hour, value.minute, value.second,
+                            value.microsecond))
+
+    def _encode_fields(self, state, fields):
+        for f in fields:
+            self.encode(state[f])
+
+    def encode_object(self, value):
+        klass = value.__class__
+        try:
+            schema = self.schemas[klass]
+        except KeyError:
+            schema = _SCHEMAS_BY_CLASS.get(_get_class_name(klass))
+            self.schemas[klass] = schema
+
+        if schema != None:
+            i, fields = schema
+            self.out.append("O" + _SCHEMA.pack(i))
+            self._encode_fields(value.__getstate__(), fields)
+        elif isinstance(value, File.File):
+            path = value.get_local_uri()
+            if path == None:
+                raise WireFormatError("Could not get %s" % value)
+            self.out.append("X")
+            self.encode_str(Streaming.get_file_class_name(klass))
+            self._encode_fields(value._get_file_state(), FILE_FIELDS)
+            if self.offer != None:
+                self.out.append("S")
+                self.encode_str(self.offer(path))
+            else:
+                self.out.append("C")
+                f = open(path, "rb")
+                try:
+                    self.encode_str(f.read())
+                finally:
+                    f.close()
+        else:
+            raise WireFormatError("%s is not supported" % klass)
+
+_ENCODERS = {
+    type(None)          :   _Encoder.encode_none,
+    bool                :   _Encoder.encode_bool,
+    int                 :   _Encoder.encode_int,
+    long                :   _Encoder.encode_int,
+    float               :   _Encoder.encode_float,
+    str                 :   _Encoder.encode_str,
+    unicode             :   _Encoder.encode_unicode,
+    list                :   _Encoder.encode_list,
+    tuple               :   _Encoder.encode_tuple,
+    dict                :   _Encoder.encode_dict,
+    datetime.datetime   :   _Encoder.encode_datetime,
+}
+
+class _Decoder:
+    def __init__(self, data, fetch):
+        self.data = data
+        self.pos = len(_HEADER)
+        self.fetch = fetch
+
+    def _read(self, n):
+        start = self.pos
+        self.pos += n
+        if self.pos > len(self.data):
+            raise WireFormatError("Message truncated")
+        return self.data[start:self.pos]
+
+    def _read_length(self):
+        return _LENGTH.unpack(self._read(4))[0]
+
+    def decode(self):
+        tag = self._read(1)
+        try:
+            decoder = _DECODERS[tag]
+        except KeyError:
+            raise WireFormatError("Unknown tag: %r" % tag)
+        return decoder(self)
+
+    def decode_none(self):
+        return None
+
+    def decode_true(self):
+        return True
+
+    def decode_false(self):
+        return False
+
+    def decode_int(self):
+        return _INT.unpack(self._read(8))[0]
+
+    def decode_float(self):
+        return _FLOAT.unpack(self._read(8))[0]
+
+    def decode_str(self):
+        return self._read(self._read_length())
+
+    def decode_unicode(self):
+        return self._read(self._read_length()).decode("utf-8")
+
+    def decode_list(self):
+        return [self.decode() for i in xrange(self._read_length())]
+
+    def decode_tuple(self):
+        return tuple([self.decode() for i in xrange(self._read_length())])
+
+    def decode_dict(self):
+        d = {}
+        for i in xrange(self._read_length()):
+            k = self.decode()
+            d[k] = self.decode()
+        return d
+
+    def decode_datetime(self):
+        return datetime.datetime(*_DATETIME.unpack(self._read(_DATETIME.size)))
+
+    def _decode_fields(self, fields):
+        state = {}
+        for f in fields:
+            state[f] = self.decode()
+        return state
+
+    def decode_object(self):
+        i = _SCHEMA.unpack(self._read(2))[0]
+        try:
+            schema = _SCHEMAS_BY_ID[i]
+        except KeyError:
+            raise WireFormatError("Unknown schema: %s" % i)
+        klass, fields = schema
+        if type(klass) == str:
+            klass = _import_class(klass)
+            schema[0] = klass
+        obj = klass.__new__(klass)
+        obj.__setstate__(self._decode_fields(fields))
+        return obj
+
+    def decode_file(self):
+        try:
+            klass = Streaming.import_file_class(self.decode())
+        except (ValueError, ImportError, AttributeError), e:
+            raise WireFormatError(str(e))
+        state = self._decode_fields(FILE_FIELDS)
+        contents = self._read(1)
+        if contents == "S":
+            if self.fetch == None:
+                raise WireFormatError("Can not fetch streamed files")
+            path = self.fetch(self.decode())
+        elif contents == "C":
+            path = File.TempFile(self.decode()).get_local_uri()
+        else:
+            raise WireFormatError("Unknown file contents: %r" % contents)
+        obj = klass.__new__(klass)
+        obj._set_file_state(path, state)
+        return obj
+
+_DECODERS = {
+    "N" :   _Decoder.decode_none,
+    "T" :   _Decoder.decode_true,
+    "F" :   _Decoder.decode_false,
+    "i" :   _Decoder.decode_int,
+    "f" :   _Decoder.decode_float,
+    "s" :   _Decoder.decode_str,
+    "u" :   _Decoder.decode_unicode,
+    "l" :   _Decoder.decode_list,
+    "t" :   _Decoder.decode_tuple,
+    "d" :   _Decoder.decode_dict,
+    "D" :   _Decoder.decode_datetime,
+    "O" :   _Decoder.decode_object,
+    "X" :   _Decoder.decode_file,
+}
+
+def is_wire_format(data):
+    return data.startswith(MAGIC)
+
+def dumps(obj, offer=None):
+    """
+    Encodes obj. If offer is supplied the contents of files are not
+    included, see L{Streaming.dumps}
+
+    @raises WireFormatError: If obj contains values that can not be encoded
+    """
+    encoder = _Encoder(offer)
+    encoder.encode(obj)
+    return _HEADER + "".join(encoder.out)
+
+def loads(data, fetch=None):
+    """
+    Decodes a message encoded with L{dumps}. fetch(token) must return
+    the path of streamed files
+
+    @raises WireFormatError: If the message is not valid
+    """
+    if data[0:len(MAGIC)] != MAGIC:
+        raise WireFormatError("Not a message")
+    if data[len(MAGIC):len(_HEADER)] != chr(WIRE_VERSION):
+        raise WireFormatError("Unsupported version")
+    decoder = _Decoder(data, fetch)
+    obj = decoder.decode()
+    if decoder.pos != len(data):
+        raise WireFormatError("Trailing data")
+    return obj
+
+def write_message(f, obj, offer=None):
+    """
+    Writes obj to the file like object f, prefixed with its length
+    """
+    data = dumps(obj, offer)
+    f.write(_LENGTH.pack(len(data)))
+    f.write(data)
+
+def read_message(f, fetch=None):
+    """
+    Reads a message written with L{write_message} from f
+
+    @returns: The decoded object, or raises EOFError if there are no more
+    messages
+    """
+    length = f.read(_LENGTH.size)
+    if length == "":
+        raise EOFError
+    if len(length) != _LENGTH.size:
+        raise WireFormatError("Message truncated")
+    length = _LENGTH.unpack(length)[0]
+    data = f.read(length)
+    if len(data) != length:
+        raise WireFormatError("Message truncated")
+    return loads(data, fetch)
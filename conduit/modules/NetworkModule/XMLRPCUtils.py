@@ -4,12 +4,12 @@ Utilty functions shared between the xml-rpc client and server
 Copyright: John Stowers, 2006
 License: GPLv2
 """
-import socket
-import select
+import urlparse
 import traceback
 import threading
 import cPickle
 import xmlrpclib
+import SocketServer
 import SimpleXMLRPCServer
 import logging
 
@@ -18,6 +18,11 @@ clog = logging.getLogger("modules.Network.C")
 #One log for the server
 slog = logging.getLogger("modules.Network.S")
 
+import Peers
+import Streaming
+import WireFormat
+
+import conduit
 import conduit.Exceptions as Exceptions
 import conduit.dataproviders.DataProvider as DataProvider
 import conduit.utils as Utils
@@ -28,81 +33,138 @@ XML_RPC_EASY_EXCEPTIONS = (
     "SyncronizeFatalError",
     "StopSync"
     )
+
+#Idle keep-alive connections are closed by the server after this many seconds
+KEEPALIVE_TIMEOUT = 60
+
+#Peers of this Peers.PROTOCOL_VERSION and later exchange data in the
+#WireFormat instead of pickling it
+WIRE_FORMAT_PROTOCOL_VERSION = 2
     
-def marshal_fault_to_exception(fault, **kwargs):
+def fault_to_exception(fault, **kwargs):
     if fault.faultCode in XML_RPC_EASY_EXCEPTIONS:
         klass = getattr(Exceptions,fault.faultCode)
         #exception.message = fault.faultString
-        raise klass(fault.faultString)
+        return klass(fault.faultString)
     elif fault.faultCode == "SynchronizeConflictError":
         fromData = kwargs['server'].get(kwargs['fromDataLUID'])
         toData = kwargs['toData']
-        raise Exceptions.SynchronizeConflictError(fault.faultString, fromData, toData)
+        return Exceptions.SynchronizeConflictError(fault.faultString, fromData, toData)
+    elif fault.faultCode == "NotImplementedError":
+        return NotImplementedError(fault.faultString)
     else:
-        raise Exception("Remote Exception:\n%s" % fault.faultString)
+        return Exception("Remote Exception:\n%s" % fault.faultString)
 
-def marshal_exception_to_fault(exception):
+def marshal_fault_to_exception(fault, **kwargs):
+    raise fault_to_exception(fault, **kwargs)
+
+def exception_to_fault(exception, handling=True):
+    """
+    Must be called while handling exception, unless handling is False,
+    such as for the errors returned by put_many, in which case the fault
+    only describes the exception instead of its traceback
+    """
     klassName = exception.__class__.__name__
     if klassName in XML_RPC_EASY_EXCEPTIONS:
         #exception.message = fault.faultString
-        raise xmlrpclib.Fault(klassName, exception.message)
+        return xmlrpclib.Fault(klassName, exception.message)
     elif klassName == "SynchronizeConflictError":
         #only put the comparison in the fault, getting the other data 
         #requires subsequent xmlrpc calls
-        raise xmlrpclib.Fault("SynchronizeConflictError", exception.comparison)    
+        return xmlrpclib.Fault("SynchronizeConflictError", exception.comparison)    
+    elif klassName == "NotImplementedError":
+        return xmlrpclib.Fault("NotImplementedError", str(exception))
+    elif handling:
+        return xmlrpclib.Fault("Exception",traceback.format_exc())
     else:
-        raise xmlrpclib.Fault("Exception",traceback.format_exc())
+        return xmlrpclib.Fault("Exception", "%s: %s" % (klassName, exception))
+
+def marshal_exception_to_fault(exception):
+    raise exception_to_fault(exception)
 
-def pickle_obj_to_binary(obj):
+def pickle_obj_to_binary(obj, offer=None):
+    """
+    @param offer: If supplied, the contents of files are not pickled,
+    they are sent separately, see L{Streaming.dumps}
+    """
+    if offer != None:
+        return xmlrpclib.Binary(Streaming.dumps(obj, offer))
     bin = xmlrpclib.Binary(cPickle.dumps(obj))
     return bin
 
-def unpickle_obj_from_binary(bin):
+def unpickle_obj_from_binary(bin, fetch=None):
+    if fetch != None:
+        return Streaming.loads(bin.data, fetch)
     obj = cPickle.loads(bin.data)
     return obj
 
-class StoppableXMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCServer):
+def encode_obj_to_binary(obj, offer=None, wire=False):
+    """
+    Encodes obj in the WireFormat if wire is True, and obj can be encoded,
+    otherwise it is pickled
+    """
+    if wire:
+        try:
+            return xmlrpclib.Binary(WireFormat.dumps(obj, offer))
+        except WireFormat.WireFormatError, e:
+            clog.debug("Pickling instead: %s" % e)
+    return pickle_obj_to_binary(obj, offer)
+
+def pickle_allowed():
+    """
+    @returns: True if the user allows data from old peers, which is 
+    pickled, to be unpickled
+    """
+    return bool(conduit.GLOBALS.settings.get("network_allow_pickle"))
+
+def decode_obj_from_binary(bin, fetch=None, allowPickle=False):
+    """
+    Decodes obj from the WireFormat, or unpickles it if allowPickle is
+    True. Unpickling data from a peer lets it run any code, so only 
+    peers that use the old protocol, and that the user allowed to, may
+    send pickles
+    """
+    if WireFormat.is_wire_format(bin.data):
+        return WireFormat.loads(bin.data, fetch)
+    if not allowPickle:
+        raise Exceptions.SyncronizeError("Refusing pickled data from peer, the peer must use the wire format")
+    return unpickle_obj_from_binary(bin, fetch)
+
+class KeepAliveRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
+    """
+    Keeps the connection open between requests, so that clients do not
+    connect again for each call
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+
+class StoppableXMLRPCServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServer):
     """
-    A variant of SimpleXMLRPCServer that can be stopped. From
-    http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/520583
+    A variant of SimpleXMLRPCServer that can be stopped. Each connection
+    is handled in its own thread, and kept alive between requests
     """
     allow_reuse_address = True
+    daemon_threads = True
     def __init__( self, host, port):
         SimpleXMLRPCServer.SimpleXMLRPCServer.__init__(self,
                                 addr=(host,port),
+                                requestHandler=KeepAliveRequestHandler,
                                 logRequests=False,
                                 allow_none=True
                                 )
         self.closed = False
-    
-    def serve(self):
-        self.socket.setblocking(0)
-        while not self.closed:
-            self.handle_request()        
-            
-    def get_request(self):
-        inputObjects = []
-        while not inputObjects and not self.closed:
-            try:
-                inputObjects, outputObjects, errorObjects = select.select([self.socket], [], [], 0.2)
-                sock, addr = self.socket.accept()
-                return (sock, addr)
-            except socket.timeout:
-                if self.closed:
-                    raise
-            except socket.error:
-                #Occurs at shutdown, raise to stop serving
-                if self.closed:
-                    raise
-            except select.error:
-                #Occurs sometimes at start up, race condition, ignore
-                pass
+        self._thread = None
                 
     def start(self):
-        threading.Thread(target=self.serve).start()
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.start()
         
     def stop(self):
         self.closed = True
+        if self._thread != None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
 
 class DataProviderClient(DataProvider.TwoWay):
     """
@@ -112,10 +174,48 @@ class DataProviderClient(DataProvider.TwoWay):
     def __init__(self, *args):
         DataProvider.TwoWay.__init__(self)
         clog.info("Connecting to remote DP on %s" % self.url)
-        #Add use_datetime arg for >= python 2.5
-        self.server = xmlrpclib.Server(
+        #Each thread keeps its own connection to the server open
+        self._local = threading.local()
+
+        #Servers that stream the contents of files advertise the port to
+        #stream them on, otherwise they are pickled in the xml-rpc call
+        self.streams = None
+        streamPort = getattr(self, "_stream_port_", None)
+        if streamPort != None:
+            host = urlparse.urlparse(self.url)[1].split(":")[0]
+            self.streams = Streaming.StreamClient(host, streamPort)
+
+        #Servers that accept many items in a single call say so
+        self.batchCalls = getattr(self, "_batch_calls_", False)
+
+        #Newer servers exchange data in the WireFormat
+        protocolVersion = getattr(self, "_protocol_version_", "1")
+        self.wireFormat = int(protocolVersion) >= WIRE_FORMAT_PROTOCOL_VERSION
+
+    def _get_server(self):
+        #ServerProxy would make a remote call for server == None
+        server = getattr(self._local, "server", None)
+        if server is None:
+            #Add use_datetime arg for >= python 2.5
+            server = xmlrpclib.Server(
                                     self.url,
                                     allow_none=True)
+            self._local.server = server
+        return server
+
+    server = property(_get_server)
+
+    def _encode(self, obj):
+        if self.streams != None:
+            return encode_obj_to_binary(obj, offer=self.streams.send, wire=self.wireFormat)
+        return encode_obj_to_binary(obj, wire=self.wireFormat)
+
+    def _decode(self, binaryData):
+        #servers that use the wire format never need to send pickles
+        allowPickle = not self.wireFormat and pickle_allowed()
+        if self.streams != None:
+            return decode_obj_from_binary(binaryData, fetch=self.streams.fetch, allowPickle=allowPickle)
+        return decode_obj_from_binary(binaryData, allowPickle=allowPickle)
 
     @Utils.log_function_call(clog)
     def refresh(self):
@@ -137,18 +237,23 @@ class DataProviderClient(DataProvider.TwoWay):
     def get(self, LUID):
         DataProvider.TwoWay.get(self, LUID)
         try:
-            binaryData = self.server.get(LUID)
-            return unpickle_obj_from_binary(binaryData)
+            if self.wireFormat:
+                binaryData = self.server.get(LUID, self.streams != None, True)
+            elif self.streams != None:
+                binaryData = self.server.get(LUID, True)
+            else:
+                binaryData = self.server.get(LUID)
+            return self._decode(binaryData)
         except xmlrpclib.Fault, f:
             marshal_fault_to_exception(f)
 
     @Utils.log_function_call(clog)
     def put(self, data, overwrite=False, LUID=None):
         DataProvider.TwoWay.put(self, data, overwrite, LUID)
-        binaryData = pickle_obj_to_binary(data)
+        binaryData = self._encode(data)
         try:
             binaryRid = self.server.put(binaryData, overwrite, LUID)
-            return unpickle_obj_from_binary(binaryRid)
+            return self._decode(binaryRid)
         except xmlrpclib.Fault, f:
             #Supply additional info because the conflict exception
             #includes details of the conflict
@@ -177,16 +282,67 @@ class DataProviderClient(DataProvider.TwoWay):
             marshal_fault_to_exception(f)
 
     @Utils.log_function_call(clog)
-    def get_UID(self):
-        return self.uid
-        
+    def put_many(self, items):
+        if not self.batchCalls:
+            raise NotImplementedError
+        self.set_status(DataProvider.STATUS_SYNC)
+        try:
+            results = self._decode(self.server.put_many(self._encode(items)))
+        except xmlrpclib.Fault, f:
+            marshal_fault_to_exception(f)
+
+        rids = []
+        for (data, overwrite, LUID), (code, result) in zip(items, results):
+            if code == None:
+                rids.append(result)
+            else:
+                rids.append(fault_to_exception(
+                                xmlrpclib.Fault(code, result),
+                                server=self,
+                                fromDataLUID=LUID,
+                                toData=data
+                                ))
+        return rids
+
+    @Utils.log_function_call(clog)
+    def delete_many(self, LUIDs):
+        if not self.batchCalls:
+            raise NotImplementedError
+        self.set_status(DataProvider.STATUS_SYNC)
+        try:
+            results = self.server.delete_many(LUIDs)
+        except xmlrpclib.Fault, f:
+            marshal_fault_to_exception(f)
+
+        errors = []
+        for code, result in results:
+            if code == None:
+                errors.append(None)
+            else:
+                errors.append(fault_to_exception(xmlrpclib.Fault(code, result)))
+        return errors
+
+    @Utils.log_function_call(clog)
+    def get_all_with_rids(self):
+        if not self.batchCalls:
+            raise NotImplementedError
+        try:
+            return self._decode(self.server.get_all_with_rids(self.wireFormat))
+        except xmlrpclib.Fault, f:
+            marshal_fault_to_exception(f)
+
     @Utils.log_function_call(clog)
-    def set_status(self, newStatus):
-        self.server.set_status(newStatus)
+    def get_rid_bulk(self, LUIDs):
+        if not self.batchCalls:
+            raise NotImplementedError
+        try:
+            return self._decode(self.server.get_rid_bulk(LUIDs, self.wireFormat))
+        except xmlrpclib.Fault, f:
+            marshal_fault_to_exception(f)
 
     @Utils.log_function_call(clog)
-    def get_status(self):
-        return self.server.get_status()
+    def get_UID(self):
+        return self.uid
         
     def get_name(self):
         return "Remote %s" % self._name_
@@ -201,6 +357,12 @@ class DataproviderServer(StoppableXMLRPCServer):
         slog.info("Starting server for %s on port %s" % (wrapper,port))
         self.port = port
         self.dpw = wrapper
+
+        #The contents of files are streamed on another port
+        self.streams = Streaming.StreamServer()
+        #Connections are handled in parallel, but the dataprovider is
+        #only called by one at a time
+        self._lock = threading.Lock()
         
         #Additional functions not part of the normal dp api
         self.register_function(self.get_info)
@@ -214,6 +376,10 @@ class DataproviderServer(StoppableXMLRPCServer):
         self.register_function(self.put)
         self.register_function(self.delete)
         self.register_function(self.finish)
+        self.register_function(self.put_many)
+        self.register_function(self.delete_many)
+        self.register_function(self.get_all_with_rids)
+        self.register_function(self.get_rid_bulk)
         
         #These functions will never throw exceptions so register them in
         #the module directly
@@ -233,9 +399,27 @@ class DataproviderServer(StoppableXMLRPCServer):
                 "module_type":      self.dpw.module_type,
                 "in_type":          self.dpw.in_type,
                 "out_type":         self.dpw.out_type,
-                "dp_server_port":   self.port                 
+                "dp_server_port":   self.port,
+                "stream_port":      self.streams.port,
+                "batch_calls":      True,
+                "protocol_version": Peers.PROTOCOL_VERSION
                 }
 
+    def start(self):
+        self.streams.start()
+        StoppableXMLRPCServer.start(self)
+
+    def stop(self):
+        StoppableXMLRPCServer.stop(self)
+        self.streams.stop()
+
+    def _dispatch(self, method, params):
+        self._lock.acquire()
+        try:
+            return StoppableXMLRPCServer._dispatch(self, method, params)
+        finally:
+            self._lock.release()
+
     @Utils.log_function_call(slog)
     def refresh(self):
         try:
@@ -251,18 +435,25 @@ class DataproviderServer(StoppableXMLRPCServer):
             return marshal_exception_to_fault(e)
 
     @Utils.log_function_call(slog)
-    def get(self, LUID):
+    def get(self, LUID, stream=False, wire=False):
         try:
-            return pickle_obj_to_binary(self.dpw.module.get(LUID))
+            if stream:
+                return encode_obj_to_binary(self.dpw.module.get(LUID), offer=self.streams.offer, wire=wire)
+            return encode_obj_to_binary(self.dpw.module.get(LUID), wire=wire)
         except Exception, e:
             return marshal_exception_to_fault(e)
 
     @Utils.log_function_call(slog)
     def put(self, binaryData, overwrite, LUID):
-        data = unpickle_obj_from_binary(binaryData)
+        #reply in the format of the request
+        wire = WireFormat.is_wire_format(binaryData.data)
+        try:
+            data = decode_obj_from_binary(binaryData, fetch=self.streams.pop_received, allowPickle=pickle_allowed())
+        except Exception, e:
+            return marshal_exception_to_fault(e)
         try:
             rid = self.dpw.module.put(data, overwrite, LUID)
-            return pickle_obj_to_binary(rid)
+            return encode_obj_to_binary(rid, wire=wire)
         except Exception, e:
             return marshal_exception_to_fault(e)
 
@@ -280,3 +471,84 @@ class DataproviderServer(StoppableXMLRPCServer):
         except Exception, e:
             return marshal_exception_to_fault(e)
 
+    @Utils.log_function_call(slog)
+    def put_many(self, binaryItems):
+        """
+        Puts many items, and returns for each a (None, Rid), or the 
+        (faultCode, faultString) of the error putting it
+        """
+        wire = WireFormat.is_wire_format(binaryItems.data)
+        try:
+            items = decode_obj_from_binary(binaryItems, fetch=self.streams.pop_received, allowPickle=pickle_allowed())
+        except Exception, e:
+            return marshal_exception_to_fault(e)
+
+        results = []
+        try:
+            for rid in self.dpw.module.put_many(items):
+                if isinstance(rid, Exception):
+                    fault = exception_to_fault(rid, handling=False)
+                    results.append( (fault.faultCode, fault.faultString) )
+                else:
+                    results.append( (None, rid) )
+        except NotImplementedError:
+            #put them here, which is still only one call for the client
+            for data, overwrite, LUID in items:
+                try:
+                    results.append( (None, self.dpw.module.put(data, overwrite, LUID)) )
+                except Exception, e:
+                    fault = exception_to_fault(e)
+                    results.append( (fault.faultCode, fault.faultString) )
+                    if isinstance(e, Exceptions.SyncronizeFatalError):
+                        break
+        except Exception, e:
+            return marshal_exception_to_fault(e)
+        return encode_obj_to_binary(results, wire=wire)
+
+    @Utils.log_function_call(slog)
+    def delete_many(self, LUIDs):
+        """
+        Deletes many items, and returns for each a (None, None), or the
+        (faultCode, faultString) of the error deleting it
+        """
+        results = []
+        try:
+            for err in self.dpw.module.delete_many(LUIDs):
+                if err == None:
+                    results.append( (None, None) )
+                else:
+                    fault = exception_to_fault(err, handling=False)
+                    results.append( (fault.faultCode, fault.faultString) )
+        except NotImplementedError:
+            for LUID in LUIDs:
+                try:
+                    self.dpw.module.delete(LUID)
+                    results.append( (None, None) )
+                except Exception, e:
+                    fault = exception_to_fault(e)
+                    results.append( (fault.faultCode, fault.faultString) )
+        except Exception, e:
+            return marshal_exception_to_fault(e)
+        return results
+
+    @Utils.log_function_call(slog)
+    def get_all_with_rids(self, wire=False):
+        try:
+            return encode_obj_to_binary(list(self.dpw.module.get_all_with_rids()), wire=wire)
+        except Exception, e:
+            return marshal_exception_to_fault(e)
+
+    @Utils.log_function_call(slog)
+    def get_rid_bulk(self, LUIDs, wire=False):
+        """
+        Returns the Rids of many items. If the dataprovider can not find
+        them in bulk, the items are got here so that only the Rids are sent
+        """
+        try:
+            try:
+                rids = self.dpw.module.get_rid_bulk(LUIDs)
+            except NotImplementedError:
+                rids = dict([(i, self.dpw.module.get(i).get_rid()) for i in LUIDs])
+            return encode_obj_to_binary(rids, wire=wire)
+        except Exception, e:
+            return marshal_exception_to_fault(e)
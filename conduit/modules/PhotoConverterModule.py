@@ -14,6 +14,9 @@ MODULES = {
 NO_RESIZE = "None"
 
 class PixbufPhotoConverter(TypeConverter.Converter):
+
+    cached_conversions = ("file/photo,file/photo", "file,file/photo")
+
     def __init__(self):
         self.conversions =  {
                             "file/photo,file/photo"     :   self.transcode,    
@@ -215,6 +215,7 @@ class _TestConversionBase(DataProvider.DataSink):
     _configurable_ = True
     def __init__(self, *args):
         DataProvider.DataSink.__init__(self)
+        self.UID = Utils.random_string()
         self.encodings =  {}
         self.encoding = "unchanged"
 
@@ -251,7 +252,7 @@ class _TestConversionBase(DataProvider.DataSink):
         return {'encoding':self.encoding}
 
     def get_UID(self):
-        return Utils.random_string()
+        return self.UID
 
 class TestSource(_TestBase, DataProvider.DataSource):
 
@@ -262,6 +263,7 @@ class TestSource(_TestBase, DataProvider.DataSource):
     _in_type_ = "test_type"
     _out_type_ = "test_type"
     _icon_ = "go-next"
+    _concurrency_ = 4
     
     DEFAULT_NUM_DATA = 10
 
@@ -285,11 +287,18 @@ class TestSource(_TestBase, DataProvider.DataSource):
             data.append(str(i))
         return data
 
-    def get(self, LUID):
-        DataProvider.DataSource.get(self, LUID)
-        if self.slow:
-            time.sleep(1)
+    def _get_mtime_and_hash(self):
+        mtime = DEFAULT_MTIME
+        if self.newMtime:
+            mtime = datetime.datetime.now()
+            
+        hash = DEFAULT_HASH
+        if self.newHash:
+            hash = Utils.random_string()
 
+        return mtime, hash
+
+    def _check_error(self, LUID):
         index = int(LUID)
         if index >= self.errorAfter:
             if self.errorFatal:
@@ -297,14 +306,36 @@ class TestSource(_TestBase, DataProvider.DataSource):
             else:
                 raise Exceptions.SyncronizeError("Error After:%s Count:%s" % (self.errorAfter, index))
 
-        mtime = DEFAULT_MTIME
-        if self.newMtime:
-            mtime = datetime.datetime.now()
-            
-        hash = DEFAULT_HASH
-        if self.newHash:
-            hash = Utils.random_string()
+    def get_all_with_rids(self):
+        #one slow request for all the items
+        if self.slow:
+            time.sleep(1)
+        for LUID in self.get_all():
+            #the Rid of an item that errors is looked up, and fails, later
+            if int(LUID) >= self.errorAfter:
+                yield LUID, None
+            else:
+                mtime,hash = self._get_mtime_and_hash()
+                yield LUID, Rid(uid=LUID, mtime=mtime, hash=hash)
 
+    def get_rid_bulk(self, LUIDs):
+        if self.slow:
+            time.sleep(1)
+        rids = {}
+        for LUID in LUIDs:
+            self._check_error(LUID)
+            mtime,hash = self._get_mtime_and_hash()
+            rids[LUID] = Rid(uid=LUID, mtime=mtime, hash=hash)
+        return rids
+
+    def get(self, LUID):
+        DataProvider.DataSource.get(self, LUID)
+        if self.slow:
+            time.sleep(1)
+
+        self._check_error(LUID)
+
+        mtime,hash = self._get_mtime_and_hash()
         data = TestDataType(LUID, mtime, hash)
         return data
 
@@ -328,6 +359,8 @@ class TestSink(_TestBase, DataProvider.DataSink):
     def __init__(self, *args):
         _TestBase.__init__(self)
         DataProvider.DataSink.__init__(self)
+        #number of batches given to put_many and delete_many
+        self.numBatches = 0
         
     def put(self, data, overwrite, LUID=None):
         DataProvider.DataSink.put(self, data, overwrite, LUID)
@@ -341,6 +374,25 @@ class TestSink(_TestBase, DataProvider.DataSink):
         self.count += 1
         newData = TestDataType(data.get_UID())
         return newData.get_rid()
+
+    def put_many(self, items):
+        self.numBatches += 1
+        results = []
+        for data, overwrite, LUID in items:
+            try:
+                results.append(self.put(data, overwrite, LUID))
+            except (Exceptions.SyncronizeError, Exceptions.SynchronizeConflictError), err:
+                results.append(err)
+            except Exceptions.SyncronizeFatalError, err:
+                results.append(err)
+                break
+        return results
+
+    def delete_many(self, LUIDs):
+        self.numBatches += 1
+        for LUID in LUIDs:
+            self.delete(LUID)
+        return [None for LUID in LUIDs]
         
 class TestTwoWay(TestSource, TestSink):
 
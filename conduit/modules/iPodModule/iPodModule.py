@@ -12,6 +12,8 @@ License: GPLv2
 """
 import os
 import pickle
+import random
+import shutil
 import logging
 import time
 import socket
@@ -25,13 +27,16 @@ import conduit
 import conduit.dataproviders.DataProvider as DataProvider
 import conduit.dataproviders.DataProviderCategory as DataProviderCategory
 import conduit.dataproviders.VolumeFactory as VolumeFactory
+import conduit.Exceptions as Exceptions
 import conduit.utils as Utils
+import conduit.utils.Thread as Thread
 import conduit.datatypes.Note as Note
 import conduit.datatypes.Contact as Contact
 import conduit.datatypes.Event as Event
 import conduit.datatypes.File as File
 import conduit.datatypes.Audio as Audio
 import conduit.datatypes.Video as Video
+import conduit.utils.MediaFile as MediaFile
 
 from gettext import gettext as _
 
@@ -728,6 +733,135 @@ class DBCache:
         log.debug('Unlocking DB %s' % db)
         self.__db_locks[db].release()
 
+class TrackTransaction:
+    '''
+    Copies track files into iPod_Control/Music, many at once, without 
+    needing the database lock.
+
+    Each file copied is recorded in a journal on the iPod until L{commit}
+    is called, once the iTunesDB that refers to the files has been written.
+    If conduit stops before then, L{recover} removes the copied files that
+    the iTunesDB does not know about.
+    '''
+    COPY_THREADS = 3
+
+    def __init__(self, mountPoint, name):
+        '''
+        @param name: Identifies the journal, each dataprovider on an iPod
+        has its own
+        '''
+        self.mountPoint = mountPoint
+        self.musicDir = os.path.join(mountPoint, "iPod_Control", "Music")
+        self.journal = os.path.join(mountPoint, "iPod_Control", "conduit-pending-%s" % name)
+        self._lock = threading.Lock()
+
+    def _get_music_dirs(self):
+        dirs = []
+        if os.path.isdir(self.musicDir):
+            dirs = [d for d in os.listdir(self.musicDir) if os.path.isdir(os.path.join(self.musicDir, d))]
+        if len(dirs) == 0:
+            dirs = ["F00"]
+            os.makedirs(os.path.join(self.musicDir, dirs[0]))
+        return dirs
+
+    def _read_journal(self):
+        try:
+            f = open(self.journal, "r")
+        except IOError:
+            return []
+        try:
+            return [l.rstrip("\n") for l in f if l.strip()]
+        finally:
+            f.close()
+
+    def reserve(self, filename):
+        '''
+        Picks, and creates empty, the file in iPod_Control/Music that
+        filename will be copied to, and records it in the journal
+
+        @returns: The path of the destination file
+        '''
+        ext = os.path.splitext(filename)[1]
+        self._lock.acquire()
+        try:
+            dirs = self._get_music_dirs()
+            while True:
+                dest = os.path.join(
+                            self.musicDir,
+                            random.choice(dirs),
+                            "conduit%06d%s" % (random.randint(0, 999999), ext))
+                if not os.path.exists(dest):
+                    break
+            open(dest, "w").close()
+            f = open(self.journal, "a")
+            try:
+                f.write(dest + "\n")
+            finally:
+                f.close()
+            return dest
+        finally:
+            self._lock.release()
+
+    def discard(self, dest):
+        '''
+        Removes a reserved file that will not be added to the iTunesDB
+        '''
+        if os.path.exists(dest):
+            os.remove(dest)
+
+    def copy(self, files):
+        '''
+        Copies each (source path, destination path) in files, at the same time
+
+        @returns: A list with, for each file, None if it was copied or the
+        exception raised when copying it
+        '''
+        def copy_file(src, dest):
+            shutil.copyfile(src, dest)
+
+        if len(files) == 0:
+            return []
+        pool = Thread.WorkerPool(min(self.COPY_THREADS, len(files)), "iPod copy", Thread.get_owner())
+        try:
+            jobs = [pool.submit(copy_file, src, dest) for src, dest in files]
+            errors = []
+            for job in jobs:
+                try:
+                    job.get()
+                    errors.append(None)
+                except Exception, err:
+                    errors.append(err)
+            return errors
+        finally:
+            pool.stop()
+
+    def commit(self):
+        '''
+        Forgets the copied files, call after writing the iTunesDB
+        '''
+        self._lock.acquire()
+        try:
+            if os.path.exists(self.journal):
+                os.remove(self.journal)
+        finally:
+            self._lock.release()
+
+    def recover(self, is_referenced):
+        '''
+        Removes the files copied by a transaction that was never committed,
+        for which is_referenced(path) returns False
+
+        @returns: The number of files removed
+        '''
+        removed = 0
+        for dest in self._read_journal():
+            if not is_referenced(dest) and os.path.exists(dest):
+                log.info("Removing track copied before an interrupted sync: %s" % dest)
+                os.remove(dest)
+                removed += 1
+        self.commit()
+        return removed
+
 class IPodMediaTwoWay(IPodBase):
     FORMAT_CONVERSION_STRING = _("Encoding")
 
@@ -744,6 +878,12 @@ class IPodMediaTwoWay(IPodBase):
         self.tracks_id = {}
         self.track_args = {}
         self.keep_converted = True
+        #Track files are copied outside the db lock, and the db is only
+        #written in finish()
+        self.transaction = None
+        if not self.local_db:
+            self.transaction = TrackTransaction(self.mountPoint, self.__class__.__name__)
+        self.db_changed = False
         
     def get_db(self):
         if self.db:
@@ -766,12 +906,33 @@ class IPodMediaTwoWay(IPodBase):
         DBCache.release_db(self.db)
         self.db = None        
 
+    def write_db(self):
+        '''
+        Writes the db to the iPod if it was changed
+        '''
+        if not self.db_changed:
+            return
+        self.get_db()
+        try:
+            # Closing does not actually close the db, it only writes its
+            # contents to disk.
+            self.db.close()
+            self.db_changed = False
+        finally:
+            self.unlock_db()
+        if self.transaction:
+            self.transaction.commit()
+
     def refresh(self):
         DataProvider.TwoWay.refresh(self)
         self.tracks = {}
         self.tracks_id = {}
         self.get_db()
         try:
+            if self.transaction:
+                #Remove the tracks copied by a sync that never finished
+                filenames = set([os.path.normpath(track.ipod_filename()) for track in self.db if track.ipod_filename()])
+                self.transaction.recover(lambda f: os.path.normpath(f) in filenames)
             def add_track(track):
                 self.tracks_id[str(track['dbid'])] = track
             [add_track(track) for track in self.db \
@@ -804,26 +965,72 @@ class IPodMediaTwoWay(IPodBase):
             self.unlock_db()
         return None
 
-    def put(self, f, overwrite, LUID=None):
+    def _put_tracks(self, files):
+        '''
+        Adds a track for each file in files. The db is only locked while
+        the tracks are created and after the files are copied, the copies
+        happen at the same time.
+
+        @returns: A list with, for each file, the new media file or the
+        exception raised adding it
+        '''
+        results = []
+        #(index in results, media file, source, destination)
+        toCopy = []
+        #discover the tags of all files before the db is locked
+        MediaFile.prefetch_media_tags(files)
         self.get_db()
         try:
-            media_file = self._ipodmedia_(db = self.db, f = f, **self.track_args)
-            #FIXME: We keep the db locked while we copy the file. Not good
-            #media_file.
-            media_file.copy_ipod()
-            self.tracks_id[str(media_file.track['dbid'])] = media_file.track
-            #FIXME: Writing the db here is for debug only. Closing does not actually
-            # close the db, it only writes it's contents to disk.            
-            # Sometimes, if we only close the db when the sync is over, it might
-            # take a long time to close the db, because many files are being 
-            # copied to the iPod. Closing the DB every time not only keeps
-            # this time small, but also keeps the db more consistent in case of 
-            # a crash. But it also incurs a big overhead. 
-            # Maybe a batch update could be a better solution (close after 5 tracks?)
-            self.db.close()
-            return media_file
+            for f in files:
+                media_file = None
+                try:
+                    media_file = self._ipodmedia_(db = self.db, f = f, **self.track_args)
+                    if self.transaction:
+                        src = f.get_local_uri()
+                        toCopy.append((len(results), media_file, src, self.transaction.reserve(src)))
+                    else:
+                        media_file.copy_ipod()
+                        self.tracks_id[str(media_file.track['dbid'])] = media_file.track
+                    results.append(media_file)
+                    self.db_changed = True
+                except Exception, err:
+                    if media_file != None:
+                        self.db.remove(media_file.track)
+                    results.append(Exceptions.SyncronizeError("Could not add %s to iPod: %s" % (f, err)))
+        finally:
+            self.unlock_db()
+
+        if len(toCopy) == 0:
+            return results
+
+        errors = self.transaction.copy([(src, dest) for i, media_file, src, dest in toCopy])
+        self.get_db()
+        try:
+            for (i, media_file, src, dest), err in zip(toCopy, errors):
+                if err == None and gpod.itdb_cp_finalize(media_file.track._track, None, dest, None) == None:
+                    err = "Could not finalize %s" % dest
+                if err == None:
+                    fname = media_file.track.ipod_filename().replace(self.mountPoint, "").replace(os.path.sep, ":")
+                    media_file.track['userdata']['filename_ipod'] = fname
+                    media_file.track['userdata']['transferred'] = 1
+                    self.tracks_id[str(media_file.track['dbid'])] = media_file.track
+                else:
+                    log.warn("Could not copy track to %s: %s" % (dest, err))
+                    self.db.remove(media_file.track)
+                    self.transaction.discard(dest)
+                    results[i] = Exceptions.SyncronizeError("Could not copy track: %s" % err)
         finally:
             self.unlock_db()
+        return results
+
+    def put(self, f, overwrite, LUID=None):
+        result = self._put_tracks([f])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def put_many(self, items):
+        return self._put_tracks([f for f, overwrite, LUID in items])
 
     def delete(self, LUID):
         track = self.tracks_id[LUID]
@@ -831,10 +1038,16 @@ class IPodMediaTwoWay(IPodBase):
             self.get_db()
             try:
                 self.db.remove(track)
-                self.db.close()
+                self.db_changed = True
             finally:
                 self.unlock_db()
 
+    def finish(self, aborted, error, conflict):
+        #Write all the changes at once, even if the sync was aborted,
+        #so that the tracks already copied are not lost
+        self.write_db()
+        IPodBase.finish(self, aborted, error, conflict)
+
     def get_config_items(self):
         import gtk
         #Get an array of encodings, so it can be indexed inside a combobox
@@ -900,6 +1113,7 @@ class IPodMediaTwoWay(IPodBase):
             return {}
 
     def uninitialize(self):
+        self.write_db()
         self.release_db()
 
 IPOD_AUDIO_ENCODINGS = {
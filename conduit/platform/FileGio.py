@@ -319,12 +319,17 @@ class FileMonitor(conduit.platform.FileMonitor):
 
         self._fm.connect("changed", self._on_change)
 
+    def is_monitoring(self):
+        return self._fm != None
+
     def cancel(self):
         if self._fm:
             try:
                 self._fm.disconnect_by_func(self._on_change)
             except TypeError:
                 pass
+            self._fm.cancel()
+            self._fm = None
             
 class FolderScanner(conduit.platform.FolderScanner):
     def run(self):
@@ -342,6 +347,7 @@ class FolderScanner(conduit.platform.FolderScanner):
             except gio.Error:
                 log.warn("Folder %s Not found" % dir, exc_info=True)
                 continue
+            self.folderURIs.append(dir)
 
             try: 
                 fileinfo = enumerator.next()
@@ -343,6 +343,9 @@ class FileMonitor(conduit.platform.FileMonitor):
         except gnomevfs.NotSupportedError:
             # silently fail if we are looking at a folder that doesn't support directory monitoring
             self._id = None
+
+    def is_monitoring(self):
+        return self._id != None
         
     def cancel(self):
         if self._id != None:
@@ -364,6 +367,7 @@ class FolderScanner(conduit.platform.FolderScanner):
             except: 
                 log.warn("Folder %s Not found" % dir)
                 continue
+            self.folderURIs.append(dir)
 
             try: fileinfo = hdir.next()
             except StopIteration: continue;
@@ -1,12 +1,23 @@
 import os.path
+import stat
+import time
+import collections
 import mimetypes
 import shutil
 
 import conduit.platform
+import conduit.utils.Thread as Thread
 
 import logging
 log = logging.getLogger("platform.FilePython")
 
+#scandir (the os.scandir backport) lists directories with file types, so
+#only symlinks need to be stat'd to tell files from folders
+try:
+    import scandir
+except ImportError:
+    scandir = None
+
 class FileImpl(conduit.platform.File):
     SCHEMES = ("file://",)
     def __init__(self, URI):
@@ -28,7 +39,7 @@ class FileImpl(conduit.platform.File):
         os.unlink(self._path)
         
     def exists(self):
-        os.path.exists(self._path)
+        return os.path.exists(self._path)
         
     def set_mtime(self, timestamp=None, datetime=None):
         raise NotImplementedError        
@@ -79,6 +90,20 @@ class FileImpl(conduit.platform.File):
     def get_filesystem_type(self):
         return None
 
+    @staticmethod
+    def uri_join(first, *rest):
+        return os.path.join(first, *rest)
+
+    @staticmethod
+    def uri_get_relative(fromURI, toURI):
+        return os.path.relpath(toURI.split("file://")[-1], fromURI.split("file://")[-1])
+
+    @staticmethod
+    def uri_get_scheme(URI):
+        if "://" in URI:
+            return URI.split("://")[0]
+        return None
+
 class FileTransferImpl(conduit.platform.FileTransfer):
     pass
 
@@ -89,6 +114,91 @@ class FileMonitor(conduit.platform.FileMonitor):
     pass
 
 class FolderScanner(conduit.platform.FolderScanner):
+    """
+    Scans local folders. The folders are listed in parallel by a pool of
+    threads, which also stat the files they find.
+    """
+    #Number of folders listed simultaneously
+    SCAN_THREADS = 4
+    #Minimum seconds between scan-progress signals
+    PROGRESS_INTERVAL = 0.5
+
+    def _list_folder(self, path):
+        """
+        @returns: (files, folders) in path, as lists of (name, stat) and
+        names, respectively
+        """
+        files = []
+        folders = []
+        if scandir != None:
+            entries = [(e.name, e.path, e.is_symlink(), e.is_dir(follow_symlinks=False)) for e in scandir.scandir(path)]
+        else:
+            entries = [(n, os.path.join(path, n), None, None) for n in os.listdir(path)]
+
+        for name,fullpath,isLink,isDir in entries:
+            if name == self.CONFIG_FILE_NAME:
+                continue
+            if name.startswith(".") and not self.includeHidden:
+                continue
+            try:
+                if isLink == False and isDir:
+                    folders.append(name)
+                    continue
+                st = os.lstat(fullpath)
+                if stat.S_ISLNK(st.st_mode):
+                    if not self.followSymlinks:
+                        continue
+                    st = os.stat(fullpath)
+            except OSError:
+                #broken symlinks, or deleted while scanning
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                folders.append(name)
+            elif stat.S_ISREG(st.st_mode):
+                files.append((name, st))
+            else:
+                log.debug("Unsupported file type: %s" % fullpath)
+        return files, folders
+
     def run(self):
+        basePath = self.baseURI.split("file://")[-1].rstrip("/") or "/"
+        #the real paths of the folders seen, to prevent symlink loops
+        seen = set([os.path.realpath(basePath)])
+        pool = Thread.WorkerPool(self.SCAN_THREADS, "FolderScanner")
+        pending = collections.deque([(self.baseURI.rstrip("/"), pool.submit(self._list_folder, basePath))])
+        lastProgress = time.time()
+        try:
+            while len(pending) > 0:
+                if self.cancelled:
+                    return
+
+                uri,job = pending.popleft()
+                try:
+                    files,folders = job.get()
+                except OSError:
+                    log.warn("Folder %s Not found" % uri, exc_info=True)
+                    continue
+                self.folderURIs.append(uri)
+
+                path = uri.split("file://")[-1]
+                for name,st in files:
+                    fileURI = uri+"/"+name
+                    self.URIs.append(fileURI)
+                    self.stats[fileURI] = st
+                for name in folders:
+                    if self.followSymlinks:
+                        real = os.path.realpath(os.path.join(path, name))
+                        if real in seen:
+                            continue
+                        seen.add(real)
+                    pending.append((uri+"/"+name, pool.submit(self._list_folder, os.path.join(path, name))))
+
+                if time.time() - lastProgress > self.PROGRESS_INTERVAL:
+                    self.emit("scan-progress", len(self.URIs))
+                    lastProgress = time.time()
+        finally:
+            pool.stop()
+
+        log.debug("%s files loaded" % len(self.URIs))
         self.emit("scan-completed")
 
@@ -131,6 +131,12 @@ class FileMonitor(gobject.GObject):
 
     def add(self, folder, monitorType):
         pass
+
+    def is_monitoring(self):
+        """
+        @returns: True if changes to the added URI will be signalled
+        """
+        return False
         
     def cancel(self):
         pass
@@ -155,6 +161,9 @@ class FolderScanner(threading.Thread, gobject.GObject):
         self.dirs = [self.baseURI]
         self.cancelled = False
         self.URIs = []
+        self.folderURIs = []
+        #URI : os.stat result, for scanners that stat files while scanning
+        self.stats = {}
         self.setName("FolderScanner Thread: %s" % self.baseURI)
 
     def run(self):
@@ -175,6 +184,19 @@ class FolderScanner(threading.Thread, gobject.GObject):
     def get_uris(self):
         return self.URIs
 
+    def get_folder_uris(self):
+        """
+        @returns: The URIs of all the folders scanned, including baseURI
+        """
+        return self.folderURIs
+
+    def get_stats(self):
+        """
+        @returns: A dict of URI : os.stat result for the files scanned, if
+        the scanner collected them while scanning
+        """
+        return self.stats
+
 
 class Settings:
     def __init__(self, defaults, changedCb):
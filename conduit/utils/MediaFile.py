@@ -1,6 +1,7 @@
 import threading
 import conduit
 import conduit.datatypes.File as File
+import conduit.utils.Thread as Thread
 import logging
 log = logging.getLogger("datatypes.Audio")
 
@@ -13,6 +14,100 @@ try:
 except ImportError:
     GST_AVAILABLE = False
 
+#Number of files discovered at once by get_metadata_many
+DISCOVER_THREADS = 2
+
+def discover(path):
+    '''
+    Discovers the tags, duration and stream information of the local media
+    file at path with GStreamer.
+
+    Requires a mainloop and the calling thread MUST BE outside the main 
+    loop (usually not a problem inside the synchronization process, which
+    has it's own thread).
+    This is also a very expensive operation, should be called only when 
+    necessary.   
+    '''
+    event = threading.Event()
+    result = {}
+    def discovered(discoverer, valid):
+        result['valid'] = valid
+        event.set()
+    # FIXME: Using Discoverer for now, but we should switch to utils.GstMetadata
+    #        when we get it to work (and eventually support thumbnails).
+    info = gst.extend.discoverer.Discoverer(path)
+    info.connect('discovered', discovered)
+    info.discover()
+    # Wait for discover to finish (which is async and emits discovered)
+    # This thread MUST NOT be the mainloop thread, because then the signal
+    # will NEVER be received, and this will deadlock.
+    event.wait()
+    if result['valid']:
+        tags = info.tags
+    else:
+        log.debug("Media file not valid")
+        return {}
+
+    tags['mimetype'] = info.mimetype
+    if info.is_video:
+        tags['width'] = info.videowidth
+        tags['height'] = info.videoheight
+        #frames per second, a gst.Fraction is not picklable
+        if info.videorate.denom:
+            tags['videorate'] = float(info.videorate.num) / info.videorate.denom
+        tags['duration'] = info.videolength / gst.MSECOND
+    if info.is_audio:
+        tags['duration'] = info.audiolength / gst.MSECOND
+        tags['samplerate'] = info.audiorate
+        tags['channels'] = info.audiochannels
+        tags['audiowidth'] = info.audiowidth
+        tags['audiodepth'] = info.audiodepth
+    return tags
+
+def get_metadata(path):
+    '''
+    Returns the metadata of the local media file at path, from the global
+    L{conduit.MediaCache.MediaCache} if there is one, otherwise it is 
+    discovered
+    '''
+    cache = conduit.GLOBALS.mediaCache
+    if cache == None:
+        return discover(path)
+    tags = cache.lookup(path)
+    if tags == None:
+        #return the tags as they will be when cached
+        tags = cache.store(path, discover(path))
+    return tags
+
+def get_metadata_many(paths):
+    '''
+    Gets the metadata of many local media files. Those that are not cached
+    are discovered DISCOVER_THREADS at a time
+
+    @returns: A dict of path : tags
+    '''
+    paths = list(paths)
+    if len(paths) < 2:
+        return dict([(p,get_metadata(p)) for p in paths])
+
+    pool = Thread.WorkerPool(DISCOVER_THREADS, "MediaFile", Thread.get_owner())
+    try:
+        return dict(zip(paths, pool.imap(get_metadata, paths)))
+    finally:
+        pool.stop()
+
+def prefetch_media_tags(files):
+    '''
+    Gets the GStreamer metadata of many L{MediaFile}s at once, so that it 
+    is not discovered one file at a time when their tags are first used
+    '''
+    if not GST_AVAILABLE:
+        return
+    files = [f for f in files if isinstance(f, MediaFile) and 'gst_tags' not in f.__dict__]
+    tags = get_metadata_many(set([f.get_local_uri() for f in files]))
+    for f in files:
+        f.gst_tags = tags[f.get_local_uri()]
+
 class MediaFile(File.File):
     '''
     A MediaFile is a file with multimedia attributes, such as an audio or video
@@ -45,46 +140,9 @@ class MediaFile(File.File):
 
     def _create_gst_metadata(self):
         '''
-        Create metadata from GStreamer.
-        
-        Requires a mainloop and the calling thread MUST BE outside the main 
-        loop (usually not a problem inside the synchronization process, which
-        has it's own thread).
-        This is also a very expensive operation, should be called only when 
-        necessary.   
+        Create metadata from GStreamer, or the metadata cache. See L{discover}
         '''
-        event = threading.Event()
-        def discovered(discoverer, valid):
-            self._valid = valid
-            event.set()
-        # FIXME: Using Discoverer for now, but we should switch to utils.GstMetadata
-        #        when we get it to work (and eventually support thumbnails).
-        info = gst.extend.discoverer.Discoverer(self.get_local_uri())
-        info.connect('discovered', discovered)
-        info.discover()
-        # Wait for discover to finish (which is async and emits discovered)
-        # This thread MUST NOT be the mainloop thread, because then the signal
-        # will NEVER be received, and this will deadlock.
-        event.wait()
-        if self._valid:
-            tags = info.tags
-        else:
-            log.debug("Media file not valid")
-            return {}
-
-        tags['mimetype'] = info.mimetype
-        if info.is_video:
-            tags['width'] = info.videowidth
-            tags['height'] = info.videoheight
-            tags['videorate'] = info.videorate
-            tags['duration'] = info.videolength / gst.MSECOND
-        if info.is_audio:
-            tags['duration'] = info.audiolength / gst.MSECOND
-            tags['samplerate'] = info.audiorate
-            tags['channels'] = info.audiochannels
-            tags['audiowidth'] = info.audiowidth
-            tags['audiodepth'] = info.audiodepth
-        return tags
+        return get_metadata(self.get_local_uri())
 
     def _get_metadata(self, name):        
         tags = self.get_media_tags()
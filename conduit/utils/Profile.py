@@ -0,0 +1,103 @@
+"""
+Collects the time spent in each phase of a sync, and the number of calls,
+time and bytes transferred for each dataprovider method, conversion and
+mapping DB operation performed during it.
+"""
+import time
+import threading
+import logging
+log = logging.getLogger("utils.Profile")
+
+import conduit.utils as Utils
+
+#Categories of timed operation
+PHASE = "phase"
+DATAPROVIDER = "dataprovider"
+CONVERSION = "conversion"
+MAPPINGDB = "mappingdb"
+
+class SyncProfile:
+    """
+    Statistics gathered over a single sync. Operations are identified by
+    category, name (e.g. the dataprovider UID or conversion) and method.
+    Can be updated from multiple threads at once.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        #(category, name, method) : [calls, seconds, bytes]
+        self._stats = {}
+        self.started = time.time()
+        self.finished = None
+
+    def record(self, category, name, method, seconds, nbytes=0):
+        """
+        Records a single call that took seconds and transferred nbytes
+        """
+        self._lock.acquire()
+        try:
+            stat = self._stats.setdefault((category, name, method), [0, 0.0, 0])
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] += nbytes
+        finally:
+            self._lock.release()
+
+    def call(self, category, name, method, func, *args, **kwargs):
+        """
+        Calls func(*args) and records the time taken, even if it raises
+        an exception. Calls that raise NotImplementedError did nothing, so
+        are not recorded. The call is timed by L{conduit.utils.log_function_call}
+
+        @keyword nbytes: The bytes transferred by the call
+        @keyword sizeof: A function that is given the result of func (None
+        if it raised) and returns the bytes transferred
+        @returns: The result of func
+        """
+        nbytes = kwargs.get("nbytes", 0)
+        sizeof = kwargs.get("sizeof", None)
+        def record(seconds, result, error):
+            if isinstance(error, NotImplementedError):
+                return
+            n = nbytes
+            if sizeof != None:
+                n = sizeof(result)
+            self.record(category, name, method, seconds, n)
+        return Utils.log_function_call(None, record)(func)(*args)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def get_total_time(self):
+        """
+        @returns: The seconds from when the profile was started until
+        it was finished (or now, if it is not finished)
+        """
+        end = self.finished
+        if end == None:
+            end = time.time()
+        return end - self.started
+
+    def get_report(self):
+        """
+        @returns: A dict of "category/name/method" : (calls, seconds, bytes)
+        """
+        self._lock.acquire()
+        try:
+            report = {}
+            for (category, name, method), (calls, seconds, nbytes) in self._stats.items():
+                report["%s/%s/%s" % (category, name, method)] = (calls, seconds, nbytes)
+            return report
+        finally:
+            self._lock.release()
+
+    def format_report(self):
+        """
+        @returns: The report as a table, slowest operations first
+        """
+        report = self.get_report().items()
+        report.sort(key=lambda i: i[1][1], reverse=True)
+        lines = ["Sync profile (%.3fs)" % self.get_total_time()]
+        lines.append("%10s %10s %12s  %s" % ("Calls", "Seconds", "Bytes", "Operation"))
+        for key, (calls, seconds, nbytes) in report:
+            lines.append("%10d %10.3f %12d  %s" % (calls, seconds, nbytes, key))
+        return "\n".join(lines)
@@ -1,6 +1,37 @@
+import sys
 import time
 import threading
+import Queue
+import collections
+import logging
+log = logging.getLogger("utils.Thread")
+
 import conduit
+import conduit.Exceptions as Exceptions
+
+def get_cpu_count():
+    """
+    @returns: The number of CPUs, or 1 if it can not be determined
+    """
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+def get_owner():
+    """
+    Threads in a L{WorkerPool} work on behalf of the thread that owns the
+    pool, which is where cancellation is checked and progress reported.
+
+    @returns: The owner of the current thread, or the current thread if it
+    is not part of a pool with an owner
+    """
+    t = threading.currentThread()
+    owner = getattr(t, "owner", None)
+    if owner == None:
+        return t
+    return owner
 
 class PauseCancelThread(threading.Thread):
     SLEEP_TIME = 20
@@ -24,3 +55,114 @@ class PauseCancelThread(threading.Thread):
     def cancel(self):
         self._cancelled = True
 
+class Job(object):
+    """
+    A function call submitted to a L{WorkerPool}. Call get() to block
+    until the result is available. Exceptions raised by the function are
+    re-raised by get() in the calling thread, and get() raises
+    L{conduit.Exceptions.StopSync} if the job was cancelled before it ran.
+    """
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self._result = None
+        self._excInfo = None
+        self._cancelled = False
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self._result = self.func(*self.args)
+        except Exception:
+            self._excInfo = sys.exc_info()
+        self._done.set()
+
+    def cancel(self):
+        self._cancelled = True
+        self._done.set()
+
+    def is_done(self):
+        return self._done.isSet()
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def get(self):
+        self._done.wait()
+        if self._cancelled:
+            raise Exceptions.StopSync()
+        if self._excInfo != None:
+            raise self._excInfo[0], self._excInfo[1], self._excInfo[2]
+        return self._result
+
+class WorkerPool(object):
+    """
+    A fixed size pool of daemon threads which run L{Job}s in the order
+    they were submitted. Call stop() when finished with the pool, jobs
+    that have not started are then cancelled.
+
+    If an owner is given, the pool threads return it from L{get_owner}
+    """
+    def __init__(self, numThreads, name="WorkerPool", owner=None):
+        self._jobs = Queue.Queue()
+        self._stopped = False
+        self._threads = []
+        for i in range(0, max(1, numThreads)):
+            t = threading.Thread(target=self._run, name="%s %s" % (name, i))
+            t.owner = owner
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job == None:
+                break
+            if self._stopped:
+                job.cancel()
+            else:
+                job.run()
+
+    def get_num_threads(self):
+        return len(self._threads)
+
+    def submit(self, func, *args):
+        """
+        Schedules func(*args) to be called in the pool
+        @returns: A L{Job}
+        """
+        job = Job(func, args)
+        self._jobs.put(job)
+        return job
+
+    def imap(self, func, iterable, window=None):
+        """
+        Like itertools.imap but func is called from the pool. Results are
+        yielded in the same order as iterable, and at most window calls
+        are scheduled ahead of the consumer. Pools may be chained by
+        passing the result of one imap as iterable to another.
+        """
+        if window == None:
+            window = 2 * len(self._threads)
+        pending = collections.deque()
+        items = iter(iterable)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    pending.append(self.submit(func, items.next()))
+                except StopIteration:
+                    exhausted = True
+            if len(pending) == 0:
+                break
+            yield pending.popleft().get()
+
+    def stop(self):
+        """
+        Cancels all jobs that have not yet started and stops the threads
+        once their current job is complete. Does not block.
+        """
+        self._stopped = True
+        for t in self._threads:
+            self._jobs.put(None)
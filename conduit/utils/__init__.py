@@ -336,30 +336,45 @@ def decode_conversion_args(argString):
         args[key] = val
     return args
     
-def log_function_call(log):
+def log_function_call(log, record=None):
     """
     A decorator that prints debug message showing the function name and
     argument types to the supplied logger instance. 
+
+    If record is supplied, each call is also timed, and record is called
+    with the seconds taken, the result and the exception raised (or None),
+    even if the call raises. Pass log=None to only time the calls.
     
     Adapted from the accepts/returns decorators at
     http://wiki.python.org/moin/PythonDecoratorLibrary
     """
     def decorator(f):
         def newf(*args):
-            #Ensure args are tuples with str args - necessart for CPython methods
-            argtypes = map(str,map(type, args))
-            argnames = map(str,f.func_code.co_varnames[:f.func_code.co_argcount])
-            argnamesandtypes = ["%s:%s" % (i,j) for i,j in zip(argnames,argtypes)]
-            msg = "Method Call %s(%s)" % (
-                        f.__name__,
-                        ', '.join(argnamesandtypes)
-                        )
-            log.debug(msg)
-            return f(*args)
+            if log != None:
+                #Ensure args are tuples with str args - necessart for CPython methods
+                argtypes = map(str,map(type, args))
+                argnames = map(str,f.func_code.co_varnames[:f.func_code.co_argcount])
+                argnamesandtypes = ["%s:%s" % (i,j) for i,j in zip(argnames,argtypes)]
+                msg = "Method Call %s(%s)" % (
+                            f.__name__,
+                            ', '.join(argnamesandtypes)
+                            )
+                log.debug(msg)
+            if record == None:
+                return f(*args)
+            t = time.time()
+            try:
+                result = f(*args)
+            except:
+                exc = sys.exc_info()
+                record(time.time() - t, None, exc[1])
+                raise exc[0], exc[1], exc[2]
+            record(time.time() - t, result, None)
+            return result
         #Retain information about old function
-        newf.__name__ = f.__name__
+        newf.__name__ = getattr(f, "__name__", "")
         newf.__doc__ = f.__doc__
-        newf.__dict__.update(f.__dict__)
+        newf.__dict__.update(getattr(f, "__dict__", {}))
         return newf
     return decorator
 
@@ -0,0 +1,135 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.ConversionCache as ConversionCache
+import conduit.FileCache as FileCache
+import conduit.TypeConverter as TypeConverter
+import conduit.datatypes.File as File
+import conduit.utils as Utils
+
+FILE_SIZE = 40
+
+def new_file(contents, name=None):
+    if name == None:
+        name = Utils.random_string()
+    path = os.path.join(Utils.new_tempdir(), name)
+    f = open(path, "w")
+    f.write(contents)
+    f.close()
+    return File.File(URI=path)
+
+def read(f):
+    return open(f.get_local_uri()).read()
+
+class UpperConverter(TypeConverter.Converter):
+
+    cached_conversions = ("file,file/upper", "file,file/same")
+
+    def __init__(self):
+        self.conversions =  {
+                "file,file/upper"   : self.upper,
+                "file,file/lower"   : self.lower,
+                "file,file/same"    : self.same
+        }
+        self.converted = 0
+
+    def _convert(self, f, contents):
+        self.converted += 1
+        out = new_file(contents, f.get_filename())
+        out.basePath = f.basePath
+        out.group = f.group
+        return out
+
+    def upper(self, f, **kwargs):
+        return self._convert(f, read(f).upper())
+
+    def lower(self, f, **kwargs):
+        return self._convert(f, read(f).lower())
+
+    def same(self, f, **kwargs):
+        self.converted += 1
+        return f
+
+test = SimpleTest()
+tc = test.type_converter
+conv = UpperConverter()
+tc._add_converter(test.wrap_dataprovider(conv))
+ok("Cached conversions registered", ("file","file/upper") in tc.cachedConversions and ("file","file/lower") not in tc.cachedConversions)
+
+#files are identified by the digests in the shared file cache
+digested = []
+compute_digest = FileCache.compute_digest
+def counting_compute_digest(path):
+    digested.append(path)
+    return compute_digest(path)
+FileCache.compute_digest = counting_compute_digest
+conduit.GLOBALS.fileCache = FileCache.FileCache()
+
+cacheDir = Utils.new_tempdir()
+cache = ConversionCache.ConversionCache(cacheDir, 3*FILE_SIZE)
+conduit.GLOBALS.conversionCache = cache
+
+#File.set_mtime is not supported by every file implementation, so
+#perform the conversions without retaining the original mtime
+def convert(f, to_type):
+    return tc._convert(tc._get_conversions("file", to_type), f)
+
+a = new_file("a" * FILE_SIZE, "a.txt")
+a.group = "group"
+a.set_UID("a-uid")
+a.set_open_URI("file:///a.txt")
+converted = convert(a, "file/upper?x=1")
+ok("Converted", read(converted) == "A" * FILE_SIZE and conv.converted == 1)
+ok("Cache miss", cache.misses == 1 and cache.hits == 0 and cache.get_size() == FILE_SIZE)
+
+converted = convert(a, "file/upper?x=1")
+ok("Cache hit", conv.converted == 1 and cache.hits == 1 and read(converted) == "A" * FILE_SIZE)
+ok("Cached result has the same name", converted.get_filename() == "a.txt")
+ok("Cached result is a copy", converted.get_local_uri().startswith(cacheDir) == False)
+ok("Cached result retains group", converted.group == "group")
+ok("Cached result retains UID and open URI", converted.get_UID() == "a-uid" and converted.get_open_URI() == "file:///a.txt")
+ok("Source digested once", len(digested) == 1)
+
+b = new_file("a" * FILE_SIZE, "b.txt")
+converted = convert(b, "file/upper?x=1")
+ok("Files with the same contents share results", conv.converted == 1 and cache.hits == 2)
+ok("Shared result named after the file converted (%s)" % converted.get_filename(), converted.get_filename() == "b.txt")
+
+converted = convert(a, "file/upper?x=2")
+ok("Different args are not shared", conv.converted == 2 and cache.misses == 2)
+
+converted = convert(a, "file/lower")
+converted = convert(a, "file/lower")
+ok("Conversions are only cached if the converter allows", conv.converted == 4 and cache.misses == 2)
+
+converted = convert(a, "file/same")
+ok("Unchanged files are not cached", converted is a and cache.get_stats()["entries"] == 2)
+
+#LRU eviction
+convert(a, "file/upper?x=1")
+for i in range(3, 5):
+    convert(a, "file/upper?x=%s" % i)
+stats = cache.get_stats()
+ok("Least recently used evicted (%s)" % stats, stats["evictions"] == 1 and stats["entries"] == 3 and stats["size"] <= 3*FILE_SIZE)
+n = conv.converted
+convert(a, "file/upper?x=1")
+ok("Recently used kept", conv.converted == n)
+convert(a, "file/upper?x=2")
+ok("Evicted result converted again", conv.converted == n+1)
+
+#cache is persistent
+cache.close()
+cache = ConversionCache.ConversionCache(cacheDir, 3*FILE_SIZE)
+conduit.GLOBALS.conversionCache = cache
+n = conv.converted
+converted = convert(a, "file/upper?x=1")
+ok("Cache persisted", conv.converted == n and cache.hits == 1 and read(converted) == "A" * FILE_SIZE)
+
+cache.clear()
+ok("Cache cleared", cache.get_stats()["entries"] == 0 and cache.get_size() == 0 and [f for f in os.listdir(cacheDir) if not f.startswith("conversions.db")] == [])
+cache.close()
+conduit.GLOBALS.conversionCache = None
+conduit.GLOBALS.fileCache.close()
+conduit.GLOBALS.fileCache = None
+
+finished()
@@ -3,6 +3,7 @@ from common import *
 import traceback
 import gobject
 import threading
+import time
 
 import gtk
 gtk.gdk.threads_init()
@@ -12,6 +13,7 @@ import conduit.datatypes.Video as Video
 import conduit.datatypes.Audio as Audio
 import conduit.modules.iPodModule.iPodModule as iPodModule
 import conduit.utils as Utils
+import conduit.utils.Thread as Thread
 import conduit.Exceptions as Exceptions
 
 test = SimpleTest()
@@ -30,7 +32,16 @@ TEST = (
 )
 mainloop = gobject.MainLoop()
 
+def convert_one(job):
+    f, to_type = job
+    try:
+        newdata = tc.convert("file",to_type, f)
+        return newdata != None and newdata.exists()
+    except:
+        return False
+
 def convert():    
+    jobs = []
     for name, test_encodings, all_encodings in TEST:
         files = get_external_resources(name)
         for description,uri in files.items():
@@ -42,6 +53,7 @@ def convert():
                     args = all_encodings[encoding]
                     
                     to_type = "file/%s?%s" % (name,Utils.encode_conversion_args(args))
+                    jobs.append((f, to_type))
                     try:
                         newdata = tc.convert("file",to_type, f)
                         success = newdata != None and newdata.exists()
@@ -50,6 +62,18 @@ def convert():
 
                     ok("%s: Conversion of %s -> %s" % (name,description,encoding), success, False)
 
+    #the same conversions run simultaneously, up to transcode_threads at once
+    if jobs:
+        t = time.time()
+        results = [convert_one(j) for j in jobs]
+        serial = time.time() - t
+        pool = Thread.WorkerPool(Thread.get_cpu_count(), "Convert")
+        t = time.time()
+        results = list(pool.imap(convert_one, jobs))
+        parallel = time.time() - t
+        pool.stop()
+        ok("Converted %s files in parallel: %.1fs v %.1fs (%s CPUs)" % (len(jobs), parallel, serial, Thread.get_cpu_count()), False not in results, False)
+
     gobject.idle_add(mainloop.quit)
 
 def idle_cb():
@@ -0,0 +1,174 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.TypeConverter as TypeConverter
+import conduit.datatypes.DataType as DataType
+import conduit.datatypes.Note as Note
+import conduit.utils as Utils
+
+import time
+
+#Checks conversions are routed through any number of types, by the
+#cheapest path, and that the cost of finding the route is only paid once.
+#Dispatch is timed as the best of NUM_RUNS runs, to keep the check robust
+NUM_ITEMS = 3000
+NUM_RUNS = 5
+
+class GraphData(DataType.DataType):
+    def __init__(self, name, path):
+        DataType.DataType.__init__(self)
+        self._name_ = name
+        self.path = path
+
+class GraphConverter(TypeConverter.Converter):
+
+    conversion_costs = {
+            "ga,gd" : 5
+    }
+
+    def __init__(self):
+        self.conversions =  {
+                "ga,gb"     : self.convert,
+                "gb,gc"     : self.convert,
+                "gc,gd"     : self.convert,
+                "ga,gd"     : self.convert,
+                "gd,ge/sub" : self.convert,
+                "gd,gd"     : self.transcode,
+        }
+
+    def convert(self, data, **kwargs):
+        return GraphData("?", data.path + [kwargs])
+
+    def transcode(self, data, **kwargs):
+        return GraphData("gd", data.path + ["transcode"])
+
+class CheapConverter(TypeConverter.Converter):
+
+    conversion_costs = {
+            "ga,gd" : 2
+    }
+
+    def __init__(self):
+        self.conversions =  {
+                "ga,gd"     : self.convert,
+        }
+
+    def convert(self, data, **kwargs):
+        return GraphData("gd", data.path + ["cheap"])
+
+def route(f, t):
+    return ["%s->%s" % (cf,ct) for cf,ct,a in tc._get_conversions(f, t)]
+
+def dispatch_reference(f, t):
+    """
+    The previous implementation of _get_conversions and conversion_exists,
+    which examined the types for each item converted
+    """
+    def get_conversions(from_type, to_type):
+        conversions = []
+        args = {}
+        fromType = from_type.split("?")[0]
+        toType = to_type
+        try:
+            toType,argString = to_type.split("?")
+            args = Utils.decode_conversion_args(argString)
+        except ValueError: pass
+        if fromType != toType:
+            if tc._conversion_exists(fromType, toType):
+                conversions.append( (fromType, toType, args) )
+            else:
+                froms = fromType.split("/")
+                tos = toType.split("/")
+                if froms[0] == tos[0]:
+                    conversions.append( (froms[0],"/".join(tos),args) )
+                else:
+                    if len(tos) > 1:
+                        conversions.append( (froms[0], tos[0], {}) )
+                        conversions.append( (tos[0],"/".join(tos),args) )
+                    else:
+                        conversions.append( (froms[0], tos[0], args) )
+        else:
+            conversions.append( (fromType, toType, args) )
+        return conversions
+
+    conversions = get_conversions(f, t)
+    for cf,ct,a in get_conversions(f, t):
+        if cf != ct and not tc._conversion_exists(cf,ct):
+            return None
+    return conversions
+
+def best_time(func):
+    best = None
+    for i in range(NUM_RUNS):
+        t = time.time()
+        res = [func(f, to) for f,to in items]
+        t = time.time() - t
+        if best == None or t < best:
+            best = t
+    return best,res
+
+def dispatch(f, t):
+    #the work done by convert before the conversions are performed
+    conversions = tc._get_conversions(f, t)
+    if tc.conversion_exists(f, t):
+        return conversions
+    return None
+
+test = SimpleTest()
+tc = test.type_converter
+tc._add_converter(test.wrap_dataprovider(GraphConverter()))
+
+#routing
+ok("Multi hop route", route("ga", "gc") == ["ga->gb", "gb->gc"])
+ok("Cheapest route preferred %s" % route("ga","gd"), route("ga", "gd") == ["ga->gb", "gb->gc", "gc->gd"])
+ok("Subtypes route via parent type", route("gb/sub", "gd") == ["gb->gc", "gc->gd"])
+ok("Route to subtype", route("gc", "ge/sub") == ["gc->gd", "gd->ge/sub"])
+ok("Route to parent type transcodes", route("gc", "ge") == ["gc->gd", "gd->ge/sub", "ge->ge"])
+ok("No route", tc._get_conversions("gd", "ga") == None and tc.conversion_exists("gd", "ga") == False)
+
+args = {"arg1":Utils.random_string()}
+conversions = tc._get_conversions("gb", "gd?%s" % Utils.encode_conversion_args(args))
+ok("Args given to last conversion", [a for f,t,a in conversions] == [{}, args])
+newdata = tc._convert(conversions, GraphData("gb", []))
+ok("Converted via each type", newdata.path == [{}, args])
+conversions = tc._get_conversions("gc", "ge?%s" % Utils.encode_conversion_args(args))
+ok("Args given to transcode of parent type", [a for f,t,a in conversions] == [{}, {}, args])
+
+#memoized
+conversions = tc._get_conversions("ga", "gd")
+ok("Route memoized", tc._get_conversions("ga", "gd") is conversions)
+tc._add_converter(test.wrap_dataprovider(CheapConverter()))
+ok("Routes found again when converters added %s" % route("ga","gd"), route("ga", "gd") == ["ga->gd"])
+
+description = tc.get_graph_description()
+ok("Graph described", "ga -> gd (cost 2, CheapConverter.convert)" in description and "gb -> gc (cost 1, GraphConverter.convert)" in description)
+
+#existing conversions of notes, contacts and events are unchanged
+for f,t in (("note","text"),("note","file"),("contact","text"),("event","file"),("text","contact"),("file","event"),("note","note")):
+    ok("%s -> %s route unchanged" % (f,t), tc._get_conversions(f, t) == dispatch_reference(f, t))
+
+#dispatch overhead
+TYPES = (
+    ("note", "text"),
+    ("note", "file"),
+    ("contact", "text"),
+    ("contact", "file"),
+    ("event", "text"),
+    ("event", "file"),
+    ("text", "contact"),
+    ("file", "event"),
+)
+items = [TYPES[i % len(TYPES)] for i in range(NUM_ITEMS)]
+
+tr,expected = best_time(dispatch_reference)
+t,actual = best_time(dispatch)
+ok("Dispatched %d conversions" % NUM_ITEMS, actual == expected)
+ok("Dispatched %d conversions in %.3fs (previous implementation %.3fs)" % (NUM_ITEMS, t, tr), t < tr)
+
+notes = [Note.Note(title="Note-%d" % i, contents=Utils.random_string()) for i in range(NUM_ITEMS)]
+t = time.time()
+texts = [tc.convert("note", "text", n) for n in notes]
+t = time.time() - t
+ok("Converted %d notes in %.3fs" % (NUM_ITEMS, t), len(texts) == NUM_ITEMS and texts[-1].get_UID() == notes[-1].get_UID())
+
+finished()
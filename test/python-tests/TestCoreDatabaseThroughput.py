@@ -0,0 +1,108 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.Database as Database
+import conduit.utils as Utils
+
+import time
+import threading
+
+#Compares the queue based ThreadSafeGenericDB with the ConcurrentGenericDB.
+#Wall clock times are noisy, so the ConcurrentGenericDB need only be faster
+#where it saves a lot (bulk inserts, and not passing each statement to
+#another thread), and within MAX_SLOWDOWN times elsewhere
+NUM_ROWS = 10000
+NUM_LOOKUPS = 2000
+NUM_READERS = 4
+MAX_SLOWDOWN = 2
+
+def new_db(klass):
+    db = klass(os.path.join(os.environ['TEST_DIRECTORY'], "test-%s.db" % Utils.random_string()))
+    db.create(
+            table="files",
+            fields=("URI","BASEPATH","GROUPNAME")
+            )
+    return db
+
+def bench_insert(db, bulk):
+    rows = [("file:///foo/bar/%d" % i, "file:///foo", "group") for i in xrange(NUM_ROWS)]
+    t = time.time()
+    if bulk:
+        db.insert_many(table="files", rows=rows)
+    else:
+        for r in rows:
+            db.insert(table="files", values=r)
+    return time.time() - t
+
+def bench_select(db):
+    t = time.time()
+    uris = [uri for uri, in db.select("SELECT URI FROM files")]
+    return time.time() - t, len(uris)
+
+def bench_select_one(db):
+    t = time.time()
+    for i in xrange(0, NUM_ROWS, NUM_ROWS/NUM_LOOKUPS):
+        oid, = db.select_one("SELECT oid FROM files WHERE oid = ?", (i+1,))
+    return time.time() - t
+
+def bench_concurrent_select(db):
+    counts = []
+    def read():
+        n,count = bench_select(db)
+        counts.append(count)
+    threads = [threading.Thread(target=read) for i in range(NUM_READERS)]
+    t = time.time()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return time.time() - t, counts
+
+old = new_db(Database.ThreadSafeGenericDB)
+new = new_db(Database.ConcurrentGenericDB)
+
+ti_old = bench_insert(old, False)
+ti_new = bench_insert(new, True)
+ok("Insert %d rows: %.2fs (queue, one at a time) v %.2fs (insert_many)" % (NUM_ROWS, ti_old, ti_new), ti_new < ti_old)
+ok("Inserted rows", new.select_one("SELECT COUNT(oid) FROM files")[0] == NUM_ROWS)
+
+ts_old,n_old = bench_select(old)
+ts_new,n_new = bench_select(new)
+ok("Select %d rows: %.2fs (queue) v %.2fs" % (NUM_ROWS, ts_old, ts_new), ts_new <= MAX_SLOWDOWN*ts_old + 0.01)
+ok("Selected rows", n_old == n_new == NUM_ROWS)
+
+to_old = bench_select_one(old)
+to_new = bench_select_one(new)
+ok("%d select_one: %.2fs (queue) v %.2fs" % (NUM_LOOKUPS, to_old, to_new), to_new < to_old)
+
+chunks = [len(c) for c in new.select_chunks("SELECT URI FROM files", size=5000)]
+ok("select_chunks returns chunks of rows %s" % chunks, chunks == [5000]*(NUM_ROWS/5000))
+
+tc_old,c_old = bench_concurrent_select(old)
+tc_new,c_new = bench_concurrent_select(new)
+ok("%d concurrent selects: %.2fs (queue) v %.2fs" % (NUM_READERS, tc_old, tc_new), tc_new <= MAX_SLOWDOWN*tc_old + 0.01)
+ok("Concurrent selects", c_new == [NUM_ROWS]*NUM_READERS)
+
+#read connections are pooled, not one per thread
+threads = [threading.Thread(target=bench_select, args=(new,)) for i in range(5*NUM_READERS)]
+for th in threads:
+    th.start()
+for th in threads:
+    th.join()
+ok("Read connections reused (%s open)" % len(new._connections), len(new._connections) <= 1 + new.MAX_READERS)
+
+#reads in a transaction see its own writes, other threads see them once committed
+new.begin()
+new.insert(table="files", values=("file:///foo/new","",""))
+inTransaction, = new.select_one("SELECT COUNT(oid) FROM files")
+res = []
+th = threading.Thread(target=lambda: res.append(new.select_one("SELECT COUNT(oid) FROM files")[0]))
+th.start()
+th.join()
+new.end()
+committed, = new.select_one("SELECT COUNT(oid) FROM files")
+ok("Transaction isolated from other readers", inTransaction == committed == NUM_ROWS+1 and res == [NUM_ROWS])
+
+old.close()
+new.close()
+finished()
@@ -0,0 +1,122 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.DeltaProvider as DeltaProvider
+import conduit.Exceptions as Exceptions
+import conduit.modules.TestModule as TestModule
+from conduit.datatypes import Rid
+
+import time
+
+#Checks the changes found by the DeltaProvider, and that it takes linear
+#time. Wall clock times are noisy, so the time per item at the largest size
+#need only be within MAX_SLOWDOWN times that at the smallest
+SIZES = (1000, 10000)
+MAX_SLOWDOWN = 5
+
+#Rids are found by calling get() for each item
+class GetSource(TestModule.TestSource):
+    def get_all_with_rids(self):
+        raise NotImplementedError
+    def get_rid_bulk(self, LUIDs):
+        raise NotImplementedError
+
+#Rids are found with get_rid_bulk
+class BulkSource(TestModule.TestSource):
+    def get_all_with_rids(self):
+        raise NotImplementedError
+
+#get_rid_bulk leaves out some Rids, and returns str LUIDs
+class PartialBulkSource(BulkSource):
+    def get_rid_bulk(self, LUIDs):
+        rids = BulkSource.get_rid_bulk(self, LUIDs)
+        return dict([(str(i), rid) for i,rid in rids.items() if int(i) % 3 != 0])
+
+class Wrapper:
+    def __init__(self, module):
+        self.module = module
+    def get_UID(self):
+        return self.module.get_UID()
+
+class Mappings:
+    def __init__(self, rids):
+        self.rids = rids
+    def get_rids(self, dpUID):
+        return self.rids.copy()
+
+#The previous sync saw items n/10 to n+n/10, and every 10th item has since
+#been modified. Rids are shared to save memory
+def previous_sync(n):
+    same = Rid(uid=None, mtime=TestModule.DEFAULT_MTIME, hash=TestModule.DEFAULT_HASH)
+    different = Rid(uid=None, mtime=TestModule.DEFAULT_MTIME, hash="old")
+    rids = {}
+    for i in xrange(n/10, n+n/10):
+        if i % 10 == 0:
+            rids[unicode(i)] = different
+        else:
+            rids[unicode(i)] = same
+    return Mappings(rids)
+
+def get_changes(klass, n, mappings):
+    source = klass()
+    source.numData = n
+    source.errorAfter = n
+    delta = DeltaProvider.DeltaProvider(Wrapper(source), Wrapper(TestModule.TestSink()), mappings)
+    t = time.time()
+    added, modified, deleted = delta.get_changes()
+    return time.time() - t, added, modified, deleted
+
+def check(n, added, modified, deleted):
+    return len(added) == n/10 and \
+           len(modified) == (n-n/10)/10 and \
+           len(deleted) == n/10 and \
+           added[0] == u"0" and modified[0] == unicode(n/10) and u"%d" % n in deleted
+
+#The previous implementation, which removed each seen item from a list
+def get_changes_reference(n, mappings):
+    source = TestModule.TestSource()
+    source.numData = n
+    source.errorAfter = n
+    t = time.time()
+    allItems = [unicode(i) for i in source.get_all()]
+    rids = mappings.get_rids(None)
+    modified = []
+    for i in allItems[:]:
+        if i in rids:
+            data = source.get(i)
+            if data.get_rid().get_hash() != rids[i].get_hash():
+                modified.append(i)
+            del(rids[i])
+            allItems.remove(i)
+    return time.time() - t, allItems, modified, rids.keys()
+
+costs = {}
+for n in SIZES:
+    mappings = previous_sync(n)
+    if n == SIZES[0]:
+        t,added,modified,deleted = get_changes_reference(n, mappings)
+        ok("%d items: %.2fs (previous implementation)" % (n, t), check(n, added, modified, deleted))
+    for klass in (GetSource, BulkSource, PartialBulkSource, TestModule.TestSource):
+        t,added,modified,deleted = get_changes(klass, n, mappings)
+        costs.setdefault(klass, []).append(t/n)
+        ok("%d items: %.2fs (%s)" % (n, t, klass.__name__), check(n, added, modified, deleted))
+
+for klass,c in costs.items():
+    ok("%s: time per item scales linearly (%s)" % (klass.__name__, ", ".join(["%.1fus" % (i*1000000) for i in c])),
+            c[-1] <= MAX_SLOWDOWN * max(c[0], 1e-6))
+
+#errors are raised when the Rids of previously seen items are looked up,
+#like those from get()
+for klass in (BulkSource, TestModule.TestSource):
+    source = klass()
+    source.numData = 10
+    source.errorAfter = 5
+    delta = DeltaProvider.DeltaProvider(Wrapper(source), Wrapper(TestModule.TestSink()), previous_sync(10))
+    try:
+        delta.get_changes()
+        raised = False
+    except Exceptions.SyncronizeError:
+        raised = True
+    ok("%s: errorAfter raises when looking up Rids" % klass.__name__, raised)
+
+finished()
@@ -0,0 +1,151 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.FeedCache as FeedCache
+import conduit.utils as Utils
+from conduit.datatypes import Rid
+
+import datetime
+
+#Checks feeds are mirrored, and that Google Contacts only downloads the
+#contacts that changed since the last refresh, against a local stand-in
+NUM_CONTACTS = 2000
+BASE_TIME = datetime.datetime(2008, 1, 1)
+MTIME = datetime.datetime(2008, 1, 2, 3, 4, 5, 6)
+
+def new_rid(i, hash="hash"):
+    return Rid(uid="id%d" % i, mtime=MTIME, hash="%s%d" % (hash, i))
+
+cacheFile = os.path.join(os.environ['TEST_DIRECTORY'], "feeds-%s.db" % Utils.random_string())
+cache = FeedCache.FeedCache(cacheFile)
+
+ok("No mark before the first update", cache.get_mark("feed") == None)
+cache.update("feed", "mark1", [(new_rid(i), "data\xff%d" % i) for i in range(10)], [])
+ok("Entries stored", cache.get_num_entries("feed") == 10 and cache.get_mark("feed") == "mark1")
+ok("Data stored", cache.get_data("feed", "id3") == "data\xff3" and cache.get_data("feed", "missing") == None)
+rids = dict(cache.get_rids("feed"))
+ok("Rids stored", rids["id3"] == new_rid(3) and cache.get_rid("feed", "id3") == new_rid(3))
+
+cache.update("feed", "mark2", [(new_rid(3, "new"), "new data"), (new_rid(10), "data10")], ["id4", "missing"])
+ok("Changes stored", cache.get_num_entries("feed") == 10 and cache.get_rid("feed", "id3").get_hash() == "new3")
+ok("Deleted entries removed", "id4" not in cache.get_ids("feed") and cache.get_mark("feed") == "mark2")
+
+cache.update("other", "mark", [(new_rid(0), "other")], [])
+cache.update("feed", "mark3", [(new_rid(20), "data20")], [], replace=True)
+ok("Feed replaced", cache.get_ids("feed") == ["id20"] and cache.get_data("other", "id0") == "other")
+cache.put("feed", new_rid(21), "data21")
+cache.delete("feed", "id20")
+ok("Written entries stored", cache.get_ids("feed") == ["id21"])
+cache.close()
+
+cache = FeedCache.FeedCache(cacheFile)
+ok("Persisted", cache.get_ids("feed") == ["id21"] and cache.get_mark("feed") == "mark3")
+cache.clear("feed")
+ok("Cleared", cache.get_ids("feed") == [] and cache.get_mark("feed") == None and cache.get_mark("other") == "mark")
+
+#Google Contacts
+class ContactsServer:
+    def __init__(self):
+        #id : (updated, name, deleted)
+        self.contacts = {}
+        self.time = 0
+        self.expired = False
+        self.server = FakeWebServer(self.handle)
+
+    def tick(self):
+        self.time += 1
+        return self.time
+
+    def format_time(self, t):
+        return (BASE_TIME + datetime.timedelta(seconds=t)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    def set(self, i, name, deleted=False):
+        self.contacts[i] = (self.tick(), name, deleted)
+
+    def handle(self, path, params):
+        showDeleted = params.get("showdeleted") == "true"
+        start = int(params.get("start-index", 1))
+        limit = int(params.get("max-results", 25))
+        if "updated-min" in params:
+            if self.expired:
+                return "text/plain", "Gone", 410
+            updatedMin = params["updated-min"]
+        else:
+            updatedMin = ""
+
+        matching = []
+        for i, (updated, name, deleted) in sorted(self.contacts.items()):
+            if self.format_time(updated) >= updatedMin and (showDeleted or not deleted):
+                matching.append((i, updated, name, deleted))
+
+        entries = []
+        for i, updated, name, deleted in matching[start-1:start-1+limit]:
+            uri = "http://%s/m8/feeds/contacts/test%%40example.com/base/%d" % (self.server.host, i)
+            entries.append('''<entry>
+                <id>%s</id><updated>%s</updated><title>%s</title>
+                <link rel="edit" type="application/atom+xml" href="%s/%d"/>
+                <gd:email address="%s@example.com" primary="true"/>%s
+                </entry>''' % (uri, self.format_time(updated), name, uri, updated, name, deleted and "<gd:deleted/>" or ""))
+        next = ""
+        if start - 1 + limit < len(matching):
+            query = dict(params)
+            query["start-index"] = str(start + limit)
+            next = '<link rel="next" type="application/atom+xml" href="http://%s%s?%s"/>' % (self.server.host, path, cgi.escape(urllib.urlencode(query), True))
+        return "application/atom+xml", '''<?xml version="1.0" encoding="UTF-8"?>
+            <feed xmlns="http://www.w3.org/2005/Atom" xmlns:gd="http://schemas.google.com/g/2005">
+            <id>http://%s/m8/feeds/contacts/test%%40example.com/base</id>
+            <updated>%s</updated><title>Contacts</title>%s%s</feed>''' % (
+                self.server.host, self.format_time(self.tick()), next, "".join(entries))
+
+test = SimpleTest()
+available = [dp.classname for dp in test.model.get_all_modules()]
+if "ContactsTwoWay" in available:
+    conduit.GLOBALS.feedCache = FeedCache.FeedCache()
+    contactsServer = ContactsServer()
+    for i in range(NUM_CONTACTS):
+        contactsServer.set(i, "Contact%d" % i)
+
+    contacts = test.get_dataprovider("ContactsTwoWay").module
+    contacts.username = "test@example.com"
+    contacts.loggedIn = True
+    contacts.service.server = "localhost"
+    contacts.service.port = contactsServer.server.port
+
+    contacts.refresh()
+    ok("First refresh gets all %d contacts in %d requests" % (NUM_CONTACTS, contactsServer.server.requests),
+            len(contacts.get_all()) == NUM_CONTACTS)
+    rids = dict(contacts.get_all_with_rids())
+    LUID = contacts.get_all()[7]
+    contactsServer.server.requests = 0
+    c = contacts.get(LUID)
+    ok("Contacts got from the cache", contactsServer.server.requests == 0 and c.get_rid() == rids[LUID])
+
+    #10 changes
+    for i in range(10):
+        contactsServer.set(i*100, "Changed%d" % i)
+    contactsServer.set(5, "Contact5", deleted=True)
+    contactsServer.set(NUM_CONTACTS, "New")
+    contactsServer.server.requests = 0
+    contacts.refresh()
+    ok("Changes got in %d request" % contactsServer.server.requests, contactsServer.server.requests == 1)
+    newRids = dict(contacts.get_all_with_rids())
+    changed = [i for i in newRids if i in rids and newRids[i] != rids[i]]
+    ok("Changed contacts updated (%d)" % len(changed), len(changed) == 10)
+    ok("Deleted contact removed, new contact added", len(newRids) == NUM_CONTACTS and len([i for i in newRids if i not in rids]) == 1)
+
+    contactsServer.server.requests = 0
+    contacts.refresh()
+    ok("Nothing changed", contactsServer.server.requests == 1 and dict(contacts.get_all_with_rids()) == newRids)
+
+    #the server no longer has the changes since the last refresh
+    contactsServer.expired = True
+    contactsServer.set(1, "Changed")
+    contacts.refresh()
+    contactsServer.expired = False
+    ok("All contacts got again when changes are not available", len(contacts.get_all()) == NUM_CONTACTS and \
+            dict(contacts.get_all_with_rids())[contacts.get_all()[0]] != None)
+
+    contactsServer.server.stop()
+    conduit.GLOBALS.feedCache = None
+
+finished()
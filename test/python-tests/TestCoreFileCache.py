@@ -0,0 +1,97 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.FileCache as FileCache
+import conduit.datatypes.File as File
+import conduit.utils as Utils
+
+import time
+
+#count the number of times file contents are read
+digested = []
+compute_digest = FileCache.compute_digest
+def counting_compute_digest(path):
+    digested.append(path)
+    return compute_digest(path)
+FileCache.compute_digest = counting_compute_digest
+
+def new_file(contents, mtime=None):
+    path = os.path.join(Utils.new_tempdir(), Utils.random_string())
+    f = open(path, "w")
+    f.write(contents)
+    f.close()
+    if mtime:
+        os.utime(path, (mtime, mtime))
+    return path
+
+cache = FileCache.FileCache(os.path.join(os.environ['TEST_DIRECTORY'], "cache-%s.db" % Utils.random_string()))
+conduit.GLOBALS.fileCache = cache
+
+a = new_file("hello world")
+digest = cache.get_digest(a)
+ok("Got digest", digest == "2aae6c35c94fcfb415dbe95f408b9ce91ee846ed")
+ok("Digest cached", cache.get_digest(a) == digest and len(digested) == 1)
+
+#same size, new contents and inode
+b = new_file("HELLO WORLD")
+os.rename(b, a)
+ok("Digest invalidated by inode", cache.get_digest(a) != digest and len(digested) == 2)
+
+f = open(a, "a")
+f.write("!")
+f.close()
+ok("Digest invalidated by size", cache.get_digest(a) == FileCache.compute_digest(a) and len(digested) == 4)
+
+paths = [new_file("%s" % i) for i in range(0, 10)]
+digests = cache.get_digests(paths)
+ok("Digested files in parallel", len(digests) == 10 and digests[paths[3]] == compute_digest(paths[3]))
+del digested[:]
+digests = cache.get_digests(paths)
+ok("Parallel digests cached", len(digests) == 10 and len(digested) == 0)
+
+#content based comparison
+now = time.time()
+old = File.File(new_file("same contents", now - 3600), compareContents=True)
+new = File.File(new_file("same contents", now), compareContents=True)
+ok("Mtime comparison", old.compare(new) == conduit.datatypes.COMPARISON_OLDER)
+ok("Content comparison", old.compare(new, contents=True) == conduit.datatypes.COMPARISON_EQUAL)
+ok("Content hash ignores mtime", old.get_hash() == new.get_hash())
+ok("Rid does not contain mtime", old.get_rid().get_mtime() == None)
+
+changed = File.File(new_file("diff contents", now - 3600), compareContents=True)
+ok("Changed contents compared by mtime", changed.compare(new, contents=True) == conduit.datatypes.COMPARISON_OLDER)
+ok("Content hash changes", changed.get_hash() != new.get_hash())
+
+#mtime and size from stat
+plain = File.File(paths[0])
+ok("Mtime from stat", plain.get_mtime() == datetime.datetime.fromtimestamp(int(os.stat(paths[0]).st_mtime)))
+ok("Size from stat", plain.get_size() == 1)
+ok("Mtime hash", plain.get_rid().get_mtime() != None and plain.get_hash() != File.File(paths[0], compareContents=True).get_hash())
+
+#changes made outside the instance are seen
+rid = plain.get_rid()
+f = open(paths[0], "a")
+f.write("more")
+f.close()
+os.utime(paths[0], (now + 60, now + 60))
+ok("Size changed outside the instance", plain.get_size() == 5)
+ok("Rid changed outside the instance", plain.get_rid() != rid)
+ok("Mtime changed outside the instance", plain.compare(File.File(paths[1])) == conduit.datatypes.COMPARISON_NEWER)
+
+#deleted files are forgotten
+folder = Utils.new_tempdir()
+kept = os.path.join(folder, "kept")
+gone = os.path.join(folder, "gone")
+other = folder + "_other"
+for p in (kept, gone, other):
+    open(p, "w").close()
+cache.get_digests([kept, gone, other])
+os.unlink(gone)
+ok("Deleted files pruned", cache.prune(folder, [kept]) == 1 and cache.prune(folder, [kept]) == 0)
+del digested[:]
+cache.get_digests([kept, other])
+ok("Other files kept", len(digested) == 0)
+
+conduit.GLOBALS.fileCache = None
+cache.close()
+finished()
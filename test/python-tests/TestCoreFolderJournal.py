@@ -0,0 +1,133 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.Vfs as Vfs
+import conduit.FileCache as FileCache
+import conduit.utils as Utils
+import conduit.dataproviders.File as FileDataProvider
+
+import time
+
+#monitor events are delivered by the tests, not the mainloop
+class TestMonitor(Vfs.FileMonitor):
+    def is_monitoring(self):
+        return True
+Vfs.FileMonitor = TestMonitor
+monitor = TestMonitor()
+
+def new_file(path):
+    f = open(path, "w")
+    f.write(path)
+    f.close()
+    return "file://" + path
+
+#the folder
+base = Utils.new_tempdir()
+sub = os.path.join(base, "sub")
+os.mkdir(sub)
+uris = [new_file(os.path.join(base, "a")), new_file(os.path.join(sub, "b"))]
+folders = ["file://" + base, "file://" + sub]
+
+journal = FileDataProvider.FolderJournal("file://" + base, False, False)
+ok("Journal invalid before scan", not journal.is_valid())
+journal.set_scanned(uris, folders)
+ok("Journal valid after scan", journal.is_valid())
+ok("Journal monitors all folders", len(journal._monitors) == 2)
+ok("Journal lists files", sorted(journal.refresh()) == sorted(uris))
+
+#created and deleted files
+c = new_file(os.path.join(sub, "c"))
+journal._on_change(monitor, c, monitor.MONITOR_EVENT_CREATED)
+ok("Created file added", c in journal.refresh())
+
+hidden = new_file(os.path.join(base, ".hidden"))
+journal._on_change(monitor, hidden, monitor.MONITOR_EVENT_CREATED)
+ok("Hidden file ignored", hidden not in journal.refresh())
+
+os.unlink(os.path.join(base, "a"))
+journal._on_change(monitor, uris[0], monitor.MONITOR_EVENT_DELETED)
+ok("Deleted file removed", uris[0] not in journal.refresh())
+
+#created folders are scanned on the next refresh
+new = os.path.join(base, "new")
+os.mkdir(new)
+d = new_file(os.path.join(new, "d"))
+journal._on_change(monitor, "file://" + new, monitor.MONITOR_EVENT_CREATED)
+ok("Created folder scanned", d in journal.refresh())
+ok("Created folder monitored", len(journal._monitors) == 3)
+
+#deleting a folder removes everything in it
+journal._on_change(monitor, "file://" + sub, monitor.MONITOR_EVENT_DELETED)
+ok("Deleted folder removed", sorted(journal.refresh()) == [d])
+ok("Deleted folder not monitored", len(journal._monitors) == 2)
+
+journal.invalidate()
+ok("Journal invalidated", not journal.is_valid() and len(journal._monitors) == 0)
+ok("Journal matches settings", journal.is_for("file://" + base, False, False) and not journal.is_for("file://" + base, True, False))
+
+#changes made while the folder is scanned are not lost
+base = Utils.new_tempdir()
+sub = os.path.join(base, "sub")
+os.mkdir(sub)
+uris = [new_file(os.path.join(base, "a")), new_file(os.path.join(sub, "b"))]
+folders = ["file://" + base, "file://" + sub]
+
+journal = FileDataProvider.FolderJournal("file://" + base, False, False)
+journal.begin_scan()
+ok("Folder monitored before scan", len(journal._monitors) == 1 and not journal.is_valid())
+#the scan has listed the folders, sub is not monitored yet
+c = new_file(os.path.join(base, "c"))
+journal._on_change(monitor, c, monitor.MONITOR_EVENT_CREATED)
+ok("Changes while scanning held back", not journal.is_valid() and len(journal._events) == 1)
+d = new_file(os.path.join(sub, "d"))
+os.unlink(os.path.join(sub, "b"))
+journal.set_scanned(uris, folders)
+files = journal.refresh()
+ok("Journal valid after scan", journal.is_valid() and len(journal._monitors) == 2)
+ok("Events while scanning merged", c in files)
+ok("Folders changed before monitored listed again", d in files and uris[1] not in files)
+ok("Unchanged files kept", uris[0] in files and len(files) == 3)
+
+#only small, local folders are journaled
+remote = FileDataProvider.FolderJournal("sftp://example.com/foo", False, False)
+remote.set_scanned([], ["sftp://example.com/foo"])
+ok("Remote folder not journaled", not remote.is_valid())
+
+large = FileDataProvider.FolderJournal("file://" + base, False, False)
+large.set_scanned([], ["file://%s/%d" % (base, i) for i in range(0, large.MAX_MONITORED_FOLDERS+1)])
+ok("Large folder not journaled", not large.is_valid() and len(large._monitors) == 0)
+
+#the changes made between runs are found from the snapshot stored by the 
+#previous run, each run has its own dataprovider and opens the cache again
+cacheFile = os.path.join(os.environ['TEST_DIRECTORY'], "snapshot-%s.db" % Utils.random_string())
+def run(folder, aborted=False, error=False, conflict=False):
+    conduit.GLOBALS.fileCache = FileCache.FileCache(cacheFile)
+    dp = FileDataProvider.FolderTwoWay("file://" + folder, "", False, False, False)
+    dp.refresh()
+    try:
+        changes = dp.get_changes()
+    except NotImplementedError:
+        changes = None
+    dp.finish(aborted, error, conflict)
+    conduit.GLOBALS.fileCache.close()
+    conduit.GLOBALS.fileCache = None
+    return changes
+
+base = Utils.new_tempdir()
+sub = os.path.join(base, "sub")
+os.mkdir(sub)
+uris = [new_file(os.path.join(base, "a")), new_file(os.path.join(sub, "b")), new_file(os.path.join(sub, "c"))]
+ok("No changes before the first snapshot", run(base) == None)
+ok("No changes since the snapshot", run(base) == ([], [], []))
+
+d = new_file(os.path.join(sub, "d"))
+f = open(os.path.join(base, "a"), "a")
+f.write("modified")
+f.close()
+os.utime(os.path.join(base, "a"), (time.time() + 10, time.time() + 10))
+os.unlink(os.path.join(sub, "b"))
+ok("Changes since the snapshot found", run(base, error=True) == ([d], [uris[0]], [uris[1]]))
+ok("Snapshot forgotten when the sync failed", run(base) == None)
+ok("Snapshot stored when the sync succeeded", run(base) == ([], [], []))
+
+finished()
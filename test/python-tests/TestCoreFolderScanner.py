@@ -0,0 +1,90 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.platform.FilePython as FilePython
+import conduit.datatypes.File as File
+import conduit.utils as Utils
+
+import time
+
+#Scans a generated tree with the FilePython scanner and, if available, the GIO one
+NUM_FILES = 5000
+FILES_PER_FOLDER = 50
+FOLDERS_PER_FOLDER = 10
+
+def make_tree(base):
+    folders = [base]
+    i = 0
+    n = 0
+    while n < NUM_FILES:
+        folder = folders[i]
+        for j in range(0, FOLDERS_PER_FOLDER):
+            sub = os.path.join(folder, "d%d" % j)
+            os.mkdir(sub)
+            folders.append(sub)
+        for j in range(0, min(FILES_PER_FOLDER, NUM_FILES - n)):
+            open(os.path.join(folder, "f%d" % j), "w").close()
+            n += 1
+        i += 1
+    return len(folders)
+
+def scan(klass, uri, includeHidden=False, followSymlinks=False):
+    scanner = klass(uri, includeHidden, followSymlinks)
+    t = time.time()
+    scanner.start()
+    scanner.join()
+    return time.time() - t, scanner
+
+#options
+base = Utils.new_tempdir()
+os.mkdir(os.path.join(base, "dir"))
+os.mkdir(os.path.join(base, ".hiddendir"))
+for f in ("file", ".hidden", "dir/file", ".hiddendir/file", FilePython.FolderScanner.CONFIG_FILE_NAME):
+    open(os.path.join(base, f), "w").close()
+os.symlink(os.path.join(base, "file"), os.path.join(base, "link"))
+other = Utils.new_tempdir()
+open(os.path.join(other, "other"), "w").close()
+os.symlink(other, os.path.join(base, "linkdir"))
+os.symlink(base, os.path.join(base, "dir", "loop"))
+uri = "file://" + base
+
+t,s = scan(FilePython.FolderScanner, uri)
+ok("Scanned files %s" % s.get_uris(), sorted(s.get_uris()) == [uri+"/dir/file", uri+"/file"])
+ok("Scanned folders", sorted(s.get_folder_uris()) == [uri, uri+"/dir"])
+ok("Got stats", s.get_stats()[uri+"/file"].st_size == 0 and len(s.get_stats()) == 2)
+
+#files use the stat from the scan, rather than stat'ing again
+f = open(os.path.join(base, "file"), "w")
+f.write("grown since the scan")
+f.close()
+ok("File uses scanned stat", File.File(URI=uri+"/file", stat=s.get_stats()[uri+"/file"]).get_size() == 0)
+ok("File stats itself", File.File(URI=uri+"/file").get_size() == len("grown since the scan"))
+
+t,s = scan(FilePython.FolderScanner, uri, includeHidden=True)
+ok("Scanned hidden files", sorted(s.get_uris()) == [uri+"/.hidden", uri+"/.hiddendir/file", uri+"/dir/file", uri+"/file"])
+
+t,s = scan(FilePython.FolderScanner, uri, followSymlinks=True)
+ok("Followed symlinks", sorted(s.get_uris()) == [uri+"/dir/file", uri+"/file", uri+"/link", uri+"/linkdir/other"])
+
+#benchmark
+base = Utils.new_tempdir()
+t = time.time()
+numFolders = make_tree(base)
+ok("Made %d files in %d folders (%.1fs)" % (NUM_FILES, numFolders, time.time() - t), True)
+
+FilePython.FolderScanner.SCAN_THREADS = 1
+serial,s = scan(FilePython.FolderScanner, "file://" + base)
+ok("Serial scan: %.2fs" % serial, len(s.get_uris()) == NUM_FILES and len(s.get_folder_uris()) == numFolders)
+
+FilePython.FolderScanner.SCAN_THREADS = 4
+parallel,s = scan(FilePython.FolderScanner, "file://" + base)
+ok("Parallel scan: %.2fs" % parallel, len(s.get_uris()) == NUM_FILES and len(s.get_stats()) == NUM_FILES)
+
+try:
+    import conduit.platform.FileGio as FileGio
+    gioTime,s = scan(FileGio.FolderScanner, "file://" + base)
+    ok("GIO scan: %.2fs (%.1fx slower)" % (gioTime, gioTime/parallel), len(s.get_uris()) == NUM_FILES)
+except ImportError:
+    skip("GIO not available")
+
+finished()
@@ -96,6 +96,45 @@ ok("Deleted Mappings", len(n.get_mappings_for_dataproviders(sourceUID="source",s
 ok("----- MAPPING DB 2 -----", True)
 n.debug()
 
+#load all the mappings for a dataprovider pair into memory
+t = n.get_mappings_table(sourceUID="source",sinkUID="sink")
+ok("Mappings table loaded", len(t) == 2)
+ok("Table data3 --> data4", t.get_matching_UID("data3") == "data4")
+ok("Table data4 --> data3", t.get_matching_UID("data4") == "data3")
+ok("Table foo --> None", t.get_matching_UID("foo") == None)
+i = t.get_mapping(sourceUID="sink",dataLUID="data4",sinkUID="source")
+ok("Table mapping relative to caller", i.get_source_rid().get_UID() == "data4" and i.get_sink_rid().get_UID() == "data3")
+i = t.get_mapping(sourceUID="source",dataLUID="data4",sinkUID="sink")
+ok("Table mapping not reversed in place", i.get_source_rid().get_UID() == "data3" and i.get_sink_rid().get_UID() == "data4")
+try:
+    t.get_mapping(sourceUID="source",dataLUID="data4",sinkUID="foo")
+    ok("Table rejects other dataproviders", False)
+except ValueError:
+    ok("Table rejects other dataproviders", True)
+
+#modify the table and save it in one transaction
+i = t.get_mapping(sourceUID="source",dataLUID="new1",sinkUID="sink")
+i.set_sink_rid(Rid(uid="new2",mtime=now))
+t.save_mapping(i)
+ok("Table unsaved mappings available", t.get_matching_UID("new1") == "new2")
+i = t.get_mapping(sourceUID="source",dataLUID="data5",sinkUID="sink")
+t.delete_mapping(i)
+n.save_mappings_table(t)
+ok("Table saved", not t.is_dirty() and i.oid != None)
+ok("Table saved new mapping", n.get_matching_UID(sourceUID="source", dataLUID="new1",sinkUID="sink") == "new2")
+ok("Table saved deleted mapping", n.get_matching_UID(sourceUID="source", dataLUID="data5",sinkUID="sink") == None)
+ok("Table rids", sorted(n.get_mappings_table("source","sink").get_rids("sink").keys()) == ["data4","new2"])
+
+#a failure part way through saving saves nothing
+good = MappingDB.Mapping(None,sourceUID="source",sourceRid=Rid(uid="good1",mtime=now),sinkUID="sink",sinkRid=Rid(uid="good2",mtime=now))
+bad = MappingDB.Mapping(None,sourceUID="source",sourceRid=Rid(uid="bad1",mtime=now),sinkUID="sink",sinkRid=None)
+try:
+    n.save_mappings([good, bad])
+    ok("Save mappings fails", False)
+except AttributeError:
+    ok("Save mappings fails", True)
+ok("Failed save rolled back", n.get_matching_UID(sourceUID="source", dataLUID="good1",sinkUID="sink") == None and good.oid == None)
+
 n.save()
 n.close()
 finished()
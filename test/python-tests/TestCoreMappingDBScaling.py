@@ -0,0 +1,69 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.MappingDB as MappingDB
+import conduit.utils as Utils
+from conduit.datatypes import Rid
+
+import time
+import datetime
+
+#Measures the per item cost of looking up mappings as the mapping DB
+#grows, and checks that the lookups are index backed. Wall clock times are
+#noisy, so the cost at the largest size need only be within MAX_SLOWDOWN
+#times that at the smallest
+SIZES = (1000, 10000, 50000)
+LOOKUPS = 500
+MAX_SLOWDOWN = 5
+
+FILE=os.path.join(os.environ['TEST_DIRECTORY'], "test-%s.db" % Utils.random_string())
+m = MappingDB.MappingDB(FILE)
+now = datetime.datetime.now()
+
+def fill(start, end):
+    mappings = []
+    for j in xrange(start, end):
+        mappings.append(MappingDB.Mapping(
+                            None,
+                            sourceUID="source",
+                            sourceRid=Rid(uid="src%d" % j,mtime=now),
+                            sinkUID="sink",
+                            sinkRid=Rid(uid="snk%d" % j,mtime=now)))
+    m.save_mappings(mappings)
+
+lookupCosts = []
+tableCosts = []
+size = 0
+for s in SIZES:
+    fill(size, s)
+    size = s
+
+    #one query per item
+    t = time.time()
+    for j in xrange(0, s, s/LOOKUPS):
+        luid = m.get_matching_UID(sourceUID="source", dataLUID="src%d" % j, sinkUID="sink")
+    lookupCosts.append( (time.time()-t)/LOOKUPS )
+    ok("%d mappings: %.3fms per get_matching_UID" % (s, lookupCosts[-1]*1000), luid == "snk%d" % j)
+
+    #one query per sync
+    t = time.time()
+    table = m.get_mappings_table("source", "sink")
+    for j in xrange(0, s):
+        luid = table.get_matching_UID("snk%d" % j)
+    tableCosts.append( (time.time()-t)/s )
+    ok("%d mappings: %.3fms per item using a MappingTable" % (s, tableCosts[-1]*1000), len(table) == s and luid == "src%d" % (s-1))
+
+#Without indexes the lookup cost scales with the number of rows (50x here)
+ok("Per item lookup cost %.1fx" % (lookupCosts[-1]/max(lookupCosts[0], 1e-6)),
+        lookupCosts[-1] <= MAX_SLOWDOWN * max(lookupCosts[0], 1e-6))
+ok("Per item table cost %.1fx" % (tableCosts[-1]/max(tableCosts[0], 1e-6)),
+        tableCosts[-1] <= MAX_SLOWDOWN * max(tableCosts[0], 1e-6))
+indexes = [str(name) for name, in m._db.select("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'mappings'")]
+ok("Mappings indexed %s" % indexes, len([name for name,fields in MappingDB.DB_INDEXES if name in indexes]) == len(MappingDB.DB_INDEXES))
+plan = " ".join([str(row) for row in m._db.select(
+                "EXPLAIN QUERY PLAN SELECT oid FROM mappings WHERE sourceUID = ? AND sinkUID = ? AND sourceDataLUID = ?",
+                ("source", "sink", "src0"))])
+ok("Lookups use an index (%s)" % plan, "INDEX" in plan.upper())
+
+m.close()
+finished()
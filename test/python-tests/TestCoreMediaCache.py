@@ -0,0 +1,79 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.MediaCache as MediaCache
+import conduit.utils.MediaFile as MediaFile
+import conduit.datatypes.Video as Video
+import conduit.utils as Utils
+
+import threading
+
+#count the number of times media files are discovered, without needing
+#GStreamer
+discovered = []
+def counting_discover(path):
+    discovered.append(path)
+    return {"mimetype":"video/x-fake", "duration":1000, "title":os.path.basename(path), "videorate":25.0, "image":threading.Lock()}
+MediaFile.discover = counting_discover
+MediaFile.GST_AVAILABLE = True
+
+def new_file(contents):
+    path = os.path.join(Utils.new_tempdir(), Utils.random_string())
+    f = open(path, "w")
+    f.write(contents)
+    f.close()
+    return path
+
+cacheFile = os.path.join(os.environ['TEST_DIRECTORY'], "media-%s.db" % Utils.random_string())
+cache = MediaCache.MediaCache(cacheFile)
+conduit.GLOBALS.mediaCache = cache
+
+a = new_file("not really audio")
+ok("Nothing cached", cache.lookup(a) == None)
+tags = MediaFile.MediaFile(a).get_media_tags()
+ok("Discovered tags", tags["mimetype"] == "video/x-fake" and len(discovered) == 1)
+ok("Unpicklable tags converted when discovered", type(tags["image"]) == str)
+tags = MediaFile.MediaFile(a).get_media_tags()
+ok("Tags cached", tags["duration"] == 1000 and tags["title"] == os.path.basename(a) and len(discovered) == 1)
+ok("Unpicklable tags cached as strings", type(tags["image"]) == str)
+ok("Frame rate cached", Video.Video(a).get_video_rate() == 25.0 and len(discovered) == 1)
+
+mtime = os.stat(a).st_mtime
+os.utime(a, (mtime - 60, mtime - 60))
+MediaFile.MediaFile(a).get_media_tags()
+ok("Tags invalidated by mtime", len(discovered) == 2)
+
+f = open(a, "a")
+f.write("!")
+f.close()
+os.utime(a, (mtime - 60, mtime - 60))
+MediaFile.MediaFile(a).get_media_tags()
+ok("Tags invalidated by size", len(discovered) == 3)
+
+cache.forget(a)
+ok("Tags forgotten", cache.lookup(a) == None)
+
+#batch discovery
+paths = [new_file("%s" % i) for i in range(0, 10)]
+del discovered[:]
+files = [MediaFile.MediaFile(p) for p in paths] + [MediaFile.MediaFile(paths[0])]
+MediaFile.prefetch_media_tags(files)
+ok("Discovered files in parallel", sorted(discovered) == sorted(paths))
+ok("Prefetched tags", len([f for f in files if f.get_media_tags()["title"] == os.path.basename(f.get_local_uri())]) == 11)
+ok("Tags used once prefetched", len(discovered) == 10)
+
+del discovered[:]
+tags = MediaFile.get_metadata_many(paths)
+ok("Parallel tags cached", len(tags) == 10 and len(discovered) == 0)
+
+#cache persists
+cache.save()
+cache.close()
+cache = MediaCache.MediaCache(cacheFile)
+conduit.GLOBALS.mediaCache = cache
+MediaFile.MediaFile(paths[5]).get_media_tags()
+ok("Tags cached after restart", len(discovered) == 0)
+
+conduit.GLOBALS.mediaCache = None
+cache.close()
+finished()
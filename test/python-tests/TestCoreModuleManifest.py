@@ -0,0 +1,87 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.Module as Module
+import conduit.TypeConverter as TypeConverter
+import conduit.ModuleManifest as ModuleManifest
+import conduit.utils as Utils
+
+import os
+import time
+
+#Checks that modules loaded from the manifest give the same wrappers as
+#when every file is imported, and that files are only imported when used
+manifestFile = os.path.join(os.environ['TEST_DIRECTORY'], "modules-%s.manifest" % Utils.random_string())
+moduleDir = os.path.join(os.environ['TEST_DIRECTORY'], "ManifestModule")
+if not os.path.exists(moduleDir):
+    os.mkdir(moduleDir)
+moduleFile = os.path.join(moduleDir, "ManifestModule.py")
+MODULE = '''
+import conduit.dataproviders
+import conduit.dataproviders.DataProvider as DataProvider
+MODULES = {"ManifestSource" : { "type": "dataprovider" }}
+class ManifestSource(DataProvider.DataSource):
+    _name_ = "%s"
+    _module_type_ = "source"
+    _in_type_ = "text"
+    _out_type_ = "text"
+    _category_ = conduit.dataproviders.CATEGORY_NOTES
+'''
+f = open(moduleFile, "w")
+f.write(MODULE % "Before")
+f.close()
+
+def describe(manager):
+    wrappers = {}
+    for w in manager.get_all_modules():
+        wrappers[w.get_key()] = (w.name, w.description, w.icon_name, w.module_type, w.in_type,
+                w.out_type, w.configurable, w.concurrency, w.classname, w.category)
+    return wrappers
+
+def load():
+    manager = Module.ModuleManager([conduit.SHARED_MODULE_DIR, moduleDir], manifestFile)
+    manager.load_all(whitelist=None, blacklist=None)
+    return manager
+
+t = time.time()
+cold = load()
+coldTime = time.time() - t
+ok("Cold load imported %d files in %.2fs" % (len(cold.importedFiles), coldTime), len(cold.importedFiles) > 0)
+ok("Manifest saved", os.path.exists(manifestFile))
+
+t = time.time()
+warm = load()
+warmTime = time.time() - t
+ok("Warm load imported %d files in %.2fs" % (len(warm.importedFiles), warmTime), len(warm.importedFiles) < len(cold.importedFiles))
+#files with factories, and files without modules (which are not in the
+#manifest), are still imported
+described = [f for f in warm.importedFiles if warm.manifest.get(f) != None]
+ok("Only files with factories imported", len([f for f in described if not ModuleManifest.has_factory(warm.manifest.get(f))]) == 0)
+ok("Same wrappers (%d)" % len(cold.get_all_modules()), describe(cold) == describe(warm))
+ok("Categories are the same instances", warm.moduleWrappers["ManifestSource"].category is conduit.dataproviders.CATEGORY_NOTES)
+
+#converters
+coldConverter = TypeConverter.TypeConverter(cold)
+warmConverter = TypeConverter.TypeConverter(warm)
+ok("Same conversions", coldConverter.get_graph_description() == warmConverter.get_graph_description())
+converterFile = os.path.join(conduit.SHARED_MODULE_DIR, "ConverterModule.py")
+ok("Converters not imported", converterFile not in warm.importedFiles)
+text = warmConverter.convert("contact", "text", new_contact(None))
+ok("Converted using a lazy converter", text != None and "BEGIN:VCARD" in text.get_string() and converterFile in warm.importedFiles)
+
+#dataproviders are imported when instantiated
+ok("Source not imported", moduleFile not in warm.importedFiles)
+wrapper = warm.get_module_wrapper_with_instance("ManifestSource")
+ok("Source instantiated", wrapper.module != None and wrapper.module.__class__.__name__ == "ManifestSource" and moduleFile in warm.importedFiles)
+
+#modified files are imported again
+f = open(moduleFile, "w")
+f.write(MODULE % "After")
+f.close()
+os.utime(moduleFile, (time.time(), time.time() + 10))
+modified = load()
+ok("Modified file imported", moduleFile in modified.importedFiles and modified.moduleWrappers["ManifestSource"].name == "After")
+modified = load()
+ok("Modified file described", moduleFile not in modified.importedFiles and modified.moduleWrappers["ManifestSource"].name == "After")
+
+finished()
@@ -0,0 +1,185 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.dataproviders.DataProvider as DataProvider
+import conduit.datatypes.File as File
+import conduit.datatypes.Text as Text
+import conduit.utils as Utils
+import conduit.modules.NetworkModule.Streaming as Streaming
+import conduit.modules.NetworkModule.XMLRPCUtils as XMLRPCUtils
+
+import time
+import cPickle
+import hashlib
+import resource
+import datetime
+import cStringIO
+
+#Checks the contents of files are streamed between peers, and never
+#held in memory
+FILE_SIZE = 64*1024*1024
+SERVER_PORT = 3499
+
+def new_file(size, name):
+    path = os.path.join(Utils.new_tempdir(), name)
+    f = open(path, "wb")
+    chunk = os.urandom(1024*1024)
+    written = 0
+    while written < size:
+        f.write(chunk[:size-written])
+        written += len(chunk)
+    f.close()
+    f = File.File(URI=path)
+    f.set_UID(name)
+    f.set_mtime(datetime.datetime(2007, 1, 1))
+    return f
+
+def digest(path):
+    h = hashlib.md5()
+    f = open(path, "rb")
+    chunk = f.read(1024*1024)
+    while chunk:
+        h.update(chunk)
+        chunk = f.read(1024*1024)
+    f.close()
+    return h.hexdigest()
+
+def max_rss():
+    #kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class FileStore(DataProvider.TwoWay):
+    _name_ = "File Store"
+    _module_type_ = "twoway"
+    _in_type_ = "file"
+    _out_type_ = "file"
+    _icon_ = "folder"
+
+    def __init__(self):
+        DataProvider.TwoWay.__init__(self)
+        self.files = {}
+
+    def get_all(self):
+        return self.files.keys()
+
+    def get(self, LUID):
+        return self.files[LUID]
+
+    def put(self, f, overwrite, LUID=None):
+        self.files[f.get_UID()] = f
+        return f.get_rid()
+
+    def get_UID(self):
+        return "FileStore"
+
+test = SimpleTest()
+
+small = new_file(1000, "small.txt")
+big = new_file(FILE_SIZE, "big.bin")
+bigDigest = digest(big.get_local_uri())
+
+#files are not pickled
+streams = Streaming.StreamServer()
+streams.start()
+client = Streaming.StreamClient("localhost", streams.port)
+
+binary = XMLRPCUtils.pickle_obj_to_binary(small, offer=streams.offer)
+ok("File contents not pickled (%s bytes)" % len(binary.data), len(binary.data) < 1000)
+f = XMLRPCUtils.unpickle_obj_from_binary(binary, fetch=client.fetch)
+ok("File streamed", open(f.get_local_uri()).read() == open(small.get_local_uri()).read())
+ok("File name and UID retained", f.get_filename() == "small.txt" and f.get_UID() == "small.txt")
+ok("File class retained", f.__class__ == File.File)
+try:
+    client.fetch(Utils.random_string())
+    ok("Files only streamed once offered", False)
+except IOError:
+    ok("Files only streamed once offered", True)
+
+#other data, and data pickled by peers that do not stream files
+text = Text.Text(text="hello")
+t = XMLRPCUtils.unpickle_obj_from_binary(XMLRPCUtils.pickle_obj_to_binary(text, offer=streams.offer), fetch=client.fetch)
+ok("Other data pickled", t.get_string() == "hello")
+f = XMLRPCUtils.unpickle_obj_from_binary(XMLRPCUtils.pickle_obj_to_binary(small), fetch=client.fetch)
+ok("Files pickled by older peers", open(f.get_local_uri()).read() == open(small.get_local_uri()).read())
+
+#only the classes of files are imported
+class LocalFile(File.File):
+    pass
+f = Streaming.loads(Streaming.dumps(LocalFile(URI=small.get_local_uri()), streams.offer), client.fetch)
+ok("Files of other classes sent as their base class", f.__class__ == File.File)
+s = cStringIO.StringIO()
+pickler = cPickle.Pickler(s, cPickle.HIGHEST_PROTOCOL)
+pickler.persistent_id = lambda o: isinstance(o, File.File) and ("os.system", {}, streams.offer(small.get_local_uri())) or None
+pickler.dump(small)
+try:
+    Streaming.loads(s.getvalue(), client.fetch)
+    ok("Other classes refused", False)
+except cPickle.UnpicklingError:
+    ok("Other classes refused", True)
+
+#size limit
+limited = Streaming.StreamServer(maxFileSize=100, timeout=0.5)
+limited.start()
+limitedClient = Streaming.StreamClient("localhost", limited.port)
+try:
+    limitedClient.send(small.get_local_uri())
+    ok("Files larger than the limit refused", False)
+except IOError:
+    ok("Files larger than the limit refused", True)
+
+#tokens, and received files, expire
+tiny = new_file(10, "tiny.txt")
+token = limitedClient.send(tiny.get_local_uri())
+path, t = limited._received[token]
+offer = limited.offer(tiny.get_local_uri())
+time.sleep(1)
+try:
+    limited.pop_received(token)
+    ok("Received files expire", False)
+except IOError:
+    ok("Received files expire", not os.path.exists(path))
+ok("Offers expire", limited.pop_offer(offer) == None and os.path.exists(tiny.get_local_uri()))
+limited.stop()
+
+#memory is independent of file size
+rss = max_rss()
+binary = XMLRPCUtils.pickle_obj_to_binary(big, offer=client.send)
+f = XMLRPCUtils.unpickle_obj_from_binary(binary, fetch=streams.pop_received)
+ok("Large file sent (%sMB)" % (FILE_SIZE/1024/1024), digest(f.get_local_uri()) == bigDigest)
+binary = XMLRPCUtils.pickle_obj_to_binary(big, offer=streams.offer)
+f = XMLRPCUtils.unpickle_obj_from_binary(binary, fetch=client.fetch)
+ok("Large file received", digest(f.get_local_uri()) == bigDigest)
+used = max_rss() - rss
+ok("Memory used (%sKB) is less than the file size" % used, used*1024 < FILE_SIZE/4)
+streams.stop()
+
+#dataprovider over xml-rpc
+store = test.wrap_dataprovider(FileStore())
+server = XMLRPCUtils.DataproviderServer(store, SERVER_PORT)
+server.start()
+info = server.get_info()
+ok("Server advertises stream port", info["stream_port"] == server.streams.port)
+
+params = {}
+for key, val in info.iteritems():
+    params['_' + key + '_'] = val
+params['url'] = "http://localhost:%s/" % SERVER_PORT
+params['uid'] = "remote"
+remote = type(params['url'], (XMLRPCUtils.DataProviderClient, ), params)()
+ok("Client streams files", remote.streams != None)
+
+remote.put(big, False)
+f = store.module.files["big.bin"]
+ok("Put streamed", digest(f.get_local_uri()) == bigDigest)
+f = remote.get("big.bin")
+ok("Get streamed", digest(f.get_local_uri()) == bigDigest and f.get_filename() == "big.bin")
+
+#clients without a stream port pickle files in the xml-rpc call
+del params['_stream_port_']
+remote = type(params['url'], (XMLRPCUtils.DataProviderClient, ), params)()
+remote.put(small, False)
+f = remote.get("small.txt")
+ok("Files pickled when not streaming", remote.streams == None and open(f.get_local_uri()).read() == open(small.get_local_uri()).read())
+
+server.stop()
+finished()
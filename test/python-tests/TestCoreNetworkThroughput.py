@@ -0,0 +1,155 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.dataproviders.DataProvider as DataProvider
+import conduit.datatypes.Note as Note
+import conduit.Exceptions as Exceptions
+import conduit.modules.NetworkModule.XMLRPCUtils as XMLRPCUtils
+
+import time
+import threading
+import xmlrpclib
+
+#Measures the throughput of a networked dataprovider on a loopback peer
+NUM_NOTES = 1000
+BATCH_SIZE = 50
+SERVER_PORT = 3498
+
+class NoteStore(DataProvider.TwoWay):
+    _name_ = "Note Store"
+    _module_type_ = "twoway"
+    _in_type_ = "note"
+    _out_type_ = "note"
+    _icon_ = "tomboy"
+
+    def __init__(self):
+        DataProvider.TwoWay.__init__(self)
+        self.notes = {}
+        self.calls = 0
+
+    def get_all(self):
+        return self.notes.keys()
+
+    def get(self, LUID):
+        self.calls += 1
+        return self.notes[LUID]
+
+    def put(self, note, overwrite, LUID=None):
+        self.calls += 1
+        if note.get_title() == "error":
+            raise Exceptions.SyncronizeError("Bad note")
+        if LUID == None:
+            LUID = note.get_title()
+        note.set_UID(LUID)
+        self.notes[LUID] = note
+        return note.get_rid()
+
+    def delete(self, LUID):
+        self.calls += 1
+        del self.notes[LUID]
+
+    def get_UID(self):
+        return "NoteStore"
+
+def new_client(info):
+    params = {}
+    for key, val in info.iteritems():
+        params['_' + key + '_'] = val
+    params['url'] = "http://localhost:%s/" % SERVER_PORT
+    params['uid'] = "remote"
+    return type(params['url'], (XMLRPCUtils.DataProviderClient, ), params)()
+
+def put_reference(notes):
+    #the previous client made each call in a new connection
+    for n in notes:
+        server = xmlrpclib.Server("http://localhost:%s/" % SERVER_PORT, allow_none=True)
+        server.put(XMLRPCUtils.pickle_obj_to_binary(n), False, None)
+        server("close")()
+
+test = SimpleTest()
+store = test.wrap_dataprovider(NoteStore())
+server = XMLRPCUtils.DataproviderServer(store, SERVER_PORT)
+server.start()
+remote = new_client(server.get_info())
+ok("Client makes batch calls", remote.batchCalls == True)
+
+notes = [Note.Note(title="Note-%d" % i, contents="Contents of note %d" % i) for i in range(NUM_NOTES)]
+
+#status is kept locally
+remote.set_status(DataProvider.STATUS_SYNC)
+ok("Status kept locally", remote.get_status() == DataProvider.STATUS_SYNC and store.module.get_status() == DataProvider.STATUS_NONE)
+
+#batched calls
+rids = remote.put_many([(notes[0], False, None), (Note.Note(title="error", contents=""), False, None), (notes[1], False, None)])
+ok("Put many", rids[0].get_UID() == "Note-0" and rids[2].get_UID() == "Note-1")
+ok("Put many errors returned per item", isinstance(rids[1], Exceptions.SyncronizeError))
+rids = remote.get_rid_bulk(["Note-0", "Note-1"])
+ok("Got Rids in bulk", rids["Note-0"] == store.module.notes["Note-0"].get_rid())
+errors = remote.delete_many(["Note-0", "missing"])
+ok("Delete many", errors[0] == None and errors[1] != None and "Note-0" not in store.module.notes)
+fault = XMLRPCUtils.exception_to_fault(KeyError("missing"), handling=False)
+ok("Returned errors described (%s)" % fault.faultString, fault.faultString == "KeyError: 'missing'")
+try:
+    remote.get_all_with_rids()
+    ok("Unimplemented methods raise NotImplementedError", False)
+except NotImplementedError:
+    ok("Unimplemented methods raise NotImplementedError", True)
+
+#clients of older servers do not make batch calls
+info = server.get_info()
+del info["batch_calls"]
+try:
+    new_client(info).put_many([(notes[0], False, None)])
+    ok("Older servers put one at a time", False)
+except NotImplementedError:
+    ok("Older servers put one at a time", True)
+
+#throughput
+#the previous client sent pickles, which must be allowed
+conduit.GLOBALS.settings.set("network_allow_pickle", True)
+store.module.notes = {}
+t = time.time()
+put_reference(notes)
+tr = time.time() - t
+conduit.GLOBALS.settings.set("network_allow_pickle", False)
+ok("Put %d notes, new connection per call: %.2fs" % (NUM_NOTES, tr), len(store.module.notes) == NUM_NOTES)
+
+store.module.notes = {}
+t = time.time()
+for n in notes:
+    remote.put(n, False)
+tk = time.time() - t
+ok("Put %d notes, kept alive: %.2fs" % (NUM_NOTES, tk), len(store.module.notes) == NUM_NOTES)
+
+store.module.notes = {}
+t = time.time()
+for i in range(0, NUM_NOTES, BATCH_SIZE):
+    remote.put_many([(n, False, None) for n in notes[i:i+BATCH_SIZE]])
+tb = time.time() - t
+ok("Put %d notes, batches of %d: %.2fs" % (NUM_NOTES, BATCH_SIZE, tb), len(store.module.notes) == NUM_NOTES)
+
+t = time.time()
+for LUID in store.module.get_all():
+    remote.get(LUID)
+tg = time.time() - t
+t = time.time()
+rids = remote.get_rid_bulk(store.module.get_all())
+tgb = time.time() - t
+ok("Rids of %d notes: %.2fs one at a time, %.2fs in bulk" % (NUM_NOTES, tg, tgb), len(rids) == NUM_NOTES)
+
+#parallel clients
+def put_notes(offset):
+    for n in notes[offset::4]:
+        remote.put(n, False)
+store.module.notes = {}
+threads = [threading.Thread(target=put_notes, args=(i,)) for i in range(4)]
+t = time.time()
+for th in threads:
+    th.start()
+for th in threads:
+    th.join()
+t = time.time() - t
+ok("Put %d notes from 4 threads: %.2fs" % (NUM_NOTES, t), len(store.module.notes) == NUM_NOTES)
+
+server.stop()
+finished()
@@ -0,0 +1,63 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.Exceptions as Exceptions
+
+NUM_DATA = 120
+BATCH_SIZE = 50
+
+def sync(batchSize, numData=NUM_DATA, errorAfter=999, test=None):
+    conduit.GLOBALS.settings.set("sync_batch_size", batchSize)
+    if test == None:
+        test = SimpleSyncTest()
+        test.prepare(
+                test.get_dataprovider("TestSource"),
+                test.get_dataprovider("TestSink"))
+        test.set_two_way_policy({"conflict":"skip","deleted":"replace"})
+        test.set_two_way_sync(False)
+    test.configure(
+            source={"numData":numData,"errorAfter":999999},
+            sink={"errorAfter":errorAfter}
+            )
+    test.get_sink().module.numBatches = 0
+    test.get_sink().module.count = 0
+    test.sync(debug=False)
+
+    mappings = conduit.GLOBALS.mappingDB.get_mappings_for_dataproviders(test.get_source().get_UID(), test.get_sink().get_UID())
+    return test, len(mappings)
+
+for batchSize in (1, BATCH_SIZE):
+    ok("---- BATCH SIZE %s" % batchSize, True)
+    numBatches = (batchSize > 1 and (NUM_DATA+batchSize-1)/batchSize) or 0
+    test,numMappings = sync(batchSize)
+    ok("Sync completed", test.sync_aborted() == False and test.sync_errored() == False)
+    ok("All data put (%s mappings)" % numMappings, numMappings == NUM_DATA)
+    ok("Put in %s batches" % numBatches, test.get_sink().module.numBatches == numBatches)
+
+    #deleted data is deleted in batches too
+    test,numMappings = sync(batchSize, numData=20, test=test)
+    ok("Deleted data (%s mappings)" % numMappings, numMappings == 20)
+    numBatches = (batchSize > 1 and (NUM_DATA-20+batchSize-1)/batchSize) or 0
+    ok("Deleted in %s batches" % numBatches, test.get_sink().module.numBatches == numBatches)
+
+    #errors are handled per item
+    test,numMappings = sync(batchSize, errorAfter=60)
+    ok("Sync errored", test.sync_aborted() == False and test.sync_errored() == True)
+    ok("Data before the error put (%s mappings)" % numMappings, numMappings == 60)
+
+#if the whole batch fails each item is put on its own
+def fail_put_many(items):
+    raise Exceptions.SyncronizeError("Batch failed")
+test = SimpleSyncTest()
+test.prepare(
+        test.get_dataprovider("TestSource"),
+        test.get_dataprovider("TestSink"))
+test.set_two_way_policy({"conflict":"skip","deleted":"replace"})
+test.set_two_way_sync(False)
+test.get_sink().module.put_many = fail_put_many
+test,numMappings = sync(BATCH_SIZE, test=test)
+ok("Sync completed after a failed batch", test.sync_aborted() == False and test.sync_errored() == False)
+ok("Failed batches put one at a time (%s mappings)" % numMappings, numMappings == NUM_DATA)
+
+conduit.GLOBALS.settings.set("sync_batch_size", 1)
+finished()
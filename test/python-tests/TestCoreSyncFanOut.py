@@ -0,0 +1,77 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.Synchronization as Synchronization
+import conduit.utils as Utils
+
+#Checks that in a one way sync to many sinks each item is got from the
+#source once, and converted once for each distinct sink type
+NUM_DATA = 20
+#conversion args for each sink, None for a plain TestSink
+ENCODINGS = (None, None, "foo", "foo", "bar")
+NUM_TYPES = 3
+
+for pipelined in (False, True):
+    ok("---- PIPELINED: %s" % pipelined, True)
+    conduit.GLOBALS.settings.set("sync_pipelined", pipelined)
+
+    test = SimpleSyncTest()
+    sinks = []
+    for encoding in ENCODINGS:
+        if encoding == None:
+            sink = test.get_dataprovider("TestSink")
+        else:
+            sink = test.get_dataprovider("TestConversionArgs")
+            sink.module.set_configuration({"encoding":encoding})
+        sinks.append(sink)
+    test.prepare(test.get_dataprovider("TestSource"), sinks[0])
+    for sink in sinks[1:]:
+        test.add_extra_sink(sink)
+    test.set_two_way_policy({"conflict":"skip","deleted":"skip"})
+    test.set_two_way_sync(False)
+    test.configure(source={"numData":NUM_DATA})
+
+    gets = []
+    get = test.get_source().module.get
+    def counted_get(LUID):
+        gets.append(LUID)
+        return get(LUID)
+    test.get_source().module.get = counted_get
+
+    converts = []
+    convert = test.type_converter.convert
+    def counted_convert(fromType, toType, data):
+        converts.append(toType)
+        return convert(fromType, toType, data)
+    test.type_converter.convert = counted_convert
+
+    test.sync(debug=False)
+    aborted,errored,conflicted = test.get_sync_result()
+    ok("Sync completed", aborted == False and errored == False and conflicted == False)
+
+    for sink in sinks:
+        mappings = conduit.GLOBALS.mappingDB.get_mappings_for_dataproviders(test.get_source().get_UID(), sink.get_UID())
+        ok("All data put into %s (%s mappings)" % (sink.get_input_type(), len(mappings)), len(mappings) == NUM_DATA)
+
+    ok("Each item got once (%s gets)" % len(gets), len(gets) == NUM_DATA)
+    ok("Each item converted once per type (%s conversions)" % len(converts), len(converts) == NUM_DATA*NUM_TYPES)
+
+    #a fatal error in one sink does not stop the others. All data is
+    #modified so it is put again
+    test.get_source().module.set_configuration({"newHash":True})
+    test.get_sink(0).module.set_configuration({"errorAfter":0,"errorFatal":True})
+    test.get_sink(1).module.count = 0
+    test.sync(debug=False)
+    ok("Sync completed after fatal error in one sink", test.sync_aborted() == False)
+    ok("Modified data got once (%s gets)" % len(gets), len(gets) == 2*NUM_DATA)
+    ok("Other sinks still synced (%s put)" % test.get_sink(1).module.count, test.get_sink(1).module.count == NUM_DATA)
+
+#each sink is given its own copy of a file, which can be renamed or moved
+#without changing the others
+f = Utils.new_tempfile("fan out")
+c = Synchronization._copy_data(f)
+ok("Copied file has its own implementation", c._get_impl() is not f._get_impl())
+ok("Copied file is the same file", c._get_text_uri() == f._get_text_uri() and c.get_size() == f.get_size())
+
+conduit.GLOBALS.settings.set("sync_pipelined", False)
+finished()
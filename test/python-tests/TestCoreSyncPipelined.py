@@ -0,0 +1,97 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.Exceptions as Exceptions
+import conduit.utils.Thread as Thread
+
+import time
+import threading
+
+NUM_DATA = 8
+
+def sync_slow_source(pipelined, twoWay):
+    """
+    @returns: The time taken, and the most get() calls made at once
+    """
+    conduit.GLOBALS.settings.set("sync_pipelined", pipelined)
+    test = SimpleSyncTest()
+    if twoWay:
+        source = test.get_dataprovider("TestTwoWay")
+        sink = test.get_dataprovider("TestTwoWay")
+    else:
+        source = test.get_dataprovider("TestSource")
+        sink = test.get_dataprovider("TestSink")
+    test.prepare(source, sink)
+    test.set_two_way_policy({"conflict":"skip","deleted":"skip"})
+    test.configure(
+            source={"numData":NUM_DATA,"slow":True},
+            sink={"numData":1}
+            )
+    test.set_two_way_sync(twoWay)
+
+    #count the simultaneous get() calls
+    lock = threading.Lock()
+    running = []
+    maxRunning = [0]
+    get = source.module.get
+    def counted_get(LUID):
+        lock.acquire()
+        running.append(LUID)
+        maxRunning[0] = max(maxRunning[0], len(running))
+        lock.release()
+        try:
+            return get(LUID)
+        finally:
+            lock.acquire()
+            running.remove(LUID)
+            lock.release()
+    source.module.get = counted_get
+
+    t = time.time()
+    test.sync(debug=False)
+    t = time.time() - t
+
+    ok("Sync completed", test.sync_aborted() == False and test.sync_errored() == False)
+    mappings = conduit.GLOBALS.mappingDB.get_mappings_for_dataproviders(source.get_UID(), test.get_sink().get_UID())
+    if not twoWay:
+        ok("All data put (%s mappings)" % len(mappings), len(mappings) == NUM_DATA)
+    return t, maxRunning[0]
+
+ok("TestSource supports %s simultaneous get()" % TestModule.TestSource._concurrency_, TestModule.TestSource._concurrency_ > 1)
+ok("TestSink does not support simultaneous put()", TestModule.TestSink._concurrency_ == 1)
+
+#each get() sleeps for 1s, so overlapping them saves seconds, far more
+#than the noise in the wall clock times
+for twoWay in (False, True):
+    ok("---- %s WAY" % (twoWay and "TWO" or "ONE"), True)
+    serial, serialGets = sync_slow_source(False, twoWay)
+    pipelined, pipelinedGets = sync_slow_source(True, twoWay)
+    ok("Serial sync gets one at a time", serialGets == 1)
+    if twoWay:
+        print "Pipelined sync %.1fs v %.1fs serially" % (pipelined, serial)
+    else:
+        ok("Pipelined sync gets simultaneously (%s at once)" % pipelinedGets, pipelinedGets > 1)
+        ok("Pipelined sync faster (%.1fs v %.1fs serially)" % (pipelined, serial), pipelined < 0.75*serial)
+
+#jobs that never ran raise StopSync instead of returning None
+pool = Thread.WorkerPool(1, "Cancel")
+started = threading.Event()
+release = threading.Event()
+def block():
+    started.set()
+    release.wait()
+    return True
+first = pool.submit(block)
+second = pool.submit(block)
+started.wait()
+pool.stop()
+release.set()
+ok("Running job completes", first.get() == True)
+try:
+    second.get()
+    ok("Cancelled job raises StopSync", False)
+except Exceptions.StopSync:
+    ok("Cancelled job raises StopSync", second.is_cancelled())
+
+conduit.GLOBALS.settings.set("sync_pipelined", False)
+finished()
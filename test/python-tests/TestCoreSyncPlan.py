@@ -0,0 +1,109 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.MappingDB as MappingDB
+import conduit.SyncPlan as SyncPlan
+from conduit.datatypes import Rid
+
+import time
+
+#Checks the two way sync plan, and that it takes linear time. Wall clock
+#times are noisy, so the time per change at the largest size need only be
+#within MAX_SLOWDOWN times that at the smallest
+SIZES = (10000, 100000)
+MAX_SLOWDOWN = 5
+
+def make_mappings(n):
+    mappings = MappingDB.MappingTable("source", "sink")
+    for i in xrange(0, n):
+        mappings.add(MappingDB.Mapping(
+                            None,
+                            sourceUID="source",
+                            sourceRid=Rid(uid="src%d" % i),
+                            sinkUID="sink",
+                            sinkRid=Rid(uid="snk%d" % i)))
+    return mappings
+
+#Of n mapped items, split in fifths: the source modified the first two
+#fifths, the sink modified the second and deleted the third, and the source
+#deleted the fourth. Both sides also added n/5 new items.
+def make_changes(n):
+    f = n/5
+    sourceChanges = (
+            ["srcnew%d" % i for i in xrange(0, f)],
+            ["src%d" % i for i in xrange(0, 2*f)],
+            ["src%d" % i for i in xrange(3*f, 4*f)])
+    sinkChanges = (
+            ["snknew%d" % i for i in xrange(0, f)],
+            ["snk%d" % i for i in xrange(f, 2*f)],
+            ["snk%d" % i for i in xrange(2*f, 3*f)])
+    return sourceChanges, sinkChanges
+
+#The previous implementation, which used list.count and list.remove
+def plan_reference(source, sourceChanges, sink, sinkChanges, mappings):
+    def modified_and_deleted(dp1, modified, dp2, deleted):
+        found = []
+        for i in modified[:]:
+            matchingUID = mappings.get_matching_UID(i)
+            if deleted.count(matchingUID) != 0:
+                deleted.remove(matchingUID)
+                modified.remove(i)
+                found += [(dp2, matchingUID, dp1)]
+        return found
+    sourceAdded, sourceModified, sourceDeleted = [l[:] for l in sourceChanges]
+    sinkAdded, sinkModified, sinkDeleted = [l[:] for l in sinkChanges]
+    toput = []
+    todelete = []
+    tocomp = []
+    toput += [(source, i, sink) for i in sourceAdded]
+    toput += [(sink, i, source) for i in sinkAdded]
+    todelete += modified_and_deleted(source, sourceModified, sink, sinkDeleted)
+    todelete += modified_and_deleted(sink, sinkModified, source, sourceDeleted)
+    todelete += [(source, i, sink) for i in sourceDeleted]
+    todelete += [(sink, i, source) for i in sinkDeleted]
+    for i in sourceModified[:]:
+        matchingUID = mappings.get_matching_UID(i)
+        if sinkModified.count(matchingUID) != 0:
+            sourceModified.remove(i)
+            sinkModified.remove(matchingUID)
+            tocomp.append( (source, i, sink, matchingUID) )
+    toput += [(source, i, sink) for i in sourceModified]
+    toput += [(sink, i, source) for i in sinkModified]
+    return toput, todelete, tocomp
+
+#small plan, checked item by item
+mappings = make_mappings(5)
+plan = SyncPlan.plan_two_way_sync(
+                "source", (["srcnew"], ["src0","src1","src2"], ["src4"]),
+                "sink", (["snknew"], ["snk1","snk4"], ["snk2","snk3"]),
+                mappings)
+ok("Added data put", plan.toput[0:2] == [("source","srcnew","sink"), ("sink","snknew","source")])
+ok("Modified and deleted data deleted", plan.todelete == [("sink","snk2","source"), ("source","src4","sink"), ("sink","snk3","source")])
+ok("Modified on both sides compared", plan.tocomp == [("source","src1","sink","snk1")])
+ok("Modified data put", plan.toput[2:] == [("source","src0","sink")])
+ok("Plan length", len(plan) == 7)
+
+costs = []
+for n in SIZES:
+    mappings = make_mappings(n)
+    sourceChanges, sinkChanges = make_changes(n)
+    t = time.time()
+    plan = SyncPlan.plan_two_way_sync("source", sourceChanges, "sink", sinkChanges, mappings)
+    t = time.time() - t
+    costs.append(t/n)
+
+    f = n/5
+    ok("%d changes: planned in %.2fs" % (n, t),
+            len(plan.toput) == 3*f and len(plan.todelete) == 2*f and len(plan.tocomp) == f)
+
+    if n == SIZES[0]:
+        tr = time.time()
+        toput, todelete, tocomp = plan_reference("source", sourceChanges, "sink", sinkChanges, mappings)
+        tr = time.time() - tr
+        ok("%d changes: %.2fs (previous implementation), same plan" % (n, tr),
+                toput == plan.toput and todelete == plan.todelete and tocomp == plan.tocomp)
+
+ok("Time per change scales linearly (%s)" % ", ".join(["%.1fus" % (c*1000000) for c in costs]),
+        costs[-1] <= MAX_SLOWDOWN * max(costs[0], 1e-6))
+
+finished()
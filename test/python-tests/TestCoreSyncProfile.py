@@ -0,0 +1,84 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.utils as Utils
+import conduit.utils.Profile as Profile
+
+#Checks the timings recorded during a sync
+NUM_DATA = 10
+
+def sync(source, sink, sourceConfig={}, sinkConfig={}):
+    conduit.GLOBALS.settings.set("sync_batch_size", 1)
+    test = SimpleSyncTest()
+    test.prepare(
+            test.get_dataprovider(source),
+            test.get_dataprovider(sink))
+    test.set_two_way_policy({"conflict":"skip","deleted":"skip"})
+    test.set_two_way_sync(False)
+    test.configure(source=sourceConfig, sink=sinkConfig)
+    ok("Not synced yet", test.conduit.get_sync_report() == {})
+    test.sync(debug=False)
+    return test, test.conduit.get_sync_report()
+
+#profile class
+profile = Profile.SyncProfile()
+profile.record(Profile.DATAPROVIDER, "dp", "get", 0.5, 10)
+profile.record(Profile.DATAPROVIDER, "dp", "get", 0.25, 5)
+try:
+    profile.call(Profile.DATAPROVIDER, "dp", "put", lambda: 1/0)
+except ZeroDivisionError:
+    pass
+profile.call(Profile.DATAPROVIDER, "dp", "put_many", lambda: None, nbytes=20)
+profile.call(Profile.CONVERSION, "a->b", "convert", lambda x: x*2, 4, sizeof=lambda result: result)
+def not_implemented():
+    raise NotImplementedError
+try:
+    profile.call(Profile.DATAPROVIDER, "dp", "delete_many", not_implemented)
+except NotImplementedError:
+    pass
+report = profile.get_report()
+ok("Recorded calls", report["dataprovider/dp/get"] == (2, 0.75, 15))
+ok("Recorded failed calls", report["dataprovider/dp/put"][0] == 1)
+ok("Recorded bytes of calls", report["dataprovider/dp/put_many"][2] == 20 and report["conversion/a->b/convert"][2] == 8)
+ok("Unimplemented calls not recorded", "dataprovider/dp/delete_many" not in report)
+ok("Formatted slowest first", profile.format_report().split("\n")[2].endswith("dataprovider/dp/get"))
+
+#calls are timed by log_function_call
+calls = []
+@Utils.log_function_call(None, lambda seconds, result, error: calls.append((result, error.__class__)))
+def divide(a, b):
+    return a/b
+divide(4, 2)
+try:
+    divide(1, 0)
+except ZeroDivisionError:
+    pass
+ok("Timed calls passed result and error", calls == [(2, None.__class__), (None, ZeroDivisionError)])
+ok("Timed function keeps its name", divide.__name__ == "divide")
+
+#sync
+test,report = sync("TestSource", "TestSink", sourceConfig={"numData":NUM_DATA}, sinkConfig={"errorAfter":999})
+sourceUID = test.get_source().get_UID()
+sinkUID = test.get_sink().get_UID()
+ok("Sync completed", test.sync_aborted() == False and test.sync_errored() == False)
+ok("Got report %s" % report.keys(), len(report) > 0)
+for phase in ("configure", "refresh", "sync", "done"):
+    ok("Timed %s phase" % phase, report["phase/SyncWorker/%s" % phase][0] == 1)
+ok("Timed source refresh", report["dataprovider/%s/refresh" % sourceUID][0] == 1)
+ok("Timed sink refresh", report["dataprovider/%s/refresh" % sinkUID][0] == 1)
+ok("Timed get", report["dataprovider/%s/get" % sourceUID][0] == NUM_DATA)
+ok("Timed put", report["dataprovider/%s/put" % sinkUID][0] == NUM_DATA)
+ok("Timed conversion", report["conversion/test_type->test_type/convert"][0] == NUM_DATA)
+ok("Timed mapping DB", report["mappingdb/MappingDB/get_mappings_table"][0] == 1 and \
+                       report["mappingdb/MappingDB/save_mappings_table"][0] >= 1)
+ok("Phases take the whole sync",
+        sum([v[1] for k,v in report.items() if k.startswith("phase/")]) <= test.conduit._syncProfile.get_total_time() + 0.001)
+
+#bytes are counted for local files
+test,report = sync("TestFileSource", "TestFileSink")
+sourceUID = test.get_source().get_UID()
+calls,seconds,nbytes = report["dataprovider/%s/get" % sourceUID]
+ok("Counted bytes got (%s)" % nbytes, calls == 2 and nbytes > 0)
+
+conduit.GLOBALS.settings.set("sync_batch_size", 1)
+finished()
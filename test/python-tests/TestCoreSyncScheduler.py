@@ -0,0 +1,185 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.Conduit as Conduit
+import conduit.SyncScheduler as SyncScheduler
+
+import time
+import threading
+
+#Checks the scheduler runs conduits in priority order, within its limits,
+#and never runs conduits that share a dataprovider at the same time
+NUM_CONDUITS = 10
+MAX_RUNNING = 3
+MAX_IO = 2
+
+class Wrapper:
+    def __init__(self, module):
+        self.module = module
+
+class Worker:
+    def __init__(self, name, modules, priority=SyncScheduler.PRIORITY_USER):
+        self.name = name
+        self.dataproviders = [Wrapper(m) for m in modules]
+        self.priority = priority
+        self.cancelled = False
+
+    def get_dataproviders(self):
+        return self.dataproviders
+
+    def __str__(self):
+        return self.name
+
+def start(scheduler, worker, order):
+    def run():
+        if scheduler.wait_to_run(worker):
+            order.append(worker.name)
+            time.sleep(0.5)
+            scheduler.finished(worker)
+        else:
+            order.append("cancelled %s" % worker.name)
+    t = threading.Thread(target=run)
+    t.start()
+    #let it queue
+    time.sleep(0.05)
+    return t
+
+#priorities, and cancelling queued workers
+scheduler = SyncScheduler.SyncScheduler(1, 1, 1)
+order = []
+threads = [start(scheduler, Worker("first", ["a"]), order)]
+threads.append(start(scheduler, Worker("auto", ["b"], SyncScheduler.PRIORITY_AUTO), order))
+cancelled = Worker("cancelled", ["c"])
+threads.append(start(scheduler, cancelled, order))
+threads.append(start(scheduler, Worker("user", ["d"]), order))
+ok("Queue depth %s" % scheduler.get_queue_depth(), scheduler.get_queue_depth() == 3)
+cancelled.cancelled = True
+for t in threads:
+    t.join()
+ok("User syncs run before automatic syncs (%s)" % order, order == ["first", "cancelled cancelled", "user", "auto"])
+stats = scheduler.get_stats()
+ok("Stats: %(started)s started, %(cancelled)s cancelled, %(max_queued)s queued, waited %(wait_time).1fs" % stats,
+        stats["started"] == 3 and stats["cancelled"] == 1 and stats["max_queued"] == 3 and stats["wait_time"] > 0.5)
+
+#workers sharing a dataprovider do not run together, others may pass them
+scheduler = SyncScheduler.SyncScheduler(2, 1, 1)
+order = []
+threads = [start(scheduler, Worker("first", ["shared"]), order)]
+threads.append(start(scheduler, Worker("second", ["shared"]), order))
+threads.append(start(scheduler, Worker("other", ["other"]), order))
+for t in threads:
+    t.join()
+ok("Shared dataprovider serialized (%s)" % order, order == ["first", "other", "second"])
+
+#phases
+scheduler = SyncScheduler.SyncScheduler(4, 2, 1)
+running = {SyncScheduler.IO : [], SyncScheduler.CPU : []}
+peaks = {SyncScheduler.IO : 0, SyncScheduler.CPU : 0}
+lock = threading.Lock()
+def call(kind, func, *args):
+    scheduler.acquire(kind)
+    try:
+        return func(*args)
+    finally:
+        scheduler.release()
+def phase(kind, nested=False):
+    lock.acquire()
+    running[kind].append(1)
+    peaks[kind] = max(peaks[kind], len(running[kind]))
+    lock.release()
+    if nested:
+        #would deadlock if nested calls waited for a slot
+        call(SyncScheduler.CPU, phase, SyncScheduler.CPU)
+    time.sleep(0.05)
+    lock.acquire()
+    running[kind].pop()
+    lock.release()
+threads = []
+for i in range(6):
+    for kind in (SyncScheduler.IO, SyncScheduler.CPU):
+        t = threading.Thread(target=call, args=(kind, phase, kind, i == 0))
+        t.start()
+        threads.append(t)
+for t in threads:
+    t.join()
+ok("IO calls limited (%s at once)" % peaks[SyncScheduler.IO], peaks[SyncScheduler.IO] == 2)
+maxCPU = scheduler.get_stats()["max_phases"][SyncScheduler.CPU]
+ok("CPU calls limited (%s at once)" % maxCPU, maxCPU == 1)
+
+#workers cancelled while waiting for a slot stop waiting
+scheduler = SyncScheduler.SyncScheduler(1, 1, 1)
+ok("Slot taken", scheduler.acquire(SyncScheduler.IO) == True)
+worker = Worker("waiting", [])
+acquired = []
+t = threading.Thread(target=lambda: acquired.append(scheduler.acquire(SyncScheduler.IO, worker)))
+t.start()
+time.sleep(0.2)
+ok("Waiting for slot", t.isAlive() and acquired == [])
+worker.cancelled = True
+t.join(5)
+ok("Cancelled wait for slot", not t.isAlive() and acquired == [False])
+scheduler.release()
+ok("Slot free after cancelled wait", scheduler.acquire(SyncScheduler.IO, Worker("next", [])) == True)
+scheduler.release()
+
+#unbalanced releases do not free slots that are not held
+t = threading.Thread(target=scheduler.release)
+t.start()
+t.join()
+scheduler.release()
+ok("Unbalanced release ignored", scheduler._phases[SyncScheduler.IO] == 0)
+
+#many conduits of test dataproviders
+test = SimpleSyncTest()
+test.sync_manager.scheduler = SyncScheduler.SyncScheduler(MAX_RUNNING, MAX_IO, 1)
+
+#count the calls into the source shared by some of the conduits
+calls = []
+maxCalls = []
+def counted(get):
+    def get_counted(LUID):
+        lock.acquire()
+        calls.append(LUID)
+        maxCalls.append(len(calls))
+        lock.release()
+        try:
+            return get(LUID)
+        finally:
+            lock.acquire()
+            calls.pop()
+            lock.release()
+    return get_counted
+
+conduits = []
+sharedSource = test.get_dataprovider("TestSource")
+sharedSource.module.get = counted(sharedSource.module.get)
+for i in range(NUM_CONDUITS):
+    if i % 3 == 0:
+        source = sharedSource
+    else:
+        source = test.get_dataprovider("TestSource")
+    sink = test.get_dataprovider("TestSink")
+    source.module.set_configuration({"numData":1, "slow":True})
+    cond = Conduit.Conduit(test.sync_manager)
+    cond.add_dataprovider(source)
+    cond.add_dataprovider(sink)
+    conduits.append((cond, source, sink))
+
+t = time.time()
+for cond, source, sink in conduits:
+    cond.sync()
+for cond, source, sink in conduits:
+    test.sync_manager.join_one(cond)
+t = time.time() - t
+
+stats = test.sync_manager.scheduler.get_stats()
+ok("Synced %d conduits in %.1fs" % (NUM_CONDUITS, t), stats["started"] == NUM_CONDUITS and
+        len([c for c, source, sink in conduits if test.sync_manager.did_sync_abort(c)]) == 0)
+mappings = [conduit.GLOBALS.mappingDB.get_mappings_for_dataproviders(source.get_UID(), sink.get_UID()) for c, source, sink in conduits]
+ok("All data put", len([m for m in mappings if len(m) == 1]) == NUM_CONDUITS)
+ok("At most %d conduits synced at once (%d)" % (MAX_RUNNING, stats["max_running"]), stats["max_running"] == MAX_RUNNING)
+ok("At most %d IO calls at once (%d)" % (MAX_IO, stats["max_phases"][SyncScheduler.IO]), stats["max_phases"][SyncScheduler.IO] == MAX_IO)
+ok("Conduits waited (%d queued, waited %.1fs at most)" % (stats["max_queued"], stats["max_wait_time"]), stats["max_queued"] > 0)
+ok("Conduits sharing a source synced one at a time", len(maxCalls) > 1 and max(maxCalls) == 1)
+
+finished()
@@ -0,0 +1,242 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.dataproviders.Upload as Upload
+import conduit.Exceptions as Exceptions
+
+import os
+import time
+import socket
+import threading
+import urllib2
+import SocketServer
+import BaseHTTPServer
+
+#Checks uploads are retried, resumed where they stopped, and made
+#concurrently, against a local server implementing the resumable protocol
+FILE_SIZE = 10000
+CHUNK_SIZE = 1000
+Upload.RETRY_DELAY = 0.01
+
+class ResumableServer(object):
+    """
+    Accepts uploads in chunks. Each failure in failures is applied to the
+    next chunk put: "drop" stores half the chunk and closes the connection
+    without responding, "503" responds that the server is unavailable
+    """
+    def __init__(self):
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                session = "/session/%d" % len(server.sessions)
+                server.sessions[session] = ""
+                self.send_response(200)
+                self.send_header("Location", "http://%s%s" % (server.host, session))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path not in server.sessions:
+                    return self.respond(404)
+                received = server.sessions[self.path]
+                units, contentRange = self.headers["Content-Range"].split(" ")
+                span, size = contentRange.split("/")
+                if span != "*":
+                    start = int(span.split("-")[0])
+                    if start == len(received):
+                        failure = server.next_failure()
+                        if failure == "drop":
+                            server.sessions[self.path] = received + body[:len(body)/2]
+                            server.bytesReceived += len(body)/2
+                            self.close_connection = 1
+                            return
+                        if failure == "503":
+                            return self.respond(503)
+                        received += body
+                        server.bytesReceived += len(body)
+                        server.sessions[self.path] = received
+                        server.chunks += 1
+                        if server.onChunk != None:
+                            server.onChunk(server.chunks)
+                if len(received) == int(size):
+                    server.uploads.append(received)
+                    return self.respond(201, "<entry>%s</entry>" % self.path)
+                if received:
+                    return self.respond(308, headers={"Range":"bytes=0-%d" % (len(received)-1)})
+                return self.respond(308)
+
+            def respond(self, status, body="", headers={}):
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        server = self
+        self.sessions = {}
+        self.uploads = []
+        self.failures = []
+        self.bytesReceived = 0
+        self.chunks = 0
+        self.onChunk = None
+        self.lock = threading.Lock()
+        self.httpd = Server(("localhost", 0), Handler)
+        self.host = "localhost:%s" % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def next_failure(self):
+        self.lock.acquire()
+        try:
+            if self.failures:
+                return self.failures.pop(0)
+            return None
+        finally:
+            self.lock.release()
+
+    def reset(self):
+        self.uploads = []
+        self.failures = []
+        self.bytesReceived = 0
+        self.chunks = 0
+        self.onChunk = None
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def new_upload(key="test"):
+    create_session = lambda: Upload.start_resumable_session("http://%s/upload" % server.host, "<entry/>", {})
+    return Upload.ResumableUpload(path, "application/octet-stream", key, create_session, chunkSize=CHUNK_SIZE)
+
+contents = "".join([chr(i % 256) for i in range(FILE_SIZE)])
+path = os.path.join(os.environ['TEST_DIRECTORY'], "upload.bin")
+f = open(path, "wb")
+f.write(contents)
+f.close()
+stateFile = os.path.join(os.environ['TEST_DIRECTORY'], "uploads.db")
+if os.path.exists(stateFile):
+    os.remove(stateFile)
+
+server = ResumableServer()
+
+#retry
+calls = []
+def fail_twice(err):
+    calls.append(err)
+    if len(calls) <= 2:
+        raise err
+    return "done"
+ok("Connection errors retried", Upload.retry(fail_twice, socket.error()) == "done" and len(calls) == 3)
+calls = []
+try:
+    Upload.retry(fail_twice, urllib2.HTTPError("http://localhost", 400, "Bad Request", {}, None))
+    ok("Bad requests not retried", False)
+except urllib2.HTTPError:
+    ok("Bad requests not retried", len(calls) == 1)
+calls = []
+Upload.MAX_ATTEMPTS = 2
+try:
+    Upload.retry(fail_twice, Upload.RetryUpload())
+    ok("Retries limited", False)
+except Upload.RetryUpload:
+    ok("Retries limited", len(calls) == 2)
+Upload.MAX_ATTEMPTS = 5
+
+#upload
+rid = Upload.retry(new_upload().upload)
+ok("Uploaded in %d chunks" % server.chunks, server.uploads == [contents] and server.chunks == FILE_SIZE/CHUNK_SIZE)
+ok("Got response", rid == "<entry>/session/0</entry>")
+
+#interrupted uploads continue where they stopped
+server.reset()
+server.failures = [None, None, "drop", None, "503"]
+Upload.retry(new_upload().upload)
+ok("Resumed after dropped connection and server error (%d bytes sent)" % server.bytesReceived,
+        server.uploads == [contents] and server.bytesReceived == FILE_SIZE)
+
+#and after a restart, from the saved session
+server.reset()
+conduit.GLOBALS.uploadState = Upload.UploadState(stateFile)
+def cancel_after(n):
+    if n == 4:
+        conduit.GLOBALS.cancelled = True
+server.onChunk = cancel_after
+try:
+    Upload.retry(new_upload("restart").upload)
+    ok("Cancelled upload stopped", False)
+except Exceptions.StopSync:
+    ok("Cancelled upload stopped", server.uploads == [] and server.chunks == 4)
+conduit.GLOBALS.cancelled = False
+conduit.GLOBALS.uploadState.save()
+conduit.GLOBALS.uploadState.close()
+
+numSessions = len(server.sessions)
+conduit.GLOBALS.uploadState = Upload.UploadState(stateFile)
+upload = new_upload("restart")
+ok("Session saved", upload.session != None)
+upload.upload()
+ok("Resumed after restart (%d bytes sent)" % server.bytesReceived,
+        server.uploads == [contents] and server.bytesReceived == FILE_SIZE and len(server.sessions) == numSessions)
+ok("Session forgotten when complete", new_upload("restart").session == None)
+
+#a changed file is uploaded again
+conduit.GLOBALS.uploadState.set_session("changed", os.stat(path), "http://%s/session/0" % server.host)
+os.utime(path, (time.time(), time.time() + 10))
+ok("Session of changed file not used", new_upload("changed").session == None)
+conduit.GLOBALS.uploadState.close()
+conduit.GLOBALS.uploadState = None
+
+#concurrent uploads
+running = []
+maxRunning = []
+lock = threading.Lock()
+def put(i, overwrite, LUID):
+    lock.acquire()
+    running.append(i)
+    maxRunning.append(len(running))
+    lock.release()
+    time.sleep(0.2)
+    lock.acquire()
+    running.remove(i)
+    lock.release()
+    if i == 4:
+        raise Exceptions.SyncronizeError("Bad item")
+    if i == 5:
+        raise ValueError("Unexpected")
+    return i
+
+items = [(i, False, None) for i in range(9)]
+t = time.time()
+results = Upload.put_many(put, items)
+t = time.time() - t
+print "Put many in %.2fs" % t
+ok("Put many %d at once" % max(maxRunning), max(maxRunning) == Upload.MAX_CONCURRENT_UPLOADS)
+ok("Results in order", results[0:4] == [0, 1, 2, 3] and results[6:] == [6, 7, 8])
+ok("Errors returned per item", isinstance(results[4], Exceptions.SyncronizeError) and isinstance(results[5], Exceptions.SyncronizeError))
+
+#put retries its own uploads, so put_many does not retry it again
+attempts = []
+def failing_put(i, overwrite, LUID):
+    attempts.append(i)
+    raise Upload.RetryUpload("Unavailable")
+results = Upload.put_many(failing_put, [(i, False, None) for i in range(3)])
+ok("Failed puts not retried (%s attempts)" % len(attempts), len(attempts) == 3 and len([r for r in results if isinstance(r, Exceptions.SyncronizeError)]) == 3)
+
+#image sinks upload concurrently
+test = SimpleTest()
+sink = test.get_dataprovider("TestImageSink").module
+ok("Image sinks put many", sink.put_many([]) == [])
+
+server.stop()
+finished()
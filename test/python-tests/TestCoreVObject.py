@@ -0,0 +1,134 @@
+#common sets up the conduit environment
+from common import *
+import conduit.datatypes.Contact as Contact
+import conduit.datatypes.Event as Event
+import conduit.datatypes.VObject as VObject
+
+import os
+import time
+import pickle
+import vobject
+
+#Checks contacts and events are parsed only when needed, and their
+#serialization and hash are remembered. Then compares with parsing every
+#vcard of a large address book
+NUM_CARDS = 50000
+VCARD = """BEGIN:VCARD
+VERSION:3.0
+FN:Contact %(i)d
+N:Contact;%(i)d;;;
+EMAIL;TYPE=INTERNET:contact%(i)d@example.com
+TEL;TYPE=HOME:555-%(i)04d
+END:VCARD
+"""
+
+ical = read_data_file_from_data_dir("1.ical")
+vcard = read_data_file_from_data_dir("1.vcard")
+
+#splitting
+text = "\n".join([VCARD % {"i":i} for i in range(3)])
+ok("Split vcards", list(VObject.split_components(text, "VCARD")) == [VCARD % {"i":i} for i in range(3)])
+ok("Split lines of a file", len(list(VObject.split_components(text.splitlines(True), "vcard"))) == 3)
+nested = "BEGIN:VCALENDAR\nBEGIN:VEVENT\nEND:VEVENT\nEND:VCALENDAR\nBEGIN:VCARD\nEND:VCARD\n"
+ok("Nested components not split", list(VObject.split_components(nested, "VCALENDAR")) == [nested[0:nested.index("BEGIN:VCARD")]])
+ok("Other components skipped", list(VObject.split_components(nested, "VEVENT")) == [])
+ok("Components recognised", VObject.is_component("\n begin:vcard\n", "VCARD") and not VObject.is_component("foo"))
+ok("Property found without parsing", VObject.get_property(nested, "version") == None and VObject.get_property(VCARD % {"i":1}, "fn") == "Contact 1")
+
+#badly formed components are rejected before they are parsed
+for bad in ("foo",
+            "BEGIN:VCARD\nnot a property\nEND:VCARD\n",
+            "BEGIN:VCARD\nFN:Unclosed\n",
+            "BEGIN:VCARD\nBEGIN:X\nEND:VCARD\nEND:X\n",
+            "BEGIN:VCARD\nEND:VCARD\nFN:After\n"):
+    try:
+        Contact.Contact().set_from_vcard_string(bad)
+        ok("Bad vcard rejected %r" % bad, False)
+    except ValueError:
+        ok("Bad vcard rejected %r" % bad, True)
+try:
+    Contact.parse_vcf(VCARD % {"i":0} + "BEGIN:VCARD\nFN\nEND:VCARD\n")
+    ok("Bad vcard rejected when parsing a file", False)
+except ValueError:
+    ok("Bad vcard rejected when parsing a file", True)
+ok("Folded lines accepted", len(Contact.parse_vcf(VCARD.replace("FN:Contact", "FN:Con\n tact") % {"i":0})) == 1)
+
+#contacts
+c = Contact.Contact()
+c.set_from_vcard_string(vcard)
+ok("Contact not parsed", c._vcard == None)
+h = c.get_hash()
+s = c.get_vcard_string()
+ok("Contact serialized once", c.get_vcard_string() is s and c.get_hash() == h)
+c.set_emails("foo@bar.com")
+ok("Hash changes with the contact", c.get_hash() != h and "foo@bar.com" in c.get_vcard_string())
+
+c.vcard.fn.value = "Changed"
+ok("Changes to the vobject seen", "FN:Changed" in c.get_vcard_string())
+c.vcard.fn.value = "Changed Again"
+ok("Changes to the vobject always seen", "FN:Changed Again" in c.get_vcard_string())
+
+c2 = pickle.loads(pickle.dumps(c))
+ok("Unpickled contact not parsed", c2._vcard == None and c2.get_hash() == c.get_hash() and c2._vcard == None)
+ok("Unpickled contact parsed", c2.get_name() == "Changed Again")
+
+c = Contact.Contact(formattedName="Im Cool")
+ok("Named contact", c.get_name() == "Im Cool")
+
+#events
+e = Event.Event()
+e.set_from_ical_string(ical)
+ok("Event not parsed", e._ical == None)
+h = e.get_hash()
+ok("Event hashed once", e.get_hash() == h and e.get_ical_string() is e.get_ical_string())
+e2 = Event.Event()
+e2.set_from_ical_string(ical.replace("UID:", "UID:changed"))
+ok("Event hash ignores UID", e2.get_hash() == h)
+e.iCal.add("vevent").add("summary").value = "Added"
+ok("Changes to the event seen", e.get_hash() != h and "SUMMARY:Added" in e.get_ical_string())
+e2 = pickle.loads(pickle.dumps(e))
+ok("Unpickled event not parsed", e2._ical == None and e2.get_hash() == e.get_hash())
+ok("Parsed calendars", len(Event.parse_ics(ical + ical)) == 2)
+
+#a large address book
+path = os.path.join(os.environ['TEST_DIRECTORY'], "contacts.vcf")
+f = open(path, "w")
+for i in range(NUM_CARDS):
+    f.write(VCARD % {"i":i})
+f.close()
+
+#as it was done before, every card is parsed, and every hash serializes
+t = time.time()
+f = open(path)
+cards = [Contact.Contact(vcard=v) for v in vobject.readComponents(f)]
+f.close()
+hashes = [c.get_hash() for c in cards]
+hashes = [c.get_hash() for c in cards]
+eager = time.time() - t
+del(cards)
+
+t = time.time()
+f = open(path)
+contacts = Contact.parse_vcf(f)
+f.close()
+split = time.time() - t
+for c in contacts:
+    c.get_hash()
+lazyHashes = [c.get_hash() for c in contacts]
+lazy = time.time() - t
+print "Parsed %d cards: eager %.1fs, split %.1fs, hashed twice %.1fs" % (len(contacts), eager, split, lazy)
+ok("Parsed %d cards" % len(contacts), len(contacts) == NUM_CARDS)
+ok("Hashes unchanged", lazyHashes == hashes)
+
+#contacts that were stored and loaded again are hashed without parsing
+stored = [pickle.dumps(c) for c in contacts]
+del(contacts)
+t = time.time()
+loaded = [pickle.loads(s) for s in stored]
+for c in loaded:
+    c.get_hash()
+loadedTime = time.time() - t
+ok("Loaded and hashed %d cards in %.1fs, none parsed" % (len(loaded), loadedTime),
+        [c.get_hash() for c in loaded] == hashes and len([c for c in loaded if c._vcard != None]) == 0)
+
+finished()
@@ -0,0 +1,152 @@
+#common sets up the conduit environment
+from common import *
+
+import time
+
+#Checks the Flickr and Picasa dataproviders get the metadata of all
+#photos when they are refreshed, against a local stand-in for each service
+NUM_PHOTOS = 1200
+LATENCY = 0.01
+
+def photo_tags(i):
+    return ["tag%d" % (i % 7), "all"]
+
+#(method, photo id) of the calls that change photos
+flickrChanges = []
+
+def flickr_handler(path, params):
+    method = params["method"]
+    xml = '<?xml version="1.0" encoding="utf-8" ?>\n<rsp stat="ok">%s</rsp>'
+    if method == "flickr.photosets.getList":
+        return "text/xml", xml % '<photosets><photoset id="1" photos="%d"><title>Conduit</title></photoset></photosets>' % NUM_PHOTOS
+    elif method == "flickr.people.getUploadStatus":
+        return "text/xml", xml % '<user><bandwidth maxkb="1000" usedkb="10" /></user>'
+    elif method == "flickr.photosets.getPhotos":
+        perPage = int(params["per_page"])
+        page = int(params["page"])
+        pages = (NUM_PHOTOS + perPage - 1) / perPage
+        photos = []
+        for i in range(perPage*(page-1), min(perPage*page, NUM_PHOTOS)):
+            photos.append('<photo id="%d" secret="s%d" server="1" farm="1" title="Photo %d" tags="%s"><description>Caption %d</description></photo>' % (
+                            i, i, i, " ".join(photo_tags(i)), i))
+        return "text/xml", xml % '<photoset id="1" page="%d" pages="%d" perpage="%d" total="%d">%s</photoset>' % (
+                            page, pages, perPage, NUM_PHOTOS, "".join(photos))
+    elif method in ("flickr.photos.setMeta", "flickr.photos.setTags"):
+        flickrChanges.append((method, params["photo_id"]))
+        return "text/xml", xml % ""
+    elif method == "flickr.photos.getInfo":
+        i = int(params["photo_id"])
+        tags = "".join(['<tag id="%s">%s</tag>' % (t, t) for t in photo_tags(i)])
+        return "text/xml", xml % '<photo id="%d" secret="s%d" server="1" farm="1"><title>Photo %d</title><description>Caption %d</description><tags>%s</tags></photo>' % (
+                            i, i, i, i, tags)
+    return "text/xml", xml.replace("ok", "fail") % '<err code="112" msg="Method not found" />'
+
+def picasa_handler(path, params):
+    start = int(params["start-index"])
+    limit = int(params["max-results"])
+    entries = []
+    for i in range(start, min(start+limit, NUM_PHOTOS+1)):
+        entries.append('''<entry>
+            <id>http://%(host)s/data/entry/api/user/test/albumid/1/photoid/%(i)d</id>
+            <title>Photo %(i)d</title><summary>Caption %(i)d</summary>
+            <updated>2008-01-02T03:04:05.000Z</updated>
+            <category scheme="http://schemas.google.com/g/2005#kind" term="http://schemas.google.com/photos/2007#photo"/>
+            <content type="image/jpeg" src="http://%(host)s/photo%(i)d.jpg"/>
+            <link rel="edit-media" type="image/jpeg" href="http://%(host)s/data/media/api/user/test/albumid/1/photoid/%(i)d"/>
+            <gphoto:id>%(i)d</gphoto:id>
+            <media:group>
+                <media:content url="http://%(host)s/photo%(i)d.jpg" type="image/jpeg" medium="image"/>
+                <media:keywords>%(tags)s</media:keywords>
+            </media:group>
+            </entry>''' % {"host":picasaServer.host, "i":i, "tags":", ".join(photo_tags(i))})
+    return "application/atom+xml", '''<?xml version="1.0" encoding="UTF-8"?>
+        <feed xmlns="http://www.w3.org/2005/Atom" xmlns:gphoto="http://schemas.google.com/photos/2007" xmlns:media="http://search.yahoo.com/mrss/">
+        <id>http://%s/data/feed/api/user/test/albumid/1</id><title>Conduit</title><updated>2008-01-02T03:04:05.000Z</updated>
+        <category scheme="http://schemas.google.com/g/2005#kind" term="http://schemas.google.com/photos/2007#album"/>
+        %s</feed>''' % (picasaServer.host, "".join(entries))
+
+test = SimpleTest()
+available = [dp.classname for dp in test.model.get_all_modules()]
+
+#Flickr
+if "FlickrTwoWay" in available:
+    import flickrapi
+    flickrServer = FakeWebServer(flickr_handler, LATENCY)
+    flickrapi.FlickrAPI.flickr_host = flickrServer.host
+
+    flickr = test.get_dataprovider("FlickrTwoWay").module
+    flickr.fapi = flickrapi.FlickrAPI(flickr.API_KEY, flickr.SHARED_SECRET, format='xmlnode', store_token=False)
+    flickr.logged_in = True
+    flickr.photoSetName = "Conduit"
+
+    t = time.time()
+    flickr.refresh()
+    t = time.time() - t
+    ok("Flickr refreshed in %s requests, %.2fs" % (flickrServer.requests, t), flickrServer.requests < 10)
+    uids = flickr.get_all()
+    ok("Flickr photos listed", len(uids) == NUM_PHOTOS and len(set(uids)) == NUM_PHOTOS)
+
+    flickrServer.requests = 0
+    t = time.time()
+    photos = [flickr.get(LUID) for LUID in uids]
+    tp = time.time() - t
+    ok("Got %d photos from memory in %.2fs" % (NUM_PHOTOS, tp), flickrServer.requests == 0)
+    p = photos[8]
+    ok("Photo metadata", p.get_UID() == "8" and p.get_caption() == "Caption 8" and list(p.get_tags()) == photo_tags(8) and p.get_filename() == "Photo 8.jpg")
+    ok("Photo URL", p.get_open_URI() == "http://farm1.static.flickr.com/1/8_s8.jpg")
+
+    #the previous get made a photos.getInfo call for each photo
+    t = time.time()
+    for LUID in uids:
+        flickr.fapi.photos_getInfo(photo_id=LUID)
+    tr = time.time() - t
+    print "Got %d photos one at a time in %.2fs, v %.2fs from memory" % (NUM_PHOTOS, tr, tp)
+    ok("Previous get made a request per photo (%d requests)" % flickrServer.requests, flickrServer.requests == NUM_PHOTOS)
+
+    #photos not in the photoset are still got
+    flickrServer.requests = 0
+    info = flickr._get_photo_info(str(NUM_PHOTOS - 1))
+    ok("Cached photo info", flickrServer.requests == 0 and info.tags == tuple(photo_tags(NUM_PHOTOS - 1)))
+
+    #replaced photos are not answered from the listing
+    import conduit.dataproviders.Image as Image
+    replaced = []
+    flickr.fapi.replace = lambda filename, photo_id: replaced.append(photo_id)
+    flickr._replace_photo("3", Image.UploadInfo("file:///tmp/new.jpg", "image/jpeg", "New", ("new tag",), "New caption"))
+    ok("Photo replaced", replaced == ["3"] and ("flickr.photos.setMeta", "3") in flickrChanges and ("flickr.photos.setTags", "3") in flickrChanges)
+    flickrServer.requests = 0
+    flickr._get_photo_info("3")
+    ok("Replaced photo info got again", flickrServer.requests == 1)
+    flickr.finish(False, False, False)
+    ok("Cache cleared when finished", flickr.get_all() == [])
+    p = flickr.get("5")
+    ok("Photo info got when not cached", flickrServer.requests == 1 and p.get_caption() == "Caption 5" and list(p.get_tags()) == photo_tags(5))
+    flickrServer.stop()
+
+#Picasa
+if "PicasaTwoWay" in available:
+    import gdata.photos
+    picasaServer = FakeWebServer(picasa_handler, LATENCY)
+
+    picasa = test.get_dataprovider("PicasaTwoWay").module
+    picasa.galbum = gdata.photos.AlbumEntryFromString('''<?xml version="1.0" encoding="UTF-8"?>
+        <entry xmlns="http://www.w3.org/2005/Atom" xmlns:gphoto="http://schemas.google.com/photos/2007">
+        <id>http://%s/data/entry/api/user/test/albumid/1</id><title>Conduit</title>
+        <link rel="http://schemas.google.com/g/2005#feed" type="application/atom+xml" href="http://%s/data/feed/api/user/test/albumid/1"/>
+        <gphoto:id>1</gphoto:id><gphoto:numphotos>%d</gphoto:numphotos>
+        </entry>''' % (picasaServer.host, picasaServer.host, NUM_PHOTOS))
+
+    t = time.time()
+    picasa._get_photos()
+    t = time.time() - t
+    uids = picasa.get_all()
+    ok("Picasa listed in %s requests, %.2fs" % (picasaServer.requests, t), len(uids) == NUM_PHOTOS and picasaServer.requests < 10)
+
+    picasaServer.requests = 0
+    p = picasa.get("8")
+    ok("Picasa tags got from memory", picasaServer.requests == 0 and list(p.get_tags()) == photo_tags(8) and p.get_caption() == "Caption 8")
+    picasa.finish(False, False, False)
+    ok("Cache cleared when finished", picasa.get_all() == [])
+    picasaServer.stop()
+
+finished()
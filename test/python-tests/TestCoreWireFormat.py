@@ -0,0 +1,145 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.Exceptions as Exceptions
+import conduit.datatypes as datatypes
+import conduit.datatypes.Bookmark as Bookmark
+import conduit.datatypes.File as File
+import conduit.datatypes.Note as Note
+import conduit.datatypes.Setting as Setting
+import conduit.datatypes.Text as Text
+import conduit.utils as Utils
+import conduit.modules.NetworkModule.Streaming as Streaming
+import conduit.modules.NetworkModule.WireFormat as WireFormat
+import conduit.modules.NetworkModule.XMLRPCUtils as XMLRPCUtils
+
+import time
+import datetime
+import cStringIO
+import xmlrpclib
+
+#Checks the binary wire format, and compares it with pickling
+NUM_NOTES = 2000
+MTIME = datetime.datetime(2008, 1, 2, 3, 4, 5, 6)
+
+def roundtrip(obj, offer=None, fetch=None):
+    return WireFormat.loads(WireFormat.dumps(obj, offer), fetch)
+
+def new_note(i):
+    n = Note.Note(title="Note-%d" % i, contents="Contents of note %d. " % i * 10)
+    n.set_UID("note%d" % i)
+    n.set_mtime(MTIME)
+    n.set_tags(["a", "b"])
+    return n
+
+#values
+values = [None, True, False, 0, -1, 2**40, 1.5, "", "str", u"unicod\xe9", [1, [2]], (1, "a"), {"a":1, 2:None}, MTIME]
+for v in values:
+    r = roundtrip(v)
+    ok("Encoded %r" % (v,), r == v and type(r) == type(v))
+
+#datatypes
+n = roundtrip(new_note(1))
+ok("Note", n.__class__ == Note.Note and n.get_title() == "Note-1" and n.get_contents() == new_note(1).get_contents())
+ok("DataType state", n.get_UID() == "note1" and n.get_mtime() == MTIME and n.get_tags() == ["a", "b"])
+rid = new_note(1).get_rid()
+ok("Rid", roundtrip(rid) == rid)
+s = roundtrip(Setting.Setting(key="key", value="value"))
+ok("Setting", s.key == "key" and s.value == "value")
+b = roundtrip(Bookmark.Bookmark(title="title", uri="http://www.example.com"))
+ok("Bookmark", b.get_title() == "title" and b.get_uri() == "http://www.example.com")
+t = roundtrip(Text.Text(text=u"text\xe9"))
+ok("Text", t.get_string() == u"text\xe9")
+results = roundtrip([(None, rid), ("SyncronizeError", "message")])
+ok("Results", results == [(None, rid), ("SyncronizeError", "message")])
+
+#files
+f = Utils.new_tempfile("contents of the file")
+f.set_UID("file")
+r = roundtrip(f)
+ok("File contents included", r.get_UID() == "file" and r.get_contents_as_text() == "contents of the file")
+streams = Streaming.StreamServer()
+streams.start()
+client = Streaming.StreamClient("localhost", streams.port)
+data = WireFormat.dumps(f, streams.offer)
+ok("File contents streamed (%d bytes)" % len(data), "contents of the file" not in data)
+r = WireFormat.loads(data, client.fetch)
+ok("Streamed file", r.get_UID() == "file" and r.get_contents_as_text() == "contents of the file")
+streams.stop()
+
+#only the described datatypes are decoded
+class Unknown(object):
+    pass
+try:
+    WireFormat.dumps([Unknown()])
+    ok("Unknown classes not encoded", False)
+except WireFormat.WireFormatError:
+    ok("Unknown classes not encoded", True)
+ok("Unknown classes pickled instead", XMLRPCUtils.encode_obj_to_binary(Note.Note, wire=True).data.startswith(WireFormat.MAGIC) == False)
+
+plain = WireFormat.dumps(File.File(URI=f.get_local_uri()))
+notFile = plain.replace("conduit.datatypes.File.File", "conduit.datatypes.Note.Note")
+noClass = plain.replace("conduit.datatypes.File.File", "conduit.datatypes.File.Fool")
+for name, data in (
+        ("Not a message", "\x80\x02N."),
+        ("Unknown tag", WireFormat.MAGIC + chr(WireFormat.WIRE_VERSION) + "?"),
+        ("Unknown schema", WireFormat.MAGIC + chr(WireFormat.WIRE_VERSION) + "O\xff\xff"),
+        ("Truncated", WireFormat.dumps(new_note(1))[:-3]),
+        ("Not a file", notFile),
+        ("Unknown class", noClass)):
+    try:
+        WireFormat.loads(data)
+        ok("Invalid message rejected: %s" % name, False)
+    except WireFormat.WireFormatError:
+        ok("Invalid message rejected: %s" % name, True)
+
+#streaming
+s = cStringIO.StringIO()
+for i in range(3):
+    WireFormat.write_message(s, new_note(i))
+s.seek(0)
+notes = []
+try:
+    while True:
+        notes.append(WireFormat.read_message(s))
+except EOFError:
+    pass
+ok("Read streamed messages", [n.get_title() for n in notes] == ["Note-0", "Note-1", "Note-2"])
+
+#contacts and events need vobject
+try:
+    import conduit.datatypes.Contact as Contact
+    c = Contact.Contact()
+    c.set_from_vcard_string("BEGIN:VCARD\nVERSION:3.0\nFN:John Smith\nN:Smith;John;;;\nEND:VCARD\n")
+    vcard = c.get_vcard_string()
+except Exception:
+    c = None
+if c != None:
+    ok("Contact", roundtrip(c).get_vcard_string() == vcard)
+
+#throughput, of a batch of notes in an xml-rpc response
+notes = [new_note(i) for i in range(NUM_NOTES)]
+for name, encode in (
+        ("pickle", lambda o: XMLRPCUtils.pickle_obj_to_binary(o)),
+        ("wire format", lambda o: XMLRPCUtils.encode_obj_to_binary(o, wire=True))):
+    t = time.time()
+    xml = xmlrpclib.dumps((encode(notes),), methodresponse=True)
+    te = time.time() - t
+    t = time.time()
+    decoded = XMLRPCUtils.decode_obj_from_binary(xmlrpclib.loads(xml)[0][0], allowPickle=True)
+    td = time.time() - t
+    ok("%d notes, %s: %d bytes, encoded in %.3fs, decoded in %.3fs" % (NUM_NOTES, name, len(xml), te, td),
+            decoded[-1].get_contents() == notes[-1].get_contents())
+    if name == "pickle":
+        pickleSize = len(xml)
+ok("Wire format is smaller", len(xml) < pickleSize)
+
+#pickles are only unpickled when allowed
+try:
+    XMLRPCUtils.decode_obj_from_binary(XMLRPCUtils.pickle_obj_to_binary(notes[0]))
+    ok("Pickle refused", False)
+except Exceptions.SyncronizeError:
+    ok("Pickle refused", True)
+ok("Pickles refused by default", XMLRPCUtils.pickle_allowed() == False)
+
+finished()
@@ -0,0 +1,64 @@
+#common sets up the conduit environment
+from common import *
+
+import os.path
+
+import conduit.modules.iPodModule.iPodModule as iPodModule
+import conduit.utils as Utils
+
+NUM_TRACKS = 12
+
+#simulate an ipod
+fakeIpodDir = Utils.new_tempdir()
+musicDir = os.path.join(fakeIpodDir, "iPod_Control", "Music")
+for i in range(4):
+    os.makedirs(os.path.join(musicDir, "F%02d" % i))
+ok("Created fake ipod at %s" % fakeIpodDir, os.path.exists(musicDir))
+
+sourceDir = Utils.new_tempdir()
+sources = []
+for i in range(NUM_TRACKS):
+    path = os.path.join(sourceDir, "track%s.mp3" % i)
+    f = open(path, "w")
+    f.write("track %s" % i)
+    f.close()
+    sources.append(path)
+
+def read(path):
+    f = open(path, "r")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+#reserve and copy the tracks at once
+transaction = iPodModule.TrackTransaction(fakeIpodDir, "Test")
+dests = [transaction.reserve(src) for src in sources]
+ok("Reserved unique files", len(set(dests)) == NUM_TRACKS and len([d for d in dests if os.path.exists(d)]) == NUM_TRACKS)
+ok("Reserved in the music dirs", len([d for d in dests if os.path.dirname(os.path.dirname(d)) == musicDir and d.endswith(".mp3")]) == NUM_TRACKS)
+
+errors = transaction.copy(zip(sources + ["/does/not/exist.mp3"], dests + [dests[0] + ".missing"]))
+ok("Copied tracks", errors[:-1] == [None]*NUM_TRACKS and len([d for s,d in zip(sources, dests) if read(s) == read(d)]) == NUM_TRACKS)
+ok("Failed copy reported", isinstance(errors[-1], Exception))
+
+#committed tracks are kept
+transaction.commit()
+ok("Nothing to recover after commit", iPodModule.TrackTransaction(fakeIpodDir, "Test").recover(lambda f: False) == 0)
+ok("Committed tracks kept", len([d for d in dests if os.path.exists(d)]) == NUM_TRACKS)
+
+#crash before the db is written. The tracks the db refers to are kept,
+#the others are removed on the next refresh
+dests = [transaction.reserve(src) for src in sources]
+transaction.copy(zip(sources, dests))
+referenced = dests[:NUM_TRACKS/2]
+otherDataprovider = iPodModule.TrackTransaction(fakeIpodDir, "Other")
+ok("Other dataproviders journals are separate", otherDataprovider.recover(lambda f: False) == 0)
+
+recovered = iPodModule.TrackTransaction(fakeIpodDir, "Test")
+removed = recovered.recover(lambda f: f in referenced)
+ok("Removed %s orphaned tracks" % removed, removed == NUM_TRACKS - len(referenced))
+ok("Referenced tracks kept", len([d for d in referenced if os.path.exists(d)]) == len(referenced))
+ok("Orphaned tracks removed", len([d for d in dests[len(referenced):] if os.path.exists(d)]) == 0)
+ok("Journal removed", recovered.recover(lambda f: False) == 0)
+
+finished()
@@ -0,0 +1,61 @@
+#common sets up the conduit environment
+from common import *
+
+import conduit.utils as Utils
+import conduit.datatypes.File as File
+from conduit.datatypes import COMPARISON_EQUAL
+
+import os.path
+
+#One way sync from one folder into two. Each sink must get the files at
+#the same path, relative to its folder, as they have in the source
+NUM_FILES = 10
+
+sourceDir = Utils.new_tempdir()
+FILES = []
+for i in range(0, NUM_FILES):
+    relpath = os.path.join("dir%s" % (i % 3), Utils.random_string())
+    if not os.path.exists(os.path.join(sourceDir, os.path.dirname(relpath))):
+        os.mkdir(os.path.join(sourceDir, os.path.dirname(relpath)))
+    f = open(os.path.join(sourceDir, relpath), "w")
+    f.write(Utils.random_string())
+    f.close()
+    FILES.append(relpath)
+
+for pipelined in (False, True):
+    ok("---- PIPELINED: %s" % pipelined, True)
+    conduit.GLOBALS.settings.set("sync_pipelined", pipelined)
+
+    test = SimpleSyncTest()
+    test.prepare(test.get_dataprovider("FolderTwoWay"), test.get_dataprovider("FolderTwoWay"))
+    test.add_extra_sink(test.get_dataprovider("FolderTwoWay"))
+    test.set_two_way_policy({"conflict":"skip","deleted":"skip"})
+    test.set_two_way_sync(False)
+
+    config = {}
+    config["folderGroupName"] = "TestGroup"
+    config["folder"] = "file://"+sourceDir
+    config["includeHidden"] = False
+    config["followSymlinks"] = False
+    test.configure(source=config)
+
+    sinkDirs = []
+    for i in range(0, 2):
+        sinkDirs.append(Utils.new_tempdir())
+        config["folder"] = "file://"+sinkDirs[i]
+        test.get_sink(i).module.set_configuration(config)
+
+    test.sync(debug=False)
+    abort,error,conflict = test.get_sync_result()
+    ok("Sync completed", abort == False and error == False and conflict == False)
+
+    for sinkDir in sinkDirs:
+        for relpath in FILES:
+            f1 = File.File(os.path.join(sourceDir, relpath))
+            f2 = File.File(os.path.join(sinkDir, relpath))
+            ok("%s synced to %s" % (relpath, sinkDir), f2.exists() and f1.compare(f2) == COMPARISON_EQUAL)
+
+    ok("Source files unchanged", len([p for p in FILES if os.path.exists(os.path.join(sourceDir, p))]) == NUM_FILES)
+
+conduit.GLOBALS.settings.set("sync_pipelined", False)
+finished()
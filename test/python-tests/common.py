@@ -8,6 +8,11 @@ import datetime
 import traceback
 import ConfigParser
 import random
+import cgi
+import urllib
+import threading
+import SocketServer
+import BaseHTTPServer
 
 # make sure we have conduit folder in path!
 my_path = os.path.dirname(__file__)
@@ -612,4 +617,63 @@ class SimpleSyncTest(SimpleTest):
     def get_sync_result(self):
         return self.sync_aborted(), self.sync_errored(), self.sync_conflicted()
 
-
+class FakeWebServer(object):
+    """
+    A local stand-in for a web service, so that dataproviders can be
+    tested and benchmarked offline. handler(path, params) is called for
+    each request, with the query and form parameters as a dict, and
+    must return (contentType, body), or (contentType, body, status) to
+    respond with a status other than 200. Each request is delayed by
+    latency seconds, to approximate a remote server
+    """
+    def __init__(self, handler, latency=0):
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, query = urllib.splitquery(self.path)
+                self.respond(path, query or "")
+
+            def do_POST(self):
+                path, query = urllib.splitquery(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                self.respond(path, "&".join([query or "", self.rfile.read(length)]))
+
+            def respond(self, path, query):
+                server.count_request()
+                params = dict(cgi.parse_qsl(query))
+                time.sleep(latency)
+                response = handler(path, params)
+                contentType, body = response[0:2]
+                if len(response) > 2:
+                    self.send_response(response[2])
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        server = self
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = Server(("localhost", 0), Handler)
+        self.port = self.httpd.server_address[1]
+        self.host = "localhost:%s" % self.port
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def count_request(self):
+        self.lock.acquire()
+        self.requests += 1
+        self.lock.release()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()